@@ -12,11 +12,14 @@ sys.path.insert(0, r"C:\JWW")
 try:
     from jwai_core import (
         load_config, save_config, CONFIG_FILE,
-        parse_jwc_temp, elements_to_context, write_result_to_jwc,
+        parse_jwc_store, elements_to_context, write_result_to_jwc,
+        JWC_LINE, JWC_TEXT, JWC_CIRCLE,
         JWC_TEMP, SIGNAL_FILE, DONE_FILE, LOCK_FILE,
         create_lock, remove_lock, write_done, cleanup_signal_files,
-        apply_transform, parse_ai_transform, normalize_ai_transform,
-        parse_jww_full, build_jww_full_context,
+        apply_transform, parse_ai_transform, normalize_ai_transform, TransformJournal,
+        render_transform_preview, render_jww_overview, image_to_base64_png,
+        parse_jww_full, build_jww_full_context, jww_rooms, JwwFile,
+        JwwParseCache, jww_fingerprint, parse_jww_incremental, JwwParseBudget,
     )
     CORE_AVAILABLE = True
 except ImportError:
@@ -61,7 +64,16 @@ except ImportError:
                 if os.path.exists(f): os.remove(f)
             except Exception: pass
 
-    def apply_transform(elements, transform): return {}, {}
+    class JwwFile:
+        """jwai_core.py が無い場合の簡易版（mmapを使わずに全体を読み込む）"""
+        def __init__(self, filepath):
+            with open(filepath, 'rb') as f:
+                self.buffer = memoryview(f.read())
+        def __enter__(self): return self
+        def __exit__(self, *exc): self.close()
+        def close(self): self.buffer.release()
+
+    def apply_transform(elements, transform, store=None): return {}, {}
     def parse_ai_transform(text): return None
     def normalize_ai_transform(transform): return None, "jwai_core.py が見つかりません"
 
@@ -74,17 +86,38 @@ def read_cstring(data, pos):
     length = data[pos]; pos += 1
     if pos + length > len(data): return "", pos
     text_bytes = data[pos:pos+length]
-    try: text = text_bytes.decode('cp932')
-    except: text = text_bytes.decode('latin-1', errors='replace')
+    try: text = str(text_bytes, 'cp932')
+    except: text = str(text_bytes, 'latin-1', errors='replace')
     return text, pos + length
 
 def parse_jww(filepath):
-    with open(filepath, 'rb') as f:
-        data = f.read()
+    # jwai_core があれば parse_jww_full の1回の走査からヘッダ・テキスト・寸法値を作る
+    if CORE_AVAILABLE:
+        full_info, error = parse_jww_full(filepath)
+        if error:
+            return None, error
+        return jww_info_from_full(filepath, full_info), None
+    # mmap経由で参照し、ファイル全体をコピーしない
+    with JwwFile(filepath) as jf:
+        return _parse_jww_buffer(filepath, jf.buffer)
+
+def jww_info_from_full(filepath, full_info):
+    """parse_jww_full の結果を parse_jww の形式（ファイル名・バージョン・メモ・図面サイズ・テキスト要素・寸法値）にする"""
+    header = full_info.get("header") or {}
+    seen = set()
+    texts = [t["text"] for t in full_info["texts"] if t["text"] not in seen and not seen.add(t["text"])]
+    return {"ファイル名": os.path.basename(filepath),
+            "バージョン": header.get("version", 0),
+            "メモ": header.get("memo", ""),
+            "図面サイズ": header.get("paper_size", ""),
+            "テキスト要素": texts[:100],
+            "寸法値": [d["value"] for d in full_info["dims"]]}
+
+def _parse_jww_buffer(filepath, data):
+    # jwai_core.py が無い場合の簡易版（バイト列を直接走査してテキストを拾う）
     info = {"ファイル名": os.path.basename(filepath), "バージョン": 0,
             "メモ": "", "図面サイズ": "", "テキスト要素": [], "寸法値": []}
-    header = data[:8].decode('ascii', errors='ignore')
-    if not header.startswith('JwwData'):
+    if len(data) < 8 or data[:7] != b'JwwData':
         return None, "JWWファイルではありません"
     info["バージョン"] = struct.unpack_from('<I', data, 8)[0]
     memo, _ = read_cstring(data, 12)
@@ -97,7 +130,7 @@ def parse_jww(filepath):
         if 2 <= length <= 100:
             chunk = data[i+1:i+1+length]
             try:
-                text = chunk.decode('cp932')
+                text = str(chunk, 'cp932')
                 clean = ''.join(c for c in text if c.isprintable()).strip()
                 if len(clean) >= 2:
                     has_jp = any('\u3040'<=c<='\u9fff' or '\uff00'<=c<='\uffef' for c in clean)
@@ -193,14 +226,21 @@ class JWAIApp:
 
         self.config = load_config()
         self.jww_info = None
+        self._jww_loading = None    # 解析中・読み込み済みの図面パス（古い解析スレッドの結果を捨てる）
         self.chat_history = []
         self.system_prompt = ""
         self.gaihenkei_elements = []
         self.gaihenkei_raw_lines = []
+        self.gaihenkei_store = None     # 差分書き戻し用（行のバイト位置）
         self.gaihenkei_context = ""
         self.gaihenkei_applied = False
         self.gaihenkei_last_ai_response = None
+        self.gaihenkei_journal = None           # 反映した変換の履歴（取り消し・やり直し）
+        self.gaihenkei_applied_response = None  # 反映済みのAI応答（同じ変換を2度重ねない）
         self.gaihenkei_screenshot_b64 = None   # JW_CAD画面キャプチャ (base64)
+        self.gaihenkei_selection_b64 = None    # 選択図形を描いた画像 (base64、キャプチャできない時に使う)
+        self.gaihenkei_preview_b64 = None      # 変換プレビュー（灰色=変換前、色=変換後）(base64)
+        self._gaihenkei_photo = None           # 右パネルに表示中のプレビュー（Tkの画像は参照を持っておく）
 
         self.setup_styles()
         self.build_ui()
@@ -214,6 +254,8 @@ class JWAIApp:
 
     def on_close(self):
         self.watcher.stop()
+        if self.gaihenkei_journal:
+            self.gaihenkei_journal.close()
         remove_lock()
         cleanup_signal_files()
         self.root.destroy()
@@ -373,6 +415,20 @@ class JWAIApp:
             command=self.gaihenkei_return_to_jwcad)
         self.gaihenkei_return_btn.pack(side='left')
 
+        self.gaihenkei_redo_btn = tk.Button(btn_frame,
+            text="↷", font=('Meiryo UI', 10, 'bold'),
+            bg='#555', fg='#aaa', relief='flat', state='disabled',
+            cursor='hand2', padx=8, pady=6,
+            command=self.gaihenkei_redo)
+        self.gaihenkei_redo_btn.pack(side='right')
+
+        self.gaihenkei_undo_btn = tk.Button(btn_frame,
+            text="↶", font=('Meiryo UI', 10, 'bold'),
+            bg='#555', fg='#aaa', relief='flat', state='disabled',
+            cursor='hand2', padx=8, pady=6,
+            command=self.gaihenkei_undo)
+        self.gaihenkei_undo_btn.pack(side='right', padx=(0, 4))
+
         # AI指示入力（ボタンの上）
         gi_frame = tk.Frame(parent, bg='#0d1b2a')
         gi_frame.pack(side='bottom', fill='x', padx=5, pady=(0, 2))
@@ -408,12 +464,79 @@ class JWAIApp:
         # 右パネルに待機メッセージ表示
         self._update_gaihenkei_detail("JW_CADで範囲を選択し\n外部変形(JWAI.BAT)を実行してください。\n\n選択した図形データがここに表示されます。")
 
-    def _update_gaihenkei_detail(self, text):
+    def _update_gaihenkei_detail(self, text, image=None):
         self.gaihenkei_detail.configure(state='normal')
         self.gaihenkei_detail.delete('1.0', 'end')
+        self._gaihenkei_photo = None
+        if image is not None:
+            try:
+                from PIL import ImageTk
+                thumb = image.convert('RGB')
+                thumb.thumbnail((max(self.gaihenkei_detail.winfo_width() - 24, 240), 10000))
+                self._gaihenkei_photo = ImageTk.PhotoImage(thumb)
+                self.gaihenkei_detail.image_create('end', image=self._gaihenkei_photo)
+                self.gaihenkei_detail.insert('end', "\n")
+            except Exception:
+                self._gaihenkei_photo = None
         self.gaihenkei_detail.insert('end', text)
         self.gaihenkei_detail.configure(state='disabled')
 
+    def _refresh_gaihenkei_preview(self, transform=None):
+        """
+        選択図形のプレビューを右パネルに出す。transform を渡すと反映済みの変換にそれを重ねた結果、
+        省略すると今の状態（反映済みの変換）を、変換前（灰色）と重ねて描く。
+        """
+        journal = self.gaihenkei_journal
+        if not CORE_AVAILABLE or not journal:
+            return
+        try:
+            if transform is not None:
+                steps = journal.steps() + (transform if isinstance(transform, list) else [transform])
+                mod_lines, mod_circles = apply_transform(self.gaihenkei_elements, steps, self.gaihenkei_store)
+            else:
+                mod_lines, mod_circles = journal.modified_maps()
+            img, _ = render_transform_preview(self.gaihenkei_elements, mod_lines, mod_circles,
+                                              store=self.gaihenkei_store)
+        except Exception:
+            img = None
+        if img is not None and (mod_lines or mod_circles):
+            self.gaihenkei_preview_b64 = image_to_base64_png(img)
+        else:
+            self.gaihenkei_preview_b64 = None
+        self._update_gaihenkei_detail(self.gaihenkei_context, img)
+
+    def _gaihenkei_image(self):
+        """AIに添付する画像と、その説明（システムプロンプトに足す文）"""
+        if self.gaihenkei_preview_b64:
+            return self.gaihenkei_preview_b64, (
+                "【図面画像について】\n"
+                "最初のメッセージに、選択範囲の変換プレビューを添付しています。\n"
+                "灰色が変換前の図形、赤が変換後の線、青が変換後の円弧です（まだJW_CADには返していません）。\n"
+                "ユーザーの指示と見比べ、意図どおりでなければ正しい変換を返してください。\n\n")
+        if self.gaihenkei_screenshot_b64:
+            return self.gaihenkei_screenshot_b64, (
+                "【図面画像について】\n"
+                "最初のメッセージにJW_CADの図面画像が添付されています。\n"
+                "画像を見て、ユーザーが指示している図形（ドア・窓・部屋など）の位置を特定し、\n"
+                "対応する円弧番号（circle_indices）を正確に選んでください。\n\n")
+        if self.gaihenkei_selection_b64:
+            return self.gaihenkei_selection_b64, (
+                "【図面画像について】\n"
+                "最初のメッセージに、選択範囲の線・円弧を描いた画像（上が+Y）を添付しています。\n"
+                "画像を見て、ユーザーが指示している図形の位置を特定し、\n"
+                "対応する円弧番号（circle_indices）を正確に選んでください。\n\n")
+        return None, ""
+
+    def _update_history_buttons(self, active=True):
+        """取り消し・やり直しボタンを履歴に合わせて有効・無効にする（active=False なら両方無効）"""
+        journal = self.gaihenkei_journal if active else None
+        for btn, enabled in ((self.gaihenkei_undo_btn, bool(journal and journal.can_undo)),
+                             (self.gaihenkei_redo_btn, bool(journal and journal.can_redo))):
+            if enabled:
+                btn.configure(state='normal', bg='#2c3e50', fg='#fff')
+            else:
+                btn.configure(state='disabled', bg='#555', fg='#aaa')
+
     def _set_status(self, status, summary=""):
         if status == "waiting":
             self.status_bar.configure(bg='#2d1b0e')
@@ -448,27 +571,39 @@ class JWAIApp:
             self.status_summary.configure(text="", bg='#0d1b2e')
             self.gaihenkei_apply_btn.configure(state='disabled', bg='#555', fg='#aaa', text="図面に反映")
             self.gaihenkei_return_btn.configure(state='disabled', bg='#555', fg='#aaa')
+        self._update_history_buttons(active=status not in ("waiting", "done"))
 
     # ===== 外部変形データ受信 =====
 
     def on_jwc_updated(self):
         if not CORE_AVAILABLE: return
-        elements, raw_lines, error = parse_jwc_temp(JWC_TEMP)
+        store, error = parse_jwc_store(JWC_TEMP)
         if error: return
+        elements, raw_lines = store.to_elements(), store.raw_lines
 
         self.gaihenkei_elements = elements
         self.gaihenkei_raw_lines = raw_lines
-        self.gaihenkei_context = elements_to_context(elements, raw_lines)
+        self.gaihenkei_store = store
+        if self.gaihenkei_journal:
+            self.gaihenkei_journal.close()
+        self.gaihenkei_journal = TransformJournal(store, elements)
+        self.gaihenkei_applied_response = None
+        self.gaihenkei_context = elements_to_context(elements, raw_lines, store)
         self.gaihenkei_applied = False
         self.gaihenkei_last_ai_response = None
         self.gaihenkei_screenshot_b64 = None  # 先にリセット
+        self.gaihenkei_preview_b64 = None
+        self.gaihenkei_selection_b64 = None
 
-        line_count   = len([e for e in elements if e['type'] == 'line'])
-        text_count   = len([e for e in elements if e['type'] == 'text'])
-        circle_count = len([e for e in elements if e['type'] == 'circle'])
+        line_count   = store.count(JWC_LINE)
+        text_count   = store.count(JWC_TEXT)
+        circle_count = store.count(JWC_CIRCLE)
         summary = f"線:{line_count}本 文字:{text_count}件 円弧:{circle_count}件"
 
-        self._update_gaihenkei_detail(self.gaihenkei_context)
+        img, _ = render_transform_preview(elements, store=store)
+        if img is not None:
+            self.gaihenkei_selection_b64 = image_to_base64_png(img)
+        self._update_gaihenkei_detail(self.gaihenkei_context, img)
         self._set_status("data_ready", summary)
         self.append_chat("system",
             f"外部変形データを受信しました ({summary})\n"
@@ -546,28 +681,34 @@ class JWAIApp:
             '   → {"type": "mirror_y", "axis_y": <反転軸のY座標>}\n\n'
             "5. rotate（回転）\n"
             '   → {"type": "rotate", "angle": <度数>, "cx": <中心X>, "cy": <中心Y>}\n\n'
+            "【属性で対象を絞る（任意）】\n"
+            "図形データの【属性別】や各図形の [レイヤ0-3 線色2 線種1] を見て、\n"
+            "特定のレイヤ・線色・線種の図形だけを変換する場合は filter を付けてください。\n"
+            "lg=レイヤグループ、ly=レイヤ（どちらも0〜15）、lc=線色、lt=線種。配列で複数指定もできます。\n"
+            '   → {"type": "mirror_x", "filter": {"lg": 0, "ly": 3}}\n'
+            "範囲で絞る場合は filter に bbox（[xmin, ymin, xmax, ymax]）か near（[x, y, 半径]、単位mm）を指定します。\n"
+            '   → {"type": "arc_flip_x", "filter": {"near": [1200, 3400, 500]}}\n\n'
+            "【複数の変換を続けて行う場合】\n"
+            "変換を順に並べた配列を1つのJSONで返してください（最大16手順、まとめて1回で書き込みます）。\n"
+            "各手順に target / filter / circle_indices / door_indices を個別に付けられます。\n"
+            '   → [{"type": "arc_flip_x", "circle_indices": [0]}, {"type": "rotate", "angle": 90}]\n\n'
             "【ドアの勝手（開く向き）を変える場合の正しい手順】\n"
-            "JW_CADのドアは: ドア枠線（複数の線）+ 扇形（円弧 ci）で構成されます。\n"
+            "JW_CADのドアは: ドア枠線（複数の線）+ 扇形（円弧 ci）+ 戸の線で構成されます。\n"
+            "図形データの【ドア】欄には、扇形と戸の線・枠の線を組にしたドアが [ドア0], [ドア1]... と\n"
+            "番号付きで載っています（吊元・幅・開く向き付き）。\n"
             "手順:\n"
-            "1. 図形データの【円弧データ（番号付き）】欄を確認する\n"
-            "2. ドアの扇形に該当する円弧を特定する\n"
-            "   - 始角と終角の差が約90°の円弧（←ドア扇形）\n"
-            "   - 半径700〜1000mm程度（標準的なドア幅）\n"
-            "   - 「←ドア扇形(90°)」と表示されている円弧\n"
-            "3. その円弧番号だけを circle_indices に指定する\n"
-            "4. arc_flip_x を使う（mirror_x は絶対に使わない）\n\n"
-            "JSONの例（円弧0番だけを変換）：\n"
+            "1. 【ドア】欄で該当するドアを特定する（無ければ【円弧データ（番号付き）】の「←ドア扇形(90°)」）\n"
+            "2. ドア番号を door_indices に指定する（ドアが無い場合は円弧番号を circle_indices に指定する）\n"
+            "3. arc_flip_x を使う（mirror_x は絶対に使わない）\n"
+            "   door_indices を付けた mirror_x / rotate はそのドアの円弧と戸の線だけを動かします\n"
+            "   （戸の線ごと勝手を変えるなら axis_x に吊元のX座標を指定した mirror_x）。\n\n"
+            "JSONの例（ドア0番の扇形だけを変換）：\n"
             "```json\n"
-            '{"type": "arc_flip_x", "circle_indices": [0]}\n'
+            '{"type": "arc_flip_x", "door_indices": [0]}\n'
             "```\n\n"
         )
-        if self.gaihenkei_screenshot_b64:
-            base_system += (
-                "【図面画像について】\n"
-                "最初のメッセージにJW_CADの図面画像が添付されています。\n"
-                "画像を見て、ユーザーが指示している図形（ドア・窓・部屋など）の位置を特定し、\n"
-                "対応する円弧番号（circle_indices）を正確に選んでください。\n\n"
-            )
+        image_b64, image_note = self._gaihenkei_image()
+        base_system += image_note
         if self.system_prompt:
             base_system += "【図面全体情報（JWWファイル）】\n" + self.system_prompt + "\n\n"
         if self.gaihenkei_context:
@@ -576,7 +717,7 @@ class JWAIApp:
         self.root.config(cursor='wait')
         threading.Thread(
             target=self._call_api_gaihenkei,
-            args=(user_text, api_key, mode, base_system, self.gaihenkei_screenshot_b64),
+            args=(user_text, api_key, mode, base_system, image_b64),
             daemon=True).start()
 
     def _call_api_gaihenkei(self, user_text, api_key, mode, system, screenshot_b64=None):
@@ -675,22 +816,30 @@ class JWAIApp:
         if CORE_AVAILABLE:
             transform = parse_ai_transform(response)
             if transform:
-                ttype = transform.get('type','')
-                # タイプ別の日本語説明
-                type_labels = {
-                    'arc_flip_x': '円弧の向きを左右反転（ドア勝手変更）',
-                    'arc_flip_y': '円弧の向きを上下反転（ドア勝手変更）',
-                    'mirror_x':   '全体を左右反転',
-                    'mirror_y':   '全体を上下反転',
-                    'rotate':     f"回転 {transform.get('angle',0)}°",
-                }
-                label = type_labels.get(ttype, ttype)
+                label = self._transform_label(transform, door_note=True)
+                self._refresh_gaihenkei_preview(transform)
                 self._set_status("transform_ready", f"変換準備完了: {label}")
                 self.append_chat("success",
                     f"✅ 変換指示を検出しました\n"
                     f"変換内容: {label}\n"
+                    "右パネルのプレビュー（灰色=変換前、赤・青=変換後）を確認し、\n"
                     "「▶ 図面に反映」ボタンをクリックしてください。")
 
+    def _transform_label(self, transform, door_note=False):
+        """変換指示（辞書 or 手順のリスト）の日本語説明"""
+        if isinstance(transform, list):
+            return " → ".join(self._transform_label(t, door_note) for t in transform)
+        note = "（ドア勝手変更）" if door_note else ""
+        type_labels = {
+            'arc_flip_x': f'円弧の向きを左右反転{note}',
+            'arc_flip_y': f'円弧の向きを上下反転{note}',
+            'mirror_x':   '全体を左右反転',
+            'mirror_y':   '全体を上下反転',
+            'rotate':     f"回転 {transform.get('angle',0)}°",
+        }
+        ttype = transform.get('type', '')
+        return type_labels.get(ttype, ttype)
+
     def gaihenkei_apply(self):
         if not self.gaihenkei_elements:
             messagebox.showinfo("データなし", "外部変形データがありません")
@@ -703,34 +852,47 @@ class JWAIApp:
         if self.gaihenkei_last_ai_response:
             transform = parse_ai_transform(self.gaihenkei_last_ai_response)
 
+        journal = self.gaihenkei_journal
+        if transform and self.gaihenkei_last_ai_response is self.gaihenkei_applied_response:
+            self.append_chat("system",
+                "この変換は反映済みです。取り消す場合は「↶」をクリックしてください。")
+            return
+
         if transform:
             transform, normalize_err = normalize_ai_transform(transform)
             if normalize_err or not transform:
                 self.append_chat("error", f"❌ 変換指示の形式が不正です: {normalize_err}")
                 return
 
-            ttype = transform.get('type', '')
-            type_labels = {
-                'arc_flip_x': '円弧の向きを左右反転',
-                'arc_flip_y': '円弧の向きを上下反転',
-                'mirror_x':   '全体を左右反転',
-                'mirror_y':   '全体を上下反転',
-                'rotate':     f"回転 {transform.get('angle',0)}°",
-            }
-            label = type_labels.get(ttype, ttype)
+            steps = transform if isinstance(transform, list) else [transform]
+            ttype = steps[0].get('type', '') if len(steps) == 1 else 'steps'
+            label = self._transform_label(transform)
             try:
-                mod_lines, mod_circles = apply_transform(self.gaihenkei_elements, transform)
-                ok, err = write_result_to_jwc(
-                    self.gaihenkei_elements, mod_lines,
-                    modified_circles_map=mod_circles)
+                # 反映済みの変換があれば、その上に重ねた版を作る（↶ で1つずつ戻せる）
+                stacked = journal.revision > 0
+                entry, err = journal.apply(transform)
+                if err:
+                    self.append_chat("error", f"❌ {err}")
+                    return
+                mod_lines, mod_circles = entry.line_ids, entry.circle_ids
+                ok, err = self._write_journal()
                 if ok:
                     self.gaihenkei_applied = True
+                    self.gaihenkei_applied_response = self.gaihenkei_last_ai_response
+                    self._refresh_gaihenkei_preview()
                     self._set_status("data_ready", "反映済み - JW_CADに返してください")
                     self.gaihenkei_apply_btn.configure(bg='#555', fg='#aaa', text="図面に反映")
-                    arc_count = len([e for e in self.gaihenkei_elements if e['type']=='circle'])
-                    line_count = len([e for e in self.gaihenkei_elements if e['type']=='line'])
-                    circle_indices = transform.get('circle_indices', None)
-                    if ttype in ('arc_flip_x', 'arc_flip_y'):
+                    arc_count = sum(1 for e in self.gaihenkei_elements if e.type == 'circle')
+                    line_count = sum(1 for e in self.gaihenkei_elements if e.type == 'line')
+                    circle_indices = steps[0].get('circle_indices', None)
+                    door_indices = steps[0].get('door_indices', None)
+                    if ttype == 'steps':
+                        detail = (f"{len(steps)}手順をまとめて1回で書き込み、"
+                                  f"線{len(mod_lines)}本・円弧{len(mod_circles)}件を変換")
+                    elif door_indices is not None:
+                        detail = (f"ドア[{','.join(str(i) for i in door_indices)}]番の"
+                                  f"線{len(mod_lines)}本・円弧{len(mod_circles)}件を変換")
+                    elif ttype in ('arc_flip_x', 'arc_flip_y'):
                         if circle_indices is not None:
                             detail = (f"円弧[{','.join(str(i) for i in circle_indices)}]番のみ変換、"
                                       f"他{arc_count - len(circle_indices)}件と線{line_count}本は変更なし")
@@ -738,23 +900,73 @@ class JWAIApp:
                             detail = f"円弧{arc_count}件の向きを変換、線{line_count}本は変更なし"
                     else:
                         detail = f"円弧{arc_count}件・線{line_count}本を変換"
+                    if ttype != 'steps' and steps[0].get('filter'):
+                        detail = (f"条件 {steps[0]['filter']} に該当する図形のうち、"
+                                  f"線{len(mod_lines)}本・円弧{len(mod_circles)}件を変換")
+                    if stacked:
+                        detail += f"（反映済みの変換に重ねて 版{journal.revision}）"
                     self.append_chat("success",
                         f"✅ {label}をJWC_TEMP.TXTに書き込みました。\n"
                         f"{detail}\n"
-                        "「JW_CADに返す」をクリックで図面に反映されます。")
+                        "「JW_CADに返す」をクリックで図面に反映されます。「↶」で取り消せます。")
                 else:
                     messagebox.showerror("エラー", f"書き込みに失敗:\n{err}")
             except Exception as e:
                 messagebox.showerror("変換エラー", str(e))
+        elif journal and journal.revision > 0:
+            self.append_chat("system", "反映済みの変換があります。「JW_CADに返す」で完了します。")
         else:
             # 変換なし → hq除去のみ
-            ok, err = write_result_to_jwc(self.gaihenkei_elements, {})
+            ok, err = write_result_to_jwc(self.gaihenkei_elements, {}, store=self.gaihenkei_store)
             if ok:
                 self.gaihenkei_applied = True
                 self.append_chat("system", "変更なしでJWC_TEMP.TXTを更新しました。\n「JW_CADに返す」で完了します。")
             else:
                 messagebox.showerror("エラー", f"書き込みに失敗:\n{err}")
 
+    def _write_journal(self):
+        """履歴の今の版を JWC_TEMP.TXT に書き戻す（変わった行だけ）。自分の書き込みは監視で拾わない"""
+        ok, err = self.gaihenkei_journal.write(JWC_TEMP)
+        if ok:
+            try:
+                self.watcher.last_jwc_mtime = os.path.getmtime(JWC_TEMP)
+            except OSError:
+                pass
+        self._update_history_buttons()
+        return ok, err
+
+    def gaihenkei_undo(self):
+        journal = self.gaihenkei_journal
+        if not journal or not journal.can_undo:
+            return
+        entry = journal.undo()
+        self._on_history_moved(entry, "取り消し")
+
+    def gaihenkei_redo(self):
+        journal = self.gaihenkei_journal
+        if not journal or not journal.can_redo:
+            return
+        entry = journal.redo()
+        self._on_history_moved(entry, "やり直し")
+
+    def _on_history_moved(self, entry, verb):
+        ok, err = self._write_journal()
+        if not ok:
+            messagebox.showerror("エラー", f"書き込みに失敗:\n{err}")
+            return
+        journal = self.gaihenkei_journal
+        label = self._transform_label(entry.steps)
+        self.gaihenkei_applied_response = None
+        self.gaihenkei_applied = journal.revision > 0
+        self._refresh_gaihenkei_preview()
+        if journal.revision > 0:
+            self._set_status("data_ready", f"版{journal.revision} - JW_CADに返してください")
+            state = f"版{journal.revision}（線{entry.n_lines}本・円弧{entry.n_circles}件を書き換え）"
+        else:
+            self._set_status("data_ready", "変換なし（元の図形）")
+            state = "変換前の元の図形（JWC_TEMP.TXT を読み込んだ時のまま）"
+        self.append_chat("system", f"↶↷ {label} を{verb}しました。\n今の状態: {state}")
+
     def gaihenkei_return_to_jwcad(self):
         if not self.gaihenkei_applied:
             if not messagebox.askyesno("確認",
@@ -775,6 +987,13 @@ class JWAIApp:
         self._update_gaihenkei_detail("処理完了。次の外部変形を待機中...\n\nJW_CADで次の範囲を選択してください。")
         self.gaihenkei_elements = []
         self.gaihenkei_raw_lines = []
+        self.gaihenkei_store = None
+        if self.gaihenkei_journal:
+            self.gaihenkei_journal.close()
+        self.gaihenkei_journal = None
+        self.gaihenkei_applied_response = None
+        self.gaihenkei_preview_b64 = None
+        self.gaihenkei_selection_b64 = None
         self.gaihenkei_context = ""
         self.gaihenkei_applied = False
         self.gaihenkei_last_ai_response = None
@@ -899,61 +1118,149 @@ class JWAIApp:
             filetypes=[("JW_CAD Files", "*.jww *.jwc"), ("All Files", "*.*")])
         if not filepath: return
 
-        info, error = parse_jww(filepath)
+        # 前回から変更の無い図面はキャッシュから読み込む（再解析しない）
+        # 保存し直した図面は、前回の結果を土台に変わった範囲だけを解析する
+        cache = fingerprint = cached = base = None
+        if CORE_AVAILABLE:
+            cache = JwwParseCache.from_config(load_config())
+            try:
+                fingerprint = jww_fingerprint(filepath)
+                cached = cache.load(fingerprint, columnar=True)
+                if not cached:
+                    base = cache.load_base(fingerprint, columnar=True)
+            except OSError:
+                pass
+
+        self.jww_info = None
+        self.system_prompt = ""
+        self.chat_history = []
+        self._jww_loading = filepath
+        if cached:
+            full_info, _ = cached
+            self._on_jww_loaded(filepath, jww_info_from_full(filepath, full_info), full_info)
+        elif CORE_AVAILABLE:
+            # 解析は別スレッドで行い、途中経過（ヘッダ → 件数）を root.after で受け取って表示する
+            # 時間・バイト数の上限（設定 "jww_parse_seconds" / "jww_parse_mb"）を超えたらそこまでの結果を使う
+            def progress(stage, snapshot):
+                self.root.after(0, lambda: self._on_jww_progress(filepath, stage, snapshot))
+            budget = JwwParseBudget.from_config(load_config(), progress)
+            self.file_label.config(text=f"{os.path.basename(filepath)}（解析中）", fg='#ffaa00')
+            self.append_chat("system",
+                f"図面を解析しています: {os.path.basename(filepath)}\n"
+                "JW_CADで図面を開いています...")
+            threading.Thread(target=self._parse_jww_worker,
+                             args=(filepath, cache, fingerprint, base, budget), daemon=True).start()
+        else:
+            info, error = parse_jww(filepath)
+            if error:
+                self.append_chat("error", f"エラー: {error}"); return
+            self._on_jww_loaded(filepath, info, None)
+        # JW_CADで図面を開く（AIの図面説明は解析が終わった時点で、解析結果から描いた概要図で始める）
+        threading.Thread(target=self._open_jwcad, args=(filepath,), daemon=True).start()
+
+    def _parse_jww_worker(self, filepath, cache, fingerprint, base, budget):
+        """解析スレッド。結果は root.after でUIスレッドの _on_jww_parsed に渡す"""
+        full_info = error = None
+        try:
+            if base:
+                full_info, error = parse_jww_incremental(filepath, base[0], columnar=True)
+            if full_info is None:
+                # ヘッダ・線・円弧・テキスト座標を1回の走査で解析
+                # 大きな図面（8MB以上）は全コアで並列に解析する
+                full_info, error = parse_jww_full(filepath, columnar=True, workers=0, layout=True,
+                                                  budget=budget)
+            if not error:
+                # 部屋（壁の平面グラフ）とドアはここで求めておき、キャッシュにも保存する
+                jww_rooms(full_info)
+            if not error and fingerprint:
+                cache.store(fingerprint, full_info)     # 打ち切った結果は保存されない
+        except Exception as e:
+            full_info, error = None, str(e)
+        self.root.after(0, lambda: self._on_jww_parsed(filepath, full_info, error))
+
+    def _on_jww_progress(self, filepath, stage, snapshot):
+        """解析の途中経過（ヘッダ → 件数）。AIの図面説明が先に始まったときはこの内容を使う"""
+        if self._jww_loading != filepath or self.jww_info is not None:
+            return
+        name = os.path.basename(filepath)
+        header = snapshot.get("header") or {}
+        ctx = f"【図面情報】ファイル名:{name} 図面サイズ:{header.get('paper_size', '')}\n"
+        if stage == "header":
+            self.system_prompt = ctx + "【図面全体データ】解析中\n"
+            self.append_chat("system", f"サイズ:{header.get('paper_size', '')}  "
+                                       f"{snapshot['size'] / 1e6:.1f}MB を解析中...")
+            return
+        stats = snapshot.get("stats") or {}
+        percent = snapshot["scanned"] * 100 // max(snapshot["size"], 1)
+        counts = (f"線:{stats.get('lines', 0)}本 円弧:{stats.get('arcs', 0)}件 "
+                  f"テキスト:{stats.get('texts', 0)}件")
+        self.system_prompt = ctx + f"【図面全体データ（解析中 {percent}%）】\n{counts}\n"
+        self.file_label.config(text=f"{name}（解析中 {percent}%  {counts}）", fg='#ffaa00')
+
+    def _on_jww_parsed(self, filepath, full_info, error):
+        if self._jww_loading != filepath:
+            return
         if error:
+            self.file_label.config(text="図面未読み込み", fg='#888888')
             self.append_chat("error", f"エラー: {error}"); return
+        self._on_jww_loaded(filepath, jww_info_from_full(filepath, full_info), full_info, announce=False)
 
+    def _on_jww_loaded(self, filepath, info, full_info, announce=True):
+        """読み込んだ図面をAIのコンテキストにする。announce=False は解析の完了（起動済み）の通知"""
         self.jww_info = info
-        # フル解析（線・円弧・テキスト座標）も実行
-        full_info, _ = parse_jww_full(filepath) if CORE_AVAILABLE else (None, None)
         base_ctx = build_jww_context(info)
         full_ctx  = build_jww_full_context(full_info) if full_info else ""
         self.system_prompt = base_ctx + "\n\n" + full_ctx if full_ctx else base_ctx
 
-        self.chat_history = []
         self.file_label.config(text=os.path.basename(filepath), fg='#00d4ff')
         stats = f"線:{full_info['stats']['lines']}本 円弧:{full_info['stats']['arcs']}件 テキスト:{full_info['stats']['texts']}件" if full_info else f"テキスト:{len(info['テキスト要素'])}件"
-        self.append_chat("system",
-            f"図面を読み込みました: {info['ファイル名']}\n"
-            f"サイズ:{info['図面サイズ']}  {stats}\n"
-            "JW_CADで図面を開いています...")
+        partial = full_info.get("partial") if full_info else None
+        if partial:
+            reason = {"time": "解析の時間上限に達した", "bytes": "解析のサイズ上限に達した",
+                      "format": "図面データが途中で切れている・壊れている"}.get(partial["reason"], "解析を打ち切った")
+            stats += (f"\n⚠ {reason}ため、先頭 {partial['scanned'] / 1e6:.1f}MB"
+                      f" / {partial['size'] / 1e6:.1f}MB までの結果です")
+        if announce:
+            self.append_chat("system",
+                f"図面を読み込みました: {info['ファイル名']}\n"
+                f"サイズ:{info['図面サイズ']}  {stats}\n"
+                "JW_CADで図面を開いています...")
+        else:
+            self.append_chat("system", f"図面の解析が完了しました: {info['ファイル名']}\n{stats}")
+        # AIに図面概要を説明させる（JW_CADの画面は待たない）
+        threading.Thread(target=self._analyze_overview, args=(filepath, full_info), daemon=True).start()
 
-        # JW_CADで図面を開く
-        def _open_and_analyze():
+    def _open_jwcad(self, filepath):
+        """JW_CADで図面を開く（別スレッド）。起動を待たずに戻る"""
+        try:
+            import subprocess
+            jww_exe = r"C:\JWW\Jw_win.exe"
+            if os.path.exists(jww_exe):
+                subprocess.Popen([jww_exe, filepath])
+            else:
+                self.root.after(0, lambda: self.append_chat("error",
+                    f"Jw_win.exe が見つかりません: {jww_exe}"))
+        except Exception as e:
+            self.root.after(0, lambda: self.append_chat("error", f"JW_CAD起動エラー: {e}"))
+
+    def _analyze_overview(self, filepath, full_info):
+        """
+        解析結果から描いた図面全体の概要図と図面情報から、AIに図面概要を説明させる（別スレッド）。
+        概要図を描けない（解析結果が無い・Pillowが無い）ときは、JW_CADの画面をキャプチャできれば使う。
+        """
+        screenshot_b64 = None
+        image_note = ""
+        if full_info is not None:
             try:
-                import subprocess, time
-                import win32gui
-                jww_exe = r"C:\JWW\Jw_win.exe"
-                fname = os.path.splitext(os.path.basename(filepath))[0]
-                if os.path.exists(jww_exe):
-                    subprocess.Popen([jww_exe, filepath])
-                    # タイトルバーに図面名が表示されるまで最大15秒待つ
-                    deadline = time.time() + 15
-                    found = False
-                    while time.time() < deadline:
-                        time.sleep(0.5)
-                        def _check(hwnd, _):
-                            t = win32gui.GetWindowText(hwnd).lower()
-                            if 'jw_win' in t and fname.lower()[:6] in t:
-                                _check.found = True
-                        _check.found = False
-                        win32gui.EnumWindows(_check, None)
-                        if _check.found:
-                            time.sleep(1.0)
-                            found = True
-                            break
-                    if not found:
-                        time.sleep(3.0)
-                else:
-                    self.root.after(0, lambda: self.append_chat("error",
-                        f"Jw_win.exe が見つかりません: {jww_exe}"))
-                    return
-            except Exception as e:
-                self.root.after(0, lambda: self.append_chat("error", f"JW_CAD起動エラー: {e}"))
-                return
-
-            # JW_CADウィンドウをキャプチャ
-            screenshot_b64 = None
+                img, _ = render_jww_overview(full_info)
+                if img is not None:
+                    screenshot_b64 = image_to_base64_png(img)
+                    image_note = "（図面画像は解析データから描いた概要図です。線は黒、円弧は青、文字の位置は赤い十字、上が+Y）\n"
+                    self.root.after(0, lambda: self.append_chat("system",
+                        f"🗺 図面の概要図を作成しました（{img.width}×{img.height}）→ AIが図面を解析中..."))
+            except Exception:
+                screenshot_b64 = None
+        if screenshot_b64 is None:
             try:
                 from jwai_core import capture_jwcad_window
                 b64, _ = capture_jwcad_window()
@@ -962,81 +1269,82 @@ class JWAIApp:
                     self.root.after(0, lambda: self.append_chat("system", "📷 図面画像キャプチャ完了 → AIが図面を解析中..."))
             except Exception:
                 pass
+        if self._jww_loading != filepath:
+            return
 
-            # AIに図面概要を説明させる
-            config = load_config()
-            mode = config.get('mode', 'claude')
-            key_map = {'claude': 'claude_api_key', 'openai': 'openai_api_key', 'gemini': 'gemini_api_key'}
-            api_key = config.get(key_map.get(mode, 'claude_api_key'), '').strip()
-            if not api_key and mode != 'ollama':
-                self.root.after(0, lambda: self.append_chat("system",
-                    "⚙ APIキーが未設定です。設定からAPIキーを入力してください。"))
-                return
+        # AIに図面概要を説明させる
+        config = load_config()
+        mode = config.get('mode', 'claude')
+        key_map = {'claude': 'claude_api_key', 'openai': 'openai_api_key', 'gemini': 'gemini_api_key'}
+        api_key = config.get(key_map.get(mode, 'claude_api_key'), '').strip()
+        if not api_key and mode != 'ollama':
+            self.root.after(0, lambda: self.append_chat("system",
+                "⚙ APIキーが未設定です。設定からAPIキーを入力してください。"))
+            return
 
-            try:
-                system = (
-                    "あなたはJW_CAD（日本の建築CADソフト）の図面作業をサポートするAIアシスタント「JW AI」です。\n"
-                    "添付された図面画像を見て、この図面がどのような図面か（建物の平面図、立面図、詳細図など）、\n"
-                    "どこに何が配置されているかを日本語で簡潔に説明してください。\n"
-                    "その後「この図面についてどのような作業をしますか？」と聞いてください。\n\n"
-                    + self.system_prompt
-                )
-                prompt = "この図面を見て、どのような図面か教えてください。"
-
-                if mode == 'claude':
-                    import anthropic
-                    client = anthropic.Anthropic(api_key=api_key)
-                    content = []
-                    if screenshot_b64:
-                        content.append({"type": "image", "source": {
-                            "type": "base64", "media_type": "image/png", "data": screenshot_b64}})
-                    content.append({"type": "text", "text": prompt})
-                    response = client.messages.create(
-                        model="claude-sonnet-4-5-20250929",
-                        max_tokens=1000,
-                        system=system,
-                        messages=[{"role": "user", "content": content}])
-                    ai_response = response.content[0].text
-
-                elif mode == 'openai':
-                    from openai import OpenAI
-                    client = OpenAI(api_key=api_key)
-                    content = []
-                    if screenshot_b64:
-                        content.append({"type": "image_url", "image_url": {
-                            "url": f"data:image/png;base64,{screenshot_b64}"}})
-                    content.append({"type": "text", "text": prompt})
-                    response = client.chat.completions.create(
-                        model="gpt-4o", max_tokens=1000,
-                        messages=[{"role": "system", "content": system},
-                                  {"role": "user", "content": content}])
-                    ai_response = response.choices[0].message.content
-
-                elif mode == 'gemini':
-                    import google.generativeai as genai
-                    genai.configure(api_key=api_key)
-                    model_g = genai.GenerativeModel('gemini-1.5-pro', system_instruction=system)
-                    if screenshot_b64:
-                        import base64
-                        img_bytes = base64.b64decode(screenshot_b64)
-                        from PIL import Image
-                        import io
-                        img = Image.open(io.BytesIO(img_bytes))
-                        ai_response = model_g.generate_content([prompt, img]).text
-                    else:
-                        ai_response = model_g.generate_content(prompt).text
-                else:
-                    ai_response = "図面を読み込みました。作業内容を指示してください。"
+        try:
+            system = (
+                "あなたはJW_CAD（日本の建築CADソフト）の図面作業をサポートするAIアシスタント「JW AI」です。\n"
+                "添付された図面画像を見て、この図面がどのような図面か（建物の平面図、立面図、詳細図など）、\n"
+                "どこに何が配置されているかを日本語で簡潔に説明してください。\n"
+                "その後「この図面についてどのような作業をしますか？」と聞いてください。\n"
+                + image_note + "\n"
+                + self.system_prompt
+            )
+            prompt = "この図面を見て、どのような図面か教えてください。"
 
-                self.chat_history.append({"role": "user", "content": prompt})
-                self.chat_history.append({"role": "assistant", "content": ai_response})
-                self.root.after(0, lambda: self.append_chat("ai", ai_response))
+            if mode == 'claude':
+                import anthropic
+                client = anthropic.Anthropic(api_key=api_key)
+                content = []
+                if screenshot_b64:
+                    content.append({"type": "image", "source": {
+                        "type": "base64", "media_type": "image/png", "data": screenshot_b64}})
+                content.append({"type": "text", "text": prompt})
+                response = client.messages.create(
+                    model="claude-sonnet-4-5-20250929",
+                    max_tokens=1000,
+                    system=system,
+                    messages=[{"role": "user", "content": content}])
+                ai_response = response.content[0].text
 
-            except Exception as e:
-                err = str(e)
-                self.root.after(0, lambda: self.append_chat("error", f"AI解析エラー: {err}"))
+            elif mode == 'openai':
+                from openai import OpenAI
+                client = OpenAI(api_key=api_key)
+                content = []
+                if screenshot_b64:
+                    content.append({"type": "image_url", "image_url": {
+                        "url": f"data:image/png;base64,{screenshot_b64}"}})
+                content.append({"type": "text", "text": prompt})
+                response = client.chat.completions.create(
+                    model="gpt-4o", max_tokens=1000,
+                    messages=[{"role": "system", "content": system},
+                              {"role": "user", "content": content}])
+                ai_response = response.choices[0].message.content
+
+            elif mode == 'gemini':
+                import google.generativeai as genai
+                genai.configure(api_key=api_key)
+                model_g = genai.GenerativeModel('gemini-1.5-pro', system_instruction=system)
+                if screenshot_b64:
+                    import base64
+                    img_bytes = base64.b64decode(screenshot_b64)
+                    from PIL import Image
+                    import io
+                    img = Image.open(io.BytesIO(img_bytes))
+                    ai_response = model_g.generate_content([prompt, img]).text
+                else:
+                    ai_response = model_g.generate_content(prompt).text
+            else:
+                ai_response = "図面を読み込みました。作業内容を指示してください。"
+
+            self.chat_history.append({"role": "user", "content": prompt})
+            self.chat_history.append({"role": "assistant", "content": ai_response})
+            self.root.after(0, lambda: self.append_chat("ai", ai_response))
 
-        threading.Thread(target=_open_and_analyze, daemon=True).start()
+        except Exception as e:
+            err = str(e)
+            self.root.after(0, lambda: self.append_chat("error", f"AI解析エラー: {err}"))
 
     # ===== 設定ダイアログ =====
 
@@ -0,0 +1,1559 @@
+"""
+JW AI ベンチマーク
+合成JWWファイルを生成し、jwai_core の解析処理の速度を計測する。
+
+  python jwai_bench.py parse            # 1MB / 5MB の合成図面で旧実装と比較
+  python jwai_bench.py parse --mb 5 20  # サイズ指定
+  python jwai_bench.py parse --mb 20 50 --workers 8 --no-legacy  # 並列解析
+  python jwai_bench.py analyze          # insights・コンテキスト生成（辞書 vs 列指向）
+  python jwai_bench.py cache            # 解析キャッシュ（再解析 vs 読み込み）
+  python jwai_bench.py incr             # 保存し直した図面の差分解析
+  python jwai_bench.py archive          # オブジェクトストリーム（スキーマ駆動デコーダ・レイヤ指定）
+  python jwai_bench.py archive --mb 20 --workers 8  # オブジェクトストリームの並列解析
+  python jwai_bench.py fuzz             # 壊れた入力での例外・処理時間・打ち切りの確認
+  python jwai_bench.py text             # 文字分類（旧実装 vs JwwTextClassifier）
+  python jwai_bench.py jwc              # JWC_TEMP.TXT 解析・書き戻し（旧実装との比較）
+"""
+import os
+import math
+import sys
+import time
+import random
+import struct
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import jwai_core
+
+
+# ========== 合成JWWファイル生成 ==========
+
+ROOM_NAMES = ('玄関', 'ＬＤＫ', '洋室1', '洋室2', '和室', '浴室', '洗面脱衣', 'トイレ',
+              'ホール', '廊下', 'キッチン', '収納', 'WIC', 'バルコニー', '階段')
+
+
+def _cstring(text):
+    raw = text.encode('cp932')
+    return bytes([len(raw)]) + raw
+
+
+def make_synthetic_jww(path, target_bytes, seed=0):
+    """
+    parse_jww_full が想定するレコード形式で合成JWWファイルを書き出す。
+    線・円弧(一部ドア扇形)・0x30台文字レコード・レコード外の長さ付き文字列を混在させる。
+    """
+    rnd = random.Random(seed)
+    out = bytearray(b'JwwData.')
+    out += struct.pack('<I', 600)
+    out += _cstring('合成ベンチマーク図面')
+    out += struct.pack('<I', 3)
+
+    room_no = 0
+    while len(out) < target_bytes:
+        kind = rnd.random()
+        if kind < 0.70:
+            x, y = rnd.uniform(0, 20000), rnd.uniform(0, 15000)
+            if rnd.random() < 0.8:
+                # 壁系の直交線
+                if rnd.random() < 0.5:
+                    x2, y2 = x + rnd.uniform(100, 5000), y
+                else:
+                    x2, y2 = x, y + rnd.uniform(100, 5000)
+            else:
+                x2, y2 = rnd.uniform(0, 20000), rnd.uniform(0, 15000)
+            out += struct.pack('<HH', 0x10 + rnd.randrange(4), 32)
+            out += struct.pack('<dddd', x, y, x2, y2)
+        elif kind < 0.85:
+            sa = rnd.choice((0.0, 90.0, 180.0, 270.0))
+            span = 90.0 if rnd.random() < 0.5 else rnd.uniform(10, 350)
+            out += struct.pack('<HH', 0x20 + rnd.randrange(4), 40)
+            out += struct.pack('<ddddd', rnd.uniform(0, 20000), rnd.uniform(0, 15000),
+                               rnd.uniform(300, 1000), sa, (sa + span) % 360)
+        elif kind < 0.97:
+            if rnd.random() < 0.5:
+                text = ROOM_NAMES[rnd.randrange(len(ROOM_NAMES))]
+            else:
+                text = str(rnd.choice((455, 910, 1820, 2730, 3640)) * rnd.randint(1, 4))
+            if rnd.random() < 0.3:
+                room_no += 1
+                text += str(room_no)
+            body = struct.pack('<dd', rnd.uniform(0, 20000), rnd.uniform(0, 15000)) + _cstring(text)
+            out += struct.pack('<HH', 0x30 + rnd.randrange(6), len(body)) + body
+        else:
+            # レコード外の文字列（フォールバックスキャン対象）
+            out += _cstring(f'備考{rnd.randrange(100000)}')
+    with open(path, 'wb') as f:
+        f.write(out)
+    return len(out)
+
+
+def make_synthetic_jww_archive(path, target_bytes, seed=0, version=600):
+    """
+    JW_CAD と同じ MFC CArchive 形式（ヘッダ + クラスタグ付きオブジェクト列）で合成JWWファイルを書き出す。
+    線・円弧・点・文字・寸法を 16グループ×16レイヤに散らす（ヘッダの設定項目はゼロ埋め）。
+    Returns: (ファイルサイズ, {"line","arc","text","dim": 件数, (グループ, レイヤ): 図形数})
+    """
+    rnd = random.Random(seed)
+    out = bytearray(b'JwwData.')
+    out += struct.pack('<I', version)
+    out += _cstring('合成オブジェクトストリーム図面')
+    out += struct.pack('<II', 3, 0)
+    for g in range(16):
+        out += struct.pack('<IIdI', 2, 0, 100.0, 0) + struct.pack('<II', 2, 0) * 16
+    out += bytes(jwai_core._JWW_HEADER_SETTINGS)
+    for g in range(16):
+        for k in range(16):
+            out += _cstring(f'{g:X}-{k:X}壁' if k == 0 else '')
+    for g in range(16):
+        out += _cstring(f'グループ{g:X}')
+    out += bytes(rnd.randrange(200, 400))     # 寸法・文字などの設定（合成ではゼロ埋め）
+
+    truth = {"line": 0, "arc": 0, "text": 0, "dim": 0}
+    classes = {}
+    body = bytearray()
+    loaded = 0            # CArchive の通し番号（クラスとオブジェクトで共通）
+    count = 0
+
+    def data(layer):
+        return struct.pack('<IBHHHHH', 0, 1, rnd.randrange(1, 9), 1, layer[1], layer[0], 0)
+
+    def sen(layer, x1, y1, x2, y2):
+        return data(layer) + struct.pack('<dddd', x1, y1, x2, y2)
+
+    def moji(layer, x, y, text):
+        return (data(layer) + struct.pack('<ddddIdddd', x, y, x + 1000, y, 1, 300.0, 300.0, 0.0, 0.0)
+                + _cstring('ＭＳ ゴシック') + _cstring(text))
+
+    def ten(layer, x, y):
+        return data(layer) + struct.pack('<ddI', x, y, 0)
+
+    while len(out) + len(body) < target_bytes:
+        layer = (rnd.randrange(16), rnd.randrange(16))
+        x, y = rnd.uniform(0, 20000), rnd.uniform(0, 15000)
+        kind = rnd.random()
+        if kind < 0.70:
+            name = "CDataSen"
+            x2, y2 = (x + rnd.uniform(100, 5000), y) if rnd.random() < 0.5 else (x, y + rnd.uniform(100, 5000))
+            obj = sen(layer, x, y, x2, y2)
+            truth["line"] += 1
+        elif kind < 0.82:
+            name = "CDataEnko"
+            full = rnd.random() < 0.1
+            obj = data(layer) + struct.pack('<dddddddI', x, y, rnd.uniform(300, 1000),
+                                            rnd.choice((0.0, 1.5707963267948966)), 1.5707963267948966,
+                                            0.0, 1.0, int(full))
+            truth["arc"] += 1
+        elif kind < 0.87:
+            name = "CDataTen"
+            obj = ten(layer, x, y)
+        elif kind < 0.95:
+            name = "CDataMoji"
+            obj = moji(layer, x, y, ROOM_NAMES[rnd.randrange(len(ROOM_NAMES))])
+            truth["text"] += 1
+        else:
+            name = "CDataSunpou"
+            value = rnd.choice((455, 910, 1820, 2730, 3640)) * rnd.randint(1, 4)
+            obj = (data(layer) + sen(layer, x, y, x + value, y) + moji(layer, x + value / 2, y, f'{value:,}')
+                   + struct.pack('<H', 0) + sen(layer, x, y, x, y - 300) + sen(layer, x + value, y, x + value, y - 300)
+                   + ten(layer, x, y) + ten(layer, x + value, y) + ten(layer, x, y - 300)
+                   + ten(layer, x + value, y - 300))
+            truth["dim"] += 1
+        if name in classes:
+            body += struct.pack('<H', 0x8000 | classes[name])
+        else:
+            loaded += 1
+            classes[name] = loaded
+            body += struct.pack('<HHH', 0xFFFF, version, len(name)) + name.encode('ascii')
+        loaded += 1
+        body += obj
+        count += 1
+        truth[layer] = truth.get(layer, 0) + 1
+
+    out += struct.pack('<H', count) if count < 0xFFFF else struct.pack('<HI', 0xFFFF, count)
+    out += body
+    out += struct.pack('<H', 0)               # ブロック図形定義の件数
+    with open(path, 'wb') as f:
+        f.write(out)
+    return len(out), truth
+
+
+def make_synthetic_jwc(path, rows, seed=0):
+    """
+    外部変形の JWC_TEMP.TXT 形式（ヘッダ・属性・線・円弧・文字）で合成ファイルを書き出す。
+    Returns: 書き出した行数
+    """
+    rnd = random.Random(seed)
+    out = ['hq', 'hk', 'hs 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1 1', 'hn', 'hp']
+    while len(out) < rows:
+        r = rnd.random()
+        if r < 0.05:
+            out.append(f'lg{rnd.randint(0, 15):X}')
+            out.append(f'ly{rnd.randint(0, 15):X}')
+            out.append(f'lc{rnd.randint(1, 9)}')
+            out.append(f'lt{rnd.randint(1, 9)}')
+        elif r < 0.80:
+            x, y = rnd.uniform(-20000, 20000), rnd.uniform(-20000, 20000)
+            out.append(f'{x:.4f} {y:.4f} {x + rnd.uniform(-5000, 5000):.4f} {y + rnd.uniform(-5000, 5000):.4f}')
+        elif r < 0.92:
+            sa = rnd.choice((0.0, 90.0, 180.0, 270.0))
+            out.append(f'ci {rnd.uniform(-20000, 20000):.4f} {rnd.uniform(-20000, 20000):.4f} '
+                       f'{rnd.uniform(300, 1000):.4f} {sa} {sa + 90} 1 0')
+        elif r < 0.97:
+            out.append(f'ch {rnd.uniform(-20000, 20000):.4f} {rnd.uniform(-20000, 20000):.4f} 1 0 '
+                       f'"{rnd.choice(ROOM_NAMES)}')
+        else:
+            out.append(f'pt {rnd.uniform(-20000, 20000):.4f} {rnd.uniform(-20000, 20000):.4f}')
+    with open(path, 'w', encoding='cp932', newline='\r\n') as f:
+        f.write('\n'.join(out[:rows]) + '\n')
+    return rows
+
+
+# ========== 旧実装（比較用） ==========
+
+def legacy_parse_jww_full(filepath, max_texts=500, fallback=True):
+    """
+    旧実装（レコード走査・0x30台走査・フォールバックの3パス）。比較用にそのまま残している。
+    max_texts=None で文字の500件打切りを外し、fallback=False でフォールバックのパスを省く
+    （parse_jww_full と同じ量の文字を読ませて比べるため）。
+    """
+    import struct
+    import os
+    import re
+    import unicodedata
+
+    def is_reasonable_coord(*vals):
+        return all(abs(v) < 1000000 for v in vals)
+
+    def normalize_text(raw):
+        if not raw:
+            return ""
+        return ''.join(c for c in raw if c.isprintable()).strip()
+
+    def normalize_for_match(text):
+        # 全角/半角ゆれを抑える（３０００ -> 3000, ＬＤＫ -> LDK）
+        return unicodedata.normalize('NFKC', text).strip()
+
+    def classify_text(clean):
+        if not clean:
+            return None
+        n = normalize_for_match(clean)
+        compact = re.sub(r'\s+', '', n)
+        lower = compact.lower()
+
+        # 寸法値（1000, 900.5, 1200x600, R250, φ100, 1000mm）
+        if re.fullmatch(r'[+-]?\d+(?:\.\d+)?(?:mm)?', lower):
+            return "dim"
+        if re.fullmatch(r'[+-]?\d+(?:\.\d+)?x[+-]?\d+(?:\.\d+)?(?:mm)?', lower):
+            return "dim"
+        if re.fullmatch(r'(?:r|φ|d)?[+-]?\d+(?:\.\d+)?(?:mm)?', lower):
+            return "dim"
+
+        room_keywords = (
+            '玄関', 'ホール', '廊下', 'ポーチ', '洗面', '脱衣', '浴室', '風呂', 'トイレ',
+            '便所', 'キッチン', '台所', 'ダイニング', 'リビング', '和室', '洋室',
+            '寝室', '納戸', '収納', '押入', '階段', 'バルコニー', 'ベランダ',
+            'ps', 'mb', 'cl', 'wic', 'sic', 'ldk'
+        )
+        low = n.lower()
+        if any(k in low for k in room_keywords):
+            return "room"
+
+        has_jp = any('぀' <= c <= '鿿' or '＀' <= c <= '￯' for c in clean)
+        if has_jp:
+            return "text"
+        return None
+
+    def append_text(clean, source, coord=None):
+        cls = classify_text(clean)
+        if not cls:
+            return
+        item = {"text": clean, "source": source, "kind": cls}
+        if coord:
+            item["x"], item["y"] = coord
+        texts.append(item)
+        seen_texts.add(clean)
+
+        if cls == "dim":
+            dim = {"value": clean}
+            if coord:
+                dim["x"], dim["y"] = coord
+            dims.append(dim)
+        elif cls == "room":
+            rooms.append({"name": clean, **({"x": coord[0], "y": coord[1]} if coord else {})})
+
+    if not os.path.exists(filepath):
+        return None, f"ファイルが見つかりません: {filepath}"
+
+    try:
+        with open(filepath, 'rb') as f:
+            data = f.read()
+    except Exception as e:
+        return None, str(e)
+
+    if len(data) < 8 or not data[:7].decode('ascii', errors='ignore').startswith('JwwData'):
+        return None, "JWWファイルではありません"
+
+    lines, arcs, texts, dims, rooms = [], [], [], [], []
+
+    i = 0
+    max_items = 2000
+    while i < len(data) - 4:
+        try:
+            rec_type = struct.unpack_from('<H', data, i)[0]
+            rec_size = struct.unpack_from('<H', data, i + 2)[0]
+            if rec_size == 0 or rec_size > 512 or i + 4 + rec_size > len(data):
+                i += 1
+                continue
+
+            rec_data = data[i + 4: i + 4 + rec_size]
+
+            if rec_type in (0x10, 0x11, 0x12, 0x13) and rec_size >= 32:
+                try:
+                    x1, y1, x2, y2 = struct.unpack_from('<dddd', rec_data, 0)
+                    if is_reasonable_coord(x1, y1, x2, y2):
+                        length = ((x2-x1)**2 + (y2-y1)**2) ** 0.5
+                        if length > 0.1:
+                            lines.append({
+                                "x1": round(x1, 2), "y1": round(y1, 2),
+                                "x2": round(x2, 2), "y2": round(y2, 2),
+                                "length": round(length, 2)
+                            })
+                            if len(lines) >= max_items:
+                                i += 4 + rec_size
+                                continue
+                except Exception:
+                    pass
+
+            elif rec_type in (0x20, 0x21, 0x22, 0x23) and rec_size >= 40:
+                try:
+                    cx, cy, r, sa, ea = struct.unpack_from('<ddddd', rec_data, 0)
+                    if is_reasonable_coord(cx, cy) and 0 < r < 100000:
+                        arcs.append({
+                            "cx": round(cx, 2), "cy": round(cy, 2), "r": round(r, 2),
+                            "start_a": round(sa, 2), "end_a": round(ea, 2)
+                        })
+                            
+                        if len(arcs) >= max_items:
+                            i += 4 + rec_size
+                            continue
+                except Exception:
+                    pass
+
+            i += 4 + rec_size
+        except Exception:
+            i += 1
+
+    seen_texts = set()
+
+    # type 0x30台（文字/寸法系を想定）優先
+    i = 0
+    while i < len(data) - 4 and (max_texts is None or len(texts) < max_texts):
+        try:
+            rec_type = struct.unpack_from('<H', data, i)[0]
+            rec_size = struct.unpack_from('<H', data, i + 2)[0]
+            if rec_type not in (0x30, 0x31, 0x32, 0x33, 0x34, 0x35) or rec_size < 6 or rec_size > 1024:
+                i += 1
+                continue
+            if i + 4 + rec_size > len(data):
+                i += 1
+                continue
+
+            rec_data = data[i + 4:i + 4 + rec_size]
+            coord = None
+            if rec_size >= 16:
+                try:
+                    x, y = struct.unpack_from('<dd', rec_data, 0)
+                    if is_reasonable_coord(x, y):
+                        coord = (round(x, 2), round(y, 2))
+                except Exception:
+                    coord = None
+
+            for start in range(0, min(96, rec_size - 2)):
+                length = rec_data[start]
+                if not 2 <= length <= 120 or start + 1 + length > rec_size:
+                    continue
+                raw = rec_data[start + 1:start + 1 + length]
+                try:
+                    clean = normalize_text(raw.decode('cp932'))
+                except Exception:
+                    continue
+                if len(clean) < 2 or clean in seen_texts:
+                    continue
+                append_text(clean, f"0x{rec_type:02x}", coord)
+
+            i += 4 + rec_size
+        except Exception:
+            i += 1
+
+    # fallback: 可変長文字列スキャン
+    j = 0
+    while fallback and j < len(data) - 2 and (max_texts is None or len(texts) < max_texts):
+        length = data[j]
+        if 2 <= length <= 80:
+            chunk = data[j+1:j+1+length]
+            try:
+                clean = normalize_text(chunk.decode('cp932'))
+                if len(clean) >= 2 and clean not in seen_texts:
+                    append_text(clean, "fallback")
+                    if clean in seen_texts:
+                        j += 1 + length
+                        continue
+            except Exception:
+                pass
+        j += 1
+
+    # 重複整理
+    seen_dim = set()
+    dedup_dims = []
+    for d in dims:
+        key = normalize_for_match(d.get('value', ''))
+        if not key or key in seen_dim:
+            continue
+        seen_dim.add(key)
+        dedup_dims.append(d)
+    dims = dedup_dims
+
+    room_counts = {}
+    room_labels_with_coord = 0
+    for r in rooms:
+        name = normalize_for_match(r['name'])
+        if not name:
+            continue
+        room_counts[name] = room_counts.get(name, 0) + 1
+        if 'x' in r and 'y' in r:
+            room_labels_with_coord += 1
+    room_summary = [
+        {"name": name, "count": count}
+        for name, count in sorted(room_counts.items(), key=lambda x: (-x[1], x[0]))
+    ]
+
+    # 図面理解に有効な幾何学ヒント
+    bbox = None
+    if lines:
+        xs = [l['x1'] for l in lines] + [l['x2'] for l in lines]
+        ys = [l['y1'] for l in lines] + [l['y2'] for l in lines]
+        min_x, max_x = min(xs), max(xs)
+        min_y, max_y = min(ys), max(ys)
+        bbox = {
+            "min_x": round(min_x, 2), "min_y": round(min_y, 2),
+            "max_x": round(max_x, 2), "max_y": round(max_y, 2),
+            "width": round(max_x - min_x, 2), "height": round(max_y - min_y, 2),
+        }
+
+    hv = 0
+    for l in lines:
+        dx = abs(l['x2'] - l['x1'])
+        dy = abs(l['y2'] - l['y1'])
+        if dx < 1.0 or dy < 1.0:
+            hv += 1
+    orthogonality_ratio = round((hv / len(lines)), 3) if lines else 0.0
+
+    door_like_arcs = 0
+    for a in arcs:
+        span = (a['end_a'] - a['start_a']) % 360
+        if 80 <= span <= 100:
+            door_like_arcs += 1
+
+    drawing_type = "unknown"
+    if room_summary and orthogonality_ratio >= 0.45:
+        drawing_type = "floor_plan_like"
+
+    insights = {
+        "drawing_type": drawing_type,
+        "orthogonality_ratio": orthogonality_ratio,
+        "door_like_arcs": door_like_arcs,
+        "bbox": bbox,
+        "room_labels_with_coord": room_labels_with_coord,
+    }
+
+    info = {
+        "lines": lines,
+        "arcs": arcs,
+        "texts": texts,
+        "dims": dims,
+        "rooms": room_summary,
+        "insights": insights,
+        "stats": {
+            "lines": len(lines),
+            "arcs": len(arcs),
+            "texts": len(texts),
+            "dims": len(dims),
+            "rooms": len(room_summary),
+        }
+    }
+    return info, None
+
+
+def legacy_parse_jwc_temp(filepath):
+    """
+    旧 parse_jwc_temp（startswith の連鎖で1行ずつ判定する）
+    Returns: (elements, raw_lines, error_str_or_None)
+    """
+    elements = []
+    raw_lines = []
+
+    if not os.path.exists(filepath):
+        return elements, raw_lines, f"ファイルが見つかりません: {filepath}"
+
+    try:
+        with open(filepath, 'r', encoding='cp932', errors='replace') as f:
+            lines = f.readlines()
+    except Exception as e:
+        return elements, raw_lines, str(e)
+
+    for line in lines:
+        line = line.rstrip('\n\r')
+        raw_lines.append(line)
+        if not line:
+            elements.append({'type': 'blank', 'raw': ''})
+            continue
+
+        parts = line.split()
+        if not parts:
+            continue
+        code = parts[0]
+
+        if code == 'hq':
+            elements.append({'type': 'hq', 'raw': line})
+        elif (code.startswith('hk') or code.startswith('hs') or code.startswith('hn')
+              or code.startswith('hcw') or code.startswith('hch') or code.startswith('hcd')
+              or code.startswith('hcc') or code.startswith('hp')):
+            elements.append({'type': 'header', 'raw': line})
+        elif (code.startswith('lg') or code.startswith('ly') or code.startswith('lc')
+              or code.startswith('lt') or code.startswith('lw')):
+            elements.append({'type': 'attr', 'raw': line})
+        elif code == 'ci':
+            elements.append({'type': 'circle', 'raw': line, 'parts': parts})
+        elif (code.startswith('ch') or code.startswith('cv') or code.startswith('cs')
+              or code.startswith('cn')):
+            elements.append({'type': 'text', 'raw': line, 'parts': parts})
+        elif code == 'pt':
+            elements.append({'type': 'point', 'raw': line, 'parts': parts})
+        elif code == 'hd':
+            elements.append({'type': 'hd', 'raw': line})
+        elif len(parts) == 4:
+            try:
+                x1, y1, x2, y2 = float(parts[0]), float(parts[1]), float(parts[2]), float(parts[3])
+                elements.append({'type': 'line', 'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2, 'raw': line})
+            except Exception:
+                elements.append({'type': 'other', 'raw': line})
+        else:
+            elements.append({'type': 'other', 'raw': line})
+
+    return elements, raw_lines, None
+
+
+def legacy_write_result_to_jwc(elements, modified_lines_map, filepath,
+                                modified_circles_map=None):
+    """
+    旧 write_result_to_jwc（全行を1つの文字列にしてから、ファイルへ直接書く）
+    Returns: (success, error_or_None)
+    """
+    if modified_circles_map is None:
+        modified_circles_map = {}
+
+    output = []
+    line_idx = 0
+    circle_idx = 0
+    for elem in elements:
+        if elem['type'] == 'hq':
+            continue  # hq削除が「実行済み」の合図
+        elif elem['type'] == 'line':
+            if line_idx in modified_lines_map:
+                m = modified_lines_map[line_idx]
+                x1 = m.get('x1', elem['x1'])
+                y1 = m.get('y1', elem['y1'])
+                x2 = m.get('x2', elem['x2'])
+                y2 = m.get('y2', elem['y2'])
+                output.append(f"{x1} {y1} {x2} {y2}")
+            else:
+                output.append(elem['raw'])
+            line_idx += 1
+        elif elem['type'] == 'circle':
+            if circle_idx in modified_circles_map:
+                output.append(modified_circles_map[circle_idx])
+            else:
+                output.append(elem['raw'])
+            circle_idx += 1
+        else:
+            output.append(elem['raw'])
+
+    try:
+        content = '\n'.join(output) + '\n'
+        with open(filepath, 'w', encoding='cp932', errors='replace') as f:
+            f.write(content)
+        return True, None
+    except Exception as e:
+        return False, str(e)
+
+
+def legacy_apply_transform(elements, transform):
+    """
+    旧 apply_transform の mirror_x / mirror_y / rotate（要素ごとに Python で変換する。rotate は線だけ）
+    Returns: (modified_lines_map, modified_circles_map)
+    """
+    t = transform.get("type", "")
+    xmin, ymin, xmax, ymax = jwai_core._calc_bbox(elements)
+    axis_x = transform.get("axis_x", (xmin + xmax) / 2)
+    axis_y = transform.get("axis_y", (ymin + ymax) / 2)
+    rot_cx = transform.get("cx", (xmin + xmax) / 2)
+    rot_cy = transform.get("cy", (ymin + ymax) / 2)
+    mod_lines, mod_circles = {}, {}
+    line_idx = circle_idx = 0
+    for elem in elements:
+        if elem.type == 'line':
+            x1, y1, x2, y2 = elem.x1, elem.y1, elem.x2, elem.y2
+            if t == "mirror_x":
+                x1, x2 = 2 * axis_x - x1, 2 * axis_x - x2
+            elif t == "mirror_y":
+                y1, y2 = 2 * axis_y - y1, 2 * axis_y - y2
+            elif t == "rotate":
+                rad = math.radians(transform.get("angle", 0.0))
+                cos_a, sin_a = math.cos(rad), math.sin(rad)
+
+                def _rot(px, py, cx=rot_cx, cy=rot_cy, ca=cos_a, sa=sin_a):
+                    dx, dy = px - cx, py - cy
+                    return cx + dx * ca - dy * sa, cy + dx * sa + dy * ca
+                x1, y1 = _rot(x1, y1)
+                x2, y2 = _rot(x2, y2)
+            if (x1, y1, x2, y2) != (elem.x1, elem.y1, elem.x2, elem.y2):
+                mod_lines[line_idx] = {'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2}
+            line_idx += 1
+        elif elem.type == 'circle':
+            c, new_raw = elem, None
+            if c.valid and t == "mirror_x":
+                cx = 2 * axis_x - c.cx
+                new_raw = (f"ci {cx} {c.cy} {c.r} {(180 - c.end_a) % 360} {(180 - c.start_a) % 360} "
+                           + " ".join(c.rest)) if c.has_angles else f"ci {cx} {c.cy} {c.r}"
+            elif c.valid and t == "mirror_y":
+                cy = 2 * axis_y - c.cy
+                new_raw = (f"ci {c.cx} {cy} {c.r} {(360 - c.end_a) % 360} {(360 - c.start_a) % 360} "
+                           + " ".join(c.rest)) if c.has_angles else f"ci {c.cx} {cy} {c.r}"
+            if new_raw is not None and new_raw != c.raw:
+                mod_circles[circle_idx] = new_raw
+            circle_idx += 1
+    return mod_lines, mod_circles
+
+
+# ========== 計測 ==========
+
+def _timeit(fn, *args, repeat=1):
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, result
+
+
+def _stream_summary(path):
+    """iter_jww_entities を流して JwwSummary だけを作る（エンティティは保持しない）"""
+    summary = jwai_core.JwwSummary()
+    for ent in jwai_core.iter_jww_entities(path):
+        summary.add(ent)
+    return summary.to_info()
+
+
+def _peak_memory(fn, *args):
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_parse(sizes_mb, repeat=1, legacy=True, workers=1):
+    """
+    parse_jww_full と iter_jww_entities（ストリーム集計）を計測する。
+    旧実装は文字を500件で打ち切っていたため、打切りを外して同じ文字を読ませた場合とも比べる
+    （parse_jww_full はフォールバックを64KBごとにレコードの走査に追いつかせるので、比べるのはレコード由来の文字）。
+    フォールバックを絞った場合（narrow_fallback=True）の時間も測る。
+    """
+    print("parse_jww_full: 1パス デコーダ vs 旧3パス実装")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mb in sizes_mb:
+            path = os.path.join(tmp, f"synthetic_{mb}mb.jww")
+            size = make_synthetic_jww(path, int(mb * 1024 * 1024))
+            t_new, (info, err) = _timeit(jwai_core.parse_jww_full, path, repeat=repeat)
+            if err:
+                print(f"  {mb}MB: エラー {err}")
+                continue
+            line = (f"  {mb:>5}MB ({size:,} bytes)  新: {t_new:7.3f}s  "
+                    f"線{info['stats']['lines']} 円弧{info['stats']['arcs']} 文字{info['stats']['texts']}")
+            if legacy:
+                t_old, (old, _) = _timeit(legacy_parse_jww_full, path, repeat=repeat)
+                same = old["lines"] == info["lines"] and old["arcs"] == info["arcs"]
+                line += (f"  旧: {t_old:7.3f}s（文字{old['stats']['texts']}件で打切り）"
+                         f"  線・円弧一致: {'OK' if same else 'NG'}")
+            print(line)
+            if legacy:
+                t_full, (full, _) = _timeit(legacy_parse_jww_full, path, None, repeat=repeat)
+                rec = lambda i: [(t["text"], t["kind"]) for t in i["texts"] if t["source"] != "fallback"]
+                same = rec(full) == rec(info)
+                print(f"  {'':>5}   旧（打切りなし）: {t_full:7.3f}s  x{t_full / t_new:5.1f}  "
+                      f"文字{full['stats']['texts']}  レコード由来の文字一致: {'OK' if same else 'NG'}")
+            t_narrow, (narrow, _) = _timeit(lambda p: jwai_core.parse_jww_full(p, narrow_fallback=True), path,
+                                            repeat=repeat)
+            print(f"  {'':>5}   フォールバックを絞る: {t_narrow:7.3f}s  文字{narrow['stats']['texts']}")
+
+            t_stream, stream = _timeit(_stream_summary, path, repeat=repeat)
+            same = all(stream[k] == info[k] for k in stream)
+            print(f"  {'':>5}   ストリーム集計: {t_stream:7.3f}s  "
+                  f"ピークメモリ {_peak_memory(_stream_summary, path) / 1e6:6.1f}MB"
+                  f"（parse_jww_full {_peak_memory(jwai_core.parse_jww_full, path) / 1e6:6.1f}MB）"
+                  f"  結果一致: {'OK' if same else 'NG'}")
+            if jwai_core._import_numpy() is not None:
+                t_col, (col, _) = _timeit(jwai_core.parse_jww_full, path, True, repeat=repeat)
+                same = all(col[k] == info[k] for k in info)
+                print(f"  {'':>5}   列指向(NumPy): {t_col:7.3f}s  結果一致: {'OK' if same else 'NG'}")
+            if workers > 1:
+                if size < jwai_core._JWW_PARALLEL_MIN_BYTES:
+                    print(f"  {'':>5}   並列: {jwai_core._JWW_PARALLEL_MIN_BYTES >> 20}MB未満のため直列で解析されます")
+                    continue
+                t_par, (par, _) = _timeit(jwai_core.parse_jww_full, path, False, workers, repeat=repeat)
+                same = (par["lines"] == info["lines"] and par["arcs"] == info["arcs"]
+                        and par["insights"]["bbox"] == info["insights"]["bbox"])
+                print(f"  {'':>5}   並列({workers}プロセス): {t_par:7.3f}s  x{t_new / t_par:5.1f}  "
+                      f"文字{par['stats']['texts']}  線・円弧一致: {'OK' if same else 'NG'}")
+
+
+def _random_geometry(n_lines, n_arcs, seed=0):
+    rnd = random.Random(seed)
+    lines, arcs = [], []
+    for _ in range(n_lines):
+        x, y = round(rnd.uniform(0, 50000), 2), round(rnd.uniform(0, 50000), 2)
+        if rnd.random() < 0.8:
+            x2, y2 = (round(x + rnd.uniform(100, 5000), 2), y) if rnd.random() < 0.5 else \
+                     (x, round(y + rnd.uniform(100, 5000), 2))
+        else:
+            x2, y2 = round(rnd.uniform(0, 50000), 2), round(rnd.uniform(0, 50000), 2)
+        lines.append({"x1": x, "y1": y, "x2": x2, "y2": y2,
+                      "length": round(((x2 - x) ** 2 + (y2 - y) ** 2) ** 0.5, 2)})
+    for _ in range(n_arcs):
+        sa = rnd.choice((0.0, 90.0, 180.0, 270.0))
+        arcs.append({"cx": round(rnd.uniform(0, 50000), 2), "cy": round(rnd.uniform(0, 50000), 2),
+                     "r": round(rnd.uniform(300, 1000), 2), "start_a": sa,
+                     "end_a": round((sa + rnd.choice((90.0, rnd.uniform(10, 350)))) % 360, 2)})
+    return lines, arcs
+
+
+def bench_analyze(counts):
+    """insights と build_jww_full_context の線ソートを、辞書リストと列指向で比較"""
+    np = jwai_core._import_numpy()
+    if np is None:
+        print("NumPy が無いため列指向の比較は省略します")
+        return
+    print("図面全体の解析: 辞書リスト vs 列指向(NumPy)")
+    for n in counts:
+        lines, arcs = _random_geometry(n, n // 10)
+        line_arr = np.array([tuple(l[f] for f in jwai_core.JWW_LINE_FIELDS) for l in lines],
+                            dtype=[(f, 'f8') for f in jwai_core.JWW_LINE_FIELDS])
+        arc_arr = np.array([tuple(a[f] for f in jwai_core.JWW_ARC_FIELDS) for a in arcs],
+                           dtype=[(f, 'f8') for f in jwai_core.JWW_ARC_FIELDS])
+        stats = {"lines": n, "arcs": len(arcs)}
+        dict_info = {"lines": lines, "arcs": arcs, "stats": stats}
+        col_info = {"lines": jwai_core.JwwColumnView(line_arr), "arcs": jwai_core.JwwColumnView(arc_arr),
+                    "line_array": line_arr, "arc_array": arc_arr, "stats": stats}
+
+        line_ents = [jwai_core.JwwLine(**l) for l in lines]
+        arc_ents = [jwai_core.JwwArc(**a) for a in arcs]
+
+        def run_dict():
+            summary = jwai_core.JwwSummary()
+            for ent in line_ents:
+                summary.add_line(ent)
+            for ent in arc_ents:
+                summary.add_arc(ent)
+            return summary.insights(), jwai_core.build_jww_full_context(dict_info)
+
+        def run_col():
+            summary = jwai_core.JwwSummary()
+            summary.add_columns(np, line_arr, arc_arr)
+            return summary.insights(), jwai_core.build_jww_full_context(col_info)
+
+        t_dict, r_dict = _timeit(run_dict, repeat=3)
+        t_col, r_col = _timeit(run_col, repeat=3)
+        print(f"  線{n:>9,}本  辞書: {t_dict * 1000:8.1f}ms  列指向: {t_col * 1000:7.1f}ms  "
+              f"x{t_dict / t_col:6.1f}  結果一致: {'OK' if r_dict == r_col else 'NG'}")
+
+
+def bench_cache(sizes_mb):
+    """解析キャッシュの保存・読み込みと、再解析との時間差を比べる"""
+    print("解析キャッシュ: parse_jww_full vs JwwParseCache.load")
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = jwai_core.JwwParseCache(os.path.join(tmp, "cache"), 1 << 30)
+        for mb in sizes_mb:
+            path = os.path.join(tmp, f"synthetic_{mb}mb.jww")
+            make_synthetic_jww(path, int(mb * 1024 * 1024))
+            t_parse, (info, _) = _timeit(jwai_core.parse_jww_full, path, True)
+            t_fp, fp = _timeit(jwai_core.jww_fingerprint, path, repeat=3)
+            t_store, (size, err) = _timeit(cache.store, fp, info)
+            if err:
+                print(f"  {mb}MB: 保存エラー {err}")
+                continue
+            t_load, hit = _timeit(cache.load, fp, True, repeat=3)
+            same = hit is not None and all(hit[0][k] == info[k] for k in info
+                                           if k not in ("line_array", "arc_array"))
+            print(f"  {mb:>5}MB  解析: {t_parse:7.3f}s  指紋: {t_fp * 1000:6.1f}ms  "
+                  f"保存: {t_store * 1000:7.1f}ms ({size / 1e6:.2f}MB)  読込: {t_load * 1000:7.1f}ms  "
+                  f"結果一致: {'OK' if same else 'NG'}")
+
+
+def _jww_edits(data):
+    """保存し直しを模した編集（名前, 新しい内容）を返す"""
+    n = len(data)
+    line = struct.pack('<HHdddd', 0x10, 32, 1000.0, 2000.0, 4600.0, 2000.0)
+    return [
+        ("線を1本上書き", data[:n // 2] + line + data[n // 2 + len(line):]),
+        ("線を1本挿入", data[:n // 2] + line + data[n // 2:]),
+        ("4KB削除", data[:n // 3] + data[n // 3 + 4096:]),
+        ("末尾に追記", data + line * 10),
+    ]
+
+
+def _jww_archive_edits(data):
+    """
+    オブジェクトストリーム形式の図面で、JW_CAD の保存し直しを模した編集（名前, 新しい内容）を返す。
+    オブジェクト単位で上書き・挿入・削除・追記し、件数も書き換える（合成図面はクラス定義が先頭に集まる）。
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "archive.jww")
+        with open(path, 'wb') as f:
+            f.write(data)
+        with jwai_core.JwwFile(path) as jf:
+            archive = jwai_core.JwwArchive(jf.buffer)
+            trace = jwai_core.JwwArchiveLayout()
+            kinds = [obj.cls for obj in archive.iter_objects(trace=trace)]
+            start, count, count_pos = archive.start, archive.count, archive.count_pos
+    tags, end = list(trace.tags), trace.end
+    slot = next(s for _, s, name in trace.classes if name == "CDataSen")
+    line = (struct.pack('<HIBHHHHH', 0x8000 | slot, 0, 1, 1, 1, 0, 0, 0)
+            + struct.pack('<dddd', 1000.0, 2000.0, 4600.0, 2000.0))
+
+    def recount(content, n):
+        fmt = '<I' if count_pos == start - 6 else '<H'
+        pos = start - struct.calcsize(fmt)
+        return content[:pos] + struct.pack(fmt, n) + content[start:]
+
+    i = next(k for k in range(len(tags) // 2, len(tags)) if kinds[k] == "CDataSen")
+    x1 = tags[i] + 2 + 15            # クラスタグ(2) + CData部(15) のあとが始点X
+    return [
+        ("線を1本上書き", data[:x1] + struct.pack('<d', 1234.5) + data[x1 + 8:]),
+        ("線を1本挿入", recount(data[:tags[i]] + line + data[tags[i]:], count + 1)),
+        ("1件削除", recount(data[:tags[i]] + data[tags[i + 1]:], count - 1)),
+        ("末尾に追記", recount(data[:end] + line * 10 + data[end:], count + 10)),
+    ]
+
+
+def bench_incremental(sizes_mb):
+    """
+    保存し直した図面の読み直しを、フル解析と parse_jww_incremental で比べる。
+    レコード推定で読む図面と、オブジェクトストリームとして読む図面の両方で計測する。
+    """
+    print("差分解析: parse_jww_full vs parse_jww_incremental")
+    same_rec = lambda a, b: ([t for t in a["texts"] if t["source"] != "fallback"]
+                             == [t for t in b["texts"] if t["source"] != "fallback"])
+    formats = (("レコード", make_synthetic_jww, _jww_edits),
+               ("オブジェクトストリーム", make_synthetic_jww_archive, _jww_archive_edits))
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, make, edits in formats:
+            for mb in sizes_mb:
+                path = os.path.join(tmp, f"synthetic_{mb}mb.jww")
+                make(path, int(mb * 1024 * 1024))
+                with open(path, 'rb') as f:
+                    data = f.read()
+                base, _ = jwai_core.parse_jww_full(path, True, layout=True)
+                print(f"  {mb:>5}MB  {name}")
+                for title, content in edits(data):
+                    with open(path, 'wb') as f:
+                        f.write(content)
+                    t_full, (full, _) = _timeit(jwai_core.parse_jww_full, path, True)
+                    t_inc, (inc, err) = _timeit(jwai_core.parse_jww_incremental, path, base, True)
+                    if err:
+                        print(f"    {title}: エラー {err}")
+                        continue
+                    start, end = inc["layout"].decoded
+                    same = (inc["lines"] == full["lines"] and inc["arcs"] == full["arcs"]
+                            and same_rec(inc, full) and inc["insights"] == full["insights"])
+                    print(f"    {title:<8}  フル: {t_full:7.3f}s  差分: {t_inc:7.3f}s  x{t_full / t_inc:5.1f}  "
+                          f"デコード {(end - start) / 1024:7.0f}KB  線・円弧・レコード文字・insights一致: "
+                          f"{'OK' if same else 'NG'}")
+
+
+def bench_archive(sizes_mb, workers=1):
+    """
+    オブジェクトストリーム形式の合成図面で、スキーマ駆動デコーダとレコード推定を比べる。
+    workers が2以上なら、並列解析（位置の索引を区画に分けてデコード）とも比べる。
+    """
+    print("オブジェクトストリーム: JwwArchive vs レコード推定")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mb in sizes_mb:
+            path = os.path.join(tmp, f"archive_{mb}mb.jww")
+            size, truth = make_synthetic_jww_archive(path, int(mb * 1024 * 1024))
+            expect = (truth["line"], truth["arc"], truth["text"] + truth["dim"])
+
+            t_arc, (info, err) = _timeit(jwai_core.parse_jww_full, path, True)
+            if err:
+                print(f"  {mb:>5}MB  エラー: {err}")
+                continue
+            got = (info["stats"]["lines"], info["stats"]["arcs"], info["stats"]["texts"])
+
+            def heuristic():
+                with jwai_core.JwwFile(path) as jf:
+                    return jwai_core._collect_jww_entities(jf, jwai_core._import_numpy())[3].to_info()
+            t_heu, heu = _timeit(heuristic)
+            guessed = (heu["stats"]["lines"], heu["stats"]["arcs"], heu["stats"]["texts"])
+
+            def one_layer():
+                with jwai_core.JwwFile(path) as jf:
+                    archive = jwai_core.JwwArchive(jf.buffer)
+                    t0 = time.perf_counter()
+                    archive.layer_index()
+                    t_index = time.perf_counter() - t0
+                    t0 = time.perf_counter()
+                    n = sum(1 for _ in archive.iter_objects(layers=[(0, 0)]))
+                    return t_index, time.perf_counter() - t0, n
+            t_index, t_layer, n_layer = one_layer()
+
+            print(f"  {mb:>5}MB  図形 {expect}  (線, 円弧, 文字+寸法)")
+            print(f"    スキーマ: {t_arc:7.3f}s  {got}  {'OK' if got == expect else 'NG'}")
+            print(f"    推定    : {t_heu:7.3f}s  {guessed}  {'OK' if guessed == expect else 'NG'}")
+            print(f"    レイヤ 0-0 だけ: 索引 {t_index * 1000:7.1f}ms + デコード {t_layer * 1000:6.1f}ms  "
+                  f"{n_layer}件  {'OK' if n_layer == truth[(0, 0)] else 'NG'}")
+            if workers > 1:
+                if size < jwai_core._JWW_PARALLEL_MIN_BYTES:
+                    print(f"    並列: {jwai_core._JWW_PARALLEL_MIN_BYTES >> 20}MB未満のため直列で解析されます")
+                    continue
+                t_par, (par, _) = _timeit(jwai_core.parse_jww_full, path, True, workers)
+                same = all(par[k] == info[k] for k in info if k not in ("line_array", "arc_array"))
+                print(f"    並列({workers}プロセス): {t_par:7.3f}s  x{t_arc / t_par:5.1f}  "
+                      f"結果一致: {'OK' if same else 'NG'}")
+
+
+# parse_jww_full の1MBあたりの処理時間の上限（秒）。乱数・途中で切れた・壊れた図面は普通の図面と同じ程度、
+# 読み込みが重くなるように作った並び（1バイトごとに長さバイト・レコード頭の候補になるもの）はその数倍まで
+FUZZ_SECONDS_PER_MB = 1.0
+FUZZ_SECONDS_PER_MB_ADVERSARIAL = 8.0
+
+
+def _fuzz_inputs(mb, trials, seed):
+    """
+    壊れた・変わった入力を (名前, bytes, 1MBあたりの処理時間の上限) で返す
+    （乱数・途中で切れたファイル・読み込みが重くなりやすい並び）
+    """
+    rnd = random.Random(seed)
+    size = int(mb * 1024 * 1024)
+    head = b'JwwData.' + struct.pack('<I', 600)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "records.jww")
+        make_synthetic_jww(path, size, seed)
+        with open(path, 'rb') as f:
+            records = f.read()
+        make_synthetic_jww_archive(path, size, seed)
+        with open(path, 'rb') as f:
+            archive = f.read()
+
+    typical, adversarial = FUZZ_SECONDS_PER_MB, FUZZ_SECONDS_PER_MB_ADVERSARIAL
+    cases = [
+        ("乱数", head + rnd.randbytes(size), typical),
+        ("ゼロ埋め", head + bytes(size), typical),
+        ("長さバイト候補の連続", head + b'\x02' * size, adversarial),
+        ("線レコード頭の連続", head + b'\x10\x00\x20\x00' * (size // 4), adversarial),
+        ("文字レコード頭の連続", head + b'\x30\x00\x06\x00' * (size // 4), adversarial),
+        ("範囲外の長さ", head + b'\x10\x00\xff\xff' * (size // 4), adversarial),
+        ("クラスタグの連続", head + (b'\xff\xff\x58\x02\x08\x00CDataSen') * (size // 16), adversarial),
+    ]
+    for k in range(trials):
+        cut = rnd.randrange(12, len(records))
+        cases.append((f"途中で切れた図面 {k + 1}", records[:cut], typical))
+        cut = rnd.randrange(12, len(archive))
+        cases.append((f"途中で切れたストリーム {k + 1}", archive[:cut], typical))
+        flipped = bytearray(archive)
+        for _ in range(64):
+            flipped[rnd.randrange(12, len(flipped))] = rnd.randrange(256)
+        cases.append((f"壊れたストリーム {k + 1}", bytes(flipped), typical))
+    return cases
+
+
+def bench_fuzz(mb, trials, seed=0, seconds=0.2):
+    """
+    壊れた・変わった入力で parse_jww_full が例外を出さず、1MBあたりの処理時間が入力の種類ごとの上限
+    （FUZZ_SECONDS_PER_MB / FUZZ_SECONDS_PER_MB_ADVERSARIAL）に収まることと、
+    JwwParseBudget の時間・バイト数の上限で打ち切れることを確かめる。NG の件数を返す。
+    """
+    print(f"壊れた入力: parse_jww_full（{mb}MB、上限 {seconds}s / 打ち切りは64KB単位）")
+    worst = 0.0
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "fuzz.jww")
+        for title, data, limit in _fuzz_inputs(mb, trials, seed):
+            with open(path, 'wb') as f:
+                f.write(data)
+            try:
+                t_full, (info, err) = _timeit(jwai_core.parse_jww_full, path, True)
+                budget = jwai_core.JwwParseBudget(seconds=seconds)
+                t_cut, (cut, _) = _timeit(lambda: jwai_core.parse_jww_full(path, True, budget=budget))
+                budget = jwai_core.JwwParseBudget(max_bytes=len(data) // 2)
+                half, _ = jwai_core.parse_jww_full(path, True, budget=budget)
+            except Exception as e:
+                failures += 1
+                print(f"  {title:<16} NG 例外 {type(e).__name__}: {e}")
+                continue
+            per_mb = t_full / max(len(data) / 1e6, 1e-6)
+            worst = max(worst, per_mb)
+            ok_rate = per_mb <= limit
+            # 打ち切りの遅れは区切り1〜2つ分（64KB単位。フォールバックだけの区間は平均より重いので3つ分を許す）
+            slack = per_mb * 3 * jwai_core._JWW_SCAN_CHUNK / 1e6 + 0.05
+            ok_time = t_cut <= seconds + slack
+            ok_bytes = (half is None or not half.get("partial")
+                        or half["partial"]["scanned"] <= len(data) // 2 + jwai_core._JWW_SCAN_CHUNK)
+            if not (ok_rate and ok_time and ok_bytes):
+                failures += 1
+            decoder = info["decoder"] if info else "-"
+            print(f"  {title:<16} {len(data) / 1e6:6.2f}MB  {decoder:<9}  全体 {t_full:6.3f}s ({per_mb:6.3f}s/MB "
+                  f"{'OK' if ok_rate else 'NG'})  "
+                  f"上限付き {t_cut:6.3f}s {'OK' if ok_time else 'NG'}  バイト上限 {'OK' if ok_bytes else 'NG'}"
+                  + (f"  [{err}]" if err else ""))
+    print(f"  最悪 {worst:.3f}s/MB  NG {failures}件")
+    return failures
+
+
+def _legacy_decode_classify(raw):
+    """旧実装の文字判定（cp932デコード → 印字不可文字除去 → classify_text）"""
+    import re
+    import unicodedata
+    try:
+        text = str(raw, 'cp932')
+    except UnicodeDecodeError:
+        return None
+    clean = ''.join(c for c in text if c.isprintable()).strip()
+    if len(clean) < 2:
+        return None
+    n = unicodedata.normalize('NFKC', clean).strip()
+    lower = re.sub(r'\s+', '', n).lower()
+    if (re.fullmatch(r'[+-]?\d+(?:\.\d+)?(?:mm)?', lower)
+            or re.fullmatch(r'[+-]?\d+(?:\.\d+)?x[+-]?\d+(?:\.\d+)?(?:mm)?', lower)
+            or re.fullmatch(r'(?:r|φ|d)?[+-]?\d+(?:\.\d+)?(?:mm)?', lower)):
+        return clean, "dim"
+    low = n.lower()
+    if any(k in low for k in jwai_core.JWW_ROOM_KEYWORDS):
+        return clean, "room"
+    if any('぀' <= c <= '鿿' or '＀' <= c <= '￯' for c in clean):
+        return clean, "text"
+    return None
+
+
+def _text_candidates(path, limit):
+    """フォールバックスキャンと同じ位置の長さ付きバイト列を最大limit件集める"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    out = []
+    for m in jwai_core._JWW_FALLBACK_LEN_RE.finditer(data):
+        j = m.start()
+        out.append(data[j + 1:j + 1 + data[j]])
+        if len(out) >= limit:
+            break
+    return out
+
+
+def bench_text(count):
+    """文字候補の判定を、旧実装と JwwTextClassifier（初回 / メモ済み）で比べる"""
+    print("文字分類: 旧実装 vs JwwTextClassifier")
+    rnd = random.Random(0)
+    labels = [name + (str(rnd.randint(1, 9)) if rnd.random() < 0.3 else '') for name in ROOM_NAMES]
+    labels += [str(v) for v in (455, 910, 1820, 2730, 3640, 'R250', '1200x600', 'φ100')]
+    labels += [f'備考{i}' for i in range(200)]
+    records = [rnd.choice(labels).encode('cp932') for _ in range(count)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "synthetic.jww")
+        make_synthetic_jww(path, 2 * 1024 * 1024)
+        scan = _text_candidates(path, count)
+
+    for title, cands in (("図面の文字列", records), ("フォールバック候補", scan)):
+        def run_engine(clf):
+            return [clf.decode(c, 0, len(c)) for c in cands]
+        t_old, r_old = _timeit(lambda: [_legacy_decode_classify(c) for c in cands])
+        t_cold, r_cold = _timeit(lambda: run_engine(jwai_core.JwwTextClassifier()))
+        warm = jwai_core.JwwTextClassifier()
+        run_engine(warm)
+        t_warm, r_warm = _timeit(run_engine, warm)
+        same = r_old == r_cold == r_warm
+        print(f"  {title:<10} {len(cands):>8,}件  旧: {t_old * 1000:8.1f}ms  "
+              f"新(初回): {t_cold * 1000:8.1f}ms  新(メモ済み): {t_warm * 1000:8.1f}ms  "
+              f"結果一致: {'OK' if same else 'NG'}")
+
+
+def bench_jwc(counts):
+    """
+    JWC_TEMP.TXT の解析を、旧実装と parse_jwc_store（列）/ parse_jwc_temp（要素オブジェクト）で比べ、
+    書き戻しを旧実装と write_result_to_jwc（ストリーム書き出し）で、変換を旧実装とアフィン行列で比べる
+    """
+    print("JWC_TEMP.TXT 解析: 旧実装 vs parse_jwc_store / parse_jwc_temp、書き戻し: 旧実装 vs write_result_to_jwc")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in counts:
+            path = os.path.join(tmp, f"jwc_{n}.txt")
+            make_synthetic_jwc(path, n)
+            t_old, (e_old, r_old, _) = _timeit(legacy_parse_jwc_temp, path, repeat=3)
+            t_store, (store, _) = _timeit(jwai_core.parse_jwc_store, path, repeat=3)
+            t_dict, (e_new, r_new, _) = _timeit(jwai_core.parse_jwc_temp, path, repeat=3)
+            same = e_old == e_new and r_old == r_new
+            print(f"  {n:>9,}行  旧: {t_old * 1000:8.1f}ms  列: {t_store * 1000:8.1f}ms  "
+                  f"要素: {t_dict * 1000:8.1f}ms  (線 {store.count(jwai_core.JWC_LINE):,}本)  "
+                  f"結果一致: {'OK' if same else 'NG'}")
+
+            # 書き戻し（全要素を左右反転）: 旧実装 vs ストリーム書き出し
+            mod_lines, mod_circles = jwai_core.apply_transform(e_new, {"type": "mirror_x"})
+            out_old, out_new = os.path.join(tmp, "old.txt"), os.path.join(tmp, "new.txt")
+            t_wold, _ = _timeit(legacy_write_result_to_jwc, e_new, mod_lines, out_old, mod_circles, repeat=3)
+            stats = {}
+            t_wnew, _ = _timeit(lambda: jwai_core.write_result_to_jwc(e_new, mod_lines, out_new, mod_circles,
+                                                                      stats=stats), repeat=3)
+            m_old = _peak_memory(legacy_write_result_to_jwc, e_new, mod_lines, out_old, mod_circles)
+            m_new = _peak_memory(jwai_core.write_result_to_jwc, e_new, mod_lines, out_new, mod_circles)
+            with open(out_old, 'rb') as f1, open(out_new, 'rb') as f2:
+                same = f1.read() == f2.read()
+            print(f"  {'':>9}    書き戻し 旧: {t_wold * 1000:8.1f}ms / {m_old / 1e6:6.1f}MB  "
+                  f"新: {t_wnew * 1000:8.1f}ms / {m_new / 1e6:6.1f}MB  ({stats['bytes'] / 1e6:.2f}MB)  "
+                  f"結果一致: {'OK' if same else 'NG'}")
+
+            # 円弧1つだけの arc_flip_x: 全行の書き直し vs 差分書き戻し
+            one = {"type": "arc_flip_x", "circle_indices": [0]}
+            mod_lines, mod_circles = jwai_core.apply_transform(e_new, one)
+            src = os.path.join(tmp, "src.txt")
+
+            def write_once(use_store):
+                shutil.copyfile(path, src)
+                st, _ = jwai_core.parse_jwc_store(src)
+                stats = {}
+                t0 = time.perf_counter()
+                jwai_core.write_result_to_jwc(e_new, mod_lines, src, mod_circles, stats=stats,
+                                              store=st if use_store else None)
+                return time.perf_counter() - t0, stats
+            t_full = min(write_once(False)[0] for _ in range(3))
+            full_elems = jwai_core.parse_jwc_temp(src)[0]
+            t_delta, s_delta = min((write_once(True) for _ in range(3)), key=lambda r: r[0])
+            same = full_elems == jwai_core.parse_jwc_temp(src)[0]
+            print(f"  {'':>9}    円弧1つ反転 全行: {t_full * 1000:8.1f}ms  差分({s_delta['mode']}): "
+                  f"{t_delta * 1000:8.1f}ms  結果一致: {'OK' if same else 'NG'}")
+
+            # 変換: 旧実装（要素ごと）vs アフィン行列（まとめて）
+            for transform in ({"type": "mirror_x"}, {"type": "rotate", "angle": 30.0}):
+                t_old, r_old = _timeit(legacy_apply_transform, e_new, transform, repeat=3)
+                t_new, r_new = _timeit(jwai_core.apply_transform, e_new, transform, store, repeat=3)
+                if transform["type"] == "rotate":
+                    # 旧実装は円弧を回さず、線も計算の順序が違うので差は丸め誤差まで
+                    same = r_old[0].keys() == r_new[0].keys() and all(
+                        abs(v[k] - r_new[0][i][k]) < 1e-6 for i, v in r_old[0].items() for k in v)
+                else:
+                    same = r_old == r_new
+                print(f"  {'':>9}    {transform['type']:<8} 旧: {t_old * 1000:8.1f}ms  行列: {t_new * 1000:8.1f}ms  "
+                      f"x{t_old / t_new:5.1f}  (円弧 {len(r_new[1]):,}件)  結果一致: {'OK' if same else 'NG'}")
+
+            # 3手順: 1手順ずつ変換・書き戻し・読み直し vs 手順のリストを1回で
+            steps = [{"type": "arc_flip_x"}, {"type": "rotate", "angle": 90.0}, {"type": "mirror_x"}]
+            seq, one = os.path.join(tmp, "seq.txt"), os.path.join(tmp, "one.txt")
+
+            def run_sequential():
+                shutil.copyfile(path, seq)
+                for step in steps:
+                    st, _ = jwai_core.parse_jwc_store(seq)
+                    els = st.to_elements()
+                    ml, mc = jwai_core.apply_transform(els, step, st)
+                    jwai_core.write_result_to_jwc(els, ml, seq, mc, store=st)
+
+            def run_composite():
+                shutil.copyfile(path, one)
+                st, _ = jwai_core.parse_jwc_store(one)
+                els = st.to_elements()
+                ml, mc = jwai_core.apply_transform(els, steps, st)
+                jwai_core.write_result_to_jwc(els, ml, one, mc, store=st)
+            t_seq, _ = _timeit(run_sequential)
+            t_one, _ = _timeit(run_composite)
+            # 1手順ごとに書き出すと途中で丸められるので、読み直した座標を許容誤差で比べる
+            s_seq, s_one = jwai_core.parse_jwc_store(seq)[0], jwai_core.parse_jwc_store(one)[0]
+            same = all(abs(u - v) < 1e-3 for u, v in zip(s_seq.line_coords, s_one.line_coords)) and \
+                all(abs(u - v) < 1e-3 for u, v in zip(s_seq.circle_fields, s_one.circle_fields))
+            print(f"  {'':>9}    3手順 1つずつ: {t_seq * 1000:8.1f}ms  まとめて: {t_one * 1000:8.1f}ms  "
+                  f"x{t_seq / t_one:5.1f}  結果一致: {'OK' if same else 'NG'}")
+
+            # 取り消し: 1つ前の版を元の図面から計算し直して全行書き直す vs ジャーナルで変わった行だけ
+            # （全体を変換した後と、ドア2枚だけ反転した後）
+            undo_full, undo_journal = os.path.join(tmp, "undo_full.txt"), os.path.join(tmp, "undo_journal.txt")
+            doors = [{"type": "arc_flip_x", "circle_indices": [0]}, {"type": "arc_flip_x", "circle_indices": [1]}]
+            for name, chain in (("全体", steps), ("ドア2枚", doors)):
+                shutil.copyfile(path, undo_journal)
+                st, _ = jwai_core.parse_jwc_store(undo_journal)
+                journal = jwai_core.TransformJournal(st)
+                for step in chain:
+                    journal.apply(step)
+                    journal.write(undo_journal)
+
+                def run_recompute():
+                    shutil.copyfile(path, undo_full)
+                    st, _ = jwai_core.parse_jwc_store(undo_full)
+                    els = st.to_elements()
+                    ml, mc = jwai_core.apply_transform(els, chain[:-1], st)
+                    jwai_core.write_result_to_jwc(els, ml, undo_full, mc)
+
+                def run_journal():
+                    journal.undo()
+                    journal.write(undo_journal)
+                    journal.redo()
+                t_full, _ = _timeit(run_recompute)
+                t_journal, _ = _timeit(run_journal)
+                journal.undo()
+                journal.write(undo_journal)
+                run_recompute()
+                same = open(undo_full, 'rb').read().splitlines() == open(undo_journal, 'rb').read().splitlines()
+                print(f"  {'':>9}    取り消し({name}) 計算し直し: {t_full * 1000:8.1f}ms  履歴: {t_journal * 1000:8.1f}ms  "
+                      f"x{t_full / t_journal:5.1f}  (差分 {journal.nbytes / 1e6:.1f}MB)  結果一致: {'OK' if same else 'NG'}")
+                journal.close()
+
+
+def _brute_segment_distance(np, seg, x, y):
+    """全線分までの距離（_segment_distance と同じ式をまとめて計算）"""
+    x1, y1, x2, y2 = seg.T
+    dx, dy = x2 - x1, y2 - y1
+    l2 = dx * dx + dy * dy
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.where(l2 == 0, 0.0, np.clip(((x - x1) * dx + (y - y1) * dy) / l2, 0.0, 1.0))
+    return np.hypot(x - x1 - t * dx, y - y1 - t * dy)
+
+
+def _brute_segment_box(np, seg, xmin, ymin, xmax, ymax):
+    """矩形に掛かる線分の番号（_segment_hits_box と同じ Liang-Barsky をまとめて計算）"""
+    x1, y1, x2, y2 = seg.T
+    dx, dy = x2 - x1, y2 - y1
+    t0, t1 = np.zeros(len(seg)), np.ones(len(seg))
+    ok = np.ones(len(seg), dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for p, q in ((-dx, x1 - xmin), (dx, xmax - x1), (-dy, y1 - ymin), (dy, ymax - y1)):
+            t = q / p
+            ok &= ~((p == 0) & (q < 0))
+            ok &= ~((p < 0) & (t > t1))
+            ok &= ~((p > 0) & (t < t0))
+            t0 = np.where(p < 0, np.maximum(t0, t), t0)
+            t1 = np.where(p > 0, np.minimum(t1, t), t1)
+    return np.flatnonzero(ok)
+
+
+def bench_spatial(counts, queries=50):
+    """SpatialGrid の構築時間と、範囲・半径・最近傍の問い合わせを全線分の総当たり（NumPy）と比べる"""
+    np = jwai_core._import_numpy()
+    if np is None:
+        print("NumPy が無いため総当たりとの比較を省略します")
+        return
+    print("空間索引: SpatialGrid vs 総当たり（NumPy、全線分）  時間は問い合わせ1回あたり")
+    for n in counts:
+        # 1万本・50m角の図面を格子状に並べる（本数が増えても線の密度は同じ）
+        tiles = max(1, n // 10000)
+        side = math.ceil(math.sqrt(tiles))
+        blocks = []
+        for t in range(tiles):
+            lines, _ = _random_geometry(min(n, 10000), 0, seed=t)
+            block = np.array([(l["x1"], l["y1"], l["x2"], l["y2"]) for l in lines])
+            block += np.array([t % side, t // side] * 2) * 50000.0
+            blocks.append(block)
+        seg = np.concatenate(blocks)
+        t_build, grid = _timeit(jwai_core.SpatialGrid, seg.ravel().tolist(), [])
+        rnd = random.Random(1)
+        pts = [(rnd.uniform(0, side * 50000), rnd.uniform(0, side * 50000)) for _ in range(queries)]
+        r = 500.0
+        same = True
+
+        t0 = time.perf_counter()
+        got = [grid.query_radius(x, y, r) for x, y in pts]
+        t_grid_r = (time.perf_counter() - t0) / queries
+        t0 = time.perf_counter()
+        ref = [np.flatnonzero(_brute_segment_distance(np, seg, x, y) <= r) for x, y in pts]
+        t_brute_r = (time.perf_counter() - t0) / queries
+        same &= all([i for _, i in g] == b.tolist() for g, b in zip(got, ref))
+
+        boxes = [(x, y, x + 2000, y + 1500) for x, y in pts]
+        t0 = time.perf_counter()
+        got = [grid.query_bbox(*b) for b in boxes]
+        t_grid_b = (time.perf_counter() - t0) / queries
+        t0 = time.perf_counter()
+        ref = [_brute_segment_box(np, seg, *b) for b in boxes]
+        t_brute_b = (time.perf_counter() - t0) / queries
+        same &= all([i for _, i in g] == b.tolist() for g, b in zip(got, ref))
+
+        t0 = time.perf_counter()
+        got = [grid.nearest(x, y, k=5) for x, y in pts]
+        t_grid_n = (time.perf_counter() - t0) / queries
+        t0 = time.perf_counter()
+        ref = []
+        for x, y in pts:
+            d = _brute_segment_distance(np, seg, x, y)
+            ref.append(np.sort(d[np.argpartition(d, 5)[:5]]))
+        t_brute_n = (time.perf_counter() - t0) / queries
+        same &= all(np.allclose([d for d, _, _ in g], b) for g, b in zip(got, ref))
+
+        print(f"  {n:>9,}本  構築: {t_build * 1000:8.1f}ms  (マス {grid.cell:.0f}mm)")
+        for label, tg, tb in (("半径500mm", t_grid_r, t_brute_r), ("範囲2×1.5m", t_grid_b, t_brute_b),
+                              ("最近傍5件", t_grid_n, t_brute_n)):
+            print(f"  {'':>9}    {label:<10} 索引: {tg * 1e6:9.1f}µs  総当たり: {tb * 1e6:9.1f}µs  "
+                  f"x{tb / max(tg, 1e-9):7.1f}")
+        print(f"  {'':>9}    結果一致: {'OK' if same else 'NG'}")
+
+
+def _imagedraw_preview(store, mod_lines, mod_circles, width, height):
+    """比較用: 同じ図を PIL の ImageDraw で1本ずつ描く"""
+    from PIL import Image, ImageDraw
+    np = jwai_core._import_numpy()
+    lines, circles = store.line_array(np), store.circle_array(np)
+    new_lines = [(m['x1'], m['y1'], m['x2'], m['y2']) for _, m in mod_lines.items()]
+    new_circles = [jwai_core._jwc_circle_fields(t.split()) for t in mod_circles.values()]
+    xs = np.concatenate([lines[:, 0::2].ravel(), np.array(new_lines).reshape(-1, 4)[:, 0::2].ravel()])
+    ys = np.concatenate([lines[:, 1::2].ravel(), np.array(new_lines).reshape(-1, 4)[:, 1::2].ravel()])
+    xmin, xmax, ymin, ymax = xs.min(), xs.max(), ys.min(), ys.max()
+    s = min((width - 16) / (xmax - xmin), (height - 16) / (ymax - ymin))
+    img = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(img)
+    for rows, arcs, color in ((lines.tolist(), circles.tolist(), (190, 190, 190)),
+                              (new_lines, new_circles, (231, 76, 60))):
+        for x1, y1, x2, y2 in rows:
+            draw.line(((x1 - xmin) * s + 8, (ymax - y1) * s + 8, (x2 - xmin) * s + 8, (ymax - y2) * s + 8),
+                      fill=color)
+        for cx, cy, r, sa, ea in arcs:
+            if cx != cx or cy != cy or r != r:
+                continue
+            box = ((cx - r - xmin) * s + 8, (ymax - cy - r) * s + 8, (cx + r - xmin) * s + 8, (ymax - cy + r) * s + 8)
+            if sa != sa or ea != ea:
+                draw.ellipse(box, outline=color)
+            else:
+                draw.arc(box, -ea, -sa, fill=color)
+    return img
+
+
+def bench_preview(counts):
+    """変換プレビューの描画: render_transform_preview（NumPy でまとめて画素化）vs ImageDraw で1本ずつ"""
+    print(f"変換プレビュー ({jwai_core.PREVIEW_WIDTH}x{jwai_core.PREVIEW_HEIGHT}): "
+          "render_transform_preview vs ImageDraw（1本ずつ）")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in counts:
+            path = os.path.join(tmp, f"preview_{n}.txt")
+            make_synthetic_jwc(path, int(n / 0.65))      # 行の約65%が線
+            store, _ = jwai_core.parse_jwc_store(path)
+            elements = store.to_elements()
+            print(f"  線 {store.count(jwai_core.JWC_LINE):,}本  円弧 {store.count(jwai_core.JWC_CIRCLE):,}件")
+            for name, transform in (("選択のみ", None), ("ドア反転", {"type": "arc_flip_x"}),
+                                    ("全体を回転", {"type": "rotate", "angle": 30.0})):
+                ml, mc = jwai_core.apply_transform(elements, transform, store) if transform else ({}, {})
+                t_new, (img, _) = _timeit(jwai_core.render_transform_preview, elements, ml, mc, store, repeat=5)
+                t_old, _ = _timeit(_imagedraw_preview, store, ml, mc, img.width, img.height)
+                t_png, _ = _timeit(jwai_core.image_to_base64_png, img, repeat=3)
+                print(f"    {name:<6} ImageDraw: {t_old * 1000:8.1f}ms  描画: {t_new * 1000:7.1f}ms  "
+                      f"x{t_old / t_new:5.1f}  (PNG化 {t_png * 1000:.1f}ms)")
+
+
+def bench_overview(sizes_mb):
+    """
+    図面全体の概要図: parse_jww_full の結果から render_jww_overview で PNG にするまでの時間と、
+    解析し直した結果からも同じ画像になるか・画素数の上限に収まるか。NG の件数を返す
+    """
+    import hashlib
+    failures = 0
+    print(f"図面の概要図（画素数の上限 {jwai_core.JWW_OVERVIEW_PIXELS:,}）: 解析 → render_jww_overview → PNG")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mb in sizes_mb:
+            path = os.path.join(tmp, f"synthetic_{mb}mb.jww")
+            make_synthetic_jww(path, int(mb * 1024 * 1024))
+            t_parse, (info, _) = _timeit(jwai_core.parse_jww_full, path, True)
+            t_draw, (img, _) = _timeit(jwai_core.render_jww_overview, info, repeat=3)
+            t_png, b64 = _timeit(jwai_core.image_to_base64_png, img)
+            again, _ = jwai_core.render_jww_overview(jwai_core.parse_jww_full(path)[0])
+            same = hashlib.sha1(jwai_core.image_to_base64_png(again).encode()).digest() == \
+                hashlib.sha1(b64.encode()).digest()
+            fits = (img.width * img.height <= jwai_core.JWW_OVERVIEW_PIXELS
+                    and max(img.width, img.height) <= jwai_core.JWW_OVERVIEW_MAX_SIDE)
+            failures += (not same) + (not fits)
+            st = info["stats"]
+            print(f"  {mb:>5}MB  線 {st['lines']:,}本 円弧 {st['arcs']:,}件 文字 {st['texts']:,}件  "
+                  f"解析: {t_parse * 1000:8.1f}ms  描画: {t_draw * 1000:6.1f}ms  PNG: {t_png * 1000:6.1f}ms  "
+                  f"{img.width}x{img.height} {len(b64) * 3 // 4 / 1024:.0f}KB  同じ画像: {'OK' if same else 'NG'}  "
+                  f"画素数の上限: {'OK' if fits else 'NG'}")
+    return failures
+
+
+def _planted_doors(n_lines, seed=0):
+    """
+    ランダムな線の中に、扇形・戸の線・枠の線2本の組のドアを n_lines/50 枚埋め込む。
+    Returns: (線の座標列, 円弧の値の列, [(円弧の番号, 戸の線の番号, 開く向き), ...])
+    """
+    rnd = random.Random(seed)
+    lines, arcs = _random_geometry(n_lines, n_lines // 50, seed)
+    coords = [v for l in lines for v in (l["x1"], l["y1"], l["x2"], l["y2"])]
+    fields = [v for a in arcs for v in (a["cx"], a["cy"], a["r"], a["start_a"], a["end_a"])]
+    planted = []
+    for _ in range(n_lines // 50):
+        hx, hy, w = round(rnd.uniform(0, 50000), 2), round(rnd.uniform(0, 50000), 2), rnd.choice((700, 800, 900))
+        sa = rnd.choice((0.0, 90.0, 180.0, 270.0))
+        swing = rnd.choice(("ccw", "cw"))
+        closed, opened = (sa, sa + 90) if swing == "ccw" else (sa + 90, sa)
+        cx, cy = hx + w * math.cos(math.radians(closed)), hy + w * math.sin(math.radians(closed))
+        ox, oy = hx + w * math.cos(math.radians(opened)), hy + w * math.sin(math.radians(opened))
+        leaf = len(coords) // 4
+        coords += [hx, hy, round(ox, 2), round(oy, 2)]
+        coords += [hx, hy, hx - (cx - hx), hy - (cy - hy)]           # 吊元側の枠（壁）
+        coords += [round(cx, 2), round(cy, 2), cx + (cx - hx), cy + (cy - hy)]    # 閉じた側の枠（壁）
+        planted.append((len(fields) // 5, leaf, swing))
+        fields += [hx, hy, w, sa, sa + 90]
+    return coords, fields, planted
+
+
+def bench_doors(counts):
+    """detect_doors: ドアの組み立て時間（NumPy / 無し）と、埋め込んだドアの戸の線・開く向きを当てられるか"""
+    print("ドアの検出: detect_doors（扇形と戸・枠の線の端点の突き合わせ）")
+    for n in counts:
+        coords, fields, planted = _planted_doors(n)
+        t_np, doors = _timeit(jwai_core.detect_doors, coords, fields, repeat=3)
+        found = {d["arc"]: d for d in doors}
+        hit = sum(1 for a, leaf, swing in planted
+                  if a in found and found[a]["leaf"] == leaf and found[a]["swing"] == swing
+                  and len(found[a]["jambs"]) >= 2)
+        import_numpy = jwai_core._import_numpy
+        jwai_core._import_numpy = lambda: None
+        try:
+            t_py, doors_py = _timeit(jwai_core.detect_doors, coords, fields, repeat=3)
+        finally:
+            jwai_core._import_numpy = import_numpy
+        print(f"  {n:>9,}本  扇形候補 {len(doors):,}件  NumPy: {t_np * 1000:8.1f}ms  無し: {t_py * 1000:8.1f}ms  "
+              f"埋め込んだドア {hit}/{len(planted)}枚  結果一致: {'OK' if doors == doors_py else 'NG'}")
+
+
+def _planted_rooms(n_lines, width=4000, depth=3000, wall=120, hatch=0, seed=0):
+    """
+    約 n_lines 本の線で、入口にドアのある部屋を格子状に並べた平面図を作る。
+    hatch 本の短い45°の線（ハッチング）を図面全体にばらまく（壁と交わっても部屋の面積は変わらない）。
+    Returns: (線の座標列, 円弧の値の列, 部屋名の [(名前, x, y), ...])
+    """
+    side = max(1, int(math.sqrt(n_lines / 9)))
+    coords, fields, labels = [], [], []
+    for i in range(side):
+        for j in range(side):
+            x0, y0 = i * (width + wall), j * (depth + wall)
+            x1, y1, gx = x0 + width, y0 + depth, x0 + 600
+            coords += [x0, y0, gx, y0, gx + 800, y0, x1, y0]                # 下の壁（入口で途切れる）
+            coords += [x1, y0, x1, y1, x1, y1, x0, y1, x0, y1, x0, y0]      # 右・上・左の壁
+            coords += [gx, y0, gx, y0 - wall, gx + 800, y0, gx + 800, y0 - wall]   # 枠
+            coords += [gx, y0, gx, y0 + 800]                                 # 戸（開いた位置）
+            fields += [gx, y0, 800, 0.0, 90.0]
+            labels.append((f"室{i}-{j}", x0 + width / 2, y0 + depth / 2))
+    rnd = random.Random(seed)
+    for _ in range(hatch):
+        hx, hy = rnd.uniform(0, side * (width + wall)), rnd.uniform(0, side * (depth + wall))
+        coords += [round(hx), round(hy), round(hx) + 100, round(hy) + 100]
+    return coords, fields, labels
+
+
+def bench_rooms(counts, hatch=(0, 2000, 10000)):
+    """
+    extract_rooms: 壁の平面グラフから部屋を取り出す時間（NumPy / 無し）と、並べた部屋を全部当てられるか。
+    斜めの線の交点を候補の組だけで調べているかを見るため、ハッチングの本数を変えて測る
+    """
+    print("部屋の抽出: extract_rooms（端点の丸め・重なりの結合・交点での分割・閉じた範囲の列挙）")
+    for n, h in ((n, h) for n in counts for h in hatch):
+        coords, fields, labels = _planted_rooms(n, hatch=h)
+        doors = jwai_core.detect_doors(coords, fields)
+        t_np, res = _timeit(jwai_core.extract_rooms, coords, labels, doors, repeat=3)
+        area = 4000 * 3000 / 1e6
+        hit = sum(1 for r in res["rooms"] if abs(r["area_m2"] - area) < 0.05)
+        import_numpy = jwai_core._import_numpy
+        jwai_core._import_numpy = lambda: None
+        try:
+            t_py, res_py = _timeit(jwai_core.extract_rooms, coords, labels, doors, repeat=1)
+        finally:
+            jwai_core._import_numpy = import_numpy
+        print(f"  {len(coords) // 4:>9,}本（斜め {h:>6,}本）  辺 {res['edges']:,}  NumPy: {t_np * 1000:8.1f}ms  無し: {t_py * 1000:8.1f}ms  "
+              f"部屋 {hit}/{len(labels)}室  結果一致: {'OK' if res == res_py else 'NG'}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="JW AI ベンチマーク")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("parse", help="parse_jww_full の速度計測")
+    p.add_argument("--mb", type=float, nargs="+", default=[1, 5])
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--no-legacy", action="store_true", help="旧実装との比較を省略")
+    p.add_argument("--workers", type=int, default=1, help="並列解析のプロセス数（2以上で計測）")
+
+    p = sub.add_parser("analyze", help="insights / コンテキスト生成の速度計測（辞書 vs 列指向）")
+    p.add_argument("--lines", type=int, nargs="+", default=[10000, 100000, 300000])
+
+    p = sub.add_parser("cache", help="解析キャッシュの保存・読み込み時間")
+    p.add_argument("--mb", type=float, nargs="+", default=[1, 5])
+
+    p = sub.add_parser("incr", help="保存し直した図面の差分解析（フル解析との比較）")
+    p.add_argument("--mb", type=float, nargs="+", default=[1, 5])
+
+    p = sub.add_parser("archive", help="オブジェクトストリームのデコード（スキーマ vs レコード推定、レイヤ指定）")
+    p.add_argument("--mb", type=float, nargs="+", default=[1, 5])
+    p.add_argument("--workers", type=int, default=1, help="並列解析のプロセス数（2以上で計測）")
+
+    p = sub.add_parser("fuzz", help="壊れた入力での例外・1バイトあたりの処理時間・打ち切りの確認")
+    p.add_argument("--mb", type=float, default=2)
+    p.add_argument("--trials", type=int, default=3, help="途中で切れた・壊れた図面の数（種類ごと）")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--seconds", type=float, default=0.2, help="打ち切りを確かめる時間上限")
+
+    p = sub.add_parser("text", help="文字分類の速度計測（旧実装 vs JwwTextClassifier）")
+    p.add_argument("--count", type=int, default=200000)
+
+    p = sub.add_parser("jwc", help="JWC_TEMP.TXT 解析・書き戻しの速度計測（旧実装との比較）")
+    p.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+
+    p = sub.add_parser("spatial", help="空間索引の構築・問い合わせ（総当たりとの比較）")
+    p.add_argument("--lines", type=int, nargs="+", default=[10000, 100000, 1000000])
+
+    p = sub.add_parser("preview", help="変換プレビューの描画時間（ImageDraw で1本ずつとの比較）")
+    p.add_argument("--lines", type=int, nargs="+", default=[10000, 50000])
+
+    p = sub.add_parser("overview", help="図面全体の概要図（解析結果から PNG まで）の時間と再現性")
+    p.add_argument("--mb", type=float, nargs="+", default=[1, 5])
+
+    p = sub.add_parser("doors", help="ドアの検出（扇形・戸の線・枠の線の組み立て）の時間と正しさ")
+    p.add_argument("--lines", type=int, nargs="+", default=[10000, 100000])
+
+    p = sub.add_parser("rooms", help="部屋の抽出（壁の平面グラフと閉じた範囲）の時間と正しさ")
+    p.add_argument("--lines", type=int, nargs="+", default=[10000, 100000])
+    p.add_argument("--hatch", type=int, nargs="+", default=[0, 2000, 10000], help="ばらまく斜めの線の本数")
+
+    args = ap.parse_args(argv)
+    if args.cmd == "parse":
+        bench_parse(args.mb, args.repeat, legacy=not args.no_legacy, workers=args.workers)
+    elif args.cmd == "analyze":
+        bench_analyze(args.lines)
+    elif args.cmd == "cache":
+        bench_cache(args.mb)
+    elif args.cmd == "incr":
+        bench_incremental(args.mb)
+    elif args.cmd == "archive":
+        bench_archive(args.mb, args.workers)
+    elif args.cmd == "fuzz":
+        return 1 if bench_fuzz(args.mb, args.trials, args.seed, args.seconds) else 0
+    elif args.cmd == "text":
+        bench_text(args.count)
+    elif args.cmd == "jwc":
+        bench_jwc(args.rows)
+    elif args.cmd == "spatial":
+        bench_spatial(args.lines)
+    elif args.cmd == "preview":
+        bench_preview(args.lines)
+    elif args.cmd == "overview":
+        return 1 if bench_overview(args.mb) else 0
+    elif args.cmd == "doors":
+        bench_doors(args.lines)
+    elif args.cmd == "rooms":
+        bench_rooms(args.lines, args.hatch)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
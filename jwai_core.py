@@ -13,6 +13,7 @@ DONE_FILE   = r"C:\JWW\jwai_done.json"
 LOCK_FILE   = r"C:\JWW\jwai_main.lock"
 READY_FILE  = r"C:\JWW\jwai_ready.json"   # jw_ai.py起動完了マーカー
 CONFIG_FILE = os.path.join(os.path.expanduser("~"), ".jwai_config.json")
+CACHE_DIR   = os.path.join(os.path.expanduser("~"), ".jwai_cache")   # JWW解析キャッシュ
 
 
 # ========== 設定管理 ==========
@@ -33,84 +34,500 @@ def save_config(config):
 
 # ========== JWC_TEMP.TXT 解析 ==========
 
-def parse_jwc_temp(filepath=None):
+from collections import namedtuple
+
+# 行の種類は先頭の語で決まる（規則は先頭2文字で引く）。どれにも当たらず4語なら座標行（線）
+
+JWC_KINDS = ('blank', 'hq', 'header', 'attr', 'circle', 'text', 'point', 'hd', 'line', 'other')
+(JWC_BLANK, JWC_HQ, JWC_HEADER, JWC_ATTR, JWC_CIRCLE, JWC_TEXT, JWC_POINT, JWC_HD,
+ JWC_LINE, JWC_OTHER) = range(len(JWC_KINDS))
+
+# (先頭の語, 完全一致か, 種類)。同じ先頭2文字の規則は上から順に当てる
+_JWC_CODE_RULES = (
+    ('hq', True, JWC_HQ),
+    ('hk', False, JWC_HEADER), ('hs', False, JWC_HEADER), ('hn', False, JWC_HEADER),
+    ('hcw', False, JWC_HEADER), ('hch', False, JWC_HEADER), ('hcd', False, JWC_HEADER),
+    ('hcc', False, JWC_HEADER), ('hp', False, JWC_HEADER),
+    ('lg', False, JWC_ATTR), ('ly', False, JWC_ATTR), ('lc', False, JWC_ATTR),
+    ('lt', False, JWC_ATTR), ('lw', False, JWC_ATTR),
+    ('ci', True, JWC_CIRCLE),
+    ('ch', False, JWC_TEXT), ('cv', False, JWC_TEXT), ('cs', False, JWC_TEXT), ('cn', False, JWC_TEXT),
+    ('pt', True, JWC_POINT),
+    ('hd', True, JWC_HD),
+)
+_JWC_DISPATCH = {}
+for _prefix, _exact, _kind in _JWC_CODE_RULES:
+    _JWC_DISPATCH.setdefault(_prefix[:2], []).append((_prefix, _exact, _kind))
+del _prefix, _exact, _kind
+
+_JWC_NUMERIC_START = frozenset('0123456789+-.')
+# NumPy の一括変換に回してよい文字（16進・"_" など float() と解釈が違う書き方を避ける）
+_JWC_NUMERIC_CHARS = str.maketrans('', '', '0123456789+-.eE \n')
+_JWC_CIRCLE_FIELDS = ('cx', 'cy', 'r', 'start_a', 'end_a')
+
+# 属性行（lg レイヤグループ / ly レイヤ / lc 線色 / lt 線種 / lw 線幅）は、次に変わるまで
+# 後に続く線・円弧に掛かる。状態の組み合わせは少ないので番号を振って共有する
+JWC_ATTR_CODES = ('lg', 'ly', 'lc', 'lt', 'lw')
+JwcAttrs = namedtuple('JwcAttrs', JWC_ATTR_CODES)
+JWC_NO_ATTRS = JwcAttrs(None, None, None, None, None)
+_JWC_HEX_ATTRS = ('lg', 'ly')       # レイヤグループ・レイヤは 0〜F の16進
+
+
+def _jwc_classify(code):
+    """先頭の語から種類を返す。表に無ければNone（座標行かどうかは語の数で決める）"""
+    for prefix, exact, kind in _JWC_DISPATCH.get(code[:2], ()):
+        if code == prefix if exact else code.startswith(prefix):
+            return kind
+    return None
+
+
+def _jwc_attr_update(attrs, code, parts):
+    """属性行で状態を更新する（値が読めなければその属性は不明=None）"""
+    key = code[:2]
+    text = code[2:] or (parts[1] if len(parts) > 1 else '')
+    try:
+        value = int(text, 16 if key in _JWC_HEX_ATTRS else 10)
+    except ValueError:
+        value = None
+    return attrs._replace(**{key: value})
+
+
+def _jwc_parse_coords(rows, np=None):
     """
-    JWC_TEMP.TXTを解析して図形要素のリストと生データを返す。
-    Returns: (elements, raw_lines, error_str_or_None)
+    座標行（スペース1つ区切りの4語）をまとめて数値にする。
+    Returns: array('d')（4値×行数）。読めない語が混じっていればNone（呼び出し側で1行ずつ読む）
     """
-    if filepath is None:
-        filepath = JWC_TEMP
+    from array import array
+    if not rows:
+        return array('d')
+    block = "\n".join(rows)
+    if np is not None and not block.translate(_JWC_NUMERIC_CHARS):
+        try:
+            values = np.array(block.split(), dtype=np.float64)
+        except ValueError:
+            return None
+        return array('d', values.tobytes()) if len(values) == 4 * len(rows) else None
+    try:
+        values = array('d', map(float, block.split()))
+    except ValueError:
+        return None
+    return values if len(values) == 4 * len(rows) else None
 
-    elements = []
-    raw_lines = []
 
-    if not os.path.exists(filepath):
-        return elements, raw_lines, f"ファイルが見つかりません: {filepath}"
+class JwcElement:
+    """
+    JWC_TEMP.TXT の1要素（ヘッダ・属性・空行など、生行をそのまま書き戻すもの）。
+    __slots__ で持ち、従来の辞書と同じく elem['type'] / elem.get('parts', []) でも読める。
+    """
+    __slots__ = ('type', 'raw')
+    _fields = ('type', 'raw')
+
+    def __init__(self, type, raw):
+        self.type = type
+        self.raw = raw
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self._fields else default
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def keys(self):
+        return self._fields
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self._fields}
+
+    def __eq__(self, other):
+        if isinstance(other, JwcElement):
+            other = other.to_dict()
+        return self.to_dict() == other if isinstance(other, dict) else NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class JwcLine(JwcElement):
+    """線（x1 y1 x2 y2 の行）"""
+    __slots__ = ('x1', 'y1', 'x2', 'y2', 'attrs')
+    _fields = ('type', 'x1', 'y1', 'x2', 'y2', 'raw')
+
+    def __init__(self, raw, x1, y1, x2, y2, attrs=JWC_NO_ATTRS):
+        self.type = 'line'
+        self.raw = raw
+        self.x1, self.y1, self.x2, self.y2 = x1, y1, x2, y2
+        self.attrs = attrs              # JwcAttrs（直前の lg/ly/lc/lt/lw）
+
+
+class JwcPartsElement(JwcElement):
+    """文字・点など、語に分けて読む行。parts は必要になった時に生行から作る（保持しない）"""
+    __slots__ = ()
+    _fields = ('type', 'raw', 'parts')
+
+    @property
+    def parts(self):
+        return self.raw.split()
 
+
+class JwcCircle(JwcPartsElement):
+    """
+    円・円弧（ci cx cy r [start_a end_a 扁平率 傾き]）。数値は読み込み時に一度だけ変換しておく。
+    語が無い・読めない値は None（角度の無い円は start_a / end_a が None）。
+    """
+    __slots__ = ('cx', 'cy', 'r', 'start_a', 'end_a', 'nparts', 'attrs')
+
+    def __init__(self, raw, fields, nparts, attrs=JWC_NO_ATTRS):
+        self.type = 'circle'
+        self.raw = raw
+        self.nparts = nparts
+        self.attrs = attrs
+        cx, cy, r, sa, ea = [None if v != v else v for v in fields]
+        self.cx, self.cy, self.r = (cx, cy, r) if nparts >= 4 else (None, None, None)
+        self.start_a, self.end_a = (sa, ea) if nparts >= 6 else (None, None)
+
+    @property
+    def has_angles(self):
+        """角度の語がある（円弧として書き出す）"""
+        return self.nparts >= 6
+
+    @property
+    def valid(self):
+        """変換に必要な値が全部読めた"""
+        if self.cx is None or self.cy is None or self.r is None:
+            return False
+        return not self.has_angles or (self.start_a is not None and self.end_a is not None)
+
+    @property
+    def rest(self):
+        """角度より後ろの語（扁平率・傾き）"""
+        return self.raw.split()[6:]
+
+
+class JwcElementStore:
+    """
+    JWC_TEMP.TXT の要素を種類ごとの列で持つ（parse_jwc_store の戻り値）。
+      raw_lines    ファイルの全行
+      kinds / rows 要素ごとの種類（JWC_KINDS の番号）と行番号
+      line_coords  線の x1, y1, x2, y2 / circle_fields 円・円弧の cx, cy, r, start_a, end_a（無い値は NaN）
+      line_slots / circle_slots  線・円弧ごとの要素番号
+      offsets      各行の先頭バイト位置（差分書き戻し用。決められなければ None）
+      source       (絶対パス, サイズ, 更新時刻ns) 読み込んだ時のファイル
+    """
+
+    def __init__(self, raw_lines):
+        from array import array
+        self.raw_lines = raw_lines
+        self.kinds = bytearray()
+        self.rows = array('l')
+        self.line_coords = array('d')
+        self.circle_fields = array('d')
+        self.circle_parts = array('b')
+        self.line_slots = array('l')
+        self.circle_slots = array('l')
+        self.attr_states = [JWC_NO_ATTRS]
+        self.line_state = array('I')
+        self.circle_state = array('I')
+        self.line_runs = {}
+        self.circle_runs = {}
+        self.layer_index = {}
+        self.color_index = {}
+        self.offsets = None
+        self.source = None
+        self._spatial = None
+        self._doors = None
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def count(self, kind):
+        """種類（JWC_LINE など）ごとの要素数"""
+        return self.kinds.count(kind)
+
+    def line_array(self, np):
+        """線の座標を (N, 4) の配列で返す（コピーなし）"""
+        return np.frombuffer(self.line_coords, dtype=np.float64).reshape(-1, 4)
+
+    def circle_array(self, np):
+        """円・円弧を (M, 5) の配列で返す（コピーなし）"""
+        return np.frombuffer(self.circle_fields, dtype=np.float64).reshape(-1, 5)
+
+    def line(self, i):
+        c = self.line_coords
+        return c[4 * i], c[4 * i + 1], c[4 * i + 2], c[4 * i + 3]
+
+    def spatial_index(self):
+        """線・円弧の空間索引（SpatialGrid）。初めて使う時に1度だけ作る"""
+        if self._spatial is None:
+            self._spatial = SpatialGrid.from_store(self)
+        return self._spatial
+
+    def doors(self):
+        """線・円弧から組み立てたドア（detect_doors）。初めて使う時に1度だけ求める"""
+        if self._doors is None:
+            self._doors = detect_doors(self.line_coords, self.circle_fields)
+        return self._doors
+
+    def build_attr_index(self):
+        """属性状態ごとの線・円弧の範囲と、レイヤ・線色の索引を作る（parse_jwc_store が呼ぶ）"""
+        from itertools import groupby
+        for states, runs in ((self.line_state, self.line_runs), (self.circle_state, self.circle_runs)):
+            runs.clear()
+            pos = 0
+            for sid, group in groupby(states):
+                n = sum(1 for _ in group)
+                runs.setdefault(sid, []).append((pos, pos + n))
+                pos += n
+        self.layer_index, self.color_index = {}, {}
+        for sid, attrs in enumerate(self.attr_states):
+            self.layer_index.setdefault((attrs.lg, attrs.ly), []).append(sid)
+            self.color_index.setdefault(attrs.lc, []).append(sid)
+
+    def match_states(self, flt):
+        """
+        属性の条件 {"lg": {0}, "ly": {3}, ...}（値は候補の集合）に合う状態番号を返す。
+        レイヤ・線色が1つに決まっていれば索引から候補を引き、残りの条件は状態ごとに確かめる。
+        """
+        lg, ly, lc = flt.get('lg'), flt.get('ly'), flt.get('lc')
+        if lg is not None and ly is not None and len(lg) == 1 and len(ly) == 1:
+            candidates = self.layer_index.get((next(iter(lg)), next(iter(ly))), [])
+        elif lc is not None and len(lc) == 1:
+            candidates = self.color_index.get(next(iter(lc)), [])
+        else:
+            candidates = range(len(self.attr_states))
+        states = self.attr_states
+        return [sid for sid in candidates
+                if all(getattr(states[sid], k) in v for k, v in flt.items())]
+
+    def select(self, kind, flt):
+        """属性の条件に合う線（JWC_LINE）または円弧（JWC_CIRCLE）の番号を昇順で返す"""
+        runs = self.line_runs if kind == JWC_LINE else self.circle_runs
+        spans = sorted(span for sid in self.match_states(flt) for span in runs.get(sid, ()))
+        out = []
+        for start, stop in spans:
+            out.extend(range(start, stop))
+        return out
+
+    def to_elements(self):
+        """要素オブジェクト（JwcElement / JwcLine / JwcCircle など）のリストを作る"""
+        raw_lines = self.raw_lines
+        coords = iter(self.line_coords)
+        quads = zip(coords, coords, coords, coords)
+        fields = iter(self.circle_fields)
+        fives = zip(fields, fields, fields, fields, fields)
+        nparts = iter(self.circle_parts)
+        states = self.attr_states
+        line_attrs = map(states.__getitem__, self.line_state)
+        circle_attrs = map(states.__getitem__, self.circle_state)
+        out = []
+        append = out.append
+        for kind, row in zip(self.kinds, self.rows):
+            raw = raw_lines[row]
+            if kind == JWC_LINE:
+                append(JwcLine(raw, *next(quads), next(line_attrs)))
+            elif kind == JWC_CIRCLE:
+                append(JwcCircle(raw, next(fives), next(nparts), next(circle_attrs)))
+            elif kind == JWC_TEXT or kind == JWC_POINT:
+                append(JwcPartsElement(JWC_KINDS[kind], raw))
+            else:
+                append(JwcElement(JWC_KINDS[kind], raw))
+        return out
+
+
+def _jwc_circle_fields(parts):
+    """ci 行の cx, cy, r, start_a, end_a を読む（無い・読めない値は NaN）"""
+    nan = float('nan')
+    out = []
+    for tok in parts[1:6]:
+        try:
+            out.append(float(tok))
+        except ValueError:
+            out.append(nan)
+    out.extend([nan] * (5 - len(out)))
+    return out
+
+
+def parse_jwc_store(filepath=None):
+    """
+    JWC_TEMP.TXTを解析して JwcElementStore を返す。
+    Returns: (store, error_str_or_None)
+    """
+    from array import array
+    from itertools import accumulate
+    if filepath is None:
+        filepath = JWC_TEMP
+    if not os.path.exists(filepath):
+        return JwcElementStore([]), f"ファイルが見つかりません: {filepath}"
     try:
-        with open(filepath, 'r', encoding='cp932', errors='replace') as f:
-            lines = f.readlines()
+        with open(filepath, 'rb') as f:
+            data = f.read()
+            st = os.fstat(f.fileno())
     except Exception as e:
-        return elements, raw_lines, str(e)
-
-    for line in lines:
-        line = line.rstrip('\n\r')
-        raw_lines.append(line)
+        return JwcElementStore([]), str(e)
+
+    # cp932 の2バイト文字に \r \n は現れないので、行の区切りはバイト列のまま探せる
+    content = data.decode('cp932', errors='replace')
+    crlf = data.count(b'\r\n')
+    offsets = None
+    if data.count(b'\r') == crlf:
+        if crlf:
+            content = content.replace('\r\n', '\n')
+        # 各行の先頭バイト位置（改行だけ書き換えずに済むよう、行の境目はファイルのまま）
+        offsets = array('q', accumulate(map((1).__add__, map(len, data.split(b'\n'))), initial=0))
+        offsets[-1] = len(data)
+    else:
+        content = content.replace('\r\n', '\n').replace('\r', '\n')   # 単独の \r も改行（位置は記録しない）
+
+    raw_lines = content.split('\n')
+    if raw_lines and raw_lines[-1] == '':
+        raw_lines.pop()             # 最終行の改行
+    store = JwcElementStore(raw_lines)
+    if offsets is not None:
+        del offsets[len(raw_lines) + 1:]
+        store.offsets = offsets
+        store.source = (os.path.abspath(filepath), st.st_size, st.st_mtime_ns)
+    kinds, rows = store.kinds, store.rows
+    numeric_start = _JWC_NUMERIC_START
+    attrs, sid = JWC_NO_ATTRS, 0
+    state_ids = {JWC_NO_ATTRS: 0}
+
+    # 1) 種類分け。スペース1つ区切りの数字行は座標行の候補として語に分けずに取っておく
+    coord_rows, coord_slots, coord_state = [], [], array('I')
+    for row, line in enumerate(raw_lines):
         if not line:
-            elements.append({'type': 'blank', 'raw': ''})
+            kinds.append(JWC_BLANK)
+            rows.append(row)
+            continue
+        if (line[0] in numeric_start and line.count(' ') == 3 and '  ' not in line
+                and line[-1] != ' ' and '\t' not in line):
+            coord_slots.append(len(kinds))
+            coord_rows.append(line)
+            coord_state.append(sid)
+            kinds.append(JWC_LINE)
+            rows.append(row)
             continue
-
         parts = line.split()
         if not parts:
-            continue
-        code = parts[0]
-
-        if code == 'hq':
-            elements.append({'type': 'hq', 'raw': line})
-        elif (code.startswith('hk') or code.startswith('hs') or code.startswith('hn')
-              or code.startswith('hcw') or code.startswith('hch') or code.startswith('hcd')
-              or code.startswith('hcc') or code.startswith('hp')):
-            elements.append({'type': 'header', 'raw': line})
-        elif (code.startswith('lg') or code.startswith('ly') or code.startswith('lc')
-              or code.startswith('lt') or code.startswith('lw')):
-            elements.append({'type': 'attr', 'raw': line})
-        elif code == 'ci':
-            elements.append({'type': 'circle', 'raw': line, 'parts': parts})
-        elif (code.startswith('ch') or code.startswith('cv') or code.startswith('cs')
-              or code.startswith('cn')):
-            elements.append({'type': 'text', 'raw': line, 'parts': parts})
-        elif code == 'pt':
-            elements.append({'type': 'point', 'raw': line, 'parts': parts})
-        elif code == 'hd':
-            elements.append({'type': 'hd', 'raw': line})
-        elif len(parts) == 4:
+            continue                # 空白だけの行は要素にしない
+        kind = _jwc_classify(parts[0])
+        if kind is None:
+            kind = JWC_LINE if len(parts) == 4 else JWC_OTHER
+            if kind == JWC_LINE:
+                coord_slots.append(len(kinds))
+                coord_rows.append(line)
+                coord_state.append(sid)
+        elif kind == JWC_CIRCLE:
+            store.circle_fields.extend(_jwc_circle_fields(parts))
+            store.circle_parts.append(min(len(parts), 127))
+            store.circle_slots.append(len(kinds))
+            store.circle_state.append(sid)
+        elif kind == JWC_ATTR:
+            attrs = _jwc_attr_update(attrs, parts[0], parts)
+            sid = state_ids.get(attrs)
+            if sid is None:
+                sid = state_ids[attrs] = len(store.attr_states)
+                store.attr_states.append(attrs)
+        kinds.append(kind)
+        rows.append(row)
+
+    # 2) 座標行をまとめて数値にする。読めない語が混じっていたら1行ずつ読み、読めない行は other
+    coords = _jwc_parse_coords(coord_rows, _import_numpy())
+    if coords is None:
+        coords = array('d')
+        for slot, line, state in zip(coord_slots, coord_rows, coord_state):
+            parts = line.split()
             try:
-                x1, y1, x2, y2 = float(parts[0]), float(parts[1]), float(parts[2]), float(parts[3])
-                elements.append({'type': 'line', 'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2, 'raw': line})
-            except Exception:
-                elements.append({'type': 'other', 'raw': line})
-        else:
-            elements.append({'type': 'other', 'raw': line})
+                if len(parts) != 4:     # 全角スペースなど、スペース以外の空白で区切られていた
+                    raise ValueError(line)
+                values = [float(v) for v in parts]
+            except ValueError:
+                kinds[slot] = JWC_OTHER
+                continue
+            coords.extend(values)
+            store.line_slots.append(slot)
+            store.line_state.append(state)
+    else:
+        store.line_slots.extend(coord_slots)
+        store.line_state = coord_state
+    store.line_coords = coords
+    store.build_attr_index()
+    return store, None
+
 
-    return elements, raw_lines, None
+def parse_jwc_temp(filepath=None):
+    """
+    JWC_TEMP.TXTを解析して図形要素のリストと生データを返す（parse_jwc_store の要素オブジェクト版）。
+    要素は JwcElement / JwcLine / JwcCircle で、従来の辞書と同じく elem['type'] でも読める。
+    Returns: (elements, raw_lines, error_str_or_None)
+    """
+    store, error = parse_jwc_store(filepath)
+    if error:
+        return [], [], error
+    return store.to_elements(), store.raw_lines, None
 
 
 # ========== AIコンテキスト生成 ==========
 
-def elements_to_context(elements, raw_lines):
-    """図形データをAIへのコンテキスト文字列に変換"""
-    lines_data   = [e for e in elements if e['type'] == 'line']
-    texts_data   = [e for e in elements if e['type'] == 'text']
-    circles_data = [e for e in elements if e['type'] == 'circle']
+def _jwc_attr_label(attrs):
+    """属性の短い表示（例: "レイヤ0-3 線色2 線種1"）。属性行が無ければ空"""
+    out = []
+    if attrs.lg is not None or attrs.ly is not None:
+        g = '?' if attrs.lg is None else f"{attrs.lg:X}"
+        l = '?' if attrs.ly is None else f"{attrs.ly:X}"
+        out.append(f"レイヤ{g}-{l}")
+    if attrs.lc is not None:
+        out.append(f"線色{attrs.lc}")
+    if attrs.lt is not None:
+        out.append(f"線種{attrs.lt}")
+    if attrs.lw is not None:
+        out.append(f"線幅{attrs.lw}")
+    return " ".join(out)
+
+
+def elements_to_context(elements, raw_lines, store=None):
+    """
+    図形データをAIへのコンテキスト文字列に変換。
+    ドア（扇形＋戸の線＋枠の線、detect_doors）も番号付きで載せる。
+    store（elements を作った JwcElementStore）を渡すと、ドアは store で1度だけ求めたものを使う。
+    """
+    lines_data   = [e for e in elements if e.type == 'line']
+    texts_data   = [e for e in elements if e.type == 'text']
+    circles_data = [e for e in elements if e.type == 'circle']
+    if store is not None:
+        doors = store.doors()
+    else:
+        doors = detect_doors(*_element_door_geometry(lines_data, circles_data))
+    door_of = {d["arc"]: k for k, d in enumerate(doors)}
 
     ctx  = "【選択された図形データ（JWC_TEMP.TXT）】\n"
     ctx += f"線: {len(lines_data)}本  文字: {len(texts_data)}件  円弧: {len(circles_data)}件\n\n"
 
+    # 属性（レイヤ・線色）ごとの内訳。filter で対象を絞るときの手掛かり
+    by_attrs = {}
+    for e in lines_data:
+        by_attrs.setdefault(e.attrs, [0, 0])[0] += 1
+    for e in circles_data:
+        by_attrs.setdefault(e.attrs, [0, 0])[1] += 1
+    if len(by_attrs) > 1 or JWC_NO_ATTRS not in by_attrs:
+        ctx += "【属性別（レイヤ・線色・線種）】\n"
+        ctx += "※属性で対象を絞るときは filter に lg / ly / lc / lt を指定してください\n"
+        for attrs, (n_line, n_circle) in sorted(by_attrs.items(), key=lambda kv: -sum(kv[1]))[:20]:
+            ctx += f"  {_jwc_attr_label(attrs) or '属性なし'}: 線{n_line}本 円弧{n_circle}件\n"
+        ctx += "\n"
+
     if lines_data:
         ctx += "【線データ（座標、単位mm）】\n"
         for i, l in enumerate(lines_data[:30]):
-            length = ((l['x2'] - l['x1'])**2 + (l['y2'] - l['y1'])**2) ** 0.5
-            ctx += f"  線{i+1}: ({l['x1']:.2f},{l['y1']:.2f})→({l['x2']:.2f},{l['y2']:.2f})  長さ:{length:.2f}mm\n"
+            length = ((l.x2 - l.x1)**2 + (l.y2 - l.y1)**2) ** 0.5
+            label = _jwc_attr_label(l.attrs)
+            ctx += (f"  線{i+1}: ({l.x1:.2f},{l.y1:.2f})→({l.x2:.2f},{l.y2:.2f})  長さ:{length:.2f}mm"
+                    + (f"  [{label}]" if label else "") + "\n")
         if len(lines_data) > 30:
             ctx += f"  ...他{len(lines_data)-30}本\n"
 
@@ -118,30 +535,34 @@ def elements_to_context(elements, raw_lines):
         ctx += "\n【円弧データ（番号付き）】\n"
         ctx += "※変換時は circle_indices でこの番号を指定してください\n"
         for i, c in enumerate(circles_data):
-            ctx += f"  [円弧{i}] {c['raw']}\n"
-            if len(c.get('parts', [])) >= 4:
-                try:
-                    cx, cy, r = float(c['parts'][1]), float(c['parts'][2]), float(c['parts'][3])
-                    desc = f"    → 中心({cx:.2f},{cy:.2f}) 半径{r:.2f}mm"
-                    if len(c['parts']) >= 6:
-                        start_a, end_a = float(c['parts'][4]), float(c['parts'][5])
-                        desc += f" 始角:{start_a:.1f}° 終角:{end_a:.1f}°"
-                        # 角度からドア方向を推定
-                        span = (end_a - start_a) % 360
-                        if 80 <= span <= 100:
-                            desc += " ←ドア扇形(90°)"
-                        elif 170 <= span <= 190:
-                            desc += " ←半円"
-                        elif span < 5:
-                            desc += " ←全円"
-                    ctx += desc + "\n"
-                except Exception:
-                    pass
+            ctx += f"  [円弧{i}] {c.raw}\n"
+            if c.valid:
+                desc = f"    → 中心({c.cx:.2f},{c.cy:.2f}) 半径{c.r:.2f}mm"
+                label = _jwc_attr_label(c.attrs)
+                if c.has_angles:
+                    desc += f" 始角:{c.start_a:.1f}° 終角:{c.end_a:.1f}°"
+                    # 角度からドア方向を推定
+                    span = (c.end_a - c.start_a) % 360
+                    if i in door_of:
+                        desc += f" ←ドア扇形(90°) [ドア{door_of[i]}]"
+                    elif 170 <= span <= 190:
+                        desc += " ←半円"
+                    elif span < 5:
+                        desc += " ←全円"
+                if label:
+                    desc += f"  [{label}]"
+                ctx += desc + "\n"
+
+    if doors:
+        ctx += "\n【ドア（扇形・戸の線・枠の線の組、番号付き）】\n"
+        ctx += "※ドアを変換するときは door_indices でこの番号を指定できます（円弧と戸の線が対象になります）\n"
+        for k, d in enumerate(doors):
+            ctx += f"  [ドア{k}] {_door_label(d)}\n"
 
     if texts_data:
         ctx += "\n【文字データ】\n"
         for t in texts_data[:10]:
-            ctx += f"  {t['raw']}\n"
+            ctx += f"  {t.raw}\n"
 
     ctx += "\n【生データ先頭30行】\n"
     for line in raw_lines[:30]:
@@ -152,53 +573,166 @@ def elements_to_context(elements, raw_lines):
 
 # ========== JWC_TEMP.TXT 書き戻し ==========
 
-def write_result_to_jwc(elements, modified_lines_map, filepath=None,
-                         modified_circles_map=None):
-    """
-    変更済みデータをJWC_TEMP.TXTに書き戻す。
-    hqを除去してJW_CADに「実行済み」として認識させる。
-    modified_lines_map:   {line_index: {'x1':..,'y1':..,'x2':..,'y2':..}}
-    modified_circles_map: {circle_index: raw_line_string}  ← 変換済みの生行文字列
-    Returns: (success, error_or_None)
-    """
-    if filepath is None:
-        filepath = JWC_TEMP
-    if modified_circles_map is None:
-        modified_circles_map = {}
+_JWC_WRITE_CHUNK_LINES = 4096           # cp932 へまとめて変換する行数
+_JWC_WRITE_BUFFER = 1024 * 1024
 
-    output = []
+
+def _iter_jwc_output(elements, modified_lines_map, modified_circles_map):
+    """書き戻す行を順に返す（hq は出さない）"""
     line_idx = 0
     circle_idx = 0
     for elem in elements:
-        if elem['type'] == 'hq':
+        if elem.type == 'hq':
             continue  # hq削除が「実行済み」の合図
-        elif elem['type'] == 'line':
+        elif elem.type == 'line':
             if line_idx in modified_lines_map:
                 m = modified_lines_map[line_idx]
-                x1 = m.get('x1', elem['x1'])
-                y1 = m.get('y1', elem['y1'])
-                x2 = m.get('x2', elem['x2'])
-                y2 = m.get('y2', elem['y2'])
-                output.append(f"{x1} {y1} {x2} {y2}")
+                x1 = m.get('x1', elem.x1)
+                y1 = m.get('y1', elem.y1)
+                x2 = m.get('x2', elem.x2)
+                y2 = m.get('y2', elem.y2)
+                yield f"{x1} {y1} {x2} {y2}"
             else:
-                output.append(elem['raw'])
+                yield elem.raw
             line_idx += 1
-        elif elem['type'] == 'circle':
+        elif elem.type == 'circle':
             if circle_idx in modified_circles_map:
-                output.append(modified_circles_map[circle_idx])
+                yield modified_circles_map[circle_idx]
             else:
-                output.append(elem['raw'])
+                yield elem.raw
             circle_idx += 1
         else:
-            output.append(elem['raw'])
+            yield elem.raw
+
+
+def _iter_cp932_chunks(lines, newline=os.linesep):
+    """行を _JWC_WRITE_CHUNK_LINES 行ずつ cp932 のバイト列にする（変換できない文字は ?）"""
+    from itertools import islice
+    lines = iter(lines)
+    while True:
+        batch = list(islice(lines, _JWC_WRITE_CHUNK_LINES))
+        if not batch:
+            return
+        batch.append('')
+        yield newline.join(batch).encode('cp932', errors='replace')
+
+
+def _jwc_delta_patches(store, modified_lines_map, modified_circles_map):
+    """
+    差分書き戻しで書き換える行を返す: [(行番号, 新しい行 or None=削除)]（行番号順）。
+    hq は削除、値の変わらない線・原文と同じ円弧は書き換えない。
+    """
+    patches = {}
+    hq = bytes([JWC_HQ])
+    i = store.kinds.find(hq)
+    while i >= 0:
+        patches[store.rows[i]] = None
+        i = store.kinds.find(hq, i + 1)
+    for i, m in modified_lines_map.items():
+        old = store.line(i)
+        new = (m.get('x1', old[0]), m.get('y1', old[1]), m.get('x2', old[2]), m.get('y2', old[3]))
+        if new != old:
+            patches[store.rows[store.line_slots[i]]] = "{} {} {} {}".format(*new)
+    for i, text in modified_circles_map.items():
+        row = store.rows[store.circle_slots[i]]
+        if text != store.raw_lines[row]:
+            patches[row] = text
+    return sorted(patches.items())
+
+
+def _write_jwc_delta(store, filepath, modified_lines_map, modified_circles_map, source_path=None):
+    """
+    読み込んだ時から変わっていない JWC_TEMP.TXT に、変わった行だけを差し替えて書き戻す。
+    Returns: 書いたバイト数。差分で書けない場合はNone
+    """
+    import mmap
+    if store.offsets is None or store.source is None:
+        return None
+    if source_path is None:
+        source_path = filepath
+    try:
+        st = os.stat(source_path)
+    except OSError:
+        return None
+    if store.source != (os.path.abspath(filepath), st.st_size, st.st_mtime_ns) or not st.st_size:
+        return None
+
+    patches = _jwc_delta_patches(store, modified_lines_map, modified_circles_map)
+    offsets = store.offsets
+    tmp = filepath + ".tmp"
+    written = 0
+    with open(source_path, 'rb') as src, open(tmp, 'wb') as dst, \
+            mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            pos = 0
+            for row, text in patches:
+                start, end = offsets[row], offsets[row + 1]
+                written += dst.write(view[pos:start])
+                if text is not None:
+                    eol = end - (2 if mm[end - 2:end] == b'\r\n' else 1 if mm[end - 1:end] == b'\n' else 0)
+                    written += dst.write(text.encode('cp932', errors='replace'))
+                    written += dst.write(view[eol:end])
+                pos = end
+            written += dst.write(view[pos:])
+        finally:
+            view.release()
+    os.replace(tmp, filepath)
+    return written
+
+
+def _write_jwc_full(tmp, filepath, elements, modified_lines_map, modified_circles_map):
+    """全行を書き直す（一時ファイルに書いてから置き換える）。Returns: 書いたバイト数"""
+    written = 0
+    with open(tmp, 'wb', buffering=_JWC_WRITE_BUFFER) as f:
+        for chunk in _iter_cp932_chunks(_iter_jwc_output(elements, modified_lines_map,
+                                                         modified_circles_map)):
+            written += f.write(chunk)
+        if not written:
+            written = f.write(os.linesep.encode('ascii'))   # 要素が無くても空行1行（従来どおり）
+    os.replace(tmp, filepath)
+    return written
+
+
+def write_result_to_jwc(elements, modified_lines_map, filepath=None,
+                         modified_circles_map=None, stats=None, store=None, source_path=None):
+    """
+    変更済みデータをJWC_TEMP.TXTに書き戻す。
+    hqを除去してJW_CADに「実行済み」として認識させる。
+    modified_lines_map:   {line_index: {'x1':..,'y1':..,'x2':..,'y2':..}}
+    modified_circles_map: {circle_index: raw_line_string}  ← 変換済みの生行文字列
+    store: elements を作った JwcElementStore。渡すと変わった行だけを差し替える
+    source_path: 読み込んだ時の内容を残した filepath の別名（TransformJournal が使う）
+    stats: 辞書を渡すと "mode"（"delta" / "full"）、"bytes"、"seconds" を入れる
+    Returns: (success, error_or_None)
+    """
+    if filepath is None:
+        filepath = JWC_TEMP
+    if modified_circles_map is None:
+        modified_circles_map = {}
 
+    t0 = time.perf_counter()
+    tmp = filepath + ".tmp"
+    mode = "delta"
     try:
-        content = '\n'.join(output) + '\n'
-        with open(filepath, 'w', encoding='cp932', errors='replace') as f:
-            f.write(content)
-        return True, None
+        written = None
+        if store is not None:
+            written = _write_jwc_delta(store, filepath, modified_lines_map, modified_circles_map,
+                                       source_path)
+        if written is None:
+            mode = "full"
+            written = _write_jwc_full(tmp, filepath, elements, modified_lines_map, modified_circles_map)
     except Exception as e:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
         return False, str(e)
+    if stats is not None:
+        stats["mode"] = mode
+        stats["bytes"] = written
+        stats["seconds"] = time.perf_counter() - t0
+    return True, None
 
 
 # ========== 座標変換エンジン ==========
@@ -209,202 +743,623 @@ def _calc_bbox(elements):
     """線要素のバウンディングボックスを計算（変換基準点に使用）"""
     xs, ys = [], []
     for e in elements:
-        if e['type'] == 'line':
-            xs += [e['x1'], e['x2']]
-            ys += [e['y1'], e['y2']]
-        elif e['type'] == 'circle' and len(e.get('parts', [])) >= 4:
-            try:
-                cx, cy, r = float(e['parts'][1]), float(e['parts'][2]), float(e['parts'][3])
-                xs += [cx - r, cx + r]
-                ys += [cy - r, cy + r]
-            except Exception:
-                pass
+        if e.type == 'line':
+            xs += [e.x1, e.x2]
+            ys += [e.y1, e.y2]
+        elif e.type == 'circle' and None not in (e.cx, e.cy, e.r):
+            xs += [e.cx - e.r, e.cx + e.r]
+            ys += [e.cy - e.r, e.cy + e.r]
     if not xs:
         return 0, 0, 0, 0
     return min(xs), min(ys), max(xs), max(ys)
 
 
-def _mirror_x_line(x1, y1, x2, y2, axis_x):
+# 変換は 3×3 のアフィン行列 ((a, b, c), (d, e, f), (0, 0, 1)) で表す: x' = a*x + b*y + c, y' = d*x + e*y + f
+_AFFINE_IDENTITY = ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0))
+
+
+def _affine_mul(m, n):
+    """行列の積 m·n（n を先に、m を後に適用する変換）"""
+    return tuple(tuple(m[i][0] * n[0][j] + m[i][1] * n[1][j] + m[i][2] * n[2][j] for j in range(3))
+                 for i in range(3))
+
+
+def _affine_translate(tx, ty):
+    """(tx, ty) だけ平行移動"""
+    return ((1.0, 0.0, tx), (0.0, 1.0, ty), (0.0, 0.0, 1.0))
+
+
+def _affine_mirror_x(axis_x):
     """x=axis_x を軸に左右反転"""
-    return 2*axis_x - x1, y1, 2*axis_x - x2, y2
+    return ((-1.0, 0.0, 2 * axis_x), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0))
 
-def _mirror_y_line(x1, y1, x2, y2, axis_y):
+
+def _affine_mirror_y(axis_y):
     """y=axis_y を軸に上下反転"""
-    return x1, 2*axis_y - y1, x2, 2*axis_y - y2
-
-def _mirror_x_circle(parts, axis_x):
-    """円弧を x=axis_x 軸で左右反転"""
-    # ci cx cy r [start end flat angle]
-    cx = 2 * axis_x - float(parts[1])
-    cy = float(parts[2])
-    r  = float(parts[3])
-    if len(parts) >= 6:
-        sa = float(parts[4])
-        ea = float(parts[5])
-        # 角度反転: 元のangle→ 180-angle (mod 360)
-        new_sa = (180 - ea) % 360
-        new_ea = (180 - sa) % 360
-        rest = parts[6:]
-        return f"ci {cx} {cy} {r} {new_sa} {new_ea} " + " ".join(rest)
-    return f"ci {cx} {cy} {r}"
-
-def _mirror_y_circle(parts, axis_y):
-    """円弧を y=axis_y 軸で上下反転"""
-    cx = float(parts[1])
-    cy = 2 * axis_y - float(parts[2])
-    r  = float(parts[3])
-    if len(parts) >= 6:
-        sa = float(parts[4])
-        ea = float(parts[5])
-        # 上下反転: 角度を 360-angle (mod360) にして始終角を入れ替え
-        new_sa = (360 - ea) % 360
-        new_ea = (360 - sa) % 360
-        rest = parts[6:]
-        return f"ci {cx} {cy} {r} {new_sa} {new_ea} " + " ".join(rest)
-    return f"ci {cx} {cy} {r}"
-
-
-def _flip_arc_angles_x(parts):
-    """
-    円弧の中心・半径はそのままで、角度だけ左右反転する。
-    左開き(90-180°) → 右開き(0-90°)
-    右開き(0-90°)   → 左開き(90-180°)
-    ci cx cy r sa ea [flat angle]
-    """
-    if len(parts) < 6:
-        return None  # 角度情報なし→変換不可
-    cx = float(parts[1])
-    cy = float(parts[2])
-    r  = float(parts[3])
-    sa = float(parts[4])
-    ea = float(parts[5])
-    # 左右反転: new_sa = (180 - ea) % 360, new_ea = (180 - sa) % 360
-    new_sa = (180 - ea) % 360
-    new_ea = (180 - sa) % 360
-    rest = parts[6:]
-    return f"ci {cx} {cy} {r} {new_sa} {new_ea} " + " ".join(rest)
-
-def _flip_arc_angles_y(parts):
-    """
-    円弧の中心・半径はそのままで、角度だけ上下反転する。
-    ci cx cy r sa ea [flat angle]
-    """
-    if len(parts) < 6:
+    return ((1.0, 0.0, 0.0), (0.0, -1.0, 2 * axis_y), (0.0, 0.0, 1.0))
+
+
+def _affine_rotate(angle, cx, cy):
+    """(cx, cy) を中心に angle 度回転。90°の倍数は cos/sin を 0・±1 ちょうどにする（座標に誤差を出さない）"""
+    q, rem = divmod(angle, 90.0)
+    if rem == 0:
+        ca, sa = ((1.0, 0.0), (0.0, 1.0), (-1.0, 0.0), (0.0, -1.0))[int(q) % 4]
+    else:
+        rad = math.radians(angle)
+        ca, sa = math.cos(rad), math.sin(rad)
+    rot = ((ca, -sa, 0.0), (sa, ca, 0.0), (0.0, 0.0, 1.0))
+    return _affine_mul(_affine_translate(cx, cy), _affine_mul(rot, _affine_translate(-cx, -cy)))
+
+
+def _affine_arc_map(m):
+    """
+    行列が円を円に写す（回転・鏡映・一様な拡大縮小）なら (倍率, φ, 向きが反転するか) を返す。
+    角度 θ は φ+θ に、向きが反転する場合は φ-θ に写り、始角と終角が入れ替わる。円が楕円になる行列ならNone
+    """
+    (a, b, _), (d, e, _) = m[0], m[1]
+    det = a * e - b * d
+    if det == 0:
+        return None
+    close = lambda u, v: math.isclose(u, v, rel_tol=1e-9, abs_tol=1e-12)
+    if close(a, e) and close(b, -d):
+        flip = False
+    elif close(a, -e) and close(b, d):
+        flip = True
+    else:
+        return None
+    # 行列の丸め誤差で 30° が 29.999999999999996° にならないよう、φ は 1e-9 度で丸める
+    phi = round(math.degrees(math.atan2(d, a)), 9)
+    return math.sqrt(abs(det)), phi, flip
+
+
+def _line_block(np, lines=None, store=None, ids=None):
+    """
+    線の番号と座標を NumPy 配列 (idx, P) にする（P は k×4 の x1, y1, x2, y2）。
+    store があれば番号 ids（None なら全部）の座標をその列から取り、無ければ lines [(番号, JwcLine)] から作る
+    """
+    if store is not None:
+        P = store.line_array(np)
+        if ids is None:
+            return np.arange(len(P)), P
+        idx = np.asarray(ids, dtype=np.int64)
+        return idx, P[idx]
+    from operator import itemgetter
+    idx = np.fromiter(map(itemgetter(0), lines), dtype=np.int64, count=len(lines))
+    P = np.array([(l.x1, l.y1, l.x2, l.y2) for _, l in lines], dtype=np.float64).reshape(-1, 4)
+    return idx, P
+
+
+class JwcLineEdits:
+    """
+    apply_transform が返す線の変更 {線番号: {'x1':..,'y1':..,'x2':..,'y2':..}} を辞書として見せるビュー。
+    番号と座標を配列で持ち、値の辞書は参照したときにだけ作る（数十万本を変換しても辞書を溜め込まない）。
+    """
+    __slots__ = ('_pos', '_coords')
+
+    def __init__(self, ids, coords):
+        from array import array
+        self._pos = dict(zip(ids, range(len(ids))))     # 線番号 → 並び順
+        self._coords = coords if isinstance(coords, array) else array('d', coords)
+
+    def __len__(self):
+        return len(self._pos)
+
+    def __bool__(self):
+        return bool(self._pos)
+
+    def __contains__(self, i):
+        return i in self._pos
+
+    def __iter__(self):
+        return iter(self._pos)
+
+    def __getitem__(self, i):
+        p = self._pos[i] * 4
+        c = self._coords
+        return {'x1': c[p], 'y1': c[p + 1], 'x2': c[p + 2], 'y2': c[p + 3]}
+
+    def get(self, i, default=None):
+        return self[i] if i in self._pos else default
+
+    def keys(self):
+        return self._pos.keys()
+
+    def items(self):
+        for i in self._pos:
+            yield i, self[i]
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(i in other and other[i] == v for i, v in self.items())
+        except TypeError:
+            return NotImplemented
+
+
+class JwcCircleEdits(dict):
+    """
+    apply_transform が返す円弧の変更 {円弧番号: 新しい ci 行}。辞書そのものだが、
+    変換後の cx, cy, r, start_a, end_a（角度の無い円は NaN）も fields に同じ並びで持つ
+    （プレビューの描画で ci 行を読み直さずに済むように）。
+    """
+    __slots__ = ('fields',)
+
+    def __init__(self):
+        from array import array
+        super().__init__()
+        self.fields = array('d')
+
+    def merge(self, other):
+        """番号の重ならない JwcCircleEdits を後ろに足す"""
+        self.update(other)
+        self.fields += other.fields
+
+
+def _affine_line_edits(m, lines, block=None):
+    """
+    線 [(番号, JwcLine)] に行列を適用し、値が変わった線を (番号のリスト, 座標の array('d')) で返す
+    （JwcLineEdits の材料）。block（_line_block の配列）があれば、lines の代わりにそれで全端点をまとめて計算する。
+    """
+    from array import array
+    (a, b, c), (d, e, f) = m[0], m[1]
+    if block is None:
+        ids, coords = [], array('d')
+        for i, l in lines:
+            new = (a * l.x1 + b * l.y1 + c, d * l.x1 + e * l.y1 + f,
+                   a * l.x2 + b * l.y2 + c, d * l.x2 + e * l.y2 + f)
+            if new != (l.x1, l.y1, l.x2, l.y2):
+                ids.append(i)
+                coords.extend(new)
+        return ids, coords
+    idx, P = block
+    Q = P.copy()
+    Q[:, 0::2] = a * P[:, 0::2] + b * P[:, 1::2] + c
+    Q[:, 1::2] = d * P[:, 0::2] + e * P[:, 1::2] + f
+    changed = (Q != P).any(axis=1)
+    return idx[changed].tolist(), array('d', Q[changed].tobytes())
+
+
+def _arc_fields(np, circles=None, store=None, ids=None):
+    """
+    円・円弧の cx, cy, r, start_a, end_a を k×5 の NumPy 配列にする（読めない値は NaN）。
+    store があれば番号 ids（None なら全部）をその列から取り、無ければ circles [(番号, JwcCircle)] から作る
+    """
+    if store is not None:
+        F = store.circle_array(np)
+        return F if ids is None else F[np.asarray(ids, dtype=np.int64)]
+    # None は NaN になる
+    return np.array([(c.cx, c.cy, c.r, c.start_a, c.end_a) for _, c in circles], dtype=np.float64).reshape(-1, 5)
+
+
+def _affine_arcs(m, arcs, fields=None, angle_m=None):
+    """円・円弧 [(番号, JwcCircle)] に行列を適用し、原文から変わったものを {番号: 新しい ci 行} で返す"""
+    amap = _affine_arc_map(m if angle_m is None else angle_m)
+    if amap is None or not arcs:
+        return JwcCircleEdits()
+    scale, phi, flip = amap
+    move_center = m != _AFFINE_IDENTITY
+    (a, b, c0), (d, e, f) = m[0], m[1]
+    if fields is None:
+        rows = []
+        for i, c in arcs:
+            if not c.valid or not (move_center or c.has_angles):
+                continue
+            cx, cy = c.cx, c.cy
+            if move_center:
+                cx, cy = a * c.cx + b * c.cy + c0, d * c.cx + e * c.cy + f
+            if not c.has_angles:
+                rows.append((i, c, cx, cy, c.r * scale, None, None))
+            elif flip:
+                rows.append((i, c, cx, cy, c.r * scale, (phi - c.end_a) % 360, (phi - c.start_a) % 360))
+            else:
+                rows.append((i, c, cx, cy, c.r * scale, (phi + c.start_a) % 360, (phi + c.end_a) % 360))
+    else:
+        np = _import_numpy()
+        F = fields
+        has = np.fromiter((c.nparts >= 6 for _, c in arcs), dtype=bool, count=len(arcs))
+        ok = ~np.isnan(F[:, :3]).any(axis=1) & ~(has & np.isnan(F[:, 3:]).any(axis=1))
+        if not move_center:
+            ok &= has
+        cx, cy = F[:, 0], F[:, 1]
+        if move_center:
+            cx, cy = a * F[:, 0] + b * F[:, 1] + c0, d * F[:, 0] + e * F[:, 1] + f
+        if flip:
+            sa, ea = (phi - F[:, 4]) % 360, (phi - F[:, 3]) % 360
+        else:
+            sa, ea = (phi + F[:, 3]) % 360, (phi + F[:, 4]) % 360
+        keep = np.flatnonzero(ok)
+        rows = zip([arcs[k][0] for k in keep.tolist()], [arcs[k][1] for k in keep.tolist()],
+                   cx[keep].tolist(), cy[keep].tolist(), (F[keep, 2] * scale).tolist(),
+                   sa[keep].tolist(), ea[keep].tolist())
+    out = JwcCircleEdits()
+    nan = float('nan')
+    for i, c, cx, cy, r, sa, ea in rows:
+        if c.nparts >= 6:
+            raw = f"ci {cx} {cy} {r} {sa} {ea} " + " ".join(c.rest)
+        else:
+            raw = f"ci {cx} {cy} {r}"
+            sa = ea = nan
+        if raw != c.raw:
+            out[i] = raw
+            out.fields.extend((cx, cy, r, sa, ea))
+    return out
+
+
+def _transform_attr_filter(transform):
+    """transform の "filter" を {"lg": {値,...}, ...} にする。指定が無ければNone"""
+    flt = transform.get("filter")
+    if not flt:
         return None
-    cx = float(parts[1])
-    cy = float(parts[2])
-    r  = float(parts[3])
-    sa = float(parts[4])
-    ea = float(parts[5])
-    # 上下反転: new_sa = (360 - ea) % 360, new_ea = (360 - sa) % 360
-    new_sa = (360 - ea) % 360
-    new_ea = (360 - sa) % 360
-    rest = parts[6:]
-    return f"ci {cx} {cy} {r} {new_sa} {new_ea} " + " ".join(rest)
+    out = {}
+    for key in JWC_ATTR_CODES:
+        if flt.get(key) is None:
+            continue
+        v = flt[key]
+        out[key] = {int(x) for x in v} if isinstance(v, (list, tuple, set)) else {int(v)}
+    return out or None
+
+
+def _transform_region(transform):
+    """
+    transform の "filter" の範囲指定を返す: ("bbox", (xmin, ymin, xmax, ymax)) / ("near", (x, y, r))。
+    指定が無ければNone
+    """
+    flt = transform.get("filter") or {}
+    if flt.get("bbox") is not None:
+        x0, y0, x1, y1 = (float(v) for v in flt["bbox"])
+        return "bbox", (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+    if flt.get("near") is not None:
+        x, y, r = (float(v) for v in flt["near"])
+        return "near", (x, y, r)
+    return None
+
+
+def _element_in_region(e, region):
+    """線・円弧の要素が範囲指定に掛かるか（索引を使わない場合）"""
+    kind, args = region
+    if e.type == 'line':
+        if kind == "bbox":
+            return _segment_hits_box(e.x1, e.y1, e.x2, e.y2, *args)
+        return _segment_distance(args[0], args[1], e.x1, e.y1, e.x2, e.y2) <= args[2]
+    if None in (e.cx, e.cy, e.r):
+        return False
+    nan = float('nan')
+    arc = (e.cx, e.cy, e.r, nan if e.start_a is None else e.start_a, nan if e.end_a is None else e.end_a)
+    if kind == "bbox":
+        x0, y0, x1, y1 = _arc_bbox(*arc)
+        return not (x0 > args[2] or x1 < args[0] or y0 > args[3] or y1 < args[1])
+    return _arc_distance(args[0], args[1], *arc) <= args[2]
+
+
+def _select_ids(store, flt, region):
+    """
+    store の属性・空間の索引から、条件に合う線・円弧の番号を引く: (線の番号, 円弧の番号)。
+    条件が無い側は None（全部）。該当数に比例する時間で済む
+    """
+    line_ids = store.select(JWC_LINE, flt) if flt is not None else None
+    circle_ids = store.select(JWC_CIRCLE, flt) if flt is not None else None
+    if region is not None:
+        grid = store.spatial_index()
+        kind, args = region
+        hits = grid.query_bbox(*args) if kind == "bbox" else grid.query_radius(*args)
+        near_lines = [i for k, i in hits if k == "line"]
+        near_circles = [i for k, i in hits if k == "arc"]
+        line_ids = near_lines if line_ids is None else sorted(set(line_ids).intersection(near_lines))
+        circle_ids = near_circles if circle_ids is None else sorted(set(circle_ids).intersection(near_circles))
+    return line_ids, circle_ids
+
+
+def _slot_pairs(elements, slots, ids):
+    """番号 ids（None なら全部）の要素を [(番号, 要素)] にする"""
+    if ids is None:
+        return list(enumerate(map(elements.__getitem__, slots)))
+    return [(i, elements[slots[i]]) for i in ids]
+
+
+def _select_geometry(elements, flt, store=None, region=None):
+    """
+    変換対象の線・円弧を [(番号, 要素)] で返す。flt（属性の条件）・region（範囲指定）があれば合うものだけ。
+    store（elements を作った JwcElementStore）があれば属性・空間の索引から引くので、該当数に比例する時間で済む。
+    """
+    if store is not None:
+        line_ids, circle_ids = _select_ids(store, flt, region)
+        return _slot_pairs(elements, store.line_slots, line_ids), _slot_pairs(elements, store.circle_slots, circle_ids)
+    lines, circles = _geometry_pairs(elements)
+    return _filter_pairs(lines, flt, region), _filter_pairs(circles, flt, region)
+
+
+def _geometry_pairs(elements):
+    """全ての線・円弧を [(番号, 要素)] で返す（要素を1度だけ走査する）"""
+    lines, circles = [], []
+    for e in elements:
+        if e.type == 'line':
+            lines.append((len(lines), e))
+        elif e.type == 'circle':
+            circles.append((len(circles), e))
+    return lines, circles
+
+
+def _filter_pairs(pairs, flt, region):
+    """[(番号, 要素)] から flt（属性の条件）・region（範囲指定）に合うものを残す（索引を使わない場合）"""
+    if flt is not None:
+        pairs = [(i, e) for i, e in pairs if all(getattr(e.attrs, k) in v for k, v in flt.items())]
+    if region is not None:
+        pairs = [(i, e) for i, e in pairs if _element_in_region(e, region)]
+    return pairs
+
+
+def _step_ids(step, n_lines, n_circles, store=None, pairs=None):
+    """
+    1つの手順の線・円弧の番号: (範囲の線, 範囲の円弧, 変換する線, 変換する円弧)。None は全部。
+    範囲は filter に合うもの（中心・軸の既定値を決める）、変換するのはそこから target・circle_indices・
+    door_indices で絞ったもの。store があれば索引で、無ければ pairs（_geometry_pairs の全線・全円弧）を絞り込んで引く
+    """
+    t = step.get("type", "")
+    target = step.get("target", "all")  # "all" | "circles_only" | "lines_only"
+    flt = _transform_attr_filter(step)
+    region = _transform_region(step)
+    if store is not None:
+        line_ids, circle_ids = _select_ids(store, flt, region)
+    elif flt is None and region is None:
+        line_ids = circle_ids = None
+    else:
+        line_ids = [i for i, _ in _filter_pairs(pairs[0], flt, region)]
+        circle_ids = [i for i, _ in _filter_pairs(pairs[1], flt, region)]
+    scope = (line_ids, circle_ids)
+    # arc_flip系はtargetに関係なく円弧のみ変換
+    if t in ("arc_flip_x", "arc_flip_y") or target == "circles_only":
+        line_ids = []
+    elif target == "lines_only":
+        circle_ids = []
+    # circle_indices: 変換対象の円弧インデックスリスト。Noneなら全円弧対象
+    circle_indices = step.get("circle_indices", None)
+    # door_indices: ドアの番号。そのドアの円弧を circle_indices に足し、線は戸の線だけにする
+    door_indices = step.get("door_indices", None)
+    if door_indices is not None:
+        if store is not None:
+            doors = store.doors()
+        else:
+            doors = detect_doors(*_element_door_geometry([e for _, e in pairs[0]], [e for _, e in pairs[1]]))
+        picked = [doors[k] for k in door_indices if 0 <= k < len(doors)]
+        circle_indices = list(circle_indices or []) + [d["arc"] for d in picked]
+        leaves = {d["leaf"] for d in picked if d["leaf"] is not None}
+        if line_ids is None:
+            line_ids = sorted(leaves)
+        else:
+            line_ids = [i for i in line_ids if i in leaves]
+    if circle_indices is not None:
+        wanted = {int(i) for i in circle_indices}
+        if circle_ids is None:
+            circle_ids = sorted(i for i in wanted if 0 <= i < n_circles)
+        else:
+            circle_ids = [i for i in circle_ids if i in wanted]
+    return scope + (line_ids, circle_ids)
 
 
-def apply_transform(elements, transform):
+def _step_membership(np, n, id_lists):
+    """
+    要素ごとに、どの番号リストに入っているかをビット列（id_lists[s] が 1<<s）にする。
+    None は全部。NumPy があれば int64 配列、無ければ int のリスト
+    """
+    if np is not None:
+        code = np.zeros(n, dtype=np.int64)
+        for s, ids in enumerate(id_lists):
+            if ids is None:
+                code |= 1 << s
+            elif len(ids):
+                code[np.asarray(ids, dtype=np.int64)] |= 1 << s
+        return code
+    code = [0] * n
+    for s, ids in enumerate(id_lists):
+        for i in (range(n) if ids is None else ids):
+            code[i] |= 1 << s
+    return code
+
+
+class _TransformGroup:
+    """同じ手順の組み合わせを受ける線・円弧のまとまりと、そこまでに合成した行列"""
+    __slots__ = ('lines', 'block', 'circles', 'fields', 'center', 'angle')
+
+    def __init__(self):
+        self.lines = []                 # [(番号, JwcLine)]（NumPy が無いとき）
+        self.block = None               # _line_block の (idx, P)（NumPy のとき）
+        self.circles = []               # [(番号, JwcCircle)]
+        self.fields = None              # circles と同じ並びの _arc_fields の配列（NumPy のとき）
+        self.center = _AFFINE_IDENTITY  # 線の端点・円弧の中心に掛ける行列
+        self.angle = _AFFINE_IDENTITY   # 円弧の半径・角度に掛ける行列（arc_flip は中心を動かさないので別に持つ）
+
+    def bbox(self, np):
+        """今の行列を掛けた後のバウンディングボックス（_calc_bbox と同じく円は中心±半径）。図形が無ければNone"""
+        (a, b, c), (d, e, f) = self.center[0], self.center[1]
+        moved = self.center != _AFFINE_IDENTITY
+        amap = _affine_arc_map(self.angle)
+        scale = amap[0] if amap is not None else 1.0
+        xs, ys = [], []
+        if np is not None:
+            if self.block is not None and len(self.block[1]):
+                P = self.block[1]
+                X, Y = P[:, 0::2], P[:, 1::2]
+                if moved:
+                    X, Y = a * P[:, 0::2] + b * P[:, 1::2] + c, d * P[:, 0::2] + e * P[:, 1::2] + f
+                xs += [X.min(), X.max()]
+                ys += [Y.min(), Y.max()]
+            if self.fields is not None and len(self.fields):
+                F = self.fields[~np.isnan(self.fields[:, :3]).any(axis=1)]
+                if len(F):
+                    X, Y, R = F[:, 0], F[:, 1], F[:, 2] * scale
+                    if moved:
+                        X, Y = a * F[:, 0] + b * F[:, 1] + c, d * F[:, 0] + e * F[:, 1] + f
+                    xs += [(X - R).min(), (X + R).max()]
+                    ys += [(Y - R).min(), (Y + R).max()]
+            return (float(min(xs)), float(min(ys)), float(max(xs)), float(max(ys))) if xs else None
+        for _, l in self.lines:
+            for x, y in ((l.x1, l.y1), (l.x2, l.y2)):
+                if moved:
+                    x, y = a * x + b * y + c, d * x + e * y + f
+                xs.append(x)
+                ys.append(y)
+        for _, ci in self.circles:
+            if None in (ci.cx, ci.cy, ci.r):
+                continue
+            x, y, r = ci.cx, ci.cy, ci.r * scale
+            if moved:
+                x, y = a * ci.cx + b * ci.cy + c, d * ci.cx + e * ci.cy + f
+            xs += [x - r, x + r]
+            ys += [y - r, y + r]
+        return (min(xs), min(ys), max(xs), max(ys)) if xs else None
+
+
+def _transform_groups(elements, steps, store, np):
+    """
+    全手順の範囲の和集合を、手順との関わり方（ビット列）ごとの _TransformGroup に分ける。
+    手順 s の範囲に入るものはビット 2s、変換されるものはビット 2s+1 が立つ。
+    要素の走査・座標の取り出しはここで1度だけ行う。Returns: {ビット列: _TransformGroup}
+    """
+    if store is not None:
+        n_lines, n_circles = store.count(JWC_LINE), store.count(JWC_CIRCLE)
+        pairs = None
+        line_of = lambda i: elements[store.line_slots[i]]
+        circle_of = lambda i: elements[store.circle_slots[i]]
+    else:
+        pairs = _geometry_pairs(elements)
+        n_lines, n_circles = len(pairs[0]), len(pairs[1])
+        line_of = lambda i: pairs[0][i][1]
+        circle_of = lambda i: pairs[1][i][1]
+    ids = [_step_ids(step, n_lines, n_circles, store, pairs) for step in steps]
+    line_code = _step_membership(np, n_lines, [l for sl, _, tl, _ in ids for l in (sl, tl)])
+    circle_code = _step_membership(np, n_circles, [c for _, sc, _, tc in ids for c in (sc, tc)])
+
+    groups = {}
+    if np is not None:
+        sel = np.flatnonzero(line_code)
+        if store is not None:
+            block = _line_block(np, store=store, ids=sel)
+        else:
+            block = _line_block(np, [(i, line_of(i)) for i in sel.tolist()])
+        codes = line_code[sel]
+        for code in np.unique(codes).tolist():
+            rows = codes == code
+            groups.setdefault(code, _TransformGroup()).block = (block[0][rows], block[1][rows])
+        csel = np.flatnonzero(circle_code)
+        circles = [(i, circle_of(i)) for i in csel.tolist()]
+        fields = _arc_fields(np, circles, store, csel)
+        codes = circle_code[csel]
+        for code in np.unique(codes).tolist():
+            rows = np.flatnonzero(codes == code)
+            g = groups.setdefault(code, _TransformGroup())
+            g.circles = [circles[k] for k in rows.tolist()]
+            g.fields = fields[rows]
+        return groups
+    for i, code in enumerate(line_code):
+        if code:
+            groups.setdefault(code, _TransformGroup()).lines.append((i, line_of(i)))
+    for i, code in enumerate(circle_code):
+        if code:
+            groups.setdefault(code, _TransformGroup()).circles.append((i, circle_of(i)))
+    return groups
+
+
+def apply_transform(elements, transform, store=None):
     """
     transform辞書に従って要素に座標変換を適用し、
-    (modified_lines_map, modified_circles_map) を返す。
+    (modified_lines_map, modified_circles_map) を返す（値が変わった線・円弧だけ）。
 
+    transform: 下記の辞書1つ、または辞書のリスト（先頭から順に適用。最大 MAX_TRANSFORM_STEPS）
     transform keys:
       "type":   "mirror_x" | "mirror_y" | "rotate" | "arc_flip_x" | "arc_flip_y"
       "target": "all"(デフォルト) | "circles_only" | "lines_only"
+      "filter": {"lg", "ly", "lc", "lt", "lw", "bbox": [xmin, ymin, xmax, ymax], "near": [x, y, r]}
+      "circle_indices": [int, ...]  対象にする円弧の番号
+      "door_indices": [int, ...]    対象にするドア（detect_doors の番号）
       "axis_x": float  (mirror_x用)
       "axis_y": float  (mirror_y用)
       "angle":  float  (rotate用、度)
       "cx": float, "cy": float  (rotate中心)
+    store: elements を作った JwcElementStore。渡すと filter を索引で解決する
 
     type説明:
       mirror_x    : x=axis_x 軸で全要素（or target指定）を左右反転
       mirror_y    : y=axis_y 軸で全要素（or target指定）を上下反転
-      rotate      : 指定中心を軸に回転
+      rotate      : 指定中心を軸に回転（円弧は中心を回し、角度も同じだけ回す）
       arc_flip_x  : 円弧の中心位置はそのままで角度だけ左右反転（ドア勝手変更に最適）
       arc_flip_y  : 円弧の中心位置はそのままで角度だけ上下反転
     """
-    t      = transform.get("type", "")
-    target = transform.get("target", "all")  # "all" | "circles_only" | "lines_only"
-    # circle_indices: 変換対象の円弧インデックスリスト。Noneなら全円弧対象
-    circle_indices = transform.get("circle_indices", None)
-    if circle_indices is not None:
-        circle_indices = set(int(i) for i in circle_indices)
-
-    line_idx   = 0
-    circle_idx = 0
-    mod_lines   = {}
-    mod_circles = {}
-
-    # バウンディングボックスから自動中心を計算
-    xmin, ymin, xmax, ymax = _calc_bbox(elements)
-    auto_cx = (xmin + xmax) / 2
-    auto_cy = (ymin + ymax) / 2
-
-    axis_x = transform.get("axis_x", auto_cx)
-    axis_y = transform.get("axis_y", auto_cy)
-    angle  = transform.get("angle",  0.0)
-    rot_cx = transform.get("cx",    auto_cx)
-    rot_cy = transform.get("cy",    auto_cy)
-
-    # arc_flip系はtargetに関係なく円弧のみ変換
-    arc_flip_mode = t in ("arc_flip_x", "arc_flip_y")
+    steps = list(transform) if isinstance(transform, (list, tuple)) else [transform]
+    np = _import_numpy()
+    groups = _transform_groups(elements, steps, store, np)
 
-    for elem in elements:
-        if elem['type'] == 'line':
-            x1,y1,x2,y2 = elem['x1'],elem['y1'],elem['x2'],elem['y2']
-            # arc_flip系 or circles_only の場合は線を変換しない
-            if not arc_flip_mode and target != "circles_only":
-                if t == "mirror_x":
-                    x1,y1,x2,y2 = _mirror_x_line(x1,y1,x2,y2, axis_x)
-                elif t == "mirror_y":
-                    x1,y1,x2,y2 = _mirror_y_line(x1,y1,x2,y2, axis_y)
-                elif t == "rotate":
-                    rad = math.radians(angle)
-                    cos_a, sin_a = math.cos(rad), math.sin(rad)
-                    def _rot(px, py, cx=rot_cx, cy=rot_cy, ca=cos_a, sa=sin_a):
-                        dx, dy = px - cx, py - cy
-                        return cx + dx*ca - dy*sa, cy + dx*sa + dy*ca
-                    x1,y1 = _rot(x1,y1)
-                    x2,y2 = _rot(x2,y2)
-            mod_lines[line_idx] = {'x1':x1,'y1':y1,'x2':x2,'y2':y2}
-            line_idx += 1
-        elif elem['type'] == 'circle':
-            parts = elem.get('parts', [])
-            new_raw = None
-
-            # circle_indicesが指定されていて、このインデックスが含まれていなければスキップ
-            if circle_indices is not None and circle_idx not in circle_indices:
-                new_raw = elem['raw']  # 変換しない
-            elif arc_flip_mode:
-                # 円弧の中心・半径はそのまま、角度だけ反転
-                if t == "arc_flip_x":
-                    new_raw = _flip_arc_angles_x(parts)
-                else:
-                    new_raw = _flip_arc_angles_y(parts)
-            elif target != "lines_only":
-                # 通常の座標変換
-                if t == "mirror_x":
-                    new_raw = _mirror_x_circle(parts, axis_x)
-                elif t == "mirror_y":
-                    new_raw = _mirror_y_circle(parts, axis_y)
-
-            if new_raw is None:
-                new_raw = elem['raw']  # 変換不可 or 対象外は原データ維持
-            mod_circles[circle_idx] = new_raw
-            circle_idx += 1
-
-    return mod_lines, mod_circles
+    for s, step in enumerate(steps):
+        members = [g for code, g in groups.items() if code >> (2 * s + 1) & 1]
+        if not members:
+            continue
+        t = step.get("type", "")
+        if t in ("arc_flip_x", "arc_flip_y"):
+            # 円弧の中心・半径はそのまま、角度だけ反転（ドア勝手変更）
+            flip = _affine_mirror_x(0.0) if t == "arc_flip_x" else _affine_mirror_y(0.0)
+            for g in members:
+                g.angle = _affine_mul(flip, g.angle)
+            continue
 
+        # 軸・中心の指定が無ければ、この手順の対象（それまでの手順を適用した後）の範囲の中心を使う
+        auto_cx = auto_cy = 0.0
+        if (t == "mirror_x" and "axis_x" not in step) or (t == "mirror_y" and "axis_y" not in step) \
+                or (t == "rotate" and ("cx" not in step or "cy" not in step)):
+            boxes = [b for b in (g.bbox(np) for code, g in groups.items() if code >> (2 * s) & 1)
+                     if b is not None]
+            if boxes:
+                xmin, ymin = min(b[0] for b in boxes), min(b[1] for b in boxes)
+                xmax, ymax = max(b[2] for b in boxes), max(b[3] for b in boxes)
+                auto_cx, auto_cy = (xmin + xmax) / 2, (ymin + ymax) / 2
+
+        if t == "mirror_x":
+            m = _affine_mirror_x(step.get("axis_x", auto_cx))
+        elif t == "mirror_y":
+            m = _affine_mirror_y(step.get("axis_y", auto_cy))
+        elif t == "rotate":
+            m = _affine_rotate(step.get("angle", 0.0), step.get("cx", auto_cx), step.get("cy", auto_cy))
+        else:
+            continue
+        for g in members:
+            g.center = _affine_mul(m, g.center)
+            g.angle = _affine_mul(m, g.angle)
+
+    from array import array
+    line_ids, coords = [], array('d')
+    mod_circles = JwcCircleEdits()
+    for g in groups.values():
+        if g.center == _AFFINE_IDENTITY and g.angle == _AFFINE_IDENTITY:
+            continue
+        ids, xy = _affine_line_edits(g.center, g.lines, g.block)
+        line_ids += ids
+        coords += xy
+        mod_circles.merge(_affine_arcs(g.center, g.circles, g.fields, g.angle))
+    return JwcLineEdits(line_ids, coords), mod_circles
 
 
 ALLOWED_TRANSFORM_TYPES = {"mirror_x", "mirror_y", "rotate", "arc_flip_x", "arc_flip_y"}
+MAX_TRANSFORM_STEPS = 16
 
 
 def normalize_ai_transform(transform):
     """
     AIが返したtransform辞書を5機能向けに正規化する。
+    辞書のリスト（手順）なら各手順を正規化したリストを返す（1つでも不正なら全体をエラーにする）。
     Returns: (normalized_transform_or_None, error_message_or_None)
     """
+    if isinstance(transform, list):
+        if not transform:
+            return None, "手順のリストが空です"
+        if len(transform) > MAX_TRANSFORM_STEPS:
+            return None, f"手順は{MAX_TRANSFORM_STEPS}個までにしてください"
+        steps = []
+        for n, step in enumerate(transform, 1):
+            if not isinstance(step, dict):
+                return None, f"手順{n}: transformが辞書ではありません"
+            normalized, err = normalize_ai_transform(step)
+            if err:
+                return None, f"手順{n}: {err}"
+            steps.append(normalized)
+        return steps, None
+
     if not isinstance(transform, dict):
         return None, "transformが辞書ではありません"
 
@@ -419,6 +1374,42 @@ def normalize_ai_transform(transform):
         target = "all"
     normalized["target"] = target
 
+    raw_filter = transform.get("filter", None)
+    if raw_filter is not None:
+        if not isinstance(raw_filter, dict):
+            return None, "filter は {\"lg\": 0, \"ly\": 3} のような辞書で指定してください"
+        unknown = [k for k in raw_filter if k not in JWC_ATTR_CODES + ("bbox", "near")]
+        if unknown:
+            return None, f"filter に未対応の属性があります: {', '.join(map(str, unknown))}"
+        flt = {}
+        for key, size in (("bbox", 4), ("near", 3)):
+            v = raw_filter.get(key)
+            if v is None:
+                continue
+            try:
+                values = [float(x) for x in v]
+            except Exception:
+                values = []
+            if len(values) != size or not all(math.isfinite(x) for x in values):
+                return None, f"filter の {key} は数値{size}個の配列で指定してください"
+            if key == "near" and values[2] < 0:
+                return None, "filter の near の半径に負の値は指定できません"
+            flt[key] = values
+        for key in JWC_ATTR_CODES:
+            v = raw_filter.get(key)
+            if v is None:
+                continue
+            values = v if isinstance(v, list) else [v]
+            try:
+                values = sorted({int(x) for x in values})
+            except Exception:
+                return None, f"filter の {key} は整数（または整数の配列）で指定してください"
+            if not values or any(x < 0 for x in values):
+                return None, f"filter の {key} に空の配列・負の値は指定できません"
+            flt[key] = values[0] if len(values) == 1 else values
+        if flt:
+            normalized["filter"] = flt
+
     def to_float(v, name):
         if v is None:
             return None, None
@@ -452,37 +1443,43 @@ def normalize_ai_transform(transform):
         if cy is not None:
             normalized["cy"] = cy
 
-    if t in ("arc_flip_x", "arc_flip_y"):
-        raw_indices = transform.get("circle_indices", None)
-        if raw_indices is not None:
-            if not isinstance(raw_indices, list):
-                return None, "circle_indices は配列で指定してください"
-            try:
-                idxs = sorted({int(v) for v in raw_indices})
-            except Exception:
-                return None, "circle_indices は整数配列で指定してください"
-            if any(i < 0 for i in idxs):
-                return None, "circle_indices に負の値は指定できません"
-            normalized["circle_indices"] = idxs
+    # circle_indices / door_indices はどの type でも、対象の円弧（ドア）をその番号だけにする
+    for key in ("circle_indices", "door_indices"):
+        raw_indices = transform.get(key, None)
+        if raw_indices is None:
+            continue
+        if not isinstance(raw_indices, list):
+            return None, f"{key} は配列で指定してください"
+        try:
+            idxs = sorted({int(v) for v in raw_indices})
+        except Exception:
+            return None, f"{key} は整数配列で指定してください"
+        if any(i < 0 for i in idxs):
+            return None, f"{key} に負の値は指定できません"
+        normalized[key] = idxs
 
     return normalized, None
 
 def parse_ai_transform(ai_response_text):
     """
     AIのレスポンスから ```json ... ``` ブロックを探し、
-    transform辞書を抽出して返す。見つからなければNone。
+    transform辞書（手順の場合は辞書のリスト）を抽出して返す。見つからなければNone。
+    手順は [{...}, {...}] のほか {"steps": [{...}, ...]} でもよい。
     """
     import re
     pattern = r'```json\s*([\s\S]*?)\s*```'
     match = re.search(pattern, ai_response_text)
     if not match:
-        # フォールバック: {...} だけでも試す
-        match = re.search(r'\{[\s\S]*?"type"[\s\S]*?\}', ai_response_text)
+        # フォールバック: [{...}, ...] や {...} だけでも試す
+        match = (re.search(r'\[\s*\{[\s\S]*?"type"[\s\S]*\}\s*\]', ai_response_text)
+                 or re.search(r'\{[\s\S]*?"type"[\s\S]*?\}', ai_response_text))
         if not match:
             return None
     try:
         data = json.loads(match.group(1) if '```' in ai_response_text else match.group(0))
-        if "type" in data:
+        if isinstance(data, dict) and isinstance(data.get("steps"), list):
+            data = data["steps"]
+        if isinstance(data, list) or "type" in data:
             normalized, _ = normalize_ai_transform(data)
             return normalized
     except Exception:
@@ -490,24 +1487,1341 @@ def parse_ai_transform(ai_response_text):
     return None
 
 
-# ========== JW_CAD 画面キャプチャ ==========
+# ========== 変換の取り消し・やり直し（ジャーナル） ==========
 
-def _find_jwcad_hwnd():
-    """JW_CADのウィンドウハンドルを探す（最小化・非表示でも検出）"""
-    import win32gui
-    # JW_CADのウィンドウタイトルパターン
-    # 実際のタイトル例: "建築一般図 - jw_win"、"Jw_cad"、"JW_CAD" など
-    JW_KEYWORDS = ('jw_win', 'jw_cad', 'jw cad', 'jww')
-    candidates = []
-    def _cb(hwnd, _):
-        title = win32gui.GetWindowText(hwnd)
-        tl = title.lower()
-        if any(kw in tl for kw in JW_KEYWORDS):
-            candidates.append((hwnd, title))
-    win32gui.EnumWindows(_cb, None)
-    if not candidates:
-        return None
-    # 表示中のものを優先、なければ最初のものを返す
+JOURNAL_MAX_BYTES = 64 * 1024 * 1024
+_JOURNAL_BASE_SUFFIX = ".jwai_base"
+
+
+class _JournalEntry:
+    """版1つ分: その版で足した手順と、前の版から変わった線・円弧"""
+    __slots__ = ('steps', 'line_ids', 'line_before', 'line_after',
+                 'circle_ids', 'circle_before', 'circle_after', 'nbytes')
+
+    def __init__(self, steps):
+        from array import array
+        self.steps = steps
+        self.line_ids = array('q')
+        self.line_before = array('d')
+        self.line_after = array('d')
+        self.circle_ids = []
+        self.circle_before = []
+        self.circle_after = []
+        self.nbytes = 0
+
+    @property
+    def n_lines(self):
+        return len(self.line_ids)
+
+    @property
+    def n_circles(self):
+        return len(self.circle_ids)
+
+
+class TransformJournal:
+    """
+    読み込んだ JWC_TEMP.TXT に対する変換の履歴（取り消し・やり直し）。
+      entry, err = journal.apply(transform)
+      ok, err = journal.write()
+      journal.undo() / journal.redo() / journal.close()
+    """
+
+    def __init__(self, store, elements=None, max_bytes=JOURNAL_MAX_BYTES):
+        self.store = store
+        self.elements = elements if elements is not None else store.to_elements()
+        self.max_bytes = max_bytes
+        self._entries = []       # 残っている版（古い順）
+        self._cursor = 0         # _entries のうち適用済みの数
+        self._floor = 0          # 捨てた古い版の数（revision の下限）
+        self._floor_steps = []   # 捨てた版の手順（新しい版を作る時に必要）
+        self._lines = {}         # 今の版で元と違う線 {番号: (x1, y1, x2, y2)}
+        self._circles = {}       # 今の版で元と違う円弧 {番号: 生行}
+        self._base_path = None   # 元ファイルを残した別名
+        self._filepath = None
+
+    @property
+    def revision(self):
+        return self._floor + self._cursor
+
+    @property
+    def can_undo(self):
+        return self._cursor > 0
+
+    @property
+    def can_redo(self):
+        return self._cursor < len(self._entries)
+
+    @property
+    def nbytes(self):
+        """残している版の差分の大きさ（バイト、おおよそ）"""
+        return sum(e.nbytes for e in self._entries)
+
+    def steps(self):
+        """今の版を作る手順（元の図面に先頭から順に当てる）"""
+        steps = list(self._floor_steps)
+        for e in self._entries[:self._cursor]:
+            steps += e.steps
+        return steps
+
+    def modified_maps(self):
+        """今の版の (modified_lines_map, modified_circles_map)。write_result_to_jwc にそのまま渡せる"""
+        from array import array
+        from itertools import chain
+        return (JwcLineEdits(list(self._lines), array('d', chain.from_iterable(self._lines.values()))),
+                dict(self._circles))
+
+    def _base_circle(self, i):
+        store = self.store
+        return store.raw_lines[store.rows[store.circle_slots[i]]]
+
+    def apply(self, transform):
+        """
+        今の版に transform（辞書 or 手順のリスト。normalize_ai_transform 済み）を足した版を作って今の版にする。
+        今より先の版（やり直し用）は捨てる。
+        Returns: (_JournalEntry, error_or_None)  entry.n_lines / n_circles はこの版で変わった線・円弧の数
+        """
+        new_steps = list(transform) if isinstance(transform, (list, tuple)) else [transform]
+        steps = self.steps() + new_steps
+        if len(steps) > MAX_TRANSFORM_STEPS:
+            return None, f"変換は合計{MAX_TRANSFORM_STEPS}手順までしか重ねられません（取り消してから反映してください）"
+        try:
+            mod_lines, mod_circles = apply_transform(self.elements, steps, self.store)
+        except Exception as e:
+            return None, str(e)
+
+        coords = mod_lines._coords
+        lines = {i: tuple(coords[4 * p:4 * p + 4]) for i, p in mod_lines._pos.items()}
+        entry = _JournalEntry(new_steps)
+        store = self.store
+        for i in sorted(lines.keys() | self._lines.keys()):
+            before = self._lines.get(i) or store.line(i)
+            after = lines.get(i) or store.line(i)
+            if before != after:
+                entry.line_ids.append(i)
+                entry.line_before.extend(before)
+                entry.line_after.extend(after)
+        for i in sorted(mod_circles.keys() | self._circles.keys()):
+            before = self._circles.get(i) or self._base_circle(i)
+            after = mod_circles.get(i) or self._base_circle(i)
+            if before != after:
+                entry.circle_ids.append(i)
+                entry.circle_before.append(before)
+                entry.circle_after.append(after)
+        entry.nbytes = (entry.line_ids.itemsize * len(entry.line_ids)
+                        + entry.line_before.itemsize * 2 * len(entry.line_before)
+                        + sum(len(t) + 8 for t in entry.circle_before)
+                        + sum(len(t) + 8 for t in entry.circle_after))
+
+        del self._entries[self._cursor:]
+        self._entries.append(entry)
+        self._cursor += 1
+        self._lines = lines
+        self._circles = dict(mod_circles)
+        self._evict()
+        return entry, None
+
+    def _evict(self):
+        """差分の合計が max_bytes を超えていたら、古い版から捨てる"""
+        total = self.nbytes
+        while total > self.max_bytes and self._cursor > 0:
+            e = self._entries.pop(0)
+            self._floor_steps += e.steps
+            self._floor += 1
+            self._cursor -= 1
+            total -= e.nbytes
+
+    def _replay(self, entry, forward):
+        """entry の差分を今の状態に当てる（forward=False なら前の値に戻す）"""
+        store = self.store
+        values = entry.line_after if forward else entry.line_before
+        for k, i in enumerate(entry.line_ids):
+            v = tuple(values[4 * k:4 * k + 4])
+            if v == store.line(i):
+                self._lines.pop(i, None)
+            else:
+                self._lines[i] = v
+        texts = entry.circle_after if forward else entry.circle_before
+        for i, text in zip(entry.circle_ids, texts):
+            if text == self._base_circle(i):
+                self._circles.pop(i, None)
+            else:
+                self._circles[i] = text
+
+    def undo(self):
+        """今の版を1つ戻す。Returns: 戻した版の _JournalEntry（戻せなければNone）"""
+        if not self.can_undo:
+            return None
+        self._cursor -= 1
+        entry = self._entries[self._cursor]
+        self._replay(entry, forward=False)
+        return entry
+
+    def redo(self):
+        """取り消した版を1つ進める。Returns: 進めた版の _JournalEntry（進められなければNone）"""
+        if not self.can_redo:
+            return None
+        entry = self._entries[self._cursor]
+        self._cursor += 1
+        self._replay(entry, forward=True)
+        return entry
+
+    def _keep_base(self, filepath):
+        """読み込んだ時のままの filepath をハードリンク（できなければコピー）で残す"""
+        import shutil
+        store = self.store
+        if self._base_path is not None or store.source is None or store.offsets is None:
+            return
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return
+        if store.source != (os.path.abspath(filepath), st.st_size, st.st_mtime_ns):
+            return
+        base = filepath + _JOURNAL_BASE_SUFFIX
+        try:
+            if os.path.exists(base):
+                os.remove(base)
+            try:
+                os.link(filepath, base)
+            except (OSError, AttributeError):
+                shutil.copy2(filepath, base)
+            bst = os.stat(base)
+            if (bst.st_size, bst.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+                self._base_path = base
+                self._filepath = filepath
+            else:
+                os.remove(base)
+        except OSError:
+            pass
+
+    def write(self, filepath=None, stats=None):
+        """
+        今の版を filepath（既定は JWC_TEMP）に書き戻す。元ファイルを残してあれば、そこからの差分書き戻しで
+        変わった線・円弧と hq の行だけを書く。版0 は元ファイル（hq 付き）をそのまま戻す。
+        Returns: (success, error_or_None)
+        """
+        import shutil
+        if filepath is None:
+            filepath = JWC_TEMP
+        self._keep_base(filepath)
+        source = self._base_path if self._filepath == filepath else None
+        if self.revision == 0 and source is not None:
+            tmp = filepath + ".tmp"
+            try:
+                shutil.copyfile(source, tmp)
+                os.replace(tmp, filepath)
+            except Exception as e:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                return False, str(e)
+            if stats is not None:
+                stats["mode"] = "base"
+            return True, None
+        mod_lines, mod_circles = self.modified_maps()
+        return write_result_to_jwc(self.elements, mod_lines, filepath, mod_circles,
+                                   stats=stats, store=self.store, source_path=source)
+
+    def close(self):
+        """残した元ファイルを消す（外部変形を JW_CAD に返した後など）"""
+        if self._base_path is not None:
+            try:
+                os.remove(self._base_path)
+            except OSError:
+                pass
+            self._base_path = None
+            self._filepath = None
+
+
+# ========== 空間索引（一様グリッド） ==========
+
+class SpatialGrid:
+    """
+    線分・円弧の空間索引。問い合わせ結果は (種類, 番号) のリスト（種類は "line" / "arc"）。
+      query_bbox(xmin, ymin, xmax, ymax) / query_radius(x, y, r) / nearest(x, y, k=1, max_dist=None)
+    """
+    MAX_SPAN = 256      # これより多くのマスに掛かる図形（円弧・区切りの多い線分）はマスに入れず、常に候補として調べる
+    MAX_CELLS = 4096    # 図形全体の範囲の縦横の長い方を、これより細かいマスには分けない
+
+    def __init__(self, lines, arcs):
+        from array import array
+        self.lines = array('d', lines)          # x1, y1, x2, y2 を線の順に
+        self.arcs = array('d', arcs)            # cx, cy, r, start_a, end_a を円弧の順に
+        self.n_lines = len(self.lines) // 4
+        self.n_arcs = len(self.arcs) // 5
+        self.bboxes = array('d')                # 図形ごとの外接矩形（線→円弧の順）
+        self.big = []                           # マスに入れなかった図形番号
+        self._cell_pos = {}
+        self._starts = array('q', [0])
+        self._ids = array('q')
+        self.cell = 1.0
+        self.origin = (0.0, 0.0)
+        self.shape = (0, 0)
+        np = _import_numpy()
+        if np is not None:
+            self._build_numpy(np)
+        else:
+            self._build_python()
+
+    # ----- 構築 -----
+
+    @classmethod
+    def from_store(cls, store):
+        """JwcElementStore の線・円弧から作る"""
+        return cls(store.line_coords, store.circle_fields)
+
+    @classmethod
+    def from_jww(cls, info):
+        """parse_jww_full の結果から作る（列指向の配列があればそれを使う）"""
+        return cls(*_jww_flat_geometry(info))
+
+    @classmethod
+    def _choose_cell(cls, median, width, height, n):
+        """
+        マスの大きさ: 1マスに2件程度になる大きさ（図形が一直線に並んで面積が0なら、その長さを件数で割る）。
+        ただし長い線分の区切りが増えすぎないよう、図形の大きさの中央値の1/8 と、範囲の長い方の 1/MAX_CELLS
+        より小さくはしない
+        """
+        if not n:
+            density = 0.0
+        elif width > 0 and height > 0:
+            density = math.sqrt(width * height / n) * 1.5
+        else:
+            density = max(width, height) / n * 1.5
+        return max(density, median / 8, max(width, height) / cls.MAX_CELLS, 1e-6)
+
+    def _setup_grid(self, minx, miny, maxx, maxy, cell):
+        self.cell = cell
+        self.origin = (minx, miny)
+        self.shape = (int((maxx - minx) / cell) + 1, int((maxy - miny) / cell) + 1)
+
+    def _build_numpy(self, np):
+        L = np.frombuffer(self.lines, dtype=np.float64).reshape(-1, 4)
+        A = np.frombuffer(self.arcs, dtype=np.float64).reshape(-1, 5)
+        arc_box = _arc_bboxes_numpy(np, A)
+        line_box = np.stack([np.minimum(L[:, 0], L[:, 2]), np.minimum(L[:, 1], L[:, 3]),
+                             np.maximum(L[:, 0], L[:, 2]), np.maximum(L[:, 1], L[:, 3])], axis=1)
+        boxes = np.concatenate([line_box, arc_box]) if len(A) else line_box
+        self.bboxes = _doubles_array(boxes)
+        with np.errstate(invalid='ignore'):
+            ok = np.isfinite(boxes).all(axis=1)
+        if not ok.any():
+            return
+        good = boxes[ok]
+        minx, miny = good[:, 0].min(), good[:, 1].min()
+        maxx, maxy = good[:, 2].max(), good[:, 3].max()
+        ext = np.maximum(good[:, 2] - good[:, 0], good[:, 3] - good[:, 1])
+        self._setup_grid(minx, miny, maxx, maxy,
+                         self._choose_cell(float(np.median(ext)), maxx - minx, maxy - miny, len(good)))
+        cell = self.cell
+
+        keys, ids = [], []
+        # 線分: マス以下の長さに区切り、区切りごとの外接矩形が掛かるマス（最大2×2）に登録する
+        # （区切りが MAX_SPAN を超える線分は big）
+        n = len(L)
+        line_ok = ok[:n]
+        if line_ok.any():
+            seg = np.nonzero(line_ok)[0]
+            Ls = L[seg]
+            k = (np.maximum(np.abs(Ls[:, 2] - Ls[:, 0]), np.abs(Ls[:, 3] - Ls[:, 1])) // cell).astype(np.int64) + 1
+            small = k <= self.MAX_SPAN
+            self.big = seg[~small].tolist()
+            seg, k = seg[small], k[small]
+            owner = np.repeat(seg, k)
+            first = np.repeat(np.cumsum(k) - k, k)
+            j = np.arange(len(owner)) - first
+            kk = np.repeat(k, k).astype(np.float64)
+            P = L[owner]
+            t0, t1 = j / kk, (j + 1) / kk
+            xa, ya = P[:, 0] + (P[:, 2] - P[:, 0]) * t0, P[:, 1] + (P[:, 3] - P[:, 1]) * t0
+            xb, yb = P[:, 0] + (P[:, 2] - P[:, 0]) * t1, P[:, 1] + (P[:, 3] - P[:, 1]) * t1
+            self._emit_numpy(np, keys, ids, owner,
+                             np.minimum(xa, xb), np.minimum(ya, yb), np.maximum(xa, xb), np.maximum(ya, yb))
+        # 円弧: 外接矩形が掛かるマス（多すぎるものは big）
+        arc_ok = ok[n:]
+        if arc_ok.any():
+            which = np.nonzero(arc_ok)[0]
+            B = arc_box[which]
+            ix0, iy0, ix1, iy1 = self._cell_range_numpy(np, B[:, 0], B[:, 1], B[:, 2], B[:, 3])
+            h = iy1 - iy0 + 1
+            span = (ix1 - ix0 + 1) * h
+            small = span <= self.MAX_SPAN
+            self.big += (which[~small] + n).tolist()
+            span, h, ix0, iy0 = span[small], h[small], ix0[small], iy0[small]
+            first = np.repeat(np.cumsum(span) - span, span)
+            j = np.arange(int(span.sum())) - first
+            hh = np.repeat(h, span)
+            keys.append((np.repeat(ix0, span) + j // hh) * self.shape[1] + np.repeat(iy0, span) + j % hh)
+            ids.append(np.repeat(which[small] + n, span))
+        self._finish_numpy(np, keys, ids)
+
+    def _cell_range_numpy(self, np, x0, y0, x1, y1):
+        ox, oy = self.origin
+        c = self.cell
+        nx, ny = self.shape
+        f = lambda v, o, hi: np.clip(((v - o) // c).astype(np.int64), 0, hi - 1)
+        return f(x0, ox, nx), f(y0, oy, ny), f(x1, ox, nx), f(y1, oy, ny)
+
+    def _emit_numpy(self, np, keys, ids, owner, x0, y0, x1, y1):
+        ny = self.shape[1]
+        ix0, iy0, ix1, iy1 = self._cell_range_numpy(np, x0, y0, x1, y1)
+        for dx, dy in ((0, 0), (1, 0), (0, 1), (1, 1)):
+            m = (ix0 + dx <= ix1) & (iy0 + dy <= iy1)
+            keys.append((ix0[m] + dx) * ny + (iy0[m] + dy))
+            ids.append(owner[m])
+
+    def _finish_numpy(self, np, keys, ids):
+        from array import array
+        if not keys:
+            return
+        k = np.concatenate(keys).astype(np.int64)
+        i = np.concatenate(ids).astype(np.int64)
+        total = self.n_lines + self.n_arcs
+        pair = np.sort(k * total + i)               # マス順・図形順に並べ、重複を除く
+        if len(pair):
+            pair = pair[np.concatenate(([True], pair[1:] != pair[:-1]))]
+        k, i = pair // total, pair % total
+        starts = np.flatnonzero(np.concatenate(([True], k[1:] != k[:-1]))) if len(k) else k
+        ukeys = k[starts]
+        self._cell_pos = dict(zip(ukeys.tolist(), range(len(ukeys))))
+        self._starts = array('q', starts.tolist() + [len(i)])
+        self._ids = array('q', i.tobytes())
+
+    def _build_python(self):
+        from array import array
+        boxes = []
+        for j in range(self.n_lines):
+            x1, y1, x2, y2 = self.lines[4 * j:4 * j + 4]
+            boxes.append((min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)))
+        for j in range(self.n_arcs):
+            boxes.append(_arc_bbox(*self.arcs[5 * j:5 * j + 5]))
+        for b in boxes:
+            self.bboxes.extend(b)
+        good = [b for b in boxes if all(math.isfinite(v) for v in b)]
+        if not good:
+            return
+        minx, miny = min(b[0] for b in good), min(b[1] for b in good)
+        maxx, maxy = max(b[2] for b in good), max(b[3] for b in good)
+        ext = sorted(max(b[2] - b[0], b[3] - b[1]) for b in good)
+        self._setup_grid(minx, miny, maxx, maxy,
+                         self._choose_cell(ext[len(ext) // 2], maxx - minx, maxy - miny, len(good)))
+        cell, ny = self.cell, self.shape[1]
+
+        cells = {}
+        def add(w, x0, y0, x1, y1):
+            ix0, iy0, ix1, iy1 = self._cell_range(x0, y0, x1, y1)
+            for ix in range(ix0, ix1 + 1):
+                for iy in range(iy0, iy1 + 1):
+                    cells.setdefault(ix * ny + iy, set()).add(w)
+        for w, b in enumerate(boxes):
+            if not all(math.isfinite(v) for v in b):
+                continue
+            if w < self.n_lines:
+                x1, y1, x2, y2 = self.lines[4 * w:4 * w + 4]
+                k = int(max(abs(x2 - x1), abs(y2 - y1)) // cell) + 1
+                if k > self.MAX_SPAN:
+                    self.big.append(w)
+                    continue
+                for j in range(k):
+                    xa, ya = x1 + (x2 - x1) * j / k, y1 + (y2 - y1) * j / k
+                    xb, yb = x1 + (x2 - x1) * (j + 1) / k, y1 + (y2 - y1) * (j + 1) / k
+                    add(w, min(xa, xb), min(ya, yb), max(xa, xb), max(ya, yb))
+            else:
+                ix0, iy0, ix1, iy1 = self._cell_range(*b)
+                if (ix1 - ix0 + 1) * (iy1 - iy0 + 1) > self.MAX_SPAN:
+                    self.big.append(w)
+                else:
+                    add(w, *b)
+        starts = [0]
+        for pos, key in enumerate(sorted(cells)):
+            self._cell_pos[key] = pos
+            self._ids.extend(sorted(cells[key]))
+            starts.append(len(self._ids))
+        self._starts = array('q', starts)
+
+    # ----- 問い合わせ -----
+
+    def _cell_range(self, x0, y0, x1, y1):
+        ox, oy = self.origin
+        c = self.cell
+        nx, ny = self.shape
+        clip = lambda v, hi: 0 if v < 0 else hi - 1 if v >= hi else v
+        return (clip(int((x0 - ox) // c), nx), clip(int((y0 - oy) // c), ny),
+                clip(int((x1 - ox) // c), nx), clip(int((y1 - oy) // c), ny))
+
+    def _cell_ids(self, ix, iy):
+        pos = self._cell_pos.get(ix * self.shape[1] + iy)
+        if pos is None:
+            return ()
+        return self._ids[self._starts[pos]:self._starts[pos + 1]]
+
+    def _candidates(self, x0, y0, x1, y1):
+        """範囲に掛かるマスの図形番号（重複なし）"""
+        seen = set(self.big)
+        if not self.shape[0]:
+            return seen
+        ox, oy = self.origin
+        nx, ny = self.shape
+        if x1 < ox or y1 < oy or x0 > ox + nx * self.cell or y0 > oy + ny * self.cell:
+            return seen
+        ix0, iy0, ix1, iy1 = self._cell_range(x0, y0, x1, y1)
+        for ix in range(ix0, ix1 + 1):
+            for iy in range(iy0, iy1 + 1):
+                seen.update(self._cell_ids(ix, iy))
+        return seen
+
+    def _item(self, w):
+        return ("line", w) if w < self.n_lines else ("arc", w - self.n_lines)
+
+    def distance(self, w, x, y):
+        """点から図形 w（線→円弧の通し番号）までの距離"""
+        if w < self.n_lines:
+            return _segment_distance(x, y, *self.lines[4 * w:4 * w + 4])
+        w -= self.n_lines
+        return _arc_distance(x, y, *self.arcs[5 * w:5 * w + 5])
+
+    def query_bbox(self, xmin, ymin, xmax, ymax):
+        """範囲に掛かる図形 [(種類, 番号)]（番号順）"""
+        out = []
+        b = self.bboxes
+        for w in sorted(self._candidates(xmin, ymin, xmax, ymax)):
+            if b[4 * w] > xmax or b[4 * w + 2] < xmin or b[4 * w + 1] > ymax or b[4 * w + 3] < ymin:
+                continue
+            if w < self.n_lines and not _segment_hits_box(*self.lines[4 * w:4 * w + 4], xmin, ymin, xmax, ymax):
+                continue
+            out.append(self._item(w))
+        return out
+
+    def query_radius(self, x, y, r):
+        """点 (x, y) から距離 r 以内の図形 [(種類, 番号)]（番号順）"""
+        return [self._item(w) for w in sorted(self._candidates(x - r, y - r, x + r, y + r))
+                if self.distance(w, x, y) <= r]
+
+    def nearest(self, x, y, k=1, max_dist=None):
+        """
+        点 (x, y) に近い図形を近い順に k 個返す: [(距離, 種類, 番号)]。
+        自分のマスから1周ずつ外へ広げ、k 番目の距離より外側のマスしか残らなくなったら止める。
+        """
+        import heapq
+        best = []                                   # (-距離, 番号) の最大ヒープ
+        seen = set()
+        limit = math.inf if max_dist is None else max_dist
+
+        def consider(ws):
+            for w in ws:
+                if w in seen:
+                    continue
+                seen.add(w)
+                d = self.distance(w, x, y)
+                if d > limit or d != d:
+                    continue
+                if len(best) < k:
+                    heapq.heappush(best, (-d, w))
+                elif d < -best[0][0]:
+                    heapq.heapreplace(best, (-d, w))
+
+        consider(self.big)
+        nx, ny = self.shape
+        if nx:
+            ox, oy = self.origin
+            c = self.cell
+            px, py = int((x - ox) // c), int((y - oy) // c)
+            # 格子の外の点は、一番近いマスまでの距離から始める
+            far = max(abs(px - min(max(px, 0), nx - 1)), abs(py - min(max(py, 0), ny - 1)))
+            last = max(px, nx - 1 - px, py, ny - 1 - py, 0)
+            for ring in range(far, last + 1):
+                if (ring - 1) * c > limit:
+                    break
+                if len(best) == k and (ring - 1) * c >= -best[0][0]:
+                    break
+                for ix in range(max(px - ring, 0), min(px + ring, nx - 1) + 1):
+                    edge = ix in (px - ring, px + ring)
+                    ys = range(max(py - ring, 0), min(py + ring, ny - 1) + 1) if edge else \
+                        [v for v in (py - ring, py + ring) if 0 <= v < ny]
+                    for iy in ys:
+                        consider(self._cell_ids(ix, iy))
+        return [(-nd, *self._item(w)) for nd, w in sorted(best, reverse=True)]
+
+
+def _doubles_array(a):
+    """float64 の NumPy 配列を array('d') にする（平らに並べる）"""
+    from array import array
+    return array('d', a.astype('<f8').tobytes())
+
+
+def _arc_in_sweep(angle, sa, ea):
+    """角度 angle（度）が start_a → end_a（反時計回り）の範囲にあるか。角度が無ければ全円"""
+    if sa != sa or ea != ea:
+        return True
+    span = (ea - sa) % 360
+    return span == 0 or (angle - sa) % 360 <= span
+
+
+def _arc_bbox(cx, cy, r, sa, ea):
+    """円弧の外接矩形（端点と、範囲に入る 0/90/180/270° の点）"""
+    if sa != sa or ea != ea or (ea - sa) % 360 == 0:
+        return cx - r, cy - r, cx + r, cy + r
+    pts = [(cx + r * math.cos(math.radians(a)), cy + r * math.sin(math.radians(a))) for a in (sa, ea)]
+    pts += [(cx + r * dx, cy + r * dy) for a, dx, dy in ((0, 1, 0), (90, 0, 1), (180, -1, 0), (270, 0, -1))
+            if _arc_in_sweep(a, sa, ea)]
+    xs, ys = [p[0] for p in pts], [p[1] for p in pts]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _arc_bboxes_numpy(np, A):
+    """_arc_bbox を (M, 5) の配列にまとめて適用する"""
+    if not len(A):
+        return np.empty((0, 4))
+    cx, cy, r, sa, ea = A.T
+    with np.errstate(invalid='ignore'):
+        span = (ea - sa) % 360
+        full = ~np.isfinite(sa) | ~np.isfinite(ea) | (span == 0)
+        sx, sy = cx + r * np.cos(np.radians(sa)), cy + r * np.sin(np.radians(sa))
+        ex, ey = cx + r * np.cos(np.radians(ea)), cy + r * np.sin(np.radians(ea))
+        inside = lambda a: full | ((a - sa) % 360 <= span)
+        x0 = np.where(inside(180), cx - r, np.minimum(sx, ex))
+        x1 = np.where(inside(0), cx + r, np.maximum(sx, ex))
+        y0 = np.where(inside(270), cy - r, np.minimum(sy, ey))
+        y1 = np.where(inside(90), cy + r, np.maximum(sy, ey))
+    return np.stack([x0, y0, x1, y1], axis=1)
+
+
+def _segment_distance(px, py, x1, y1, x2, y2):
+    """点から線分までの距離"""
+    dx, dy = x2 - x1, y2 - y1
+    l2 = dx * dx + dy * dy
+    t = 0.0 if l2 == 0 else max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / l2))
+    return math.hypot(px - x1 - t * dx, py - y1 - t * dy)
+
+
+def _arc_distance(px, py, cx, cy, r, sa, ea):
+    """点から円弧までの距離（角度の範囲外なら近い方の端点まで）"""
+    d = math.hypot(px - cx, py - cy)
+    if d == 0:
+        return r
+    if _arc_in_sweep(math.degrees(math.atan2(py - cy, px - cx)), sa, ea):
+        return abs(d - r)
+    return min(math.hypot(px - cx - r * math.cos(math.radians(a)), py - cy - r * math.sin(math.radians(a)))
+               for a in (sa, ea))
+
+
+def _segment_hits_box(x1, y1, x2, y2, xmin, ymin, xmax, ymax):
+    """線分が矩形と交わるか（Liang-Barsky の切り取り）"""
+    t0, t1 = 0.0, 1.0
+    dx, dy = x2 - x1, y2 - y1
+    for p, q in ((-dx, x1 - xmin), (dx, xmax - x1), (-dy, y1 - ymin), (dy, ymax - y1)):
+        if p == 0:
+            if q < 0:
+                return False
+            continue
+        t = q / p
+        if p < 0:
+            if t > t1:
+                return False
+            t0 = max(t0, t)
+        else:
+            if t < t0:
+                return False
+            t1 = min(t1, t)
+    return True
+
+
+def _jww_flat_geometry(info):
+    """
+    parse_jww_full の結果の線・円弧を平たい座標列 (x1, y1, x2, y2 の列, cx, cy, r, start_a, end_a の列) にする。
+    列指向の配列があれば NumPy 配列で返す
+    """
+    np = _import_numpy()
+    line_arr, arc_arr = info.get("line_array"), info.get("arc_array")
+    if np is not None and line_arr is not None and arc_arr is not None:
+        lines = np.ascontiguousarray(np.stack([line_arr[f] for f in JWW_LINE_FIELDS[:4]], axis=1))
+        arcs = np.ascontiguousarray(np.stack([arc_arr[f] for f in JWW_ARC_FIELDS], axis=1))
+        return lines.ravel(), arcs.ravel()
+    lines = [v for l in info.get("lines", []) for v in (l["x1"], l["y1"], l["x2"], l["y2"])]
+    arcs = [v for a in info.get("arcs", []) for v in (a["cx"], a["cy"], a["r"], a["start_a"], a["end_a"])]
+    return lines, arcs
+
+
+# ========== ドアの検出（扇形と戸・枠の線） ==========
+
+DOOR_SPAN_MIN = 80.0            # ドアの扇形とみなす開き角（度）
+DOOR_SPAN_MAX = 100.0
+DOOR_JOIN_TOL = 2.0             # 線の端点を吊元・円弧の端とみなす距離（mm）
+
+_DOOR_HINGE, _DOOR_START, _DOOR_END = 0, 1, 2
+
+
+def _is_door_span(start_a, end_a):
+    """円弧の開き角がドアの扇形（90°前後）か。NumPy配列なら要素ごとの真偽の配列（角度が NaN なら偽）"""
+    span = (end_a - start_a) % 360
+    return (span >= DOOR_SPAN_MIN) & (span <= DOOR_SPAN_MAX)
+
+
+def _element_door_geometry(lines, circles):
+    """JwcLine / JwcCircle の並びを detect_doors に渡す平たい座標列にする（読めない値は NaN）"""
+    nan = float('nan')
+    line_coords = [v for l in lines for v in (l.x1, l.y1, l.x2, l.y2)]
+    arc_fields = [nan if v is None else v for c in circles for v in (c.cx, c.cy, c.r, c.start_a, c.end_a)]
+    return line_coords, arc_fields
+
+
+def _door_keys_python(lines, arcs, tol):
+    """
+    扇形の候補の吊元・始角側の端・終角側の端を tol 四方のマスのハッシュに入れ、線の端点を1度ずつ引く。
+    Returns: (円弧の番号のリスト, 候補ごとの3点, [(候補, 役割, 端点の番号 2*線+端), ...])
+    """
+    arc_ids, pts, cells = [], [], {}
+    for k in range(len(arcs) // 5):
+        cx, cy, r, sa, ea = arcs[5 * k:5 * k + 5]
+        if not (r > tol and _is_door_span(sa, ea) and math.isfinite(cx) and math.isfinite(cy)):
+            continue
+        d = len(arc_ids)
+        arc_ids.append(k)
+        pts.append(((cx, cy), (cx + r * math.cos(math.radians(sa)), cy + r * math.sin(math.radians(sa))),
+                    (cx + r * math.cos(math.radians(ea)), cy + r * math.sin(math.radians(ea)))))
+        for role, (x, y) in enumerate(pts[-1]):
+            ix, iy = math.floor(x / tol), math.floor(y / tol)
+            # 近傍3×3マスに入れておけば、端点は自分のマスを1度引くだけで済む
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    cells.setdefault((ix + dx, iy + dy), []).append((d, role, x, y))
+    hits = []
+    if cells:
+        for p in range(len(lines) // 2):
+            x, y = lines[2 * p], lines[2 * p + 1]
+            if not (math.isfinite(x) and math.isfinite(y)):
+                continue
+            for d, role, kx, ky in cells.get((math.floor(x / tol), math.floor(y / tol)), ()):
+                if math.hypot(x - kx, y - ky) <= tol:
+                    hits.append((d, role, p))
+    return arc_ids, pts, hits
+
+
+def _door_keys_numpy(np, lines, arcs, tol):
+    """
+    _door_keys_python のベクトル演算版。マスの番号を整数1つにまとめ、3点×近傍9マスの番号を並べ替えておき、
+    端点のマスを二分探索で突き合わせる
+    """
+    A = np.asarray(arcs, dtype=np.float64).reshape(-1, 5)
+    with np.errstate(invalid='ignore'):
+        ok = _is_door_span(A[:, 3], A[:, 4]) & (A[:, 2] > tol) & np.isfinite(A[:, :2]).all(axis=1)
+    arc_ids = np.flatnonzero(ok)
+    cx, cy, r, sa, ea = A[arc_ids].T
+    sa, ea = np.radians(sa), np.radians(ea)
+    K = np.stack([cx, cy, cx + r * np.cos(sa), cy + r * np.sin(sa), cx + r * np.cos(ea), cy + r * np.sin(ea)],
+                 axis=1).reshape(-1, 2)                 # 候補 d の役割 role が 3*d+role 行目
+    E = np.asarray(lines, dtype=np.float64).reshape(-1, 2)
+    pts = K.reshape(-1, 3, 2).tolist()
+    if not len(K) or not len(E):
+        return arc_ids.tolist(), pts, []
+    kc = np.floor(K / tol).astype(np.int64)
+    codes = np.concatenate([((kc[:, 0] + dx) << 32) + kc[:, 1] + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+    order = np.argsort(codes, kind='stable')
+    codes, owner = codes[order], order % len(K)
+    with np.errstate(invalid='ignore'):
+        ends = np.flatnonzero(np.isfinite(E).all(axis=1))
+        ec = np.floor(E[ends] / tol).astype(np.int64)
+    ec = (ec[:, 0] << 32) + ec[:, 1]
+    lo = np.searchsorted(codes, ec, 'left')
+    n = np.searchsorted(codes, ec, 'right') - lo
+    sel = np.flatnonzero(n)
+    lo, n = lo[sel], n[sel]
+    # 端点ごとに、同じマスに入っている点を全部並べる
+    e = np.repeat(ends[sel], n)
+    k = owner[np.repeat(lo - np.cumsum(n) + n, n) + np.arange(int(n.sum()))]
+    near = np.hypot(*(E[e] - K[k]).T) <= tol
+    e, k = e[near], k[near]
+    return arc_ids.tolist(), pts, zip((k // 3).tolist(), (k % 3).tolist(), e.tolist())
+
+
+def detect_doors(lines, arcs, tol=DOOR_JOIN_TOL):
+    """
+    ドア（扇形＋戸の線＋枠の線）を見つける。
+    lines: x1, y1, x2, y2 を線の順に並べた数列 / arcs: cx, cy, r, start_a, end_a を円弧の順に
+    Returns: [{"arc", "hinge", "width", "leaf", "jambs", "swing", "open_to", "ends", "closed"}, ...]（円弧の順）
+    """
+    tol = max(float(tol), 1e-6)
+    np = _import_numpy()
+    if np is not None:
+        arc_ids, pts, hits = _door_keys_numpy(np, lines, arcs, tol)
+    else:
+        arc_ids, pts, hits = _door_keys_python(lines, arcs, tol)
+    ends = [{} for _ in arc_ids]            # 候補ごとに {線: {端: 役割}}
+    for d, role, p in hits:
+        ends[d].setdefault(p >> 1, {})[p & 1] = role
+
+    doors = []
+    for k, (hinge, *tips), touch in zip(arc_ids, pts, ends):
+        leaf = swing = open_to = None
+        closed = (_DOOR_START, _DOOR_END)
+        for i in sorted(touch):
+            roles = sorted(touch[i].values())
+            if len(roles) == 2 and roles[0] == _DOOR_HINGE and roles[1] != _DOOR_HINGE:
+                leaf = i
+                # 開いた位置が終角側なら、閉じた位置（始角）から反時計回りに開く
+                swing = "ccw" if roles[1] == _DOOR_END else "cw"
+                closed = (_DOOR_START if roles[1] == _DOOR_END else _DOOR_END,)
+                ox, oy = tips[roles[1] - 1]
+                w = math.hypot(ox - hinge[0], oy - hinge[1])
+                open_to = [round((ox - hinge[0]) / w, 3), round((oy - hinge[1]) / w, 3)]
+                break
+        near = (_DOOR_HINGE,) + closed
+        jambs = [i for i in sorted(touch) if i != leaf and any(r in near for r in touch[i].values())]
+        tip_pts = [[float(x), float(y)] for x, y in tips]
+        doors.append({"arc": k, "hinge": [float(hinge[0]), float(hinge[1])], "width": float(arcs[5 * k + 2]),
+                      "leaf": leaf, "jambs": jambs, "swing": swing, "open_to": open_to,
+                      "ends": tip_pts, "closed": tip_pts[closed[0] - 1] if swing is not None else None})
+    return doors
+
+
+def _door_label(door, line_numbers=True):
+    """ドア1件の短い説明。line_numbers=True なら戸・枠の線を「線N」（1始まり）で示す"""
+    hx, hy = door["hinge"]
+    out = f"円弧{door['arc']} 吊元({hx:.2f},{hy:.2f}) 幅{door['width']:.0f}mm"
+    if door["swing"] is not None:
+        dx, dy = door["open_to"]
+        out += f" {'反時計' if door['swing'] == 'ccw' else '時計'}回りに開く(開いた向き{dx:+.2f},{dy:+.2f})"
+    else:
+        out += " 開く向き不明(戸の線なし)"
+    if line_numbers:
+        if door["leaf"] is not None:
+            out += f" 戸の線:線{door['leaf'] + 1}"
+        if door["jambs"]:
+            out += " 枠の線:" + ",".join(f"線{i + 1}" for i in door["jambs"][:6])
+    else:
+        out += f" 枠の線{len(door['jambs'])}本"
+    return out
+
+
+def jww_doors(info, tol=DOOR_JOIN_TOL):
+    """
+    parse_jww_full の結果のドア（detect_doors）。1つの結果につき1度だけ求め、info["doors"] に持たせる。
+    """
+    doors = info.get("doors")
+    if doors is None:
+        doors = info["doors"] = detect_doors(*_jww_flat_geometry(info), tol)
+    return doors
+
+
+# ========== 部屋の抽出（壁の平面グラフ） ==========
+
+ROOM_SNAP = 5.0                 # 端点を丸める格子の間隔（mm）
+ROOM_MIN_AREA = 1.0             # 部屋とみなす面の最小面積（m²）
+ROOM_MAX_LINES = 200000         # 部屋を取り出す線の数の上限
+ROOM_MAX_CROSSINGS = 500000     # 交点（斜めの線は交差を調べる組）の数の上限
+JWW_CONTEXT_LINES_WITH_ROOMS = 15   # 部屋が取り出せたとき、AIに渡す主要な線の本数
+
+
+def _wall_runs(lines, snap):
+    """
+    線を格子の整数座標にして、水平線 {y: [(x1, x2)]}・垂直線 {x: [(y1, y2)]}・斜めの線 [(x1, y1, x2, y2)] に分ける。
+    水平・垂直の線は同じ直線上で重なる・つながるものを1本にまとめる
+    """
+    hs, vs, diag = {}, {}, set()
+    for k in range(len(lines) // 4):
+        x1, y1, x2, y2 = lines[4 * k:4 * k + 4]
+        if not (math.isfinite(x1) and math.isfinite(y1) and math.isfinite(x2) and math.isfinite(y2)):
+            continue
+        a, b, c, d = round(x1 / snap), round(y1 / snap), round(x2 / snap), round(y2 / snap)
+        if b == d:
+            if a != c:
+                hs.setdefault(b, []).append((a, c) if a < c else (c, a))
+        elif a == c:
+            vs.setdefault(a, []).append((b, d) if b < d else (d, b))
+        else:
+            diag.add((a, b, c, d) if (a, b) < (c, d) else (c, d, a, b))
+    for runs in (hs, vs):
+        for key, spans in runs.items():
+            spans.sort()
+            merged = [list(spans[0])]
+            for lo, hi in spans[1:]:
+                if lo <= merged[-1][1]:
+                    if hi > merged[-1][1]:
+                        merged[-1][1] = hi
+                else:
+                    merged.append([lo, hi])
+            runs[key] = merged
+    return hs, vs, sorted(diag)
+
+
+def _orthogonal_crossings(hs, vs, limit=ROOM_MAX_CROSSINGS):
+    """
+    水平線と垂直線の交点（端点で接するものも含む）を x 方向の掃引で求める。
+    Returns: ({(y, 番号): [x, ...]}, {(x, 番号): [y, ...]})  水平線・垂直線ごとの切る位置
+    交点が limit 個を超えたら None
+    """
+    from bisect import bisect_left, bisect_right, insort
+    events = []
+    for y, spans in hs.items():
+        for i, (x1, x2) in enumerate(spans):
+            events.append((x1, 0, y, i))        # 同じ x では 始まり → 垂直線 → 終わり の順
+            events.append((x2, 2, y, i))
+    for x, spans in vs.items():
+        for i in range(len(spans)):
+            events.append((x, 1, x, i))
+    events.sort()
+    h_cuts, v_cuts = {}, {}
+    active, run_of = [], {}                     # 掃引線に掛かっている水平線の y（同じ y は1本だけ）
+    for x, kind, key, i in events:
+        if kind == 0:
+            insort(active, key)
+            run_of[key] = i
+        elif kind == 2:
+            del active[bisect_left(active, key)]
+        else:
+            y1, y2 = vs[x][i]
+            lo, hi = bisect_left(active, y1), bisect_right(active, y2)
+            limit -= hi - lo
+            if limit < 0:
+                return None
+            ys = active[lo:hi]
+            if ys:
+                v_cuts.setdefault((x, i), []).extend(ys)
+                for y in ys:
+                    h_cuts.setdefault((y, run_of[y]), []).append(x)
+    return h_cuts, v_cuts
+
+
+def _segment_crossing(ax, ay, bx, by, cx, cy, dx, dy):
+    """線分 ab と cd の交点（端点で接するものも含む）の ab 上の位置 t と座標。重なる場合は cd の端点のうち ab 上のもの"""
+    rx, ry, sx, sy = bx - ax, by - ay, dx - cx, dy - cy
+    den = rx * sy - ry * sx
+    qx, qy = cx - ax, cy - ay
+    if den == 0:
+        if qx * ry - qy * rx != 0:
+            return []
+        rr = rx * rx + ry * ry
+        out = []
+        for px, py in ((cx, cy), (dx, dy)):
+            t = ((px - ax) * rx + (py - ay) * ry) / rr
+            if 0 <= t <= 1:
+                out.append((t, px, py))
+        return out
+    t = (qx * sy - qy * sx) / den
+    u = (qx * ry - qy * rx) / den
+    if 0 <= t <= 1 and 0 <= u <= 1:
+        return [(t, ax + t * rx, ay + t * ry)]
+    return []
+
+
+def _wall_edges(hs, vs, diag, limit=ROOM_MAX_CROSSINGS):
+    """
+    交点で切った壁の辺。Returns: (点のリスト, 辺の集合 {(点の番号, 点の番号)})
+    点は格子の整数座標 (x, y)、辺の両端の番号は小さい方が先。交点が limit 個を超えたら None
+    """
+    cuts = _orthogonal_crossings(hs, vs, limit)
+    if cuts is None:
+        return None
+    h_cuts, v_cuts = cuts
+    limit -= sum(map(len, v_cuts.values()))
+    segs = [(x1, y, x2, y) for y, spans in hs.items() for x1, x2 in spans]
+    owner = [(h_cuts, (y, i), 0) for y, spans in hs.items() for i in range(len(spans))]
+    segs += [(x, y1, x, y2) for x, spans in vs.items() for y1, y2 in spans]
+    owner += [(v_cuts, (x, i), 1) for x, spans in vs.items() for i in range(len(spans))]
+    cuts = [[] for _ in diag]
+    if diag:
+        np = _import_numpy()
+        if np is not None:
+            crossings = _diagonal_crossings_numpy(np, segs, diag, limit)
+        else:
+            crossings = _diagonal_crossings_grid(segs, diag, limit)
+        if crossings is None:
+            return None
+        n_orth = len(segs)
+        for k, j, t, px, py in crossings:
+            px, py = round(px), round(py)
+            cuts[k].append((t, px, py))
+            if j < n_orth:
+                table, key, axis = owner[j]
+                table.setdefault(key, []).append(py if axis else px)
+
+    edges = set()
+    ids = {}
+
+    def chain(pts):
+        ks = [ids.setdefault(p, len(ids)) for p in pts]
+        for a, b in zip(ks, ks[1:]):
+            if a != b:
+                edges.add((a, b) if a < b else (b, a))
+
+    for y, spans in hs.items():
+        for i, (x1, x2) in enumerate(spans):
+            chain([(x, y) for x in sorted({x1, x2, *h_cuts.get((y, i), ())})])
+    for x, spans in vs.items():
+        for i, (y1, y2) in enumerate(spans):
+            chain([(x, y) for y in sorted({y1, y2, *v_cuts.get((x, i), ())})])
+    for (ax, ay, bx, by), cut in zip(diag, cuts):
+        chain([(ax, ay)] + [(px, py) for _, px, py in sorted(cut)] + [(bx, by)])
+    return list(ids), edges
+
+
+def _diagonal_crossings_grid(segs, diag, limit=ROOM_MAX_CROSSINGS):
+    """
+    斜めの線と他の線の交点 [(斜めの線, 相手の線, 斜めの線上の位置 t, x, y)]。相手は空間索引の候補だけ調べる。
+    調べる組が limit を超えたら None
+    """
+    grid = SpatialGrid([v for s in segs + diag for v in s], [])
+    n_orth = len(segs)
+    candidates = []
+    for ax, ay, bx, by in diag:
+        candidates.append(grid.query_bbox(min(ax, bx), min(ay, by), max(ax, bx), max(ay, by)))
+        limit -= len(candidates[-1])
+        if limit < 0:
+            return None
+    out = []
+    for k, ((ax, ay, bx, by), found) in enumerate(zip(diag, candidates)):
+        for _, j in found:
+            if j != n_orth + k:
+                other = segs[j] if j < n_orth else diag[j - n_orth]
+                out += [(k, j, t, px, py) for t, px, py in _segment_crossing(ax, ay, bx, by, *other)]
+    return out
+
+
+def _segment_cells_numpy(np, S, cell, x0, y0):
+    """
+    線分が通る格子のマス（外接矩形ではなく、列ごとに線分の y の範囲を切り出したもの）。
+    境界ちょうどの交点を取りこぼさないよう、両側に半単位ずつ広げる。
+    Returns: (線の番号の配列, マスの番号の配列)
+    """
+    eps = 0.5
+    swap = S[:, 0] > S[:, 2]
+    X1, X2 = np.where(swap, S[:, 2], S[:, 0]) - x0, np.where(swap, S[:, 0], S[:, 2]) - x0
+    Y1, Y2 = np.where(swap, S[:, 3], S[:, 1]) - y0, np.where(swap, S[:, 1], S[:, 3]) - y0
+    c1 = np.floor((X1 - eps) / cell).astype(np.int64)
+    ncol = np.floor((X2 + eps) / cell).astype(np.int64) - c1 + 1
+    seg = np.repeat(np.arange(len(S)), ncol)
+    col = np.arange(len(seg)) - np.repeat(np.cumsum(ncol) - ncol, ncol) + c1[seg]
+    dx = X2 - X1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(dx > 0, (Y2 - Y1) / dx, 0.0)
+    xa = np.clip(col * cell, X1[seg], X2[seg])
+    xb = np.clip((col + 1) * cell, X1[seg], X2[seg])
+    ya = np.where(dx[seg] > 0, Y1[seg] + (xa - X1[seg]) * slope[seg], Y1[seg])
+    yb = np.where(dx[seg] > 0, Y1[seg] + (xb - X1[seg]) * slope[seg], Y2[seg])
+    r1 = np.floor((np.minimum(ya, yb) - eps) / cell).astype(np.int64)
+    nrow = np.floor((np.maximum(ya, yb) + eps) / cell).astype(np.int64) - r1 + 1
+    seg2 = np.repeat(seg, nrow)
+    row = np.arange(len(seg2)) - np.repeat(np.cumsum(nrow) - nrow, nrow) + np.repeat(r1, nrow)
+    height = int(np.floor((max(S[:, 1].max(), S[:, 3].max()) - y0) / cell)) + 3
+    return seg2, (np.repeat(col, nrow) + 1) * height + (row + 1)
+
+
+def _diagonal_crossings_numpy(np, segs, diag, limit=ROOM_MAX_CROSSINGS, chunk=1 << 22):
+    """_diagonal_crossings_grid のベクトル演算版。組が limit を超えたら None"""
+    n_orth = len(segs)
+    S = np.asarray(segs + diag, dtype=np.float64).reshape(-1, 4)
+    n = len(S)
+    span = np.abs(S[:, 2] - S[:, 0]) + np.abs(S[:, 3] - S[:, 1])
+    D = S[n_orth:]
+    dspan = np.maximum(np.abs(D[:, 2] - D[:, 0]), np.abs(D[:, 3] - D[:, 1]))
+    cell = max(float(np.median(dspan)), float(span.sum()) / (8 * n), 1.0)
+    x0 = min(S[:, 0].min(), S[:, 2].min())
+    y0 = min(S[:, 1].min(), S[:, 3].min())
+    seg, code = _segment_cells_numpy(np, S, cell, x0, y0)
+    mine = seg >= n_orth
+    dseg, dcode = seg[mine], code[mine]
+    keep = np.isin(code, dcode)                 # 斜めの線が通らないマスは要らない
+    order = np.argsort(code[keep], kind='stable')
+    sseg, scode = seg[keep][order], code[keep][order]
+    lo = np.searchsorted(scode, dcode, 'left')
+    cnt = np.searchsorted(scode, dcode, 'right') - lo
+    if int(cnt.sum()) > limit:
+        return None
+    first = np.repeat(lo - (np.cumsum(cnt) - cnt), cnt)
+    ks = np.repeat(dseg, cnt)
+    js = sseg[first + np.arange(len(ks))]
+    pair = np.unique(ks * n + js)               # 複数のマスで出会う組は1度だけ
+    ks, js = pair // n, pair % n
+    mine = ks != js
+    ks, js = ks[mine], js[mine]
+    out = []
+    for p0 in range(0, len(ks), chunk):
+        k, j = ks[p0:p0 + chunk], js[p0:p0 + chunk]
+        A, B = S[k], S[j]
+        rx, ry = A[:, 2] - A[:, 0], A[:, 3] - A[:, 1]
+        sx, sy = B[:, 2] - B[:, 0], B[:, 3] - B[:, 1]
+        qx, qy = B[:, 0] - A[:, 0], B[:, 1] - A[:, 1]
+        den = rx * sy - ry * sx
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (qx * sy - qy * sx) / den
+            u = (qx * ry - qy * rx) / den
+            hit = (den != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        h = np.flatnonzero(hit)
+        tt = t[h]
+        px, py = A[h, 0] + tt * rx[h], A[h, 1] + tt * ry[h]
+        out += zip((k[h] - n_orth).tolist(), j[h].tolist(), tt.tolist(), px.tolist(), py.tolist())
+        h = np.flatnonzero((den == 0) & (qx * ry - qy * rx == 0))
+        for kd, jj in zip((k[h] - n_orth).tolist(), j[h].tolist()):
+            other = segs[jj] if jj < n_orth else diag[jj - n_orth]
+            out += [(kd, jj, t, px, py) for t, px, py in _segment_crossing(*diag[kd], *other)]
+    return out
+
+
+def _planar_faces(pts, edges, min_area):
+    """
+    辺の集合から、閉じた面のうち面積が min_area 以上のものを返す（内側の面は反時計回り）。
+    Returns: [(面積, (重心x, 重心y), 反時計回りの頂点列), ...]
+    """
+    if not edges:
+        return []
+    np = _import_numpy()
+    if np is not None:
+        E = np.fromiter((v for e in edges for v in e), dtype=np.int64, count=2 * len(edges)).reshape(-1, 2)
+        src, dst = np.concatenate([E[:, 0], E[:, 1]]), np.concatenate([E[:, 1], E[:, 0]])
+        return _large_faces_numpy(np, pts, *_half_edge_next_numpy(np, pts, src, dst), min_area)
+    src = [a for a, _ in edges] + [b for _, b in edges]
+    dst = [b for _, b in edges] + [a for a, _ in edges]
+    nxt, src = _half_edge_next_python(pts, src, dst)
+    faces = []
+    seen = bytearray(len(src))
+    for h in range(len(src)):
+        if seen[h]:
+            continue
+        face = []
+        while not seen[h]:
+            seen[h] = 1
+            face.append(pts[src[h]])
+            h = nxt[h]
+        area, centroid = _polygon_area_centroid(face)
+        if area >= min_area:
+            faces.append((area, centroid, face))
+    return faces
+
+
+def _half_edge_next_python(pts, src, dst):
+    """
+    半辺（向きのある辺）を 出る頂点・角度 の順に並べ、各半辺の次の半辺の番号を求める。
+    Returns: (次の半辺の番号のリスト, 並べ替えた後の出る頂点のリスト)
+    """
+    def angle(s, d):
+        # 同じ向きの辺の角度が計算の誤差で前後しないよう、向きを既約にしてから求める
+        dx, dy = pts[d][0] - pts[s][0], pts[d][1] - pts[s][1]
+        g = math.gcd(dx, dy)
+        return math.atan2(dy // g, dx // g)
+
+    half = sorted((s, angle(s, d), d) for s, d in zip(src, dst))
+    n = len(pts)
+    src = [h[0] for h in half]
+    at = {s * n + h[2]: i for i, (s, h) in enumerate(zip(src, half))}
+    first = [0] * (n + 1)
+    for s in src:
+        first[s + 1] += 1
+    for i in range(n):
+        first[i + 1] += first[i]
+    nxt = []
+    for s, _, d in half:
+        t = at[d * n + s]               # 逆向きの半辺の、すぐ時計回り側が次の半辺
+        nxt.append(t - 1 if t > first[d] else first[d + 1] - 1)
+    return nxt, src
+
+
+def _half_edge_next_numpy(np, pts, src, dst):
+    """_half_edge_next_python のベクトル演算版"""
+    P = np.asarray(pts, dtype=np.int64)
+    S, D = src, dst
+    dx, dy = P[D, 0] - P[S, 0], P[D, 1] - P[S, 1]
+    g = np.gcd(dx, dy)
+    order = np.lexsort((D, np.arctan2((dy // g).astype(np.float64), (dx // g).astype(np.float64)), S))
+    S, D = S[order], D[order]
+    n = len(pts)
+    first = np.searchsorted(S, np.arange(n + 1))
+    code = S * n + D
+    by_code = np.argsort(code)
+    t = by_code[np.searchsorted(code[by_code], D * n + S)]
+    nxt = np.where(t > first[D], t - 1, first[D + 1] - 1)
+    return nxt, S
+
+
+def _large_faces_numpy(np, pts, nxt, S, min_area):
+    """
+    _planar_faces の面の取り出しのベクトル演算版。半辺の面の番号（面の中で一番小さい半辺の番号）を
+    ポインタの倍々飛ばしで求め、面積・重心は半辺ごとの外積を面ごとに足して求める。頂点列は大きな面だけたどる
+    """
+    P = np.asarray(pts, dtype=np.int64)
+    origin = P.min(axis=0)
+    P -= origin
+    X, Y = P[:, 0], P[:, 1]
+    face = np.arange(len(nxt))
+    jump = nxt
+    while True:
+        ahead = face[jump]
+        # 全ての半辺で jump 先までの最小が自分までの最小と同じなら、面を1周した最小になっている
+        if np.array_equal(ahead, face):
+            break
+        face = np.minimum(face, ahead)
+        jump = jump[jump]
+    D = S[nxt]
+    cross = (X[S] * Y[D] - X[D] * Y[S]).astype(np.float64)
+    area = np.bincount(face, weights=cross, minlength=len(nxt)) / 2
+    big = np.flatnonzero(area >= max(min_area, 1e-9))
+    mx = np.bincount(face, weights=(X[S] + X[D]) * cross, minlength=len(nxt))[big] / (6 * area[big])
+    my = np.bincount(face, weights=(Y[S] + Y[D]) * cross, minlength=len(nxt))[big] / (6 * area[big])
+    x0, y0 = origin.tolist()
+    nxt, S = nxt.tolist(), S.tolist()
+    faces = []
+    for h0, a, cx, cy in zip(big.tolist(), area[big].tolist(), mx.tolist(), my.tolist()):
+        ring, h = [], h0
+        while True:
+            ring.append(pts[S[h]])
+            h = nxt[h]
+            if h == h0:
+                break
+        faces.append((a, (cx + x0, cy + y0), ring))
+    return faces
+
+
+def _polygon_area_centroid(pts):
+    """多角形の符号付き面積（反時計回りが正）と重心"""
+    a = cx = cy = 0.0
+    x0, y0 = pts[0]
+    for (x1, y1), (x2, y2) in zip(pts, pts[1:] + pts[:1]):
+        # 1点目からの相対座標で計算して桁落ちを防ぐ
+        x1, y1, x2, y2 = x1 - x0, y1 - y0, x2 - x0, y2 - y0
+        c = x1 * y2 - x2 * y1
+        a += c
+        cx += (x1 + x2) * c
+        cy += (y1 + y2) * c
+    if a == 0:
+        return 0.0, (float(x0), float(y0))
+    return a / 2, (x0 + cx / (3 * a), y0 + cy / (3 * a))
+
+
+def _point_in_polygon(x, y, pts):
+    """点が多角形の内側にあるか（偶奇規則）"""
+    inside = False
+    for (x1, y1), (x2, y2) in zip(pts, pts[1:] + pts[:1]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+
+def _simplify_ring(pts):
+    """面の頂点列から、続けて同じ点・前後と一直線に並ぶ点（交点で切った跡や、行き止まりの辺を行き来した跡）を除く"""
+    ring = list(pts)
+    while True:
+        ring = [p for i, p in enumerate(ring) if p != ring[i - 1]]
+        n = len(ring)
+        if n < 3:
+            return ring
+        keep = [p for i, p in enumerate(ring)
+                if (p[0] - ring[i - 1][0]) * (ring[(i + 1) % n][1] - p[1])
+                != (p[1] - ring[i - 1][1]) * (ring[(i + 1) % n][0] - p[0])]
+        if len(keep) == n:
+            return ring
+        ring = keep
+
+
+def _face_locator(bboxes):
+    """
+    面の外接矩形を一様な格子のマスに入れ、点を含みうる面の番号を小さい順に返す関数を作る。
+    マスは外接矩形の大きさの中央値。多くのマスに掛かる大きな面はマスに入れず、常に候補にする
+    """
+    if not bboxes:
+        return lambda x, y: []
+    sizes = sorted(max(x1 - x0, y1 - y0) for x0, y0, x1, y1 in bboxes)
+    cell = max(sizes[len(sizes) // 2], 1)
+    cells, big = {}, []
+    for k, (x0, y0, x1, y1) in enumerate(bboxes):
+        ix0, iy0, ix1, iy1 = int(x0 // cell), int(y0 // cell), int(x1 // cell), int(y1 // cell)
+        if (ix1 - ix0 + 1) * (iy1 - iy0 + 1) > SpatialGrid.MAX_SPAN:
+            big.append(k)
+            continue
+        for ix in range(ix0, ix1 + 1):
+            for iy in range(iy0, iy1 + 1):
+                cells.setdefault((ix, iy), []).append(k)
+
+    def locate(x, y):
+        ids = sorted(cells.get((int(x // cell), int(y // cell)), []) + big)
+        return [k for k in ids if bboxes[k][0] <= x <= bboxes[k][2] and bboxes[k][1] <= y <= bboxes[k][3]]
+    return locate
+
+
+def extract_rooms(lines, labels, doors=(), snap=ROOM_SNAP, min_area=ROOM_MIN_AREA,
+                  max_lines=ROOM_MAX_LINES, max_crossings=ROOM_MAX_CROSSINGS):
+    """
+    線から壁の平面グラフを作り、閉じた範囲に部屋名を付ける。
+    lines: x1, y1, x2, y2 を線の順に並べた数列 / labels: [(部屋名, x, y), ...] / doors: detect_doors の結果
+    Returns: {
+        "rooms": [{"name", "area_m2", "centroid": [x, y], "bbox": [xmin, ymin, xmax, ymax],
+                   "polygon": [[x, y], ...]}, ...],   # 面積の大きい順
+        "faces": int, "unlabeled": int, "edges": int,
+        "skipped": None | "lines" | "crossings",    # 上限を超えたら rooms は空
+    }
+    """
+    snap = float(snap)
+    skipped = {"rooms": [], "faces": 0, "unlabeled": 0, "edges": 0}
+    if len(lines) // 4 > max_lines:
+        return {**skipped, "skipped": "lines"}
+    lines = lines.tolist() if hasattr(lines, "tolist") else list(lines)
+    for d in doors:
+        for x, y in ([d["closed"]] if d["closed"] is not None else d["ends"]):
+            lines += [*d["hinge"], x, y]
+    hs, vs, diag = _wall_runs(lines, snap)
+    graph = _wall_edges(hs, vs, diag, max_crossings)
+    if graph is None:
+        return {**skipped, "skipped": "crossings"}
+    pts, edges = graph
+    faces = []
+    for area, centroid, face in _planar_faces(pts, edges, min_area * 1e6 / (snap * snap)):
+        face = _simplify_ring(face)
+        xs, ys = [p[0] for p in face], [p[1] for p in face]
+        faces.append((area * snap * snap / 1e6, centroid, (min(xs), min(ys), max(xs), max(ys)), face))
+    faces.sort(key=lambda f: f[0])
+    names = {}
+    locate = _face_locator([f[2] for f in faces])
+    for name, x, y in labels:
+        gx, gy = x / snap, y / snap
+        for k in locate(gx, gy):
+            if _point_in_polygon(gx, gy, faces[k][3]):
+                if name not in names.setdefault(k, []):
+                    names[k].append(name)
+                break
+    rooms = []
+    for k in sorted(names, key=lambda k: -faces[k][0]):
+        area_m2, (cx, cy), bbox, face = faces[k]
+        rooms.append({
+            "name": "・".join(names[k]),
+            "area_m2": round(area_m2, 2),
+            "centroid": [round(cx * snap, 1), round(cy * snap, 1)],
+            "bbox": [v * snap for v in bbox],
+            "polygon": [[x * snap, y * snap] for x, y in face],
+        })
+    return {"rooms": rooms, "faces": len(faces), "unlabeled": len(faces) - len(names),
+            "edges": len(edges), "skipped": None}
+
+
+def jww_rooms(info):
+    """
+    parse_jww_full の結果の部屋（extract_rooms）。1つの結果につき1度だけ求め、info["room_faces"] に持たせる。
+    部屋名は kind が "room" で位置のある文字、ドアは jww_doors で組み立てたもの。
+    """
+    rooms = info.get("room_faces")
+    if rooms is None:
+        labels = [(t["text"], t["x"], t["y"]) for t in info.get("texts", [])
+                  if t.get("kind") == "room" and t.get("x") is not None]
+        rooms = info["room_faces"] = extract_rooms(_jww_flat_geometry(info)[0], labels, jww_doors(info))
+    return rooms
+
+
+# ========== JW_CAD 画面キャプチャ ==========
+
+def _find_jwcad_hwnd():
+    """JW_CADのウィンドウハンドルを探す（最小化・非表示でも検出）"""
+    import win32gui
+    # JW_CADのウィンドウタイトルパターン
+    # 実際のタイトル例: "建築一般図 - jw_win"、"Jw_cad"、"JW_CAD" など
+    JW_KEYWORDS = ('jw_win', 'jw_cad', 'jw cad', 'jww')
+    candidates = []
+    def _cb(hwnd, _):
+        title = win32gui.GetWindowText(hwnd)
+        tl = title.lower()
+        if any(kw in tl for kw in JW_KEYWORDS):
+            candidates.append((hwnd, title))
+    win32gui.EnumWindows(_cb, None)
+    if not candidates:
+        return None
+    # 表示中のものを優先、なければ最初のものを返す
     for hwnd, _ in candidates:
         if win32gui.IsWindowVisible(hwnd):
             return hwnd
@@ -633,6 +2947,328 @@ def capture_jwcad_screenshot_file(save_path=None):
         return None
 
 
+# ========== 図形の描画（オフスクリーン） ==========
+
+PREVIEW_WIDTH = 960
+PREVIEW_HEIGHT = 720
+
+# パレット番号と色: 0 背景、1 変換前（灰色）、2 変換後の線、3 変換後の円弧
+_PREVIEW_PALETTE = (255, 255, 255,  190, 190, 190,  231, 76, 60,  41, 128, 185)
+_RASTER_CHUNK = 1 << 16     # 線分を画素にする時、一度に作る点の数
+
+
+class _Raster:
+    """
+    bounds（xmin, ymin, xmax, ymax、mm）が width×height に収まるように線分・円弧を描くキャンバス。
+    描く色はパレット番号（ink）で指定し、image() でパレットを付けた PIL 画像にする。
+    """
+
+    def __init__(self, bounds, width, height, margin=8):
+        from PIL import Image, ImageDraw
+        xmin, ymin, xmax, ymax = bounds
+        span = max(xmax - xmin, ymax - ymin)
+        inner_w, inner_h = max(width - 2 * margin, 1), max(height - 2 * margin, 1)
+        if span > 0:
+            self.scale = min(inner_w / (xmax - xmin) if xmax > xmin else float('inf'),
+                             inner_h / (ymax - ymin) if ymax > ymin else float('inf'))
+        else:
+            self.scale = 1.0
+        # 図形の中心を画像の中心に（y は上向き → 画素は下向き）
+        self.ox = width / 2 - (xmin + xmax) / 2 * self.scale
+        self.oy = height / 2 + (ymin + ymax) / 2 * self.scale
+        self.width, self.height = width, height
+        self.np = _import_numpy()
+        if self.np is not None:
+            self.buf = self.np.zeros(width * height, dtype=self.np.uint8)
+        else:
+            self._image = Image.new('P', (width, height), 0)
+            self._draw = ImageDraw.Draw(self._image)
+
+    def lines(self, seg, ink):
+        """線分 (N, 4)（NumPy が無ければ (x1, y1, x2, y2) の並び）を描く"""
+        s, ox, oy = self.scale, self.ox, self.oy
+        np = self.np
+        if np is None:
+            draw = self._draw
+            for x1, y1, x2, y2 in seg:
+                if x1 == x1 and y1 == y1 and x2 == x2 and y2 == y2:
+                    draw.line((x1 * s + ox, oy - y1 * s, x2 * s + ox, oy - y2 * s), fill=ink)
+            return
+        seg = np.asarray(seg, dtype=np.float64).reshape(-1, 4)
+        seg = seg[~np.isnan(seg).any(axis=1)]
+        if not len(seg):
+            return
+        px = (seg[:, 0::2] * s + ox).astype(np.float32)
+        py = (oy - seg[:, 1::2] * s).astype(np.float32)
+        clip = px.min() < 0 or py.min() < 0 or px.max() >= self.width - 1 or py.max() >= self.height - 1
+        x0, y0 = px[:, 0] + 0.5, py[:, 0] + 0.5
+        dx, dy = px[:, 1] - px[:, 0], py[:, 1] - py[:, 0]
+        # 線分ごとに長い方の軸の画素数だけ点を打つ（np.repeat で線分の値を点の並びに広げる）
+        n = np.maximum(np.abs(dx), np.abs(dy)).astype(np.int64) + 1
+        inv = 1 / np.maximum(n - 1, 1).astype(np.float32)
+        sx, sy = dx * inv, dy * inv
+        # 点の数が _RASTER_CHUNK 程度になる線分のまとまりごとに描く（作業配列をキャッシュに収める）
+        ends = np.cumsum(n)
+        cuts = np.searchsorted(ends, np.arange(_RASTER_CHUNK, int(ends[-1]), _RASTER_CHUNK), side='right')
+        w = self.width
+        lo = 0
+        for hi in cuts.tolist() + [len(n)]:
+            if hi <= lo:
+                continue
+            m = n[lo:hi]
+            k = np.arange(int(ends[hi - 1] - ends[lo] + n[lo]), dtype=np.float32)
+            k -= np.repeat((np.cumsum(m) - m).astype(np.float32), m)
+            xs = np.repeat(sx[lo:hi], m)
+            xs *= k
+            xs += np.repeat(x0[lo:hi], m)
+            ys = np.repeat(sy[lo:hi], m)
+            ys *= k
+            ys += np.repeat(y0[lo:hi], m)
+            if clip:
+                np.clip(xs, 0, w - 1, out=xs)
+                np.clip(ys, 0, self.height - 1, out=ys)
+            xi = xs.astype(np.int32)
+            yi = ys.astype(np.int32)
+            yi *= w
+            yi += xi
+            self.buf[yi] = ink
+            lo = hi
+
+    def arcs(self, arcs, ink):
+        """円・円弧 (M, 5)（cx, cy, r, start_a, end_a。角度が NaN なら円）を折れ線にして描く"""
+        np = self.np
+        if np is None:
+            s, ox, oy = self.scale, self.ox, self.oy
+            draw = self._draw
+            for cx, cy, r, sa, ea in arcs:
+                if not (cx == cx and cy == cy and r == r) or r <= 0:
+                    continue
+                box = ((cx - r) * s + ox, oy - (cy + r) * s, (cx + r) * s + ox, oy - (cy - r) * s)
+                if sa != sa or ea != ea:
+                    draw.ellipse(box, outline=ink)
+                else:
+                    draw.arc(box, -ea, -sa, fill=ink)   # PIL の角度は画素座標（y下向き）で時計回り
+            return
+        arcs = np.asarray(arcs, dtype=np.float64).reshape(-1, 5)
+        arcs = arcs[~np.isnan(arcs[:, :3]).any(axis=1) & (arcs[:, 2] > 0)]
+        if not len(arcs):
+            return
+        full = np.isnan(arcs[:, 3:]).any(axis=1)
+        sa = np.where(full, 0.0, arcs[:, 3])
+        sweep = np.where(full, 360.0, (arcs[:, 4] - arcs[:, 3]) % 360)
+        sweep[sweep == 0] = 360.0
+        sweep = np.radians(sweep)
+        # 1辺が約4画素になる分割数（2〜180）
+        k = np.clip(np.ceil(sweep * arcs[:, 2] * self.scale / 4), 2, 180).astype(np.int64)
+        m = k + 1
+        start = np.cumsum(m) - m
+        j = np.arange(int(m.sum()), dtype=np.float64) - np.repeat(start, m)
+        t = np.repeat(np.radians(sa), m) + np.repeat(sweep / k, m) * j
+        r = np.repeat(arcs[:, 2], m)
+        x = np.repeat(arcs[:, 0], m) + r * np.cos(t)
+        y = np.repeat(arcs[:, 1], m) + r * np.sin(t)
+        keep = np.ones(len(x) - 1, dtype=bool)
+        keep[(start[1:] - 1)] = False                   # 円弧の終点と次の円弧の始点は結ばない
+        self.lines(np.stack([x[:-1], y[:-1], x[1:], y[1:]], axis=1)[keep], ink)
+
+    def points(self, xy, ink):
+        """点 (K, 2) を十字（中心と上下左右の1画素）で描く（文字の位置など）"""
+        s, ox, oy = self.scale, self.ox, self.oy
+        np = self.np
+        if np is None:
+            draw = self._draw
+            for x, y in xy:
+                if x == x and y == y:
+                    px, py = round(x * s + ox), round(oy - y * s)
+                    draw.point([(px, py), (px - 1, py), (px + 1, py), (px, py - 1), (px, py + 1)], fill=ink)
+            return
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        xy = xy[~np.isnan(xy).any(axis=1)]
+        px = np.rint(xy[:, 0] * s + ox).astype(np.int64)
+        py = np.rint(oy - xy[:, 1] * s).astype(np.int64)
+        for dx, dy in ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)):
+            x, y = px + dx, py + dy
+            ok = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+            self.buf[y[ok] * self.width + x[ok]] = ink
+
+    def image(self, palette=_PREVIEW_PALETTE):
+        """パレットを付けた PIL 画像（モード 'P'）"""
+        if self.np is None:
+            img = self._image
+        else:
+            from PIL import Image
+            img = Image.frombytes('P', (self.width, self.height), self.buf.tobytes())
+        img.putpalette(list(palette))
+        return img
+
+
+def _raster_bounds(np, segs=(), arcs=()):
+    """線分 (N, 4) と円・円弧 (M, 5) の全体を囲む (xmin, ymin, xmax, ymax)。何も無ければ None"""
+    xs, ys = [], []
+    if np is None:
+        for x1, y1, x2, y2 in (v for seg in segs for v in seg):
+            if x1 == x1 and y1 == y1 and x2 == x2 and y2 == y2:
+                xs += (x1, x2)
+                ys += (y1, y2)
+        for cx, cy, r, _, _ in (v for arc in arcs for v in arc):
+            if cx == cx and cy == cy and r == r:
+                xs += (cx - r, cx + r)
+                ys += (cy - r, cy + r)
+        return (min(xs), min(ys), max(xs), max(ys)) if xs else None
+    boxes = []
+    for seg in segs:
+        seg = np.asarray(seg, dtype=np.float64).reshape(-1, 4)
+        seg = seg[~np.isnan(seg).any(axis=1)]
+        if len(seg):
+            boxes.append((seg[:, 0::2].min(), seg[:, 1::2].min(), seg[:, 0::2].max(), seg[:, 1::2].max()))
+    for arc in arcs:
+        arc = np.asarray(arc, dtype=np.float64).reshape(-1, 5)
+        arc = arc[~np.isnan(arc[:, :3]).any(axis=1)]
+        if len(arc):
+            cx, cy, r = arc[:, 0], arc[:, 1], np.abs(arc[:, 2])
+            boxes.append(((cx - r).min(), (cy - r).min(), (cx + r).max(), (cy + r).max()))
+    if not boxes:
+        return None
+    return (min(float(b[0]) for b in boxes), min(float(b[1]) for b in boxes),
+            max(float(b[2]) for b in boxes), max(float(b[3]) for b in boxes))
+
+
+def _preview_geometry(np, elements, modified_lines_map, modified_circles_map, store):
+    """
+    プレビューに描く (変換前の線, 変換前の円弧, 変換後の線, 変換後の円弧)。
+    NumPy があれば (N, 4) / (M, 5) の配列、無ければタプルのリスト
+    """
+    nan = float('nan')
+    if store is not None and np is not None:
+        lines, circles = store.line_array(np), store.circle_array(np)
+    else:
+        lines = [(e.x1, e.y1, e.x2, e.y2) for e in elements if e.type == 'line']
+        circles = [tuple(nan if v is None else v for v in (e.cx, e.cy, e.r, e.start_a, e.end_a))
+                   for e in elements if e.type == 'circle']
+    if np is not None and isinstance(modified_lines_map, JwcLineEdits):
+        new_lines = np.frombuffer(modified_lines_map._coords, dtype=np.float64).reshape(-1, 4)
+    else:
+        new_lines = []
+        for i, m in modified_lines_map.items():
+            old = lines[i]
+            new_lines.append((m.get('x1', old[0]), m.get('y1', old[1]),
+                              m.get('x2', old[2]), m.get('y2', old[3])))
+    if np is not None and isinstance(modified_circles_map, JwcCircleEdits):
+        new_circles = np.frombuffer(modified_circles_map.fields, dtype=np.float64).reshape(-1, 5)
+    else:
+        new_circles = [tuple(_jwc_circle_fields(text.split())) for text in modified_circles_map.values()]
+    if np is not None:
+        lines, circles = np.asarray(lines, dtype=np.float64), np.asarray(circles, dtype=np.float64)
+        new_lines = np.asarray(new_lines, dtype=np.float64)
+        new_circles = np.asarray(new_circles, dtype=np.float64)
+    return lines, circles, new_lines, new_circles
+
+
+def render_transform_preview(elements, modified_lines_map=None, modified_circles_map=None, store=None,
+                             width=PREVIEW_WIDTH, height=PREVIEW_HEIGHT):
+    """
+    選択図形と apply_transform の結果を画像にする（変換前は灰色、変換後の線は赤・円弧は青）。
+    Returns: (PIL.Image（モード 'P'） or None, error_or_None)
+    """
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return None, "画像の描画には Pillow が必要です（pip install pillow）"
+    np = _import_numpy()
+    lines, circles, new_lines, new_circles = _preview_geometry(
+        np, elements, modified_lines_map or {}, modified_circles_map or {}, store)
+    bounds = _raster_bounds(np, (lines, new_lines), (circles, new_circles))
+    if bounds is None:
+        return None, "描画する線・円弧がありません"
+    try:
+        canvas = _Raster(bounds, width, height)
+        canvas.lines(lines, 1)
+        canvas.arcs(circles, 1)
+        canvas.lines(new_lines, 2)
+        canvas.arcs(new_circles, 3)
+        return canvas.image(), None
+    except Exception as e:
+        return None, str(e)
+
+
+# 図面全体の概要図: 画素数の上限（縦横比は図面に合わせる）と1辺の上限
+JWW_OVERVIEW_PIXELS = 1024 * 768
+JWW_OVERVIEW_MAX_SIDE = 1568
+# パレット番号と色: 0 背景、1 線、2 円弧、3 文字の位置
+_OVERVIEW_PALETTE = (255, 255, 255,  40, 40, 40,  41, 128, 185,  231, 76, 60)
+
+
+def _overview_size(bounds, max_pixels, max_side):
+    """bounds の縦横比で、画素数 max_pixels・1辺 max_side 以内に収まる (幅, 高さ)"""
+    w, h = bounds[2] - bounds[0], bounds[3] - bounds[1]
+    aspect = w / h if w > 0 and h > 0 else 1.0
+    aspect = min(max(aspect, 1 / 16), 16)
+    width = min((max_pixels * aspect) ** 0.5, max_side)
+    height = min(width / aspect, max_side)
+    width = min(width, height * aspect)
+    return max(int(width), 32), max(int(height), 32)
+
+
+def _jww_overview_geometry(np, full_info):
+    """parse_jww_full の結果から (線 (N, 4), 円弧 (M, 5), 文字の位置 (K, 2))。NumPy が無ければタプルのリスト"""
+    nan = float('nan')
+    line_arr, arc_arr = full_info.get("line_array"), full_info.get("arc_array")
+    if np is not None and line_arr is not None:
+        lines = np.column_stack([line_arr[f] for f in ('x1', 'y1', 'x2', 'y2')]) if len(line_arr) \
+            else np.empty((0, 4))
+    else:
+        lines = [(l["x1"], l["y1"], l["x2"], l["y2"]) for l in full_info.get("lines") or ()]
+    if np is not None and arc_arr is not None:
+        arcs = np.column_stack([arc_arr[f] for f in JWW_ARC_FIELDS]) if len(arc_arr) else np.empty((0, 5))
+    else:
+        arcs = [tuple(nan if a.get(f) is None else a[f] for f in JWW_ARC_FIELDS)
+                for a in full_info.get("arcs") or ()]
+    texts = [(t["x"], t["y"]) for t in full_info.get("texts") or ()
+             if t.get("x") is not None and t.get("y") is not None]
+    if np is not None:
+        lines = np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+        arcs = np.asarray(arcs, dtype=np.float64).reshape(-1, 5)
+        texts = np.asarray(texts, dtype=np.float64).reshape(-1, 2)
+    return lines, arcs, texts
+
+
+def render_jww_overview(full_info, max_pixels=JWW_OVERVIEW_PIXELS, max_side=JWW_OVERVIEW_MAX_SIDE):
+    """
+    parse_jww_full の結果から図面全体の概要図を描く（線は黒、円弧は青、文字の位置は赤い十字）。
+    Returns: (PIL.Image（モード 'P'） or None, error_or_None)
+    """
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return None, "画像の描画には Pillow が必要です（pip install pillow）"
+    np = _import_numpy()
+    lines, arcs, texts = _jww_overview_geometry(np, full_info)
+    if np is not None:
+        anchors = np.tile(texts, (1, 2))                # 文字の位置も範囲に入れる（長さ0の線分として）
+    else:
+        anchors = [(x, y, x, y) for x, y in texts]
+    bounds = _raster_bounds(np, (lines, anchors), (arcs,))
+    if bounds is None:
+        return None, "描画する線・円弧・文字がありません"
+    width, height = _overview_size(bounds, max_pixels, max_side)
+    try:
+        canvas = _Raster(bounds, width, height)
+        canvas.lines(lines, 1)
+        canvas.arcs(arcs, 2)
+        canvas.points(texts, 3)
+        return canvas.image(_OVERVIEW_PALETTE), None
+    except Exception as e:
+        return None, str(e)
+
+
+def image_to_base64_png(img):
+    """PIL 画像を PNG の base64 文字列にする（AI への添付用）"""
+    import io, base64
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return base64.b64encode(buf.getvalue()).decode('ascii')
+
+
 # ========== シグナルファイル操作 ==========
 
 def write_signal(message="ready"):
@@ -744,299 +3380,1926 @@ def cleanup_signal_files():
 
 # ========== JWWファイル フル解析 ==========
 
-def parse_jww_full(filepath):
-    """
-    JWWバイナリファイルから線・円弧・文字の座標データを解析する。
-    JWWフォーマット: 各レコードは レコードタイプ(2byte) + データ長(2byte) + データ で構成。
-    Returns: (info_dict, error_str_or_None)
-    info_dict = {
-        "lines": [{"x1","y1","x2","y2","length"},...],
-        "arcs":  [{"cx","cy","r","start_a","end_a"},...],
-        "texts": [{"x","y","text","source","kind"},...],
-        "dims":  [{"value","x","y"},...],
-        "rooms": [{"name","count"},...],
-        "insights": {
-            "drawing_type": "floor_plan_like"|"unknown",
-            "orthogonality_ratio": float,
-            "door_like_arcs": int,
-            "bbox": {"min_x","min_y","max_x","max_y","width","height"}|None,
-            "room_labels_with_coord": int,
-        },
-        "stats": {"lines":N,"arcs":N,"texts":N,"dims":N,"rooms":N},
-    }
-    """
-    import struct
-    import os
-    import re
-    import unicodedata
+import re
+import struct
 
-    def is_reasonable_coord(*vals):
-        return all(abs(v) < 1000000 for v in vals)
+# レコード解析用の構造体（毎回フォーマット文字列を解釈しないよう事前コンパイル）
+_JWW_REC_HEAD  = struct.Struct('<HH')      # レコードタイプ(2byte) + データ長(2byte)
+_JWW_LINE_BODY = struct.Struct('<dddd')    # x1, y1, x2, y2
+_JWW_ARC_BODY  = struct.Struct('<ddddd')   # cx, cy, r, 始角, 終角
+_JWW_TEXT_POS  = struct.Struct('<dd')      # 文字の基準点 x, y
 
-    def normalize_text(raw):
-        if not raw:
-            return ""
-        return ''.join(c for c in raw if c.isprintable()).strip()
+_JWW_LINE_TYPES = frozenset((0x10, 0x11, 0x12, 0x13))
+_JWW_ARC_TYPES  = frozenset((0x20, 0x21, 0x22, 0x23))
+_JWW_TEXT_TYPES = frozenset((0x30, 0x31, 0x32, 0x33, 0x34, 0x35))
 
-    def normalize_for_match(text):
-        # 全角/半角ゆれを抑える（３０００ -> 3000, ＬＤＫ -> LDK）
-        return unicodedata.normalize('NFKC', text).strip()
+# レコードヘッダの候補位置（データ長の条件をバイト列で表したもの）
+#   線・円弧系: データ長 1〜512
+#   文字系:     タイプ 0x30〜0x35 かつ データ長の上位バイトが 0〜4（1024以下）
+_JWW_GEOM_HEAD_RE = re.compile(rb'(?=[\x00-\xff]{2}(?:[\x01-\xff]\x00|[\x00-\xff]\x01|\x00\x02))')
+_JWW_TEXT_HEAD_RE = re.compile(rb'(?=[\x30-\x35]\x00[\x00-\xff][\x00-\x04])')
 
-    def classify_text(clean):
-        if not clean:
-            return None
-        n = normalize_for_match(clean)
-        compact = re.sub(r'\s+', '', n)
-        lower = compact.lower()
+_JWW_SCAN_CHUNK = 1 << 16    # カーソルを並走させる単位(byte)
 
-        # 寸法値（1000, 900.5, 1200x600, R250, φ100, 1000mm）
-        if re.fullmatch(r'[+-]?\d+(?:\.\d+)?(?:mm)?', lower):
-            return "dim"
-        if re.fullmatch(r'[+-]?\d+(?:\.\d+)?x[+-]?\d+(?:\.\d+)?(?:mm)?', lower):
-            return "dim"
-        if re.fullmatch(r'(?:r|φ|d)?[+-]?\d+(?:\.\d+)?(?:mm)?', lower):
-            return "dim"
+# 長さ付き文字列の長さバイトとみなす値（文字レコード内: 2〜120 / フォールバック: 2〜80）
+_JWW_RECORD_LEN_RE = re.compile(rb'[\x02-\x78]')
+_JWW_FALLBACK_LEN_RE = re.compile(rb'[\x02-\x50]')
 
-        room_keywords = (
-            '玄関', 'ホール', '廊下', 'ポーチ', '洗面', '脱衣', '浴室', '風呂', 'トイレ',
-            '便所', 'キッチン', '台所', 'ダイニング', 'リビング', '和室', '洋室',
-            '寝室', '納戸', '収納', '押入', '階段', 'バルコニー', 'ベランダ',
-            'ps', 'mb', 'cl', 'wic', 'sic', 'ldk'
-        )
-        low = n.lower()
-        if any(k in low for k in room_keywords):
-            return "room"
+JWW_LINE_FIELDS = ('x1', 'y1', 'x2', 'y2', 'length')
+JWW_ARC_FIELDS  = ('cx', 'cy', 'r', 'start_a', 'end_a')
+JWW_TEXT_FIELDS = ('text', 'source', 'kind', 'x', 'y')
 
-        has_jp = any('぀' <= c <= '鿿' or '＀' <= c <= '￯' for c in clean)
-        if has_jp:
+
+class JwwRecord:
+    """
+    JWWレコード1件（線・円弧・文字系）。
+    位置とヘッダだけを持ち、本体は decode_* を呼んだときにだけ読み出す。
+    """
+    __slots__ = ('buffer', 'offset', 'type', 'size')
+
+    def __init__(self, buffer, offset, rec_type, size):
+        self.buffer = buffer
+        self.offset = offset
+        self.type = rec_type
+        self.size = size
+
+    @property
+    def body(self):
+        """レコード本体（コピーしないmemoryviewスライス）"""
+        start = self.offset + 4
+        return self.buffer[start:start + self.size]
+
+    @property
+    def kind(self):
+        if self.type in _JWW_LINE_TYPES:
+            return "line"
+        if self.type in _JWW_ARC_TYPES:
+            return "arc"
+        if self.type in _JWW_TEXT_TYPES:
             return "text"
         return None
 
-    def append_text(clean, source, coord=None):
-        cls = classify_text(clean)
-        if not cls:
-            return
-        item = {"text": clean, "source": source, "kind": cls}
-        if coord:
-            item["x"], item["y"] = coord
-        texts.append(item)
-        seen_texts.add(clean)
-
-        if cls == "dim":
-            dim = {"value": clean}
-            if coord:
-                dim["x"], dim["y"] = coord
-            dims.append(dim)
-        elif cls == "room":
-            rooms.append({"name": clean, **({"x": coord[0], "y": coord[1]} if coord else {})})
+    def decode_line(self):
+        """(x1, y1, x2, y2) を返す。データ長が足りなければNone"""
+        if self.size < 32:
+            return None
+        return _JWW_LINE_BODY.unpack_from(self.buffer, self.offset + 4)
 
-    if not os.path.exists(filepath):
-        return None, f"ファイルが見つかりません: {filepath}"
+    def decode_arc(self):
+        """(cx, cy, r, 始角, 終角) を返す。データ長が足りなければNone"""
+        if self.size < 40:
+            return None
+        return _JWW_ARC_BODY.unpack_from(self.buffer, self.offset + 4)
 
-    try:
-        with open(filepath, 'rb') as f:
-            data = f.read()
-    except Exception as e:
-        return None, str(e)
+    def decode_text_pos(self):
+        """文字の基準点 (x, y) を返す。データ長が足りなければNone"""
+        if self.size < 16:
+            return None
+        return _JWW_TEXT_POS.unpack_from(self.buffer, self.offset + 4)
+
+    def iter_strings(self, max_start=96, max_len=120):
+        """本体中の長さ付きcp932文字列を先頭から順に (開始位置, 文字列) で返す"""
+        buf = self.buffer
+        base = self.offset + 4
+        size = self.size
+        for start in range(0, min(max_start, size - 2)):
+            length = buf[base + start]
+            if not 2 <= length <= max_len or start + 1 + length > size:
+                continue
+            a = base + start + 1
+            try:
+                yield start, str(buf[a:a + length], 'cp932')
+            except UnicodeDecodeError:
+                continue
 
-    if len(data) < 8 or not data[:7].decode('ascii', errors='ignore').startswith('JwwData'):
-        return None, "JWWファイルではありません"
 
-    lines, arcs, texts, dims, rooms = [], [], [], [], []
+class JwwFile:
+    """
+    JWWファイルをmmapで開き、ファイル全体を読み込まずにアクセスする。
 
-    i = 0
-    max_items = 2000
-    while i < len(data) - 4:
-        try:
-            rec_type = struct.unpack_from('<H', data, i)[0]
-            rec_size = struct.unpack_from('<H', data, i + 2)[0]
-            if rec_size == 0 or rec_size > 512 or i + 4 + rec_size > len(data):
-                i += 1
-                continue
+        with JwwFile(path) as jf:
+            for rec in jf.iter_records():
+                ...
+    """
 
-            rec_data = data[i + 4: i + 4 + rec_size]
+    def __init__(self, filepath):
+        import mmap
+        self.filepath = filepath
+        self._mmap = None
+        with open(filepath, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self._mmap) if self._mmap is not None else memoryview(b'')
 
-            if rec_type in (0x10, 0x11, 0x12, 0x13) and rec_size >= 32:
-                try:
-                    x1, y1, x2, y2 = struct.unpack_from('<dddd', rec_data, 0)
-                    if is_reasonable_coord(x1, y1, x2, y2):
-                        length = ((x2-x1)**2 + (y2-y1)**2) ** 0.5
-                        if length > 0.1:
-                            lines.append({
-                                "x1": round(x1, 2), "y1": round(y1, 2),
-                                "x2": round(x2, 2), "y2": round(y2, 2),
-                                "length": round(length, 2)
-                            })
-                            if len(lines) >= max_items:
-                                i += 4 + rec_size
-                                continue
-                except Exception:
-                    pass
+    def __enter__(self):
+        return self
 
-            elif rec_type in (0x20, 0x21, 0x22, 0x23) and rec_size >= 40:
-                try:
-                    cx, cy, r, sa, ea = struct.unpack_from('<ddddd', rec_data, 0)
-                    if is_reasonable_coord(cx, cy) and 0 < r < 100000:
-                        arcs.append({
-                            "cx": round(cx, 2), "cy": round(cy, 2), "r": round(r, 2),
-                            "start_a": round(sa, 2), "end_a": round(ea, 2)
-                        })
-                            
-                        if len(arcs) >= max_items:
-                            i += 4 + rec_size
-                            continue
-                except Exception:
-                    pass
+    def __exit__(self, *exc):
+        self.close()
 
-            i += 4 + rec_size
-        except Exception:
-            i += 1
+    def __len__(self):
+        return len(self.buffer)
 
-    seen_texts = set()
+    def close(self):
+        self.buffer.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # 呼び出し側がスライスを保持中。参照が消えた時点で解放される
+            self._mmap = None
+
+    def is_jww(self):
+        return len(self.buffer) >= 8 and self.buffer[:7] == b'JwwData'
+
+    def read_header(self):
+        """ヘッダ情報 {"version","memo","paper_size"} を返す（read_jww_header 参照）"""
+        return read_jww_header(self.buffer)
+
+    def iter_records(self):
+        """
+        線・円弧・文字系のレコードを JwwRecord としてファイル先頭から順に返す（遅延評価）。
+        本体のデコードは各レコードの decode_* を呼んだときにだけ行われる。
+        """
+        buf = self.buffer
+        for offset, rec_type, rec_size in self.iter_record_heads():
+            yield JwwRecord(buf, offset, rec_type, rec_size)
+
+    def iter_record_heads(self, want_text=None, start=None, stop=None):
+        """
+        線・円弧・文字系のレコード位置を (offset, type, size) でファイル先頭から順に返す。
+        want_text: チャンクごとに呼ばれ、Falseを返すと以降は文字系レコードを探さない。
+        start: (線・円弧カーソル, 文字カーソル) の開始位置（前回の位置から再開すると同じ結果の続きになる）。
+        stop: チャンクの先頭位置を渡して呼ばれ、Trueを返すとそこで打ち切る。
+        """
+        buf = self.buffer
+        n = len(buf)
+        head = _JWW_REC_HEAD.unpack_from
+        geom_search = _JWW_GEOM_HEAD_RE.search
+        text_search = _JWW_TEXT_HEAD_RE.search
+        last = n - 4            # レコード先頭として調べる位置の上限（未満）
+        gi, ti = start if start is not None else (0, 0)     # 線・円弧カーソル / 文字カーソル
+        scan_text = True
+        chunk = min(gi, ti)
+        while chunk < last:
+            if stop is not None and stop(chunk):
+                return
+            chunk = min(chunk + _JWW_SCAN_CHUNK, last)
+            window = min(chunk + 4, n)
+            found = []
+
+            while gi < chunk:
+                m = geom_search(buf, gi, window)
+                if m is None or m.start() >= chunk:
+                    gi = chunk
+                    break
+                pos = m.start()
+                rec_type, rec_size = head(buf, pos)
+                if pos + 4 + rec_size > n:
+                    gi = pos + 1
+                    continue
+                if rec_type in _JWW_LINE_TYPES or rec_type in _JWW_ARC_TYPES:
+                    found.append((pos, rec_type, rec_size))
+                gi = pos + 4 + rec_size
+
+            if scan_text and want_text is not None:
+                scan_text = want_text()
+            geom_count = len(found)
+            while scan_text and ti < chunk:
+                m = text_search(buf, ti, window)
+                if m is None or m.start() >= chunk:
+                    ti = chunk
+                    break
+                pos = m.start()
+                rec_type, rec_size = head(buf, pos)
+                if rec_size < 6 or rec_size > 1024 or pos + 4 + rec_size > n:
+                    ti = pos + 1
+                    continue
+                found.append((pos, rec_type, rec_size))
+                ti = pos + 4 + rec_size
 
-    # type 0x30台（文字/寸法系を想定）優先
-    i = 0
-    while i < len(data) - 4 and len(texts) < 500:
-        try:
-            rec_type = struct.unpack_from('<H', data, i)[0]
-            rec_size = struct.unpack_from('<H', data, i + 2)[0]
-            if rec_type not in (0x30, 0x31, 0x32, 0x33, 0x34, 0x35) or rec_size < 6 or rec_size > 1024:
-                i += 1
-                continue
-            if i + 4 + rec_size > len(data):
-                i += 1
-                continue
+            if geom_count and geom_count < len(found):
+                found.sort()
+            yield from found
 
-            rec_data = data[i + 4:i + 4 + rec_size]
-            coord = None
-            if rec_size >= 16:
-                try:
-                    x, y = struct.unpack_from('<dd', rec_data, 0)
-                    if is_reasonable_coord(x, y):
-                        coord = (round(x, 2), round(y, 2))
-                except Exception:
-                    coord = None
-
-            for start in range(0, min(96, rec_size - 2)):
-                length = rec_data[start]
-                if not 2 <= length <= 120 or start + 1 + length > rec_size:
-                    continue
-                raw = rec_data[start + 1:start + 1 + length]
-                try:
-                    clean = normalize_text(raw.decode('cp932'))
-                except Exception:
+
+JWW_PAPER_SIZES = {0: 'A0', 1: 'A1', 2: 'A2', 3: 'A3', 4: 'A4', 8: '2A', 9: '3A', 10: '4A',
+                   11: '5A', 12: '10m', 13: '50m', 14: '100m'}
+
+
+def _jww_read_cstring(buf, pos):
+    """長さ1byte + cp932文字列を読み、(文字列, 次の位置) を返す"""
+    if pos >= len(buf):
+        return "", pos
+    length = buf[pos]
+    pos += 1
+    if pos + length > len(buf):
+        return "", pos
+    raw = buf[pos:pos + length]
+    try:
+        text = str(raw, 'cp932')
+    except UnicodeDecodeError:
+        text = str(raw, 'latin-1', errors='replace')
+    return text, pos + length
+
+
+def read_jww_header(buf):
+    """
+    JWWヘッダ（"JwwData." の直後）からバージョン・図面メモ・用紙サイズを読む。
+    Returns: {"version": int, "memo": str, "paper_size": str}
+    """
+    header = {"version": 0, "memo": "", "paper_size": ""}
+    if len(buf) < 12:
+        return header
+    header["version"] = struct.unpack_from('<I', buf, 8)[0]
+    memo, after_memo = _jww_read_cstring(buf, 12)
+    header["memo"] = memo.strip()
+    if after_memo + 4 <= len(buf):
+        zv = struct.unpack_from('<I', buf, after_memo)[0]
+        header["paper_size"] = JWW_PAPER_SIZES.get(zv, f"不明({zv})")
+    return header
+
+
+# ========== JWW文字分類エンジン ==========
+
+JWW_ROOM_KEYWORDS = (
+    '玄関', 'ホール', '廊下', 'ポーチ', '洗面', '脱衣', '浴室', '風呂', 'トイレ',
+    '便所', 'キッチン', '台所', 'ダイニング', 'リビング', '和室', '洋室',
+    '寝室', '納戸', '収納', '押入', '階段', 'バルコニー', 'ベランダ',
+    'ps', 'mb', 'cl', 'wic', 'sic', 'ldk'
+)
+
+# 寸法値（1000, 900.5, 1200x600, R250, φ100, 1000mm）。空白除去・小文字化した文字列に fullmatch する
+_JWW_DIM_RE = re.compile(
+    r'(?:(?:r|φ|d)?[+-]?\d+(?:\.\d+)?|[+-]?\d+(?:\.\d+)?x[+-]?\d+(?:\.\d+)?)(?:mm)?')
+_JWW_SPACE_RE = re.compile(r'\s+')
+# 日本語（ひらがな〜CJK統合漢字、全角英数・半角カナ）を含むか
+_JWW_JP_RE = re.compile('[぀-鿿＀-￯]')
+
+# cp932としてデコードできるバイト列（1byte文字の並び / 先行byte+後続byte）。未割当コードは
+# 通してしまうが、それはデコード時に弾かれる。match() が末尾まで届くかで判定する。
+_JWW_CP932_RE = re.compile(
+    rb'[\x00-\x80\xa0-\xdf\xfd-\xff]*(?:[\x81-\x9f\xe0-\xfc][\x40-\x7e\x80-\xfc][\x00-\x80\xa0-\xdf\xfd-\xff]*)*')
+# 2byte文字の先行byte・半角カナ（日本語になり得るバイト）
+_JWW_MB_BYTE_RE = re.compile(rb'[\x81-\x9f\xa1-\xdf\xe0-\xfc]')
+# 1byte文字だけの候補が寸法値になり得るか（数字・記号・空白と、正規化で消える印字不可文字だけ）
+_JWW_ASCII_NOISE = rb'\x00-\x1f\x7f\x80\xa0\xfd-\xff'
+_JWW_ASCII_DIM_RE = re.compile(
+    rb'[0-9+\-.xXmMrRdD ' + _JWW_ASCII_NOISE + rb']*[0-9][0-9+\-.xXmMrRdD ' + _JWW_ASCII_NOISE + rb']*')
+
+
+class KeywordAutomaton:
+    """
+    複数キーワードの部分一致をまとめて判定する Aho-Corasick オートマトン。
+    文字列を1回なぞるだけで、キーワード数に関係なく全キーワードの出現を見つけられる。
+    """
+
+    def __init__(self, keywords):
+        from collections import deque
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for kw in keywords:
+            if not kw:
+                continue
+            s = 0
+            for ch in kw:
+                nxt = self._goto[s].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                    self._goto[s][ch] = nxt
+                s = nxt
+            self._out[s] = self._out[s] + (kw,)
+
+        # ルートから遷移できる文字が現れるまでは状態0のままなので、そこまで正規表現で読み飛ばす
+        firsts = ''.join(sorted(self._goto[0]))
+        self._first = re.compile('[' + re.escape(firsts) + ']') if firsts else None
+
+        # 失敗リンクを幅優先で張り、出力を失敗先から引き継ぐ
+        queue = deque(self._goto[0].values())
+        while queue:
+            s = queue.popleft()
+            for ch, t in self._goto[s].items():
+                queue.append(t)
+                f = self._fail[s]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[t] = self._goto[f].get(ch, 0)
+                self._out[t] = self._out[t] + self._out[self._fail[t]]
+
+    def search(self, text):
+        """いずれかのキーワードを含めばTrue"""
+        m = self._first.search(text) if self._first is not None else None
+        if m is None:
+            return False
+        goto, fail, out = self._goto, self._fail, self._out
+        s = 0
+        for ch in text[m.start():]:
+            while s and ch not in goto[s]:
+                s = fail[s]
+            s = goto[s].get(ch, 0)
+            if out[s]:
+                return True
+        return False
+
+    def find_all(self, text):
+        """出現したキーワードを (終了位置, キーワード) で出現順に返す"""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = []
+        s = 0
+        for i, ch in enumerate(text):
+            while s and ch not in goto[s]:
+                s = fail[s]
+            s = goto[s].get(ch, 0)
+            for kw in out[s]:
+                found.append((i + 1, kw))
+        return found
+
+
+_JWW_CP932_NONPRINTABLE = None
+
+
+def _jww_cp932_nonprintable():
+    """cp932でデコードし得る文字のうち印字不可なもの（str.translate用の削除テーブル）"""
+    global _JWW_CP932_NONPRINTABLE
+    if _JWW_CP932_NONPRINTABLE is None:
+        table = {}
+        for a in range(256):
+            try:
+                seqs = [bytes((a,)).decode('cp932')]
+            except UnicodeDecodeError:
+                seqs = []
+                for b in range(0x40, 0x100):
+                    try:
+                        seqs.append(bytes((a, b)).decode('cp932'))
+                    except UnicodeDecodeError:
+                        pass
+            for text in seqs:
+                for c in text:
+                    if not c.isprintable():
+                        table[ord(c)] = None
+        _JWW_CP932_NONPRINTABLE = table
+    return _JWW_CP932_NONPRINTABLE
+
+
+class JwwTextClassifier:
+    """JWWの文字候補を "dim"（寸法値）/ "room"（部屋名）/ "text"（その他の日本語）に分類する"""
+
+    def __init__(self, room_keywords=JWW_ROOM_KEYWORDS, memo_size=1 << 16):
+        import functools
+        self.rooms = KeywordAutomaton(room_keywords)
+        self._nonprintable = _jww_cp932_nonprintable()
+        # 英字だけのキーワード（ps, ldk など）は、1byte文字だけの候補でもバイト列のまま探せる
+        # （文字の間に挟まる印字不可文字は正規化で消えるので読み飛ばす）
+        ascii_kws = [k for k in room_keywords if k and k.isascii()]
+        self._ascii_rooms = re.compile(b'|'.join(
+            (b'[' + _JWW_ASCII_NOISE + b']*').join(re.escape(bytes((c,))) for c in k.encode('ascii'))
+            for k in ascii_kws), re.IGNORECASE) if ascii_kws else None
+        self.normalize_for_match = functools.lru_cache(maxsize=memo_size)(self._normalize_for_match)
+        self.classify = functools.lru_cache(maxsize=memo_size)(self._classify)
+        self.decode_bytes = functools.lru_cache(maxsize=memo_size)(self._decode_uncached)
+
+    @staticmethod
+    def _normalize_for_match(text):
+        # 全角/半角ゆれを抑える（３０００ -> 3000, ＬＤＫ -> LDK）
+        import unicodedata
+        return unicodedata.normalize('NFKC', text).strip()
+
+    def _classify(self, clean):
+        if not clean:
+            return None
+        n = self.normalize_for_match(clean)
+        if _JWW_DIM_RE.fullmatch(_JWW_SPACE_RE.sub('', n).lower()):
+            return "dim"
+        if self.rooms.search(n.lower()):
+            return "room"
+        if _JWW_JP_RE.search(clean):
+            return "text"
+        return None
+
+    def _decode_uncached(self, raw):
+        try:
+            # cp932由来の文字だけなので、印字不可文字の除去は削除テーブルで一括して行える
+            clean = str(raw, 'cp932').translate(self._nonprintable).strip()
+        except UnicodeDecodeError:
+            return None
+        if len(clean) < 2:
+            return None
+        kind = self.classify(clean)
+        return (clean, kind) if kind else None
+
+    def accepts(self, buf, start, end):
+        """
+        buf[start:end] が分類される見込みがあるか、デコードせずにバイト列のまま判定する。
+        Falseなら decode_bytes() の結果は必ずNone（cp932として不正、または日本語を含まず
+        寸法値にも英字の部屋名キーワードにもなり得ない）。
+        """
+        if _JWW_CP932_RE.match(buf, start, end).end() != end:
+            return False
+        if _JWW_MB_BYTE_RE.search(buf, start, end):
+            return True
+        if _JWW_ASCII_DIM_RE.fullmatch(buf, start, end):
+            return True
+        return self._ascii_rooms is not None and self._ascii_rooms.search(buf, start, end) is not None
+
+    def decode(self, buf, start, length):
+        """
+        buf[start:start+length] をcp932文字列として読み、分類できれば (clean, kind)、
+        デコードできない・短すぎる・分類対象外ならNoneを返す。
+        """
+        end = start + length
+        if not self.accepts(buf, start, end):
+            return None
+        return self.decode_bytes(bytes(buf[start:end]))
+
+
+_JWW_TEXT_CLASSIFIER = None
+
+
+def get_jww_text_classifier():
+    """プロセス内で共有する JwwTextClassifier（メモを図面間で使い回す）"""
+    global _JWW_TEXT_CLASSIFIER
+    if _JWW_TEXT_CLASSIFIER is None:
+        _JWW_TEXT_CLASSIFIER = JwwTextClassifier()
+    return _JWW_TEXT_CLASSIFIER
+
+
+# ========== JWWエンティティ（ストリーム） ==========
+
+from collections import namedtuple
+
+
+class JwwLine(namedtuple('JwwLine', JWW_LINE_FIELDS)):
+    """線（座標・長さは小数2桁に丸め済み）"""
+    __slots__ = ()
+    entity = "line"
+
+    def as_dict(self):
+        return dict(zip(self._fields, self))
+
+
+class JwwArc(namedtuple('JwwArc', JWW_ARC_FIELDS)):
+    """円弧（角度は度）"""
+    __slots__ = ()
+    entity = "arc"
+
+    def as_dict(self):
+        return dict(zip(self._fields, self))
+
+
+class JwwText(namedtuple('JwwText', JWW_TEXT_FIELDS)):
+    """文字。kind は "dim"/"room"/"text"、基準点が無いものは x, y が None"""
+    __slots__ = ()
+    entity = "text"
+
+    def as_dict(self):
+        item = {"text": self.text, "source": self.source, "kind": self.kind}
+        if self.x is not None:
+            item["x"], item["y"] = self.x, self.y
+        return item
+
+
+def iter_jww_entities(filepath, texts=True, classifier=None):
+    """
+    JWWファイルの線・円弧・文字を JwwLine / JwwArc / JwwText として1件ずつ返すジェネレータ。
+    texts=False なら線・円弧だけを返す。classifier は省略時は共有の JwwTextClassifier。
+    Raises: OSError（開けない）/ ValueError（JWWファイルではない）
+    """
+    with JwwFile(filepath) as jf:
+        if not jf.is_jww():
+            raise ValueError("JWWファイルではありません")
+        yield from _iter_jww_file_entities(jf, texts, classifier=classifier)
+
+
+def _jww_has_text_records(jf):
+    """
+    文字系レコードが1つでもあるか（iter_record_heads の文字カーソルが見つけるものがあるか）。
+    ほとんどの図面は先頭近くで見つかる。無い図面だけ全体を正規表現で調べる
+    """
+    buf = jf.buffer
+    n = len(buf)
+    head = _JWW_REC_HEAD.unpack_from
+    text_search = _JWW_TEXT_HEAD_RE.search
+    ti = 0
+    while True:
+        m = text_search(buf, ti, n)
+        if m is None or m.start() >= n - 4:
+            return False
+        pos = m.start()
+        rec_size = head(buf, pos)[1]
+        if 6 <= rec_size <= 1024 and pos + 4 + rec_size <= n:
+            return True
+        ti = pos + 1
+
+
+def _jww_fallback_mode(jf, narrow=False):
+    """
+    フォールバックスキャンの行い方（_iter_jww_file_entities の fallback）。
+    narrow=False なら全体を調べる（True）。narrow=True なら文字系レコードが無い図面だけ、レコードの間を調べる
+    （"gaps"。文字レコードのある図面では行わない = False）
+    """
+    if not narrow:
+        return True
+    return False if _jww_has_text_records(jf) else "gaps"
+
+
+def _iter_jww_file_entities(jf, texts=True, line_offsets=None, arc_offsets=None, classifier=None,
+                            heads=None, span=None, sources=None, budget=None, fallback=True):
+    """
+    iter_jww_entities の本体。レコード位置の走査に、フォールバックスキャンを追従させる。
+    line_offsets / arc_offsets: 渡すと線・円弧はエンティティを作らず、本体の位置だけを追記する
+    heads / span: 並列解析の1区画分（走査済みのレコード位置と、フォールバックの範囲）
+    sources: 渡すとエンティティごとの元の位置を追記する（レコード由来の文字の重複は除かない）
+    budget: JwwParseBudget。打ち切られたらそこまでの結果で終える
+    fallback: True（全体を調べる）/ "gaps"（レコードの間だけ）/ False（行わない）
+    """
+    from collections import deque
+    buf = jf.buffer
+    n = len(buf)
+    line_body = _JWW_LINE_BODY.unpack_from
+    arc_body = _JWW_ARC_BODY.unpack_from
+    classifier = classifier or get_jww_text_classifier()
+    decode = classifier.decode
+    rec_len_search = _JWW_RECORD_LEN_RE.search
+    rec_seen, fb_seen = set(), set()
+
+    def record_texts(rec):
+        x = y = None
+        pos = rec.decode_text_pos()
+        if pos is not None and abs(pos[0]) < 1000000 and abs(pos[1]) < 1000000:
+            x, y = round(pos[0], 2), round(pos[1], 2)
+
+        # 本体中の長さ付きcp932文字列（JwwRecord.iter_strings と同じ範囲）
+        source = f"0x{rec.type:02x}"
+        base = rec.offset + 4
+        end = base + rec.size
+        stop = base + min(96, rec.size - 2)
+        p = base
+        while True:
+            m = rec_len_search(buf, p, stop)
+            if m is None:
+                break
+            p = m.start() + 1
+            length = buf[p - 1]
+            if p + length > end:
+                continue
+            hit = decode(buf, p, length)
+            if hit is None:
+                continue
+            if hit[0] in rec_seen:
+                if sources is None:
                     continue
-                if len(clean) < 2 or clean in seen_texts:
+            else:
+                rec_seen.add(hit[0])
+            if sources is not None:
+                sources.append(rec.offset)
+            yield JwwText(hit[0], source, hit[1], x, y)
+
+    # フォールバック: 可変長文字列スキャン（長さバイトになり得ない位置は正規表現で読み飛ばす）
+    len_search = _JWW_FALLBACK_LEN_RE.search
+    accepts = classifier.accepts
+    decode_bytes = classifier.decode_bytes
+
+    covered = deque()                   # フォールバックがまだ通っていないレコードの範囲（重なりはまとめる）
+
+    def cover(start, end):
+        if covered and start <= covered[-1][1]:
+            if end > covered[-1][1]:
+                covered[-1] = (covered[-1][0], end)
+        else:
+            covered.append((start, end))
+
+    def scan_gaps(j, limit):
+        # limit までのレコードの間だけをフォールバックで調べる
+        while covered and covered[0][0] < limit:
+            start, end = covered.popleft()
+            if j < start:
+                j = yield from scan_fallback(j, start)
+            j = max(j, end)
+        if j < limit:
+            j = yield from scan_fallback(j, limit)
+        return j
+
+    def scan_fallback(j, limit):
+        while True:
+            m = len_search(buf, j, limit)
+            if m is None:
+                return max(j, limit)
+            j = m.start()
+            length = buf[j]
+            end = min(j + 1 + length, n)
+            hit = decode_bytes(bytes(buf[j + 1:end])) if accepts(buf, j + 1, end) else None
+            if hit is not None and hit[0] not in fb_seen and hit[0] not in rec_seen:
+                fb_seen.add(hit[0])
+                if sources is not None:
+                    sources.append(j)
+                yield JwwText(hit[0], "fallback", hit[1], None, None)
+                j += 1 + length
+                continue
+            j += 1
+
+    def catch_up(j, limit):
+        # フォールバックを limit まで進める。budget があれば64KBごとに打ち切りを確かめる
+        # （レコードがまばらな区間でも、確かめずに長く走ることがないように）
+        if budget is None:
+            return (yield from scan_gaps(j, limit))
+        while j < limit and not budget.check(j):
+            j = yield from scan_gaps(j, min(j + _JWW_SCAN_CHUNK, limit))
+        return j
+
+    if not texts:
+        fallback = False
+    fi, fb_end = span if span is not None else (0, n - 2)
+    if heads is None:
+        heads = jf.iter_record_heads(None if texts else (lambda: False), stop=budget and budget.check)
+    for offset, rec_type, rec_size in heads:
+        # フォールバックは、そこより前の文字レコードがすべて処理済みの位置まで進める
+        if fallback:
+            if offset - fi >= _JWW_SCAN_CHUNK:
+                fi = yield from catch_up(fi, min(offset, fb_end))
+            if fallback == "gaps":
+                cover(offset, offset + 4 + rec_size)
+
+        if rec_type in _JWW_LINE_TYPES:
+            if rec_size < 32:
+                continue
+            if line_offsets is not None:
+                line_offsets.append(offset + 4)
+                continue
+            x1, y1, x2, y2 = line_body(buf, offset + 4)
+            if abs(x1) < 1000000 and abs(y1) < 1000000 and abs(x2) < 1000000 and abs(y2) < 1000000:
+                length = ((x2-x1)**2 + (y2-y1)**2) ** 0.5
+                if length > 0.1:
+                    if sources is not None:
+                        sources.append(offset)
+                    yield JwwLine(round(x1, 2), round(y1, 2), round(x2, 2), round(y2, 2),
+                                  round(length, 2))
+        elif rec_type in _JWW_ARC_TYPES:
+            if rec_size < 40:
+                continue
+            if arc_offsets is not None:
+                arc_offsets.append(offset + 4)
+                continue
+            cx, cy, r, sa, ea = arc_body(buf, offset + 4)
+            if abs(cx) < 1000000 and abs(cy) < 1000000 and 0 < r < 100000:
+                if sources is not None:
+                    sources.append(offset)
+                yield JwwArc(round(cx, 2), round(cy, 2), round(r, 2), round(sa, 2), round(ea, 2))
+        elif texts:
+            yield from record_texts(JwwRecord(buf, offset, rec_type, rec_size))
+    if not fallback:
+        return
+    if budget is not None and budget.reason is not None:
+        # バイト数で打ち切った場合は、その位置までフォールバックを追いつかせる（並列解析と同じ範囲）
+        if budget.reason == "bytes":
+            yield from scan_gaps(fi, min(fb_end, budget.scanned))
+        return
+    yield from catch_up(fi, fb_end)
+
+
+class JwwSummary:
+    """エンティティを1件ずつ add() して、parse_jww_full と同じ統計・insights をその場で集計する"""
+
+    def __init__(self):
+        self.lines = 0
+        self.arcs = 0
+        self.texts = 0
+        self.hv_lines = 0
+        self.door_like_arcs = 0
+        self.min_x = self.min_y = float('inf')
+        self.max_x = self.max_y = float('-inf')
+        self.dims = []
+        self._dim_keys = set()
+        self.room_counts = {}
+        self.room_labels_with_coord = 0
+        self._normalize = get_jww_text_classifier().normalize_for_match
+
+    def add(self, ent):
+        entity = ent.entity
+        if entity == "line":
+            self.add_line(ent)
+        elif entity == "arc":
+            self.add_arc(ent)
+        else:
+            self.add_text(ent)
+
+    def add_line(self, l):
+        self.lines += 1
+        x1, y1, x2, y2 = l.x1, l.y1, l.x2, l.y2
+        if x1 < self.min_x: self.min_x = x1
+        if x2 < self.min_x: self.min_x = x2
+        if y1 < self.min_y: self.min_y = y1
+        if y2 < self.min_y: self.min_y = y2
+        if x1 > self.max_x: self.max_x = x1
+        if x2 > self.max_x: self.max_x = x2
+        if y1 > self.max_y: self.max_y = y1
+        if y2 > self.max_y: self.max_y = y2
+        if abs(x2 - x1) < 1.0 or abs(y2 - y1) < 1.0:
+            self.hv_lines += 1
+
+    def add_arc(self, a):
+        self.arcs += 1
+        if _is_door_span(a.start_a, a.end_a):
+            self.door_like_arcs += 1
+
+    def add_text(self, t):
+        self.texts += 1
+        if t.kind == "dim":
+            key = self._normalize(t.text)
+            if key and key not in self._dim_keys:
+                self._dim_keys.add(key)
+                dim = {"value": t.text}
+                if t.x is not None:
+                    dim["x"], dim["y"] = t.x, t.y
+                self.dims.append(dim)
+        elif t.kind == "room":
+            name = self._normalize(t.text)
+            if name:
+                self.room_counts[name] = self.room_counts.get(name, 0) + 1
+                if t.x is not None:
+                    self.room_labels_with_coord += 1
+
+    def add_columns(self, np, line_arr, arc_arr):
+        """線・円弧の構造化配列をまとめて集計する（add_line / add_arc のベクトル演算版）"""
+        if len(line_arr):
+            x1, y1, x2, y2 = line_arr['x1'], line_arr['y1'], line_arr['x2'], line_arr['y2']
+            self.min_x = min(self.min_x, float(x1.min()), float(x2.min()))
+            self.min_y = min(self.min_y, float(y1.min()), float(y2.min()))
+            self.max_x = max(self.max_x, float(x1.max()), float(x2.max()))
+            self.max_y = max(self.max_y, float(y1.max()), float(y2.max()))
+            self.hv_lines += int(np.count_nonzero((np.abs(x2 - x1) < 1.0) | (np.abs(y2 - y1) < 1.0)))
+            self.lines += len(line_arr)
+        self.door_like_arcs += int(np.count_nonzero(_is_door_span(arc_arr['start_a'], arc_arr['end_a'])))
+        self.arcs += len(arc_arr)
+
+    def room_summary(self):
+        return [
+            {"name": name, "count": count}
+            for name, count in sorted(self.room_counts.items(), key=lambda x: (-x[1], x[0]))
+        ]
+
+    def insights(self):
+        bbox = None
+        if self.lines:
+            bbox = _jww_bbox_dict(self.min_x, self.min_y, self.max_x, self.max_y)
+        orthogonality_ratio = round(self.hv_lines / self.lines, 3) if self.lines else 0.0
+
+        drawing_type = "unknown"
+        if self.room_counts and orthogonality_ratio >= 0.45:
+            drawing_type = "floor_plan_like"
+
+        return {
+            "drawing_type": drawing_type,
+            "orthogonality_ratio": orthogonality_ratio,
+            "door_like_arcs": self.door_like_arcs,
+            "bbox": bbox,
+            "room_labels_with_coord": self.room_labels_with_coord,
+        }
+
+    def to_info(self):
+        """parse_jww_full の戻り値のうち lines/arcs/texts 以外（dims, rooms, insights, stats）"""
+        rooms = self.room_summary()
+        return {
+            "dims": self.dims,
+            "rooms": rooms,
+            "insights": self.insights(),
+            "stats": {
+                "lines": self.lines,
+                "arcs": self.arcs,
+                "texts": self.texts,
+                "dims": len(self.dims),
+                "rooms": len(rooms),
+            },
+        }
+
+
+# ========== 解析の打ち切り（時間・バイト数）と途中経過 ==========
+
+import time
+
+JWW_PARSE_SECONDS = 30          # 設定 "jww_parse_seconds" で変更（0で無制限）
+JWW_PARSE_MB = 0                # 設定 "jww_parse_mb" で変更（0で無制限）
+_JWW_PROGRESS_INTERVAL = 0.25   # 途中経過を通知する間隔(秒)
+
+
+class JwwParseBudget:
+    """
+    parse_jww_full の打ち切り条件（経過時間・走査バイト数）と途中経過の通知。
+    progress(stage, snapshot) は解析スレッドから呼ばれる:
+      "header"  {"header", "size"}
+      "scan"    {"header", "size", "scanned", "stats"}
+    """
+
+    def __init__(self, seconds=None, max_bytes=None, progress=None, interval=_JWW_PROGRESS_INTERVAL):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.progress = progress
+        self.interval = interval
+        self.reason = None
+        self.scanned = 0
+        self._size = 0
+        self._header = None
+        self._stats = None
+        self._started = self._next = 0.0
+
+    @classmethod
+    def from_config(cls, config, progress=None):
+        seconds = config.get("jww_parse_seconds", JWW_PARSE_SECONDS)
+        mb = config.get("jww_parse_mb", JWW_PARSE_MB)
+        return cls(seconds or None, int(mb * (1 << 20)) or None, progress)
+
+    def begin(self, header, size):
+        """走査を始める（計時を始め、ヘッダを通知する）"""
+        self.reason = None
+        self.scanned = 0
+        self._size = size
+        self._header = header
+        self._started = time.perf_counter()
+        self._next = self._started + self.interval
+        if self.progress is not None:
+            self.progress("header", {"header": header, "size": size})
+
+    def watch(self, stats):
+        """途中経過の件数を返す関数 stats() -> {"lines","arcs","texts"} を登録する"""
+        self._stats = stats
+
+    def check(self, pos):
+        """走査位置 pos まで進んだことを知らせる。打ち切るべきなら True（以後ずっと True）"""
+        if self.reason is not None:
+            return True
+        self.scanned = max(self.scanned, pos)
+        if self.max_bytes is not None and pos >= self.max_bytes:
+            self.reason = "bytes"
+            return True
+        now = time.perf_counter()
+        if self.seconds is not None and now - self._started >= self.seconds:
+            self.reason = "time"
+            return True
+        if self.progress is not None and now >= self._next:
+            self._next = now + self.interval
+            self.progress("scan", {"header": self._header, "size": self._size, "scanned": self.scanned,
+                                   "stats": self._stats() if self._stats is not None else {}})
+        return False
+
+    def expired(self):
+        """経過時間が上限を超えたか"""
+        return self.seconds is not None and time.perf_counter() - self._started >= self.seconds
+
+    def partial(self):
+        """打ち切っていれば {"reason","scanned","size"}、最後まで読めていればNone"""
+        if self.reason is None:
+            return None
+        return {"reason": self.reason, "scanned": self.scanned, "size": self._size}
+
+
+# ========== JWWオブジェクトストリーム（スキーマ駆動デコーダ） ==========
+# タグの形式は README の「内部の仕組み」を参照。読めなければ JwwFormatError（レコード推定に切り替える）
+
+class JwwFormatError(ValueError):
+    """JWWのオブジェクトストリームとして読めない"""
+
+
+# 全図形共通の CData 部。3つ目の要素は、その項目が現れる最小バージョン
+_JWW_DATA_FIELDS = (
+    ("group", "I"), ("pen_style", "B"), ("pen_color", "H"), ("pen_width", "H", 351),
+    ("layer", "H"), ("glayer", "H"), ("flag", "H"),
+)
+
+
+def _jww_is_marker_point(values):
+    return values["pen_style"] == 100       # 点マーカー（コード・回転・倍率を持つ）
+
+
+def _jww_has_solid_color(values):
+    return values["pen_color"] == 10        # 任意色のソリッド
+
+
+# クラス名 -> (種類, 項目)。項目の型: 'B','H','I','d'（struct）/ 'S'（CString）/ クラス名（入れ子）
+# 3つ目の要素は最小バージョン（int）または CData 部などの値を受け取る条件関数
+_JWW_CLASS_SCHEMAS = {
+    "CDataSen": ("line", _JWW_DATA_FIELDS + (
+        ("x1", "d"), ("y1", "d"), ("x2", "d"), ("y2", "d"))),
+    "CDataEnko": ("arc", _JWW_DATA_FIELDS + (
+        ("cx", "d"), ("cy", "d"), ("r", "d"), ("start_rad", "d"), ("span_rad", "d"),
+        ("tilt_rad", "d"), ("flatness", "d"), ("full_circle", "I"))),
+    "CDataTen": ("point", _JWW_DATA_FIELDS + (
+        ("x", "d"), ("y", "d"), ("temporary", "I"),
+        ("code", "I", _jww_is_marker_point), ("angle_rad", "d", _jww_is_marker_point),
+        ("scale", "d", _jww_is_marker_point))),
+    "CDataMoji": ("text", _JWW_DATA_FIELDS + (
+        ("x1", "d"), ("y1", "d"), ("x2", "d"), ("y2", "d"), ("moji_type", "I"),
+        ("size_x", "d"), ("size_y", "d"), ("spacing", "d"), ("angle_deg", "d"),
+        ("font", "S"), ("text", "S"))),
+    "CDataSunpou": ("dim", _JWW_DATA_FIELDS + (
+        ("line", "CDataSen"), ("moji", "CDataMoji"), ("sxf_mode", "H", 420),
+        ("aux_line1", "CDataSen", 420), ("aux_line2", "CDataSen", 420),
+        ("point1", "CDataTen", 420), ("point2", "CDataTen", 420),
+        ("aux_point1", "CDataTen", 420), ("aux_point2", "CDataTen", 420))),
+    "CDataSolid": ("solid", _JWW_DATA_FIELDS + (
+        ("x1", "d"), ("y1", "d"), ("x4", "d"), ("y4", "d"),
+        ("x2", "d"), ("y2", "d"), ("x3", "d"), ("y3", "d"),
+        ("color", "I", _jww_has_solid_color))),
+    "CDataBlock": ("block", _JWW_DATA_FIELDS + (
+        ("x", "d"), ("y", "d"), ("scale_x", "d"), ("scale_y", "d"), ("angle_rad", "d"),
+        ("number", "I"))),
+}
+
+_JWW_CLASS_NAMES = frozenset(name.encode('ascii') for name in _JWW_CLASS_SCHEMAS)
+_JWW_CLASS_TAG_RE = re.compile(rb'\xff\xff[\x00-\xff]{2}([\x05-\x20])\x00(CData[A-Za-z]+)')
+_JWW_TAG = struct.Struct('<H')
+_JWW_BIG_TAG = struct.Struct('<I')
+_JWW_LAYER_GROUP = struct.Struct('<IIdI' + 'II' * 16)   # 状態, 書込レイヤ, 縮尺, プロテクト, 16レイヤ分
+_JWW_HEADER_SETTINGS = 156     # レイヤグループの後ろ、レイヤ名までの設定項目（寸法・印刷・目盛）のバイト数
+
+
+def _jww_read_mfc_string(buf, pos, decode=True):
+    """
+    MFC CArchive の CString（長さ BYTE / 0xFF+WORD / 0xFF+0xFFFF+DWORD、0xFF+0xFFFE はUnicode）を読み、
+    (文字列, 次の位置) を返す。decode=False なら文字列はNone（読み飛ばすだけ）。
+    """
+    n = len(buf)
+    wide = False
+    while True:
+        if pos >= n:
+            raise JwwFormatError("文字列が途中で切れています")
+        length = buf[pos]
+        pos += 1
+        if length == 0xFF:
+            if pos + 2 > n:
+                raise JwwFormatError("文字列が途中で切れています")
+            length = _JWW_TAG.unpack_from(buf, pos)[0]
+            pos += 2
+            if length == 0xFFFE and not wide:
+                wide = True             # Unicode印のあとに長さ（文字数）が改めて続く
+                continue
+            if length == 0xFFFF:
+                if pos + 4 > n:
+                    raise JwwFormatError("文字列が途中で切れています")
+                length = _JWW_BIG_TAG.unpack_from(buf, pos)[0]
+                pos += 4
+        break
+    end = pos + (length * 2 if wide else length)
+    if end > n:
+        raise JwwFormatError("文字列が途中で切れています")
+    if not decode:
+        return None, end
+    return str(buf[pos:end], 'utf-16-le' if wide else 'cp932', errors='replace'), end
+
+
+class _JwwClassSchema:
+    """_JWW_CLASS_SCHEMAS の1クラスを、あるバージョン向けの読み出し手順に組み立てたもの"""
+
+    def __init__(self, name, version, schemas):
+        self.name = name
+        self.kind, fields = _JWW_CLASS_SCHEMAS[name]
+        steps = []
+        run_fmt, run_names = '', []
+
+        def flush():
+            nonlocal run_fmt, run_names
+            if run_names:
+                steps.append(("struct", struct.Struct('<' + run_fmt), tuple(run_names)))
+            run_fmt, run_names = '', []
+
+        for field in fields:
+            fname, ftype = field[0], field[1]
+            cond = field[2] if len(field) > 2 else None
+            if isinstance(cond, int):
+                if version < cond:
                     continue
-                append_text(clean, f"0x{rec_type:02x}", coord)
+                cond = None
+            if ftype in ('B', 'H', 'I', 'd') and cond is None:
+                run_fmt += ftype
+                run_names.append(fname)
+                continue
+            flush()
+            if ftype == 'S':
+                steps.append(("str", fname))
+            elif ftype in ('B', 'H', 'I', 'd'):
+                steps.append(("cond", cond, struct.Struct('<' + ftype), fname))
+            else:
+                steps.append(("obj", fname, schemas(ftype)))
+        flush()
+        self.steps = steps
+        # 全項目が固定長なら大きさは一定。レイヤ番号は CData 部の決まった位置にある
+        self.size = steps[0][1].size if len(steps) == 1 else None
+        self._layer_at = struct.Struct('<HH').unpack_from
+        self._layer_offset = 7 + (2 if version >= 351 else 0)
+
+    def decode(self, buf, pos, strings=True):
+        """pos からオブジェクト本体を読み、(項目の辞書, 次の位置) を返す"""
+        values = {}
+        for step in self.steps:
+            op = step[0]
+            if op == "struct":
+                st = step[1]
+                if pos + st.size > len(buf):
+                    raise JwwFormatError(f"{self.name} が途中で切れています")
+                values.update(zip(step[2], st.unpack_from(buf, pos)))
+                pos += st.size
+            elif op == "str":
+                values[step[1]], pos = _jww_read_mfc_string(buf, pos, strings)
+            elif op == "cond":
+                if step[1](values):
+                    st = step[2]
+                    if pos + st.size > len(buf):
+                        raise JwwFormatError(f"{self.name} が途中で切れています")
+                    values[step[3]] = st.unpack_from(buf, pos)[0]
+                    pos += st.size
+            else:
+                values[step[1]], pos = step[2].decode(buf, pos, strings)
+        return values, pos
 
-            i += 4 + rec_size
-        except Exception:
-            i += 1
-
-    # fallback: 可変長文字列スキャン
-    j = 0
-    while j < len(data) - 2 and len(texts) < 500:
-        length = data[j]
-        if 2 <= length <= 80:
-            chunk = data[j+1:j+1+length]
-            try:
-                clean = normalize_text(chunk.decode('cp932'))
-                if len(clean) >= 2 and clean not in seen_texts:
-                    append_text(clean, "fallback")
-                    if clean in seen_texts:
-                        j += 1 + length
-                        continue
-            except Exception:
-                pass
-        j += 1
-
-    # 重複整理
-    seen_dim = set()
-    dedup_dims = []
-    for d in dims:
-        key = normalize_for_match(d.get('value', ''))
-        if not key or key in seen_dim:
-            continue
-        seen_dim.add(key)
-        dedup_dims.append(d)
-    dims = dedup_dims
-
-    room_counts = {}
-    room_labels_with_coord = 0
-    for r in rooms:
-        name = normalize_for_match(r['name'])
-        if not name:
+    def locate(self, buf, pos):
+        """本体を読まずに (レイヤグループ, レイヤ, 次の位置) を返す（索引作り用）"""
+        if self.size is not None:
+            end = pos + self.size
+            if end > len(buf):
+                raise JwwFormatError(f"{self.name} が途中で切れています")
+            layer, glayer = self._layer_at(buf, pos + self._layer_offset)
+            return glayer, layer, end
+        values, end = self.decode(buf, pos, strings=False)
+        return values["glayer"], values["layer"], end
+
+
+JwwObject = namedtuple('JwwObject', ('kind', 'cls', 'glayer', 'layer', 'offset', 'values'))
+JwwObject.__doc__ = "オブジェクトストリームの図形1件。values はクラスのスキーマどおりの項目の辞書"
+
+
+def _jww_read_archive_header(buf):
+    """
+    "JwwData." に続くヘッダから、バージョン・メモ・用紙・レイヤグループ／レイヤの状態と名前を読む。
+    レイヤ名は途中の設定項目を読み飛ばした先にあり、読めなかった場合は空文字のままにする。
+    Returns: (header_dict, レイヤ名の直後の位置 or レイヤグループの直後の位置)
+    """
+    n = len(buf)
+    if n < 12 or buf[:7] != b'JwwData':
+        raise JwwFormatError("JWWファイルではありません")
+    version = _JWW_BIG_TAG.unpack_from(buf, 8)[0]
+    memo, pos = _jww_read_mfc_string(buf, 12)
+    if pos + 8 + 16 * _JWW_LAYER_GROUP.size > n:
+        raise JwwFormatError("ヘッダが途中で切れています")
+    paper, write_group = struct.unpack_from('<II', buf, pos)
+    pos += 8
+    groups = []
+    for g in range(16):
+        v = _JWW_LAYER_GROUP.unpack_from(buf, pos)
+        pos += _JWW_LAYER_GROUP.size
+        groups.append({
+            "state": v[0], "write_layer": v[1], "scale": v[2], "protect": v[3], "name": "",
+            "layers": [{"state": v[4 + 2 * k], "protect": v[5 + 2 * k], "name": ""} for k in range(16)],
+        })
+    header = {"version": version, "memo": memo.strip(), "paper_size": JWW_PAPER_SIZES.get(paper, f"不明({paper})"),
+              "write_group": write_group, "groups": groups}
+
+    try:
+        p = pos + _JWW_HEADER_SETTINGS
+        names = []
+        for _ in range(16 * 16 + 16):
+            name, p = _jww_read_mfc_string(buf, p)
+            if len(name) > 64 or '\ufffd' in name:     # レイヤ名らしくない → 位置がずれている
+                return header, pos
+            names.append(name)
+    except JwwFormatError:
+        return header, pos
+    for g in range(16):
+        for k in range(16):
+            groups[g]["layers"][k]["name"] = names[g * 16 + k].strip()
+        groups[g]["name"] = names[256 + g].strip()
+    return header, p
+
+
+class JwwArchive:
+    """
+    JWWファイルのオブジェクトストリームをスキーマに沿って読む。
+
+        archive = JwwArchive.open(jf.buffer)      # オブジェクトストリームが無ければNone
+        for obj in archive.iter_objects(layers=[(0, 1)]):
+            ...
+    """
+
+    def __init__(self, buf):
+        self.buffer = buf
+        self.header, after = _jww_read_archive_header(buf)
+        self.version = self.header["version"]
+        self.start, self.count, self.count_pos = self._locate(after)
+        self._schemas = {}
+        self._index = None
+
+    @classmethod
+    def open(cls, buf):
+        """オブジェクトストリームとして読めればインスタンス、読めなければNone"""
+        try:
+            return cls(buf)
+        except JwwFormatError:
+            return None
+
+    def _locate(self, pos):
+        """最初の新クラスタグを探し、(先頭オブジェクトの位置, 件数, 件数の位置) を返す"""
+        buf = self.buffer
+        while True:
+            m = _JWW_CLASS_TAG_RE.search(buf, pos)
+            if m is None:
+                raise JwwFormatError("図形データが見つかりません")
+            pos = m.start() + 1
+            if m.group(2) not in _JWW_CLASS_NAMES or len(m.group(2)) != m.group(1)[0] or m.start() < 2:
+                continue
+            start = count_pos = m.start()
+            count_pos -= 2
+            count = _JWW_TAG.unpack_from(buf, start - 2)[0]
+            if start >= 6 and _JWW_TAG.unpack_from(buf, start - 6)[0] == 0xFFFF:
+                big = _JWW_BIG_TAG.unpack_from(buf, start - 4)[0]
+                if big >= 0xFFFF:
+                    count, count_pos = big, start - 6
+            if count == 0:
+                continue
+            return start, count, count_pos
+
+    def schema(self, name):
+        s = self._schemas.get(name)
+        if s is None:
+            if name not in _JWW_CLASS_SCHEMAS:
+                raise JwwFormatError(f"未対応のクラスです: {name}")
+            s = self._schemas[name] = _JwwClassSchema(name, self.version, self.schema)
+        return s
+
+    def _iter_tags(self, resume=None, trace=None):
+        """
+        オブジェクト列のクラスタグを読み、本体を持つオブジェクトごとに (スキーマ, 本体の位置) を返す。
+        呼び出し側は send(本体の次の位置) で読み終えた位置を知らせる。
+        """
+        buf = self.buffer
+        n = len(buf)
+        if resume is None:
+            # CArchive の読込済みテーブル（クラスはスキーマ、オブジェクトはTrue）
+            pos, first, loaded = self.start, 0, [None]
+        else:
+            pos, first, loaded = resume
+        for ordinal in range(first, self.count):
+            tag_pos = pos
+            if pos + 2 > n:
+                raise JwwFormatError("図形データが途中で切れています")
+            tag = _JWW_TAG.unpack_from(buf, pos)[0]
+            pos += 2
+            if tag == 0x7FFF:
+                if pos + 4 > n:
+                    raise JwwFormatError("図形データが途中で切れています")
+                big = _JWW_BIG_TAG.unpack_from(buf, pos)[0]
+                pos += 4
+                is_class, index = big & 0x80000000, big & 0x7FFFFFFF
+            else:
+                is_class, index = tag & 0x8000, tag & 0x7FFF
+            if tag == 0xFFFF:
+                if pos + 4 > n:
+                    raise JwwFormatError("図形データが途中で切れています")
+                name_len = _JWW_TAG.unpack_from(buf, pos + 2)[0]
+                name = str(buf[pos + 4:pos + 4 + name_len], 'ascii', errors='replace')
+                pos += 4 + name_len
+                schema = self.schema(name)
+                loaded.append(schema)
+                if trace is not None:
+                    trace.classes.append((tag_pos, len(loaded) - 1, name))
+            elif is_class:
+                schema = loaded[index] if index < len(loaded) else None
+                if not isinstance(schema, _JwwClassSchema):
+                    raise JwwFormatError(f"不正なクラス参照です: {index}")
+            else:
+                continue            # NULL / 読込済みオブジェクトへの参照（本体なし）
+            loaded.append(True)
+            if trace is not None:
+                trace.tags.append(tag_pos)
+                trace.ordinals.append(ordinal)
+            pos = yield schema, pos
+        if trace is not None:
+            trace.end = pos
+
+    def resume_state(self, tag_pos, ordinal, objects, classes):
+        """
+        列の途中のオブジェクト（タグの位置 tag_pos、通し番号 ordinal）から読むための _iter_tags の resume を作る。
+        objects はそれより前の本体を持つオブジェクトの件数、classes はそれより前のクラス定義
+        （JwwArchiveLayout.classes と同じ (タグの位置, 番号, クラス名)）。
+        """
+        loaded = [True] * (1 + objects + len(classes))
+        loaded[0] = None
+        for _, slot, name in classes:
+            loaded[slot] = self.schema(name)
+        return tag_pos, ordinal, loaded
+
+    def iter_objects(self, layers=None, budget=None, trace=None):
+        """
+        図形を JwwObject としてファイル順に返す。layers を指定するとそのレイヤだけをデコードする。
+        Raises: JwwFormatError
+        """
+        buf = self.buffer
+        next_check = 0 if budget is not None else len(buf) + 1
+        if layers is not None:
+            for offset, schema, _ in self.pick_layers(layers, budget):
+                if offset >= next_check:
+                    if budget.check(offset):
+                        return
+                    next_check = offset + _JWW_SCAN_CHUNK
+                values, _ = schema.decode(buf, offset)
+                yield JwwObject(schema.kind, schema.name, values["glayer"], values["layer"], offset, values)
+            return
+
+        tags = self._iter_tags(trace=trace)
+        try:
+            schema, pos = next(tags)
+            while True:
+                if pos >= next_check:
+                    if budget.check(pos):
+                        return
+                    next_check = pos + _JWW_SCAN_CHUNK
+                values, end = schema.decode(buf, pos)
+                yield JwwObject(schema.kind, schema.name, values["glayer"], values["layer"], pos, values)
+                schema, pos = tags.send(end)
+        except StopIteration:
+            return
+
+    def layer_index(self, budget=None):
+        """
+        {(レイヤグループ, レイヤ): (本体の位置のarray('q'), スキーマのリスト)} を返す。
+        本体は読み飛ばす（固定長のクラスは大きさだけで進む）ので、全体のデコードより軽い。
+        budget で打ち切られた場合は、そこまでの索引を返す（保持はしない）。
+        """
+        from array import array
+        if self._index is not None:
+            return self._index
+        index = {}
+        for pos, schema, key in zip(*self.object_index(budget)):
+            entry = index.get(key)
+            if entry is None:
+                entry = index[key] = (array('q'), [])
+            entry[0].append(pos)
+            entry[1].append(schema)
+        if budget is None or budget.reason is None:
+            self._index = index
+        return index
+
+    def object_index(self, budget=None, trace=None):
+        """
+        全オブジェクトの (本体の位置のarray('q'), スキーマのリスト, (レイヤグループ, レイヤ) のリスト) を
+        ファイル順に返す。読み方は layer_index と同じ。trace は _iter_tags と同じ。
+        """
+        from array import array
+        buf = self.buffer
+        next_check = 0 if budget is not None else len(buf) + 1
+        offsets, schemas, keys = array('q'), [], []
+        tags = self._iter_tags(trace=trace)
+        try:
+            schema, pos = next(tags)
+            while True:
+                if pos >= next_check:
+                    if budget.check(pos):
+                        break
+                    next_check = pos + _JWW_SCAN_CHUNK
+                glayer, layer, end = schema.locate(buf, pos)
+                offsets.append(pos)
+                schemas.append(schema)
+                keys.append((glayer, layer))
+                schema, pos = tags.send(end)
+        except StopIteration:
+            pass
+        return offsets, schemas, keys
+
+    def pick_layers(self, layers, budget=None):
+        """layers の図形の (本体の位置, スキーマ, (レイヤグループ, レイヤ)) をファイル順のリストで返す"""
+        index = self.layer_index(budget)
+        picked = []
+        for key in set(layers):
+            entry = index.get(key)
+            if entry:
+                picked.extend((offset, schema, key) for offset, schema in zip(entry[0], entry[1]))
+        picked.sort(key=lambda item: item[0])
+        return picked
+
+    def layer_name(self, glayer, layer):
+        try:
+            return self.header["groups"][glayer]["layers"][layer]["name"]
+        except (IndexError, KeyError):
+            return ""
+
+
+def _jww_object_entities(obj, classify):
+    """JwwObject を parse_jww_full の線・円弧・文字（JwwLine / JwwArc / JwwText）にする"""
+    import math
+    v = obj.values
+    kind = obj.kind
+    if kind == "line":
+        x1, y1, x2, y2 = v["x1"], v["y1"], v["x2"], v["y2"]
+        yield JwwLine(round(x1, 2), round(y1, 2), round(x2, 2), round(y2, 2),
+                      round(math.hypot(x2 - x1, y2 - y1), 2))
+    elif kind == "arc":
+        if v["full_circle"]:
+            sa, ea = 0.0, 360.0
+        else:
+            sa = math.degrees(v["start_rad"]) % 360
+            ea = (sa + math.degrees(v["span_rad"])) % 360
+        yield JwwArc(round(v["cx"], 2), round(v["cy"], 2), round(v["r"], 2), round(sa, 2), round(ea, 2))
+    elif kind == "text":
+        text = v["text"].strip()
+        if text and not text.startswith("^@"):      # "^@" で始まるものは画像などの埋め込み指定
+            yield JwwText(text, obj.cls, classify(text) or "text", round(v["x1"], 2), round(v["y1"], 2))
+    elif kind == "dim":
+        moji = v["moji"]
+        text = moji["text"].strip()
+        if text:
+            yield JwwText(text, obj.cls, "dim", round(moji["x1"], 2), round(moji["y1"], 2))
+
+
+def _jww_layer_key(key):
+    """(レイヤグループ, レイヤ) を1つの整数にする（JwwArchiveLayout.layer_keys 用）"""
+    return key[0] << 16 | key[1]
+
+
+def _jww_layer_counts(keys):
+    """_jww_layer_key の整数の並びから {(レイヤグループ, レイヤ): 図形数} を作る"""
+    counts = {}
+    for k in keys:
+        counts[k] = counts.get(k, 0) + 1
+    return {(k >> 16, k & 0xFFFF): c for k, c in counts.items()}
+
+
+def _collect_archive_entities(archive, np=None, layers=None, budget=None, layout=None):
+    """
+    _collect_jww_entities のオブジェクトストリーム版。
+    Returns: (lines, arcs, texts, summary, layer_counts, broken)  broken は読めなくなった位置 or None
+    Raises: JwwFormatError（1件も読めない）
+    """
+    summary = JwwSummary()
+    classify = get_jww_text_classifier().classify
+    lines, arcs, texts = [], [], []
+    counts = {}
+    if budget is not None:
+        budget.watch(lambda: {"lines": len(lines), "arcs": len(arcs), "texts": len(texts)})
+    if layout is not None:
+        sources = {"line": layout.line_src, "arc": layout.arc_src, "text": layout.text_src}
+    broken = last = None
+    try:
+        for obj in archive.iter_objects(layers, budget, layout):
+            last = obj.offset
+            key = (obj.glayer, obj.layer)
+            counts[key] = counts.get(key, 0) + 1
+            if layout is not None:
+                layout.layer_keys.append(_jww_layer_key(key))
+            for ent in _jww_object_entities(obj, classify):
+                entity = ent.entity
+                if layout is not None:
+                    sources[entity].append(last)
+                if entity == "text":
+                    summary.add_text(ent)
+                    texts.append(ent.as_dict())
+                elif np is not None:
+                    (lines if entity == "line" else arcs).append(ent)
+                else:
+                    summary.add(ent)
+                    (lines if entity == "line" else arcs).append(ent.as_dict())
+    except JwwFormatError:
+        if last is None:
+            raise
+        broken = last      # 途中で切れた・壊れた図面は、読めたところまでを使う
+
+    if np is not None:
+        line_array = np.array(lines, dtype=[(f, 'f8') for f in JWW_LINE_FIELDS])
+        arc_array = np.array(arcs, dtype=[(f, 'f8') for f in JWW_ARC_FIELDS])
+        summary.add_columns(np, line_array, arc_array)
+        lines, arcs = JwwColumnView(line_array), JwwColumnView(arc_array)
+    return lines, arcs, texts, summary, counts, broken
+
+
+# ========== 並列解析（大きな図面向け） ==========
+
+_JWW_PARALLEL_MIN_BYTES = 8 << 20     # これより小さいファイルは直列で解析する
+_JWW_SHARDS_PER_WORKER = 4            # 負荷の偏りを均すため、ワーカー数より細かく区切る
+
+
+def _jww_parse_shard(filepath, shm_name, first, last, span, columnar, with_sources=False, fallback=True):
+    """並列解析のワーカー。レコード位置 [first, last) と範囲 span を処理して (エンティティ, 線の位置, 円弧の位置, 元の位置) を返す"""
+    from array import array
+    from multiprocessing import shared_memory
+    # プール内のワーカーは親と同じ resource_tracker を使うので、接続しても解放の管理は親側に残る
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        table = shm.buf.cast('q')
+        flat = table[first * 3:last * 3].tolist()
+        table.release()
+    finally:
+        shm.close()
+    heads = zip(flat[0::3], flat[1::3], flat[2::3])
+
+    line_offsets = array('q') if columnar else None
+    arc_offsets = array('q') if columnar else None
+    sources = array('q') if with_sources else None
+    with JwwFile(filepath) as jf:
+        entities = list(_iter_jww_file_entities(jf, True, line_offsets, arc_offsets,
+                                                heads=heads, span=span, sources=sources, fallback=fallback))
+    return (entities,
+            line_offsets.tobytes() if columnar else b'',
+            arc_offsets.tobytes() if columnar else b'',
+            sources.tobytes() if with_sources else b'')
+
+
+def _jww_shard_ranges(offsets, n, shards):
+    """
+    レコード位置(offsetの配列)をバイト数がほぼ均等な区画に分ける。
+    Returns: [(first, last, (fallback開始, fallback終了)), ...]
+    """
+    import bisect
+    count = len(offsets)
+    cuts = [0]
+    for k in range(1, shards):
+        idx = bisect.bisect_left(offsets, n * k // shards)
+        if cuts[-1] < idx < count:
+            cuts.append(idx)
+    cuts.append(count)
+
+    ranges = []
+    for first, last in zip(cuts, cuts[1:]):
+        start = 0 if first == 0 else offsets[first]
+        end = n - 2 if last == count else offsets[last]
+        ranges.append((first, last, (start, end)))
+    return ranges
+
+
+def _iter_jww_entities_parallel(jf, workers, line_offsets=None, arc_offsets=None, sources=None,
+                                head_table=None, budget=None, fallback=True):
+    """
+    _iter_jww_file_entities の並列版。区画ごとの結果をファイル順に返す。
+    head_table: 渡すと走査したレコード位置を (offset, type, size) の順に平たく追記する
+    """
+    from array import array
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    table = array('q')
+    for head in jf.iter_record_heads(stop=budget and budget.check):
+        table.extend(head)
+    if head_table is not None:
+        head_table.extend(table)
+    offsets = table[0::3]
+    limit = len(jf) if budget is None or budget.reason is None else budget.scanned + 2
+    ranges = _jww_shard_ranges(offsets, limit, workers * _JWW_SHARDS_PER_WORKER)
+    columnar = line_offsets is not None
+
+    shm = shared_memory.SharedMemory(create=True, size=max(len(table) * table.itemsize, 8))
+    try:
+        view = shm.buf.cast('q')
+        view[:len(table)] = table
+        view.release()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_jww_parse_shard, jf.filepath, shm.name, first, last, span, columnar,
+                                   sources is not None, fallback)
+                       for first, last, span in ranges]
+            results = []
+            for (_, _, span), future in zip(ranges, futures):
+                result = _jww_shard_result(future, budget, span[0])
+                if result is None:
+                    budget.scanned = span[0]
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    break
+                results.append(result)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    # 連結と重複除外（区画内で済んでいない、区画をまたぐ重複を落とす）
+    # sources を渡された場合は直列と同じく除外せずに返す
+    accept = _jww_text_dedupe() if sources is None else None
+    for entities, lines_raw, arcs_raw, sources_raw in results:
+        if columnar:
+            line_offsets.frombytes(lines_raw)
+            arc_offsets.frombytes(arcs_raw)
+        if sources is not None:
+            sources.frombytes(sources_raw)
+            yield from entities
             continue
-        room_counts[name] = room_counts.get(name, 0) + 1
-        if 'x' in r and 'y' in r:
-            room_labels_with_coord += 1
-    room_summary = [
-        {"name": name, "count": count}
-        for name, count in sorted(room_counts.items(), key=lambda x: (-x[1], x[0]))
-    ]
-
-    # 図面理解に有効な幾何学ヒント
-    bbox = None
-    if lines:
-        xs = [l['x1'] for l in lines] + [l['x2'] for l in lines]
-        ys = [l['y1'] for l in lines] + [l['y2'] for l in lines]
-        min_x, max_x = min(xs), max(xs)
-        min_y, max_y = min(ys), max(ys)
-        bbox = {
-            "min_x": round(min_x, 2), "min_y": round(min_y, 2),
-            "max_x": round(max_x, 2), "max_y": round(max_y, 2),
-            "width": round(max_x - min_x, 2), "height": round(max_y - min_y, 2),
-        }
+        for ent in entities:
+            if ent.entity != "text" or accept(ent):
+                yield ent
 
-    hv = 0
-    for l in lines:
-        dx = abs(l['x2'] - l['x1'])
-        dy = abs(l['y2'] - l['y1'])
-        if dx < 1.0 or dy < 1.0:
-            hv += 1
-    orthogonality_ratio = round((hv / len(lines)), 3) if lines else 0.0
-
-    door_like_arcs = 0
-    for a in arcs:
-        span = (a['end_a'] - a['start_a']) % 360
-        if 80 <= span <= 100:
-            door_like_arcs += 1
-
-    drawing_type = "unknown"
-    if room_summary and orthogonality_ratio >= 0.45:
-        drawing_type = "floor_plan_like"
-
-    insights = {
-        "drawing_type": drawing_type,
-        "orthogonality_ratio": orthogonality_ratio,
-        "door_like_arcs": door_like_arcs,
-        "bbox": bbox,
-        "room_labels_with_coord": room_labels_with_coord,
+
+def _jww_shard_result(future, budget, pos):
+    """区画の結果を待つ。budget の時間切れになった場合はNone（pos はその区画の先頭位置）"""
+    from concurrent.futures import TimeoutError as FutureTimeout
+    if budget is None or budget.seconds is None:
+        return future.result()
+    while True:
+        try:
+            return future.result(timeout=budget.interval)
+        except FutureTimeout:
+            budget.check(pos)           # 途中経過の通知
+            if budget.expired():
+                budget.reason = "time"
+                return None
+
+
+def _jww_archive_shard(filepath, names, kinds, offsets_raw):
+    """
+    オブジェクトストリームの並列解析のワーカー。offsets_raw（array('q') のbytes）の位置のオブジェクトを
+    names[kinds[i]] のスキーマでデコードし、(線, 円弧, 文字, 線の元の位置, 円弧の元の位置, 文字の元の位置) を返す。
+    線・円弧は JWW_LINE_FIELDS / JWW_ARC_FIELDS の順に float64 を並べたbytes、文字はタプルのリスト。
+    """
+    from array import array
+    offsets = array('q')
+    offsets.frombytes(offsets_raw)
+    values = {"line": array('d'), "arc": array('d')}
+    texts = []
+    sources = {"line": array('q'), "arc": array('q'), "text": array('q')}
+    classify = get_jww_text_classifier().classify
+    with JwwFile(filepath) as jf:
+        buf = jf.buffer
+        archive = JwwArchive(buf)
+        schemas = [archive.schema(name) for name in names]
+        for offset, kind in zip(offsets, kinds):
+            schema = schemas[kind]
+            obj_values, _ = schema.decode(buf, offset)
+            obj = JwwObject(schema.kind, schema.name, obj_values["glayer"], obj_values["layer"], offset,
+                            obj_values)
+            for ent in _jww_object_entities(obj, classify):
+                entity = ent.entity
+                sources[entity].append(offset)
+                if entity == "text":
+                    texts.append(tuple(ent))
+                else:
+                    values[entity].extend(ent)
+    return (values["line"].tobytes(), values["arc"].tobytes(), texts,
+            sources["line"].tobytes(), sources["arc"].tobytes(), sources["text"].tobytes())
+
+
+def _collect_archive_parallel(archive, filepath, workers, np=None, layers=None, budget=None, layout=None):
+    """
+    _collect_archive_entities の並列版。戻り値・layout の扱いは直列と同じ。
+    Raises: JwwFormatError（呼び出し側で直列に読み直す）、OSError / RuntimeError
+    """
+    from array import array
+    from concurrent.futures import ProcessPoolExecutor
+
+    if layers is None:
+        offsets, schemas, keys = archive.object_index(budget, layout)
+    else:
+        picked = archive.pick_layers(layers, budget)
+        offsets = array('q', (offset for offset, _, _ in picked))
+        schemas = [schema for _, schema, _ in picked]
+        keys = [key for _, _, key in picked]
+    names = sorted({schema.name for schema in schemas})
+    number = {name: i for i, name in enumerate(names)}
+    kinds = bytes(number[schema.name] for schema in schemas)
+    limit = len(archive.buffer) if budget is None or budget.reason is None else budget.scanned + 1
+    ranges = _jww_shard_ranges(offsets, limit, workers * _JWW_SHARDS_PER_WORKER)
+
+    results = []
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_jww_archive_shard, filepath, names, kinds[first:last],
+                               offsets[first:last].tobytes())
+                   for first, last, _ in ranges]
+        for (first, last, _), future in zip(ranges, futures):
+            result = _jww_shard_result(future, budget, offsets[first])
+            if result is None:
+                budget.scanned = offsets[first]
+                pool.shutdown(wait=False, cancel_futures=True)
+                break
+            results.append(result)
+            done = last
+
+    summary = JwwSummary()
+    line_raw = b''.join(r[0] for r in results)
+    arc_raw = b''.join(r[1] for r in results)
+    texts = []
+    for r in results:
+        for row in r[2]:
+            t = JwwText(*row)
+            summary.add_text(t)
+            texts.append(t.as_dict())
+    if np is not None:
+        line_array = np.frombuffer(line_raw, dtype=[(f, 'f8') for f in JWW_LINE_FIELDS]).copy()
+        arc_array = np.frombuffer(arc_raw, dtype=[(f, 'f8') for f in JWW_ARC_FIELDS]).copy()
+        summary.add_columns(np, line_array, arc_array)
+        lines, arcs = JwwColumnView(line_array), JwwColumnView(arc_array)
+    else:
+        lines, arcs = [], []
+        for raw, out, cls in ((line_raw, lines, JwwLine), (arc_raw, arcs, JwwArc)):
+            flat = array('d')
+            flat.frombytes(raw)
+            width = len(cls._fields)
+            for i in range(0, len(flat), width):
+                ent = cls(*flat[i:i + width])
+                summary.add(ent)
+                out.append(ent.as_dict())
+    counts = {}
+    for key in keys[:done]:
+        counts[key] = counts.get(key, 0) + 1
+    if layout is not None:
+        for r in results:
+            layout.line_src.frombytes(r[3])
+            layout.arc_src.frombytes(r[4])
+            layout.text_src.frombytes(r[5])
+        layout.layer_keys.extend(_jww_layer_key(key) for key in keys[:done])
+    return lines, arcs, texts, summary, counts, None
+
+
+def _jww_text_dedupe():
+    """
+    文字の重複除外を、直列解析（_iter_jww_file_entities）と同じ規則で行う関数を返す。
+    レコード由来はレコード由来同士で、フォールバックは両方と照合する。
+    accept(text) が True のものだけを残す（出現順に呼ぶこと）。
+    """
+    rec_seen, fb_seen = set(), set()
+
+    def accept(t):
+        if t.source == "fallback":
+            if t.text in fb_seen or t.text in rec_seen:
+                return False
+            fb_seen.add(t.text)
+        else:
+            if t.text in rec_seen:
+                return False
+            rec_seen.add(t.text)
+        return True
+
+    return accept
+
+
+# ========== 列指向ジオメトリ（NumPy使用時） ==========
+
+
+def _import_numpy():
+    """NumPyがインストールされていれば返す。無ければNone（列指向の解析は使わない）"""
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+def _gather_jww_doubles(np, buf, offsets, count):
+    """各オフセットから count 個の little-endian double をまとめて読み出し (N, count) で返す"""
+    if not offsets:
+        return np.empty((0, count))
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    idx = np.frombuffer(offsets, dtype=np.int64)[:, None] + np.arange(count * 8)
+    return raw[idx].view('<f8').reshape(len(offsets), count).astype(np.float64)
+
+
+def _jww_kept_heads(np, offsets, ok, kept):
+    """採用した行の元レコード先頭位置（本体位置-4）を kept（array('q')）に追記する"""
+    if kept is not None and len(offsets):
+        kept.extend((np.frombuffer(offsets, dtype=np.int64)[ok] - 4).tolist())
+
+
+def _jww_line_columns(np, buf, offsets, kept=None):
+    """
+    線レコードを構造化配列 (x1, y1, x2, y2, length) に変換する。座標の妥当性判定も一括で行う。
+    kept を渡すと、採用した線の元レコード位置をそこへ追記する。
+    """
+    v = _gather_jww_doubles(np, buf, offsets, 4)
+    x1, y1, x2, y2 = v.T
+    with np.errstate(invalid='ignore', over='ignore'):
+        length = np.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+        ok = (np.abs(v) < 1000000).all(axis=1) & (length > 0.1)
+    out = np.empty(int(ok.sum()), dtype=[(f, 'f8') for f in JWW_LINE_FIELDS])
+    for name, col in zip(JWW_LINE_FIELDS, (x1, y1, x2, y2, length)):
+        out[name] = np.round(col[ok], 2)
+    _jww_kept_heads(np, offsets, ok, kept)
+    return out
+
+
+def _jww_arc_columns(np, buf, offsets, kept=None):
+    """円弧レコードを構造化配列 (cx, cy, r, start_a, end_a) に変換する（kept は _jww_line_columns と同じ）"""
+    v = _gather_jww_doubles(np, buf, offsets, 5)
+    cx, cy, r, sa, ea = v.T
+    with np.errstate(invalid='ignore'):
+        ok = (np.abs(cx) < 1000000) & (np.abs(cy) < 1000000) & (r > 0) & (r < 100000)
+    out = np.empty(int(ok.sum()), dtype=[(f, 'f8') for f in JWW_ARC_FIELDS])
+    for name, col in zip(JWW_ARC_FIELDS, (cx, cy, r, sa, ea)):
+        out[name] = np.round(col[ok], 2)
+    _jww_kept_heads(np, offsets, ok, kept)
+    return out
+
+
+class JwwColumnView:
+    """
+    構造化配列を parse_jww_full の辞書リスト（{"x1":..,...}）として見せるビュー。
+    辞書は要素を参照したときにだけ作る。
+    """
+    __slots__ = ('array', 'fields')
+
+    def __init__(self, array):
+        self.array = array
+        self.fields = array.dtype.names
+
+    def __len__(self):
+        return len(self.array)
+
+    def __bool__(self):
+        return len(self.array) > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [dict(zip(self.fields, row)) for row in self.array[index].tolist()]
+        return dict(zip(self.fields, self.array[index].tolist()))
+
+    def __iter__(self):
+        fields = self.fields
+        for row in self.array.tolist():
+            yield dict(zip(fields, row))
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+
+def _jww_bbox_dict(min_x, min_y, max_x, max_y):
+    return {
+        "min_x": round(min_x, 2), "min_y": round(min_y, 2),
+        "max_x": round(max_x, 2), "max_y": round(max_y, 2),
+        "width": round(max_x - min_x, 2), "height": round(max_y - min_y, 2),
     }
 
-    info = {
-        "lines": lines,
-        "arcs": arcs,
-        "texts": texts,
-        "dims": dims,
-        "rooms": room_summary,
-        "insights": insights,
-        "stats": {
-            "lines": len(lines),
-            "arcs": len(arcs),
-            "texts": len(texts),
-            "dims": len(dims),
-            "rooms": len(room_summary),
-        }
+
+def parse_jww_full(filepath, columnar=False, workers=1, layout=False, layers=None, budget=None,
+                   narrow_fallback=False):
+    """
+    JWWバイナリファイルから線・円弧・文字の座標データを解析する。
+    Returns: (info_dict, error_str_or_None)
+    info_dict = {
+        "header": {"version","memo","paper_size"},
+        "lines": [{"x1","y1","x2","y2","length"},...],
+        "arcs":  [{"cx","cy","r","start_a","end_a"},...],
+        "texts": [{"x","y","text","source","kind"},...],
+        "dims":  [{"value","x","y"},...],
+        "rooms": [{"name","count"},...],
+        "insights": {
+            "drawing_type": "floor_plan_like"|"unknown",
+            "orthogonality_ratio": float,
+            "door_like_arcs": int,
+            "bbox": {"min_x","min_y","max_x","max_y","width","height"}|None,
+            "room_labels_with_coord": int,
+        },
+        "stats": {"lines":N,"arcs":N,"texts":N,"dims":N,"rooms":N},
+        "decoder": "archive"|"heuristic",
+        "layers": [{"group","layer","name","count"},...],   # decoder が "archive" のときだけ
+        "partial": {"reason","scanned","size"},             # 打ち切った・途中で読めなくなったときだけ
     }
+    columnar: NumPy があれば線・円弧を構造化配列 info["line_array"] / info["arc_array"] でも返す
+    workers: 並列解析のプロセス数（0/None は CPU数。8MB未満は直列）
+    layout: 差分解析用の配置 info["layout"] も作る（parse_jww_incremental に渡す）
+    layers: (レイヤグループ, レイヤ) の組のリスト。そのレイヤだけをデコードする（オブジェクトストリームのみ）
+    budget: JwwParseBudget（経過時間・走査バイト数の上限と途中経過の通知）
+    narrow_fallback: フォールバックスキャンを文字レコードの無い図面のレコードの間だけに絞る
+    """
+    if not os.path.exists(filepath):
+        return None, f"ファイルが見つかりません: {filepath}"
+
+    try:
+        jf = JwwFile(filepath)
+    except Exception as e:
+        return None, str(e)
+
+    if workers is None or workers < 1:
+        workers = os.cpu_count() or 1
+
+    with jf:
+        if not jf.is_jww():
+            return None, "JWWファイルではありません"
+        header = jf.read_header()
+        if budget is not None:
+            budget.begin(header, len(jf))
+        np = _import_numpy() if columnar else None
+        size = len(jf)
+        parallel = workers > 1 and size >= _JWW_PARALLEL_MIN_BYTES
+        archive = JwwArchive.open(jf.buffer)
+        layer_list = broken = None
+        if archive is not None:
+            want_layout = layout and layers is None
+            rec_layout = JwwArchiveLayout.for_archive(archive) if want_layout else None
+            collected = None
+            if parallel:
+                try:
+                    collected = _collect_archive_parallel(archive, jf.filepath, workers, np, layers, budget,
+                                                          rec_layout)
+                except (OSError, RuntimeError, JwwFormatError):
+                    # プロセスを起動できない・ワーカーが落ちた・途中で読めなくなった等。直列でやり直す
+                    rec_layout = JwwArchiveLayout.for_archive(archive) if want_layout else None
+            try:
+                if collected is None:
+                    collected = _collect_archive_entities(archive, np, layers, budget, rec_layout)
+            except JwwFormatError:
+                archive = None      # 途中で読めなくなった図面はレコード推定で読み直す
+            else:
+                lines, arcs, texts, summary, counts, broken = collected
+                layer_list = [{"group": g, "layer": l, "name": archive.layer_name(g, l), "count": c}
+                              for (g, l), c in sorted(counts.items())]
+        if archive is None:
+            if layers is not None:
+                return None, "この図面はレイヤ構造を読めないため、レイヤを指定して読み込めません"
+            fallback = _jww_fallback_mode(jf, narrow_fallback)
+            rec_layout = JwwLayout.for_file(jf, fallback=fallback) if layout else None
+            try:
+                lines, arcs, texts, summary = _collect_jww_entities(jf, np, workers if parallel else 1,
+                                                                    rec_layout, budget, fallback)
+            except (OSError, RuntimeError):
+                # プロセスを起動できない・ワーカーが落ちた等。直列でやり直す
+                if not parallel:
+                    raise
+                rec_layout = JwwLayout.for_file(jf, fallback=fallback) if layout else None
+                lines, arcs, texts, summary = _collect_jww_entities(jf, np, 1, rec_layout, budget, fallback)
+    partial = budget.partial() if budget is not None else None
+    if broken is not None:
+        partial = {"reason": "format", "scanned": broken, "size": size}
+    if partial is not None:
+        rec_layout = None       # 途中までの配置は差分解析の土台にならない
+
+    info = {"header": header, "lines": lines, "arcs": arcs, "texts": texts}
+    info.update(summary.to_info())
+    info["decoder"] = "heuristic" if archive is None else "archive"
+    if layer_list is not None:
+        info["layers"] = layer_list
+    if partial is not None:
+        info["partial"] = partial
+    if np is not None:
+        info["line_array"] = lines.array
+        info["arc_array"] = arcs.array
+    if rec_layout is not None:
+        info["layout"] = rec_layout
     return info, None
 
 
-def build_jww_full_context(jww_full, max_lines=50, max_arcs=30):
+def _collect_jww_entities(jf, np=None, workers=1, layout=None, budget=None, fallback=True):
+    """parse_jww_full の本体。エンティティを最後まで読み、(lines, arcs, texts, summary) を返す"""
+    from array import array
+    summary = JwwSummary()
+    lines, arcs, texts = [], [], []
+    line_offsets = arc_offsets = sources = head_table = accept = None
+    if np is not None:
+        line_offsets, arc_offsets = array('q'), array('q')
+    if layout is not None:
+        sources, head_table = array('q'), array('q')
+        accept = _jww_text_dedupe()
+
+    if budget is not None:
+        budget.watch(lambda: {
+            "lines": summary.lines if line_offsets is None else len(line_offsets),
+            "arcs": summary.arcs if arc_offsets is None else len(arc_offsets),
+            "texts": summary.texts,
+        })
+
+    if workers > 1:
+        stream = _iter_jww_entities_parallel(jf, workers, line_offsets, arc_offsets, sources, head_table,
+                                             budget, fallback)
+    else:
+        heads = None
+        if head_table is not None:
+            heads = _jww_record_heads_into(jf.iter_record_heads(stop=budget and budget.check), head_table)
+        stream = _iter_jww_file_entities(jf, True, line_offsets, arc_offsets, heads=heads, sources=sources,
+                                         budget=budget, fallback=fallback)
+    buckets = {"line": lines, "arc": arcs, "text": texts}
+    for ent in stream:
+        if layout is not None and not layout.record(ent, sources[-1], accept):
+            continue
+        summary.add(ent)
+        buckets[ent.entity].append(ent.as_dict())
+
+    if np is not None:
+        line_array = _jww_line_columns(np, jf.buffer, line_offsets, layout and layout.line_src)
+        arc_array = _jww_arc_columns(np, jf.buffer, arc_offsets, layout and layout.arc_src)
+        summary.add_columns(np, line_array, arc_array)
+        lines, arcs = JwwColumnView(line_array), JwwColumnView(arc_array)
+    if layout is not None:
+        layout.set_heads(head_table)
+    return lines, arcs, texts, summary
+
+
+def _jww_record_heads_into(heads, table):
+    """レコード位置をそのまま返しつつ、(offset, type, size) を table（array('q')）に平たく追記する"""
+    for head in heads:
+        table.extend(head)
+        yield head
+
+
+def _top_k_desc(values, k):
+    """
+    NumPy配列の大きい順に上位k件のインデックスを返す。
+    同値は元の順序を保つ（sorted(..., reverse=True) と同じ並び）。全体ソートはしない。
+    """
+    n = len(values)
+    if n <= k:
+        return (-values).argsort(kind="stable")
+    kth = values[(-values).argpartition(k - 1)[k - 1]]
+    cand = (values >= kth).nonzero()[0]
+    return cand[(-values[cand]).argsort(kind="stable")][:k]
+
+
+def build_jww_full_context(jww_full, max_lines=50, max_arcs=30, max_rooms=40):
     """
     parse_jww_full()の結果をAI向けのテキストコンテキストに変換する。
-    線・円弧・テキスト + 推定ヒントをまとめて返す。
+    線・円弧・テキスト + 推定ヒント（ドアは jww_doors、部屋は jww_rooms で組み立てたもの）をまとめて返す。
+    部屋を線で閉じた範囲として取り出せた場合は、主要な線は JWW_CONTEXT_LINES_WITH_ROOMS 本までにする。
     """
     if not jww_full:
         return ""
@@ -1048,6 +5311,11 @@ def build_jww_full_context(jww_full, max_lines=50, max_arcs=30):
     rooms = jww_full.get("rooms", [])
     dims = jww_full.get("dims", [])
     insights = jww_full.get("insights", {})
+    doors = jww_doors(jww_full) if arcs else []
+    room_result = jww_rooms(jww_full) if lines else {}
+    room_faces = room_result.get("rooms", [])
+    if room_faces:
+        max_lines = min(max_lines, JWW_CONTEXT_LINES_WITH_ROOMS)
 
     ctx  = "【図面全体データ】\n"
     ctx += (
@@ -1062,13 +5330,31 @@ def build_jww_full_context(jww_full, max_lines=50, max_arcs=30):
         ortho = insights.get('orthogonality_ratio', 0)
         door = insights.get('door_like_arcs', 0)
         ctx += f"  図面タイプ推定: {dtype_ja}\n"
-        ctx += f"  直交線比率: {ortho:.3f}  ドア扇形候補: {door}件\n"
+        ctx += f"  直交線比率: {ortho:.3f}  ドア扇形候補: {door}件"
+        ctx += f"（戸の線と組めたもの: {sum(1 for d in doors if d['leaf'] is not None)}件）\n"
         bbox = insights.get('bbox')
         if bbox:
             ctx += f"  図面範囲: X[{bbox['min_x']},{bbox['max_x']}] Y[{bbox['min_y']},{bbox['max_y']}]"
             ctx += f"  幅:{bbox['width']} 高さ:{bbox['height']}\n"
         ctx += "\n"
 
+    layers = jww_full.get("layers")
+    if layers:
+        ctx += "【レイヤ（グループ-レイヤ 名前: 図形数）】\n"
+        ctx += "  " + "、".join(f"{l['group']:X}-{l['layer']:X}{' ' + l['name'] if l['name'] else ''}: {l['count']}"
+                                for l in sorted(layers, key=lambda l: -l["count"])[:20]) + "\n\n"
+
+    if room_faces:
+        ctx += f"【部屋（線で閉じた範囲と部屋名、{min(max_rooms, len(room_faces))}件）】\n"
+        for r in room_faces[:max_rooms]:
+            x0, y0, x1, y1 = r["bbox"]
+            ctx += (f"  {r['name']} {r['area_m2']:.1f}m² 中心({r['centroid'][0]:.0f},{r['centroid'][1]:.0f}) "
+                    f"{x1 - x0:.0f}×{y1 - y0:.0f}mm 壁{len(r['polygon'])}辺\n")
+        ctx += "\n"
+    elif room_result.get("skipped"):
+        why = "線" if room_result["skipped"] == "lines" else "線の交点"
+        ctx += f"【部屋】{why}が多すぎるため、線で閉じた範囲の抽出は省略\n\n"
+
     if rooms:
         ctx += "【部屋名・用途の候補】\n"
         ctx += "  " + "、".join(f"{r['name']}({r['count']})" for r in rooms[:25]) + "\n\n"
@@ -1089,17 +5375,817 @@ def build_jww_full_context(jww_full, max_lines=50, max_arcs=30):
 
     if lines:
         ctx += f"【主要な線（上位{min(max_lines, len(lines))}本）】\n"
-        sorted_lines = sorted(lines, key=lambda l: l["length"], reverse=True)
-        for l in sorted_lines[:max_lines]:
+        line_array = jww_full.get("line_array")
+        if line_array is not None:
+            top_lines = [lines[int(i)] for i in _top_k_desc(line_array["length"], max_lines)]
+        else:
+            top_lines = sorted(lines, key=lambda l: l["length"], reverse=True)[:max_lines]
+        for l in top_lines:
             ctx += f"  ({l['x1']},{l['y1']})→({l['x2']},{l['y2']}) 長さ:{l['length']}mm\n"
         ctx += "\n"
 
+    if doors:
+        ctx += f"【ドア（扇形・戸の線・枠の線の組、{min(max_arcs, len(doors))}件）】\n"
+        # 戸の線と組めたドアを先に載せる
+        for d in sorted(doors, key=lambda d: d["leaf"] is None)[:max_arcs]:
+            ctx += f"  {_door_label(d, line_numbers=False)}\n"
+        ctx += "\n"
+
     if arcs:
         ctx += f"【円弧データ（{min(max_arcs, len(arcs))}件）】\n"
         for a in arcs[:max_arcs]:
-            span = (a['end_a'] - a['start_a']) % 360
-            hint = " ←ドア扇形" if 80 <= span <= 100 else ""
+            hint = " ←ドア扇形" if _is_door_span(a['start_a'], a['end_a']) else ""
             ctx += f"  中心({a['cx']},{a['cy']}) 半径{a['r']}mm 角度{a['start_a']}°〜{a['end_a']}°{hint}\n"
         ctx += "\n"
 
     return ctx
+
+
+# ========== JWW解析キャッシュ ==========
+# .jwac の形式は README の「解析キャッシュ」を参照
+
+_JWW_CACHE_HEAD = struct.Struct('<4sHII')
+_JWW_CACHE_MAGIC = b'JWAC'
+_JWW_CACHE_VERSION = 7
+JWW_CACHE_MAX_MB = 256          # 設定 "jww_cache_mb" で変更（0で無効）
+
+_JWW_HASH_WHOLE = 1 << 20       # これ以下のファイルは全体をハッシュする
+_JWW_HASH_SAMPLES = 16          # それより大きいファイルは等間隔の16箇所だけ読む
+_JWW_HASH_SAMPLE_SIZE = 1 << 16
+
+
+def jww_fingerprint(filepath):
+    """
+    キャッシュ照合用の指紋 {"path","size","mtime_ns","hash"} を返す。
+    hash は内容のサンプリングハッシュ（先頭・末尾を含む等間隔の64KB×16箇所＋サイズ）。
+    """
+    import hashlib
+    st = os.stat(filepath)
+    size = st.st_size
+    h = hashlib.blake2b(digest_size=16)
+    h.update(struct.pack('<Q', size))
+    with open(filepath, 'rb') as f:
+        if size <= _JWW_HASH_WHOLE:
+            h.update(f.read())
+        else:
+            last = size - _JWW_HASH_SAMPLE_SIZE
+            for k in range(_JWW_HASH_SAMPLES):
+                f.seek(last * k // (_JWW_HASH_SAMPLES - 1))
+                h.update(f.read(_JWW_HASH_SAMPLE_SIZE))
+    return {
+        "path": os.path.normcase(os.path.abspath(filepath)),
+        "size": size,
+        "mtime_ns": st.st_mtime_ns,
+        "hash": h.hexdigest(),
+    }
+
+
+def _jww_pack_doubles(rows, array_, fields):
+    """線・円弧を little-endian double 列のbytesにする（構造化配列があればそれを使う）"""
+    from array import array
+    import sys
+    if array_ is not None:
+        return array_[list(fields)].astype([(f, '<f8') for f in fields]).tobytes()
+    out = array('d')
+    for row in rows:
+        out.extend([row[f] for f in fields])
+    if sys.byteorder == 'big':
+        out.byteswap()
+    return out.tobytes()
+
+
+def _jww_unpack_doubles(raw, count, fields, np=None):
+    """_jww_pack_doubles の逆。np を渡すと構造化配列、無ければ辞書リストで返す"""
+    from array import array
+    import sys
+    width = len(fields)
+    if np is not None:
+        return np.frombuffer(raw, dtype=[(f, '<f8') for f in fields], count=count).copy()
+    vals = array('d')
+    vals.frombytes(raw[:count * width * 8])
+    if sys.byteorder == 'big':
+        vals.byteswap()
+    vals = vals.tolist()
+    return [dict(zip(fields, vals[i:i + width])) for i in range(0, len(vals), width)]
+
+
+class JwwParseCache:
+    """
+    parse_jww_full の結果をディスクに保存・再利用するキャッシュ（図面1枚に1ファイル、合計 max_bytes を超えたらLRUで削除）。
+
+        cache = JwwParseCache.from_config(load_config())
+        hit = cache.load(jww_fingerprint(path))
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=JWW_CACHE_MAX_MB << 20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_config(cls, config):
+        mb = config.get("jww_cache_mb", JWW_CACHE_MAX_MB)
+        try:
+            mb = float(mb)
+        except (TypeError, ValueError):
+            mb = JWW_CACHE_MAX_MB
+        return cls(CACHE_DIR, int(mb * (1 << 20)))
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _entry_path(self, fingerprint):
+        import hashlib
+        name = hashlib.blake2b(fingerprint["path"].encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, name + ".jwac")
+
+    def load(self, fingerprint, columnar=False):
+        """
+        一致するエントリがあれば (full_info, extra) を返す。無い・壊れている・古い場合はNone。
+        columnar=True かつ NumPy が使える場合は parse_jww_full(columnar=True) と同じ形で返す。
+        """
+        return self._load(fingerprint, columnar, stale=False)
+
+    def load_base(self, fingerprint, columnar=False):
+        """
+        同じパスで内容が変わった（保存し直された）図面の前回のエントリを、差分解析
+        （parse_jww_incremental）の土台として (full_info, extra) で返す。
+        レイアウト（JwwLayout / JwwArchiveLayout）を持たないエントリや、内容が変わっていない場合はNone（load を使う）。
+        """
+        return self._load(fingerprint, columnar, stale=True)
+
+    def _load(self, fingerprint, columnar, stale):
+        import zlib
+        if not self.enabled:
+            return None
+        path = self._entry_path(fingerprint)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            magic, version, meta_len, geom_len = _JWW_CACHE_HEAD.unpack_from(data, 0)
+            if magic != _JWW_CACHE_MAGIC or version != _JWW_CACHE_VERSION:
+                return None
+            pos = _JWW_CACHE_HEAD.size
+            meta = json.loads(zlib.decompress(data[pos:pos + meta_len]).decode('utf-8'))
+            cached_fp = meta.get("fingerprint") or {}
+            if stale:
+                if cached_fp.get("path") != fingerprint["path"] or cached_fp == fingerprint \
+                        or "layout" not in meta:
+                    return None
+            elif cached_fp != fingerprint:
+                return None
+            geom = zlib.decompress(data[pos + meta_len:pos + meta_len + geom_len])
+        except (OSError, ValueError, struct.error, zlib.error):
+            return None
+
+        n_lines, n_arcs = meta["counts"]
+        split = n_lines * len(JWW_LINE_FIELDS) * 8
+        end = split + n_arcs * len(JWW_ARC_FIELDS) * 8
+        np = _import_numpy() if columnar else None
+        info = {
+            "lines": _jww_unpack_doubles(geom[:split], n_lines, JWW_LINE_FIELDS, np),
+            "arcs": _jww_unpack_doubles(geom[split:end], n_arcs, JWW_ARC_FIELDS, np),
+        }
+        info.update(meta["info"])
+        if "layout" in meta:
+            try:
+                info["layout"] = _jww_restore_layout(meta["layout"], geom[end:])
+            except (KeyError, TypeError, ValueError):
+                if stale:
+                    return None
+        if np is not None:
+            info["line_array"], info["arc_array"] = info["lines"], info["arcs"]
+            info["lines"] = JwwColumnView(info["line_array"])
+            info["arcs"] = JwwColumnView(info["arc_array"])
+        try:
+            os.utime(path)    # LRU用に最終利用時刻を更新
+        except OSError:
+            pass
+        return info, meta.get("extra")
+
+    def store(self, fingerprint, full_info, extra=None):
+        """
+        解析結果を保存する。extra には呼び出し側の追加情報（JSONにできる値）を一緒に保存できる。
+        途中で打ち切った解析結果（info["partial"] あり）は保存しない。
+        Returns: (保存したバイト数, error_str_or_None)
+        """
+        import zlib
+        if not self.enabled or full_info.get("partial"):
+            return 0, None
+        lines = full_info.get("lines", [])
+        arcs = full_info.get("arcs", [])
+        meta = {
+            "fingerprint": fingerprint,
+            "counts": [len(lines), len(arcs)],
+            "info": {k: v for k, v in full_info.items()
+                     if k not in ("lines", "arcs", "line_array", "arc_array", "layout")},
+            "extra": extra,
+        }
+        layout_raw = b''
+        if full_info.get("layout") is not None:
+            meta["layout"], layout_raw = full_info["layout"].dump()
+        try:
+            meta_raw = zlib.compress(json.dumps(meta, ensure_ascii=False).encode('utf-8'), 1)
+            geom_raw = zlib.compress(
+                _jww_pack_doubles(lines, full_info.get("line_array"), JWW_LINE_FIELDS)
+                + _jww_pack_doubles(arcs, full_info.get("arc_array"), JWW_ARC_FIELDS)
+                + layout_raw, 1)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._entry_path(fingerprint)
+            tmp = path + ".tmp"
+            with open(tmp, 'wb') as f:
+                f.write(_JWW_CACHE_HEAD.pack(_JWW_CACHE_MAGIC, _JWW_CACHE_VERSION,
+                                             len(meta_raw), len(geom_raw)))
+                f.write(meta_raw)
+                f.write(geom_raw)
+            os.replace(tmp, path)
+        except (OSError, TypeError, ValueError) as e:
+            return 0, str(e)
+        self.evict()
+        return _JWW_CACHE_HEAD.size + len(meta_raw) + len(geom_raw), None
+
+    def evict(self):
+        """合計サイズが max_bytes 以下になるまで、最終利用が古いエントリから削除する"""
+        try:
+            names = [n for n in os.listdir(self.cache_dir) if n.endswith(".jwac")]
+        except OSError:
+            return
+        entries = []
+        total = 0
+        for name in names:
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """キャッシュを全て削除する"""
+        max_bytes, self.max_bytes = self.max_bytes, 0
+        try:
+            self.evict()
+        finally:
+            self.max_bytes = max_bytes
+
+
+# ========== 差分解析（保存し直した図面の再読み込み） ==========
+
+_JWW_LAYOUT_BLOCK = 1 << 16
+_JWW_INCR_MARGIN = 4 + 0xFFFF + 4    # レコード1件が読みうるバイト数（ヘッダ＋最大データ長＋次の探索）
+_JWW_INCR_FB_MARGIN = 0x60           # フォールバック文字列1件が読みうるバイト数（長さバイト＋最大0x50）
+
+
+def _jww_block_hash(buf, start, stop):
+    import hashlib
+    return hashlib.blake2b(buf[start:stop], digest_size=8).digest()
+
+
+def _jww_hash_blocks(buf, origin=0, reuse=(), reuse_bytes=0):
+    """
+    buf[origin:] を64KBブロックに区切った内容ハッシュのリストを返す。
+    reuse_bytes までのブロックは reuse（前回のハッシュ）をそのまま使う。
+    """
+    n = len(buf)
+    keep = min(max(reuse_bytes - origin, 0) // _JWW_LAYOUT_BLOCK, len(reuse))
+    hashes = list(reuse[:keep])
+    hashes.extend(_jww_block_hash(buf, a, min(a + _JWW_LAYOUT_BLOCK, n))
+                  for a in range(origin + keep * _JWW_LAYOUT_BLOCK, n, _JWW_LAYOUT_BLOCK))
+    return hashes
+
+
+def _jww_compare_blocks(hashes, size, buf, origin=0):
+    """
+    _jww_hash_blocks で作った前回（サイズ size）のハッシュと新しい内容 buf を比べ、
+    (先頭から一致する範囲の終わり, 末尾の一致範囲の前回での開始位置) を返す。
+    末尾の一致範囲は、新しいファイルでは 開始位置 + (len(buf) - size) から始まる。
+    """
+    n = len(buf)
+    delta = n - size
+    k = 0
+    while k < len(hashes):
+        a, b = origin + k * _JWW_LAYOUT_BLOCK, min(origin + (k + 1) * _JWW_LAYOUT_BLOCK, size)
+        if b > n or _jww_block_hash(buf, a, b) != hashes[k]:
+            break
+        k += 1
+    prefix = min(origin + k * _JWW_LAYOUT_BLOCK, size)
+
+    suffix = size
+    for k in range(len(hashes) - 1, -1, -1):
+        a, b = origin + k * _JWW_LAYOUT_BLOCK, min(origin + (k + 1) * _JWW_LAYOUT_BLOCK, size)
+        if a < prefix or a + delta < prefix or _jww_block_hash(buf, a + delta, b + delta) != hashes[k]:
+            break
+        suffix = a
+    return prefix, suffix
+
+
+def _jww_pack_ints(values):
+    """array('q') を little-endian のbytesにする"""
+    from array import array
+    import sys
+    if sys.byteorder == 'big':
+        values = array('q', values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _jww_unpack_ints(raw):
+    from array import array
+    import sys
+    out = array('q')
+    out.frombytes(raw)
+    if sys.byteorder == 'big':
+        out.byteswap()
+    return out
+
+
+def _jww_shift(values, start, delta):
+    """values[start:] の各要素に delta を足した array('q') を返す"""
+    from array import array
+    tail = values[start:]
+    return tail if delta == 0 else array('q', [v + delta for v in tail])
+
+
+class JwwLayout:
+    """
+    差分解析（parse_jww_incremental）用に、解析結果と一緒に保持するレコード配置。
+      block_hashes  64KBブロックごとの内容ハッシュ
+      geom_heads / text_heads  線・円弧系／文字系レコードの先頭位置
+      line_src / arc_src / text_src  各線・円弧・文字の元の位置
+      decoded       デコードしたファイル上の範囲 (開始, 終了)
+      fallback      フォールバックスキャンの行い方（_jww_fallback_mode）
+    """
+
+    def __init__(self, size=0, block_hashes=None, fallback=True):
+        from array import array
+        self.size = size
+        self.block_hashes = block_hashes if block_hashes is not None else []
+        self.fallback = fallback
+        self.geom_heads = array('q')
+        self.text_heads = array('q')
+        self.line_src = array('q')
+        self.arc_src = array('q')
+        self.text_src = array('q')
+        self.text_stream = []
+        self.text_kept = bytearray()
+        self.decoded = (0, size)
+
+    @classmethod
+    def for_file(cls, jf, reuse=(), reuse_bytes=0, fallback=True):
+        """
+        ファイル全体のブロックハッシュを計算した空のレイアウトを作る。
+        reuse_bytes までのブロックは reuse（前回のハッシュ）をそのまま使う。
+        """
+        return cls(len(jf.buffer), _jww_hash_blocks(jf.buffer, 0, reuse, reuse_bytes), fallback)
+
+    def record(self, ent, src, accept):
+        """解析中のエンティティを記録する。出力に残す（重複でない）ものなら True"""
+        kind = ent.entity
+        if kind == "text":
+            kept = accept(ent)
+            self.text_stream.append(ent)
+            self.text_src.append(src)
+            self.text_kept.append(kept)
+            return kept
+        (self.line_src if kind == "line" else self.arc_src).append(src)
+        return True
+
+    def set_heads(self, table):
+        """(offset, type, size) を平たく並べた table からレコード位置を種類別に分けて持つ"""
+        text_types = _JWW_TEXT_TYPES
+        geom, text = self.geom_heads, self.text_heads
+        for offset, rec_type in zip(table[0::3], table[1::3]):
+            (text if rec_type in text_types else geom).append(offset)
+
+    def compare(self, buf):
+        """
+        新しい内容 buf と比べ、(先頭から一致するバイト数, 末尾の一致範囲の前回での開始位置) を返す。
+        末尾の一致範囲は、新しいファイルでは 開始位置 + (len(buf) - size) から始まる。
+        """
+        return _jww_compare_blocks(self.block_hashes, self.size, buf)
+
+    # ----- キャッシュへの保存 -----
+
+    def dump(self):
+        """(JSONにできるメタ情報, bytes) を返す（JwwParseCache が保存に使う）"""
+        arrays = (self.geom_heads, self.text_heads, self.line_src, self.arc_src, self.text_src)
+        meta = {
+            "size": self.size,
+            "decoded": list(self.decoded),
+            "fallback": self.fallback,
+            "counts": [len(self.block_hashes)] + [len(a) for a in arrays],
+            "text_stream": [list(t) for t in self.text_stream],
+        }
+        return meta, (b''.join(self.block_hashes) + b''.join(_jww_pack_ints(a) for a in arrays)
+                      + bytes(self.text_kept))
+
+    @classmethod
+    def restore(cls, meta, raw):
+        """dump() の逆。形式が合わなければ ValueError"""
+        counts = meta["counts"]
+        if len(raw) != counts[0] * 8 + sum(counts[1:]) * 8 + counts[5] or len(meta["text_stream"]) != counts[5]:
+            raise ValueError("レイアウトの長さが一致しません")
+        layout = cls(meta["size"], [raw[i:i + 8] for i in range(0, counts[0] * 8, 8)], meta["fallback"])
+        pos = counts[0] * 8
+        for name, count in zip(("geom_heads", "text_heads", "line_src", "arc_src", "text_src"), counts[1:]):
+            setattr(layout, name, _jww_unpack_ints(raw[pos:pos + count * 8]))
+            pos += count * 8
+        layout.text_stream = [JwwText(*row) for row in meta["text_stream"]]
+        layout.text_kept = bytearray(raw[pos:])
+        layout.decoded = tuple(meta["decoded"])
+        return layout
+
+
+class JwwArchiveLayout:
+    """
+    オブジェクトストリームとして読んだ図面の差分解析用の配置（JwwLayout のオブジェクトストリーム版）。
+      start / count_pos / head_hash  図形データの先頭・件数の位置と、それより前の内容ハッシュ
+      tags / ordinals / layer_keys   本体を持つオブジェクトのタグの位置・通し番号・レイヤ
+      classes       クラス定義の (タグの位置, 読込済みテーブルの番号, クラス名)
+      line_src / arc_src / text_src  各線・円弧・文字の元オブジェクトの位置
+    """
+
+    def __init__(self, size=0, start=0, count_pos=0, count=0, head_hash=b'', block_hashes=None):
+        from array import array
+        self.size = size
+        self.start = start
+        self.count_pos = count_pos
+        self.count = count
+        self.head_hash = head_hash
+        self.block_hashes = block_hashes if block_hashes is not None else []
+        self.end = start
+        self.tags = array('q')
+        self.ordinals = array('q')
+        self.layer_keys = array('q')
+        self.classes = []
+        self.line_src = array('q')
+        self.arc_src = array('q')
+        self.text_src = array('q')
+        self.decoded = (start, size)
+
+    @classmethod
+    def for_archive(cls, archive, reuse=(), reuse_bytes=0):
+        """図面全体のハッシュを計算した空のレイアウトを作る（reuse / reuse_bytes は JwwLayout.for_file と同じ）"""
+        buf = archive.buffer
+        return cls(len(buf), archive.start, archive.count_pos, archive.count,
+                   _jww_block_hash(buf, 0, archive.count_pos),
+                   _jww_hash_blocks(buf, archive.start, reuse, reuse_bytes))
+
+    def matches(self, archive):
+        """新しい図面 archive のヘッダ側（件数より前）が前回と同じか"""
+        return (archive.start == self.start and archive.count_pos == self.count_pos
+                and _jww_block_hash(archive.buffer, 0, archive.count_pos) == self.head_hash)
+
+    def compare(self, buf):
+        """JwwLayout.compare と同じ。件数とそれより前は matches で確かめる"""
+        return _jww_compare_blocks(self.block_hashes, self.size, buf, self.start)
+
+    # ----- キャッシュへの保存 -----
+
+    _ARRAYS = ("tags", "ordinals", "layer_keys", "line_src", "arc_src", "text_src")
+
+    def dump(self):
+        """(JSONにできるメタ情報, bytes) を返す（JwwParseCache が保存に使う）"""
+        arrays = [getattr(self, name) for name in self._ARRAYS]
+        meta = {
+            "kind": "archive",
+            "size": self.size, "start": self.start, "count_pos": self.count_pos,
+            "count": self.count, "end": self.end,
+            "decoded": list(self.decoded),
+            "classes": [list(c) for c in self.classes],
+            "counts": [len(self.block_hashes)] + [len(a) for a in arrays],
+        }
+        return meta, (self.head_hash + b''.join(self.block_hashes)
+                      + b''.join(_jww_pack_ints(a) for a in arrays))
+
+    @classmethod
+    def restore(cls, meta, raw):
+        """dump() の逆。形式が合わなければ ValueError"""
+        counts = meta["counts"]
+        if len(raw) != 8 + sum(counts) * 8:
+            raise ValueError("レイアウトの長さが一致しません")
+        layout = cls(meta["size"], meta["start"], meta["count_pos"], meta["count"], raw[:8],
+                     [raw[8 + i:16 + i] for i in range(0, counts[0] * 8, 8)])
+        pos = 8 + counts[0] * 8
+        for name, count in zip(cls._ARRAYS, counts[1:]):
+            setattr(layout, name, _jww_unpack_ints(raw[pos:pos + count * 8]))
+            pos += count * 8
+        layout.end = meta["end"]
+        layout.classes = [tuple(c) for c in meta["classes"]]
+        layout.decoded = tuple(meta["decoded"])
+        return layout
+
+
+def _jww_restore_layout(meta, raw):
+    """キャッシュに保存したレイアウトを、種類に応じて JwwLayout / JwwArchiveLayout に戻す"""
+    if meta.get("kind") == "archive":
+        return JwwArchiveLayout.restore(meta, raw)
+    return JwwLayout.restore(meta, raw)
+
+
+def parse_jww_incremental(filepath, base, columnar=False):
+    """
+    保存し直した図面を、前回の parse_jww_full(layout=True) の結果 base を土台に、変わった範囲だけ解析する。
+    Returns: (info_dict, error_str_or_None)  形は parse_jww_full(layout=True) と同じ
+    """
+    layout = base.get("layout") if base else None
+    if layout is None:
+        return None, "差分解析の元になる解析結果がありません"
+    if not os.path.exists(filepath):
+        return None, f"ファイルが見つかりません: {filepath}"
+
+    try:
+        jf = JwwFile(filepath)
+    except Exception as e:
+        return None, str(e)
+
+    with jf:
+        if not jf.is_jww():
+            return None, "JWWファイルではありません"
+        header = jf.read_header()
+        np = _import_numpy() if columnar and "line_array" in base else None
+        archive = JwwArchive.open(jf.buffer)
+        if isinstance(layout, JwwArchiveLayout):
+            if archive is None or not layout.matches(archive):
+                return None, "図面のヘッダ・図形データの位置が変わったため、差分解析できません"
+            try:
+                info = _jww_archive_splice(archive, base, layout, np)
+            except JwwFormatError as e:
+                return None, f"図形データを読めないため、差分解析できません: {e}"
+        else:
+            if archive is not None:
+                return None, "オブジェクトストリームとして読める図面になったため、差分解析できません"
+            if _jww_fallback_mode(jf, layout.fallback is not True) != layout.fallback:
+                # フォールバックスキャンの行い方（_iter_jww_file_entities）が前回と変わるので、継ぎ合わせられない
+                return None, "文字レコードの有無が変わったため、差分解析できません"
+            info = _jww_splice(jf, base, layout, np)
+    info["header"] = header
+    return info, None
+
+
+def _jww_splice(jf, base, old, np=None):
+    """parse_jww_incremental の本体。変わった範囲だけをデコードして base と継ぎ合わせる"""
+    from array import array
+    from bisect import bisect_left
+
+    buf = jf.buffer
+    n = len(buf)
+    delta = n - old.size
+    prefix, suffix_old = old.compare(buf)
+    suffix = suffix_old + delta              # 新しいファイルでの末尾一致範囲の開始位置
+    resume = max(prefix - _JWW_INCR_MARGIN, 0)
+
+    # 先頭側: resume より前のレコードは前回と同じ。その直前のレコードから走査を再開する
+    gh, th = old.geom_heads, old.text_heads
+    ig, it = bisect_left(gh, resume), bisect_left(th, resume)
+    start = (gh[ig - 1] if ig else 0, th[it - 1] if it else 0)
+
+    # 末尾側: 前回と同じ位置(+delta)のレコードに行き当たったら、その種類の走査は同期済み
+    sync = {"geom": None, "text": None}
+
+    def changed_heads():
+        for head in jf.iter_record_heads(start=start):
+            offset = head[0]
+            kind = "text" if head[1] in _JWW_TEXT_TYPES else "geom"
+            if sync[kind] is not None or offset < resume:
+                continue
+            if offset >= suffix:
+                prev = th if kind == "text" else gh
+                i = bisect_left(prev, offset - delta)
+                if i < len(prev) and prev[i] == offset - delta:
+                    sync[kind] = offset
+                    if sync["geom"] is not None and sync["text"] is not None:
+                        return
+                    continue
+            yield head
+
+    fb_stop = n - 2 if suffix >= n else max(min(suffix + _JWW_INCR_FB_MARGIN, n - 2), resume)
+    fb_start = resume
+    if old.fallback == "gaps":
+        # レコードの範囲を読み飛ばすので、resume をまたぐ前回のレコードの中からは始めない
+        head = _JWW_REC_HEAD.unpack_from
+        before = ([gh[ig - 1]] if ig else []) + ([th[it - 1]] if it else [])
+        fb_start = max([resume] + [off + 4 + head(buf, off)[1] for off in before])
+    layout = JwwLayout.for_file(jf, old.block_hashes, prefix, old.fallback)
+    sources, head_table = array('q'), array('q')
+    line_offsets = arc_offsets = None
+    if np is not None:
+        line_offsets, arc_offsets = array('q'), array('q')
+    mid_lines, mid_arcs = [], []
+    mid_texts, mid_text_src = [], array('q')
+    stream = _iter_jww_file_entities(jf, True, line_offsets, arc_offsets,
+                                     heads=_jww_record_heads_into(changed_heads(), head_table),
+                                     span=(fb_start, max(fb_stop, fb_start)), sources=sources,
+                                     fallback=old.fallback)
+    for ent in stream:
+        src = sources[-1]
+        if ent.entity == "text":
+            mid_texts.append(ent)
+            mid_text_src.append(src)
+        elif ent.entity == "line":
+            mid_lines.append(ent.as_dict())
+            layout.line_src.append(src)
+        else:
+            mid_arcs.append(ent.as_dict())
+            layout.arc_src.append(src)
+
+    # 同期できなかった種類は末尾まで解析し直したので、前回の分は使わない
+    geom_cut = old.size + 1 if sync["geom"] is None else sync["geom"] - delta
+    text_cut = old.size + 1 if sync["text"] is None else sync["text"] - delta
+    fb_cut = old.size + 1 if fb_stop >= n - 2 else fb_stop - delta
+    layout.decoded = (resume, max(fb_stop, *(n if v is None else v for v in sync.values())))
+
+    # レコード位置: 前回の先頭側 + 今回走査した分 + 前回の末尾側（delta ずらし）
+    mid_geom, mid_text = array('q'), array('q')
+    for offset, rec_type in zip(head_table[0::3], head_table[1::3]):
+        (mid_text if rec_type in _JWW_TEXT_TYPES else mid_geom).append(offset)
+    layout.geom_heads = gh[:ig] + mid_geom + _jww_shift(gh, bisect_left(gh, geom_cut), delta)
+    layout.text_heads = th[:it] + mid_text + _jww_shift(th, bisect_left(th, text_cut), delta)
+
+    # 線・円弧
+    summary = JwwSummary()
+    spliced = {}
+    for name, src_name, fields, mid in (("lines", "line_src", JWW_LINE_FIELDS, mid_lines),
+                                        ("arcs", "arc_src", JWW_ARC_FIELDS, mid_arcs)):
+        prev_src = getattr(old, src_name)
+        i0, i1 = bisect_left(prev_src, resume), bisect_left(prev_src, geom_cut)
+        if np is not None:
+            mid_src = array('q')
+            columns = _jww_line_columns if name == "lines" else _jww_arc_columns
+            mid_arr = columns(np, buf, line_offsets if name == "lines" else arc_offsets, mid_src)
+            prev = base[name[:-1] + "_array"]
+            spliced[name] = np.concatenate((prev[:i0], mid_arr, prev[i1:]))
+        else:
+            mid_src = getattr(layout, src_name)
+            prev = base[name]
+            spliced[name] = list(prev[:i0]) + mid + list(prev[i1:])
+        setattr(layout, src_name, prev_src[:i0] + mid_src + _jww_shift(prev_src, i1, delta))
+
+    if np is not None:
+        summary.add_columns(np, spliced["lines"], spliced["arcs"])
+        lines, arcs = JwwColumnView(spliced["lines"]), JwwColumnView(spliced["arcs"])
+    else:
+        lines, arcs = spliced["lines"], spliced["arcs"]
+        for d in lines:
+            summary.add_line(JwwLine(**d))
+        for d in arcs:
+            summary.add_arc(JwwArc(**d))
+
+    # 文字: 前回の先頭側 + 今回 + 前回の末尾側（出現順）を、フル解析と同じ規則で重複除外する。
+    # 判定が変わりうるのは差し替えた範囲で消えた・増えた文字列と同じ値のものだけなので、
+    # それ以外は前回の判定と辞書をそのまま使う
+    prev_dicts = iter(base["texts"])
+    head_items, tail_items, changed = [], [], set()
+    for t, s, kept in zip(old.text_stream, old.text_src, old.text_kept):
+        d = next(prev_dicts) if kept else None
+        if s < resume:
+            head_items.append((t, s, d))
+        elif s >= (fb_cut if t.source == "fallback" else text_cut):
+            tail_items.append((t, s + delta, d))
+        else:
+            changed.add(t.text)
+    changed.update(t.text for t in mid_texts)
+
+    accept = _jww_text_dedupe()
+    texts = []
+    items = head_items + [(t, s, None) for t, s in zip(mid_texts, mid_text_src)] + tail_items
+    for t, s, d in items:
+        if t.text in changed:
+            kept = accept(t)
+            if kept and d is None:
+                d = t.as_dict()
+        else:
+            kept = d is not None
+        layout.text_stream.append(t)
+        layout.text_src.append(s)
+        layout.text_kept.append(kept)
+        if kept:
+            summary.add_text(t)
+            texts.append(d)
+
+    info = {"lines": lines, "arcs": arcs, "texts": texts}
+    info.update(summary.to_info())
+    info["decoder"] = "heuristic"
+    if np is not None:
+        info["line_array"], info["arc_array"] = spliced["lines"], spliced["arcs"]
+    info["layout"] = layout
+    return info
+
+
+def _jww_archive_splice(archive, base, old, np=None):
+    """
+    parse_jww_incremental のオブジェクトストリーム版。変わった範囲のオブジェクトだけをデコードして
+    base と継ぎ合わせる。archive は old.matches() を満たす新しい図面。
+    Raises: JwwFormatError
+    """
+    from bisect import bisect_left, bisect_right
+
+    buf = archive.buffer
+    delta = len(buf) - old.size
+    prefix, suffix_old = old.compare(buf)
+    suffix = suffix_old + delta
+
+    # 先頭側: 一致する範囲に収まるオブジェクト（次のタグが prefix 以前）は前回と同じ
+    k = max(bisect_right(old.tags, prefix) - 1, 0)
+    if k < len(old.tags):
+        resume_pos, first = old.tags[k], old.ordinals[k]
+    else:
+        resume_pos, first = old.start, 0
+    classes = [c for c in old.classes if c[0] < resume_pos]
+    old_slots = {(slot, name) for _, slot, name in old.classes}
+    last_class = old.classes[-1][0] if old.classes else -1
+
+    # 間のオブジェクトをデコードする。末尾側で前回と同じ位置(+delta)のオブジェクトに行き当たり、
+    # その先の読み方が前回と変わらなければ止める
+    mid = JwwArchiveLayout()
+    sources = {"line": mid.line_src, "arc": mid.arc_src, "text": mid.text_src}
+    mid_ents = {"line": [], "arc": [], "text": []}
+    classify = get_jww_text_classifier().classify
+    sync = None
+    tags = archive._iter_tags(archive.resume_state(resume_pos, first, k, classes), mid)
+    try:
+        schema, pos = next(tags)
+        while True:
+            tag_pos = mid.tags[-1]
+            if tag_pos >= suffix:
+                j = bisect_left(old.tags, tag_pos - delta)
+                if (j < len(old.tags) and old.tags[j] == tag_pos - delta and old.tags[j] > last_class
+                        and archive.count - mid.ordinals[-1] == old.count - old.ordinals[j]
+                        and {(slot, name) for _, slot, name in classes + mid.classes} == old_slots):
+                    mid.tags.pop()
+                    mid.ordinals.pop()
+                    sync = j
+                    break
+            values, end = schema.decode(buf, pos)
+            obj = JwwObject(schema.kind, schema.name, values["glayer"], values["layer"], pos, values)
+            mid.layer_keys.append(_jww_layer_key((obj.glayer, obj.layer)))
+            for ent in _jww_object_entities(obj, classify):
+                sources[ent.entity].append(pos)
+                mid_ents[ent.entity].append(ent)
+            schema, pos = tags.send(end)
+    except StopIteration:
+        pass
+
+    # 前回の分のうち使うのは、タグが resume_pos より前のものと、同期したオブジェクト以降（delta ずらし）
+    cut = old.size + 1 if sync is None else old.tags[sync]
+    layout = JwwArchiveLayout.for_archive(archive, old.block_hashes, prefix)
+    layout.end = mid.end if sync is None else old.end + delta
+    layout.decoded = (resume_pos, layout.end if sync is None else old.tags[sync] + delta)
+    tail = len(old.tags) if sync is None else sync
+    layout.tags = old.tags[:k] + mid.tags + _jww_shift(old.tags, tail, delta)
+    layout.ordinals = (old.ordinals[:k] + mid.ordinals
+                       + _jww_shift(old.ordinals, tail, archive.count - old.count))
+    layout.layer_keys = old.layer_keys[:k] + mid.layer_keys + old.layer_keys[tail:]
+    layout.classes = classes + mid.classes
+
+    summary = JwwSummary()
+    spliced = {}
+    for name, entity, fields in (("lines", "line", JWW_LINE_FIELDS), ("arcs", "arc", JWW_ARC_FIELDS),
+                                 ("texts", "text", None)):
+        prev_src = getattr(old, entity + "_src")
+        i0, i1 = bisect_left(prev_src, resume_pos), bisect_left(prev_src, cut)
+        setattr(layout, entity + "_src",
+                prev_src[:i0] + sources[entity] + _jww_shift(prev_src, i1, delta))
+        decoded = mid_ents[entity]
+        if fields is None:
+            prev = base["texts"]
+            spliced[name] = prev[:i0] + [t.as_dict() for t in decoded] + prev[i1:]
+        elif np is not None:
+            prev = base[entity + "_array"]
+            mid_arr = np.array(decoded, dtype=[(f, 'f8') for f in fields])
+            spliced[name] = np.concatenate((prev[:i0], mid_arr, prev[i1:]))
+        else:
+            prev = base[name]
+            spliced[name] = list(prev[:i0]) + [ent.as_dict() for ent in decoded] + list(prev[i1:])
+
+    if np is not None:
+        summary.add_columns(np, spliced["lines"], spliced["arcs"])
+        lines, arcs = JwwColumnView(spliced["lines"]), JwwColumnView(spliced["arcs"])
+    else:
+        lines, arcs = spliced["lines"], spliced["arcs"]
+        for d in lines:
+            summary.add_line(JwwLine(**d))
+        for d in arcs:
+            summary.add_arc(JwwArc(**d))
+    for d in spliced["texts"]:
+        summary.add_text(JwwText(d["text"], d["source"], d["kind"], d.get("x"), d.get("y")))
+
+    info = {"lines": lines, "arcs": arcs, "texts": spliced["texts"]}
+    info.update(summary.to_info())
+    info["decoder"] = "archive"
+    info["layers"] = [{"group": g, "layer": l, "name": archive.layer_name(g, l), "count": c}
+                      for (g, l), c in sorted(_jww_layer_counts(layout.layer_keys).items())]
+    if np is not None:
+        info["line_array"], info["arc_array"] = spliced["lines"], spliced["arcs"]
+    info["layout"] = layout
+    return info
@@ -0,0 +1,247 @@
+"""
+JW AI 図面コーパス抽出
+フォルダ以下のJWWファイルをまとめて parse_jww_full で解析し、
+コーパス全体を1つの列指向データセット（.npz）に書き出す。
+
+  python jwai_corpus.py D:\\projects -o corpus.npz              # 初回
+  python jwai_corpus.py D:\\projects -o corpus.npz --workers 8  # 再実行: 変更の無い図面は再解析しない
+
+データセットの列（図面数を F とする）:
+  path, size, mtime_ns, hash                        … 図面ごとの指紋（再実行時の照合用）
+  version, memo, paper_size                         … ヘッダ
+  stat_lines, stat_arcs, stat_texts, stat_dims, stat_rooms
+  drawing_type, orthogonality_ratio, door_like_arcs, room_labels_with_coord
+  bbox (F, 6)                                       … min_x, min_y, max_x, max_y, width, height（無ければNaN）
+  room_start (F+1), room_name, room_count           … 図面 i の部屋名は room_start[i]:room_start[i+1]
+  dim_start (F+1), dim_value, dim_xy (N, 2)         … 寸法値（座標が無ければNaN）
+  line_start (F+1), lines (N, 5)                    … x1, y1, x2, y2, length
+  arc_start (F+1), arcs (N, 5)                      … cx, cy, r, start_a, end_a
+NumPy が必要。
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import jwai_core
+
+_BBOX_KEYS = ("min_x", "min_y", "max_x", "max_y", "width", "height")
+_STAT_KEYS = ("lines", "arcs", "texts", "dims", "rooms")
+
+
+# ========== 図面1枚の抽出（ワーカー） ==========
+
+def extract_drawing(path):
+    """
+    図面1枚を解析し、データセットの1行分を返す。
+    Returns: (entry_dict, error_str_or_None)
+    """
+    np = jwai_core._import_numpy()
+    try:
+        fingerprint = jwai_core.jww_fingerprint(path)
+    except OSError as e:
+        return None, str(e)
+    info, err = jwai_core.parse_jww_full(path, columnar=True)
+    if err:
+        return None, err
+
+    line_array, arc_array = info["line_array"], info["arc_array"]
+    entry = {
+        "fingerprint": fingerprint,
+        "header": info["header"],
+        "stats": info["stats"],
+        "insights": info["insights"],
+        "rooms": [(r["name"], r["count"]) for r in info["rooms"]],
+        "dims": [(d["value"], d.get("x"), d.get("y")) for d in info["dims"]],
+        "lines": line_array.view('f8').reshape(len(line_array), 5) if len(line_array) else np.empty((0, 5)),
+        "arcs": arc_array.view('f8').reshape(len(arc_array), 5) if len(arc_array) else np.empty((0, 5)),
+    }
+    return entry, None
+
+
+def _extract_worker(path):
+    try:
+        entry, err = extract_drawing(path)
+    except Exception as e:      # 1枚の失敗でコーパス全体を止めない
+        entry, err = None, f"{type(e).__name__}: {e}"
+    return path, entry, err
+
+
+# ========== データセットの読み書き ==========
+
+def _ragged(np, rows_per_file, dtype, width=None):
+    """図面ごとの行リストを (開始位置配列, 連結した配列) にする"""
+    start = np.zeros(len(rows_per_file) + 1, dtype=np.int64)
+    np.cumsum([len(r) for r in rows_per_file], out=start[1:])
+    if width is None:
+        flat = [v for rows in rows_per_file for v in rows]
+        return start, np.array(flat, dtype=dtype) if flat else np.empty(0, dtype=dtype)
+    parts = [r for r in rows_per_file if len(r)]
+    return start, np.concatenate(parts).astype(dtype) if parts else np.empty((0, width), dtype=dtype)
+
+
+def save_dataset(out_path, entries):
+    """
+    {path: entry} をデータセットとして書き出す（一時ファイルに書いてから置き換える）。
+    """
+    np = jwai_core._import_numpy()
+    paths = sorted(entries)
+    rows = [entries[p] for p in paths]
+    nan = float('nan')
+
+    cols = {
+        "path": np.array(paths, dtype=str),
+        "size": np.array([e["fingerprint"]["size"] for e in rows], dtype=np.int64),
+        "mtime_ns": np.array([e["fingerprint"]["mtime_ns"] for e in rows], dtype=np.int64),
+        "hash": np.array([e["fingerprint"]["hash"] for e in rows], dtype=str),
+        "version": np.array([e["header"].get("version", 0) for e in rows], dtype=np.int64),
+        "memo": np.array([e["header"].get("memo", "") for e in rows], dtype=str),
+        "paper_size": np.array([e["header"].get("paper_size", "") for e in rows], dtype=str),
+        "drawing_type": np.array([e["insights"]["drawing_type"] for e in rows], dtype=str),
+        "orthogonality_ratio": np.array([e["insights"]["orthogonality_ratio"] for e in rows], dtype=np.float64),
+        "door_like_arcs": np.array([e["insights"]["door_like_arcs"] for e in rows], dtype=np.int64),
+        "room_labels_with_coord": np.array([e["insights"]["room_labels_with_coord"] for e in rows],
+                                           dtype=np.int64),
+        "bbox": np.array([[(e["insights"]["bbox"] or {}).get(k, nan) for k in _BBOX_KEYS] for e in rows],
+                         dtype=np.float64).reshape(len(rows), len(_BBOX_KEYS)),
+    }
+    for k in _STAT_KEYS:
+        cols["stat_" + k] = np.array([e["stats"][k] for e in rows], dtype=np.int64)
+
+    cols["room_start"], cols["room_name"] = _ragged(np, [[n for n, _ in e["rooms"]] for e in rows], str)
+    _, cols["room_count"] = _ragged(np, [[c for _, c in e["rooms"]] for e in rows], np.int64)
+    cols["dim_start"], cols["dim_value"] = _ragged(np, [[v for v, _, _ in e["dims"]] for e in rows], str)
+    _, dim_xy = _ragged(np, [[(nan if x is None else x, nan if y is None else y) for _, x, y in e["dims"]]
+                             for e in rows], np.float64)
+    cols["dim_xy"] = dim_xy.reshape(-1, 2)
+    cols["line_start"], cols["lines"] = _ragged(np, [e["lines"] for e in rows], np.float64, 5)
+    cols["arc_start"], cols["arcs"] = _ragged(np, [e["arcs"] for e in rows], np.float64, 5)
+
+    tmp = out_path + ".tmp"
+    with open(tmp, 'wb') as f:
+        np.savez(f, **cols)
+    os.replace(tmp, out_path)
+
+
+def load_dataset(path):
+    """save_dataset で書いたデータセットを {path: entry} に戻す。無い・読めない場合は空"""
+    np = jwai_core._import_numpy()
+    if not os.path.exists(path):
+        return {}
+    try:
+        data = np.load(path, allow_pickle=False)
+    except (OSError, ValueError):
+        return {}
+
+    with data:
+        d = {k: data[k] for k in data.files}
+    entries = {}
+    for i, p in enumerate(d["path"].tolist()):
+        bbox = d["bbox"][i]
+        r0, r1 = d["room_start"][i], d["room_start"][i + 1]
+        m0, m1 = d["dim_start"][i], d["dim_start"][i + 1]
+        entries[p] = {
+            "fingerprint": {"path": p, "size": int(d["size"][i]), "mtime_ns": int(d["mtime_ns"][i]),
+                            "hash": str(d["hash"][i])},
+            "header": {"version": int(d["version"][i]), "memo": str(d["memo"][i]),
+                       "paper_size": str(d["paper_size"][i])},
+            "stats": {k: int(d["stat_" + k][i]) for k in _STAT_KEYS},
+            "insights": {
+                "drawing_type": str(d["drawing_type"][i]),
+                "orthogonality_ratio": float(d["orthogonality_ratio"][i]),
+                "door_like_arcs": int(d["door_like_arcs"][i]),
+                "bbox": None if np.isnan(bbox).all() else dict(zip(_BBOX_KEYS, bbox.tolist())),
+                "room_labels_with_coord": int(d["room_labels_with_coord"][i]),
+            },
+            "rooms": list(zip(d["room_name"][r0:r1].tolist(), d["room_count"][r0:r1].tolist())),
+            "dims": [(v, None if x != x else x, None if y != y else y)
+                     for v, (x, y) in zip(d["dim_value"][m0:m1].tolist(), d["dim_xy"][m0:m1].tolist())],
+            "lines": d["lines"][d["line_start"][i]:d["line_start"][i + 1]],
+            "arcs": d["arcs"][d["arc_start"][i]:d["arc_start"][i + 1]],
+        }
+    return entries
+
+
+# ========== コーパス走査 ==========
+
+def find_jww_files(root):
+    """root 以下の .jww を（大文字小文字を区別せず）列挙する"""
+    found = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if name.lower().endswith(".jww"):
+                found.append(os.path.normcase(os.path.abspath(os.path.join(dirpath, name))))
+    found.sort()
+    return found
+
+
+def build_corpus(root, out_path, workers=None, checkpoint=200, log=print):
+    """
+    root 以下の図面を解析して out_path に書き出す。既存のデータセットがあれば、
+    指紋（サイズ・更新日時・内容ハッシュ）が変わっていない図面はそのまま引き継ぐ。
+    checkpoint 件ごとに途中結果を書き出すので、中断しても次回はそこから再開できる。
+    Returns: (データセットの図面数, 解析した数, エラーのリスト[(path, error)])
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    paths = find_jww_files(root)
+    previous = load_dataset(out_path)
+    entries, todo = {}, []
+    for p in paths:
+        old = previous.get(p)
+        if old is not None:
+            try:
+                if jwai_core.jww_fingerprint(p) == old["fingerprint"]:
+                    entries[p] = old
+                    continue
+            except OSError:
+                pass
+        todo.append(p)
+    log(f"図面 {len(paths)}件（変更なし {len(entries)}件 / 解析対象 {len(todo)}件）")
+
+    errors = []
+    done = 0
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_extract_worker, p) for p in todo]
+        for future in as_completed(futures):
+            path, entry, err = future.result()
+            done += 1
+            if err:
+                errors.append((path, err))
+            else:
+                entries[path] = entry
+            if checkpoint and done % checkpoint == 0:
+                save_dataset(out_path, entries)
+                log(f"  {done}/{len(todo)}件  {time.perf_counter() - t0:.1f}s")
+    save_dataset(out_path, entries)
+    return len(entries), done - len(errors), errors
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="JW AI 図面コーパス抽出")
+    ap.add_argument("root", help="JWWファイルを探すフォルダ")
+    ap.add_argument("-o", "--output", default="jwai_corpus.npz", help="書き出すデータセット(.npz)")
+    ap.add_argument("--workers", type=int, default=None, help="解析プロセス数（省略時はCPU数）")
+    ap.add_argument("--checkpoint", type=int, default=200, help="途中結果を書き出す間隔（件）")
+    args = ap.parse_args(argv)
+
+    if jwai_core._import_numpy() is None:
+        print("NumPy が必要です: pip install numpy", file=sys.stderr)
+        return 1
+    if not os.path.isdir(args.root):
+        print(f"フォルダが見つかりません: {args.root}", file=sys.stderr)
+        return 1
+
+    t0 = time.perf_counter()
+    total, parsed, errors = build_corpus(args.root, args.output, args.workers, args.checkpoint)
+    for path, err in errors:
+        print(f"  エラー: {path}: {err}", file=sys.stderr)
+    print(f"{args.output}: 図面{total}件（今回解析 {parsed}件 / エラー {len(errors)}件）"
+          f"  {time.perf_counter() - t0:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+変換の履歴 TransformJournal の確認。
+反映・取り消し・やり直しの状態、差分の上限を超えた古い版の破棄、版0の書き戻しが元ファイルと同じバイト列になること、
+版Nの書き戻しで変わった行と hq の行だけが書き換わること、close() で残した元ファイルが消えること。
+"""
+import os
+
+import pytest
+
+import jwai_bench
+import jwai_core
+
+ROWS = [
+    'hq',
+    'hk',
+    'lg0',
+    'ly0',
+    '0 0 1000 0',
+    '1000 0 1000 1000',
+    'lg1',
+    'ly2',
+    '5000 5000 6000 5000',
+    'ci 5000 5000 800 0 90 1 0',
+    'ch 0 0 1 0 "居間',
+]
+
+
+@pytest.fixture
+def jwc(tmp_path):
+    path = str(tmp_path / "JWC_TEMP.TXT")
+    data = '\r\n'.join(ROWS).encode('cp932') + b'\r\n'
+    with open(path, 'wb') as f:
+        f.write(data)
+    store, err = jwai_core.parse_jwc_store(path)
+    assert err is None, err
+    return path, data, store
+
+
+def _lines(path):
+    with open(path, 'rb') as f:
+        return f.read().split(b'\r\n')
+
+
+def test_apply_undo_redo(jwc):
+    _, _, store = jwc
+    journal = jwai_core.TransformJournal(store)
+    assert journal.revision == 0 and not journal.can_undo and not journal.can_redo
+
+    first = {"type": "mirror_x", "axis_x": 5000.0, "target": "all", "filter": {"ly": 2}}
+    entry, err = journal.apply(first)
+    assert err is None, err
+    assert (entry.n_lines, entry.n_circles) == (1, 1)
+    lines, circles = journal.modified_maps()
+    assert lines[2] == {'x1': 5000.0, 'y1': 5000.0, 'x2': 4000.0, 'y2': 5000.0}
+    assert list(circles) == [0]
+
+    second = {"type": "mirror_y", "axis_y": 0.0, "target": "lines_only"}
+    entry, err = journal.apply(second)
+    assert err is None, err
+    assert entry.n_lines == 2 and entry.n_circles == 0         # y=0 上の線は変わらない
+    assert journal.revision == 2 and journal.steps() == [first, second]
+    after_two = journal.modified_maps()
+
+    assert journal.undo() is entry
+    assert journal.revision == 1 and journal.can_redo
+    assert journal.steps() == [first]
+    assert dict(journal.modified_maps()[0].items()) == dict(lines.items())
+
+    journal.undo()
+    assert journal.revision == 0 and not journal.can_undo
+    assert journal.undo() is None
+    assert not journal.modified_maps()[0] and not journal.modified_maps()[1]
+
+    journal.redo()
+    journal.redo()
+    assert journal.revision == 2 and not journal.can_redo and journal.redo() is None
+    assert journal.modified_maps() == after_two
+
+    # 取り消した後に反映すると、やり直し用の版は捨てる
+    journal.undo()
+    journal.apply({"type": "arc_flip_x", "target": "circles_only"})
+    assert journal.revision == 2 and not journal.can_redo
+    assert journal.steps()[1]["type"] == "arc_flip_x"
+
+
+def test_step_limit(jwc):
+    _, _, store = jwc
+    journal = jwai_core.TransformJournal(store)
+    step = {"type": "mirror_x", "axis_x": 0.0, "target": "all"}
+    _, err = journal.apply([step] * jwai_core.MAX_TRANSFORM_STEPS)
+    assert err is None, err
+    entry, err = journal.apply(step)
+    assert entry is None and err
+    assert journal.revision == 1
+
+
+def test_eviction_drops_oldest(tmp_path):
+    path = str(tmp_path / "JWC_TEMP.TXT")
+    jwai_bench.make_synthetic_jwc(path, 2000, seed=3)
+    store, _ = jwai_core.parse_jwc_store(path)
+    mirrors = [{"type": "mirror_x", "axis_x": float(k), "target": "lines_only"} for k in range(4)]
+
+    unbounded = jwai_core.TransformJournal(store)
+    for step in mirrors:
+        unbounded.apply(step)
+    size = unbounded._entries[0].nbytes
+    assert all(e.nbytes == size for e in unbounded._entries)
+
+    journal = jwai_core.TransformJournal(store, max_bytes=2 * size)
+    for step in mirrors:
+        _, err = journal.apply(step)
+        assert err is None, err
+    assert journal.revision == 4 and journal.nbytes <= 2 * size
+    assert [e.steps for e in journal._entries] == [[mirrors[2]], [mirrors[3]]]
+    assert journal.steps() == mirrors           # 捨てた版の手順も今の版を作る手順に残る
+    assert journal.modified_maps() == unbounded.modified_maps()
+
+    journal.undo()
+    journal.undo()
+    assert journal.revision == 2 and not journal.can_undo and journal.undo() is None
+    for _ in range(2):
+        unbounded.undo()
+    assert journal.modified_maps() == unbounded.modified_maps()
+
+
+def test_write_revision_zero_restores_base(jwc):
+    path, data, store = jwc
+    journal = jwai_core.TransformJournal(store)
+    journal.apply({"type": "rotate", "angle": 90.0, "cx": 0.0, "cy": 0.0})
+    ok, err = journal.write(path)
+    assert ok, err
+    assert os.path.exists(path + jwai_core._JOURNAL_BASE_SUFFIX)
+    assert open(path, 'rb').read() != data
+
+    journal.undo()
+    stats = {}
+    ok, err = journal.write(path, stats=stats)
+    assert ok, err
+    assert stats["mode"] == "base"
+    assert open(path, 'rb').read() == data
+    with open(path + jwai_core._JOURNAL_BASE_SUFFIX, 'rb') as f:
+        assert f.read() == data
+
+
+def test_write_revision_touches_changed_rows(jwc):
+    path, data, store = jwc
+    journal = jwai_core.TransformJournal(store)
+    journal.apply({"type": "mirror_x", "axis_x": 5000.0, "filter": {"ly": 2}})
+    journal.write(path)
+    journal.apply({"type": "mirror_y", "axis_y": 0.0, "filter": {"lg": 0}, "target": "lines_only"})
+    stats = {}
+    ok, err = journal.write(path, stats=stats)
+    assert ok, err
+    assert stats["mode"] == "delta"
+
+    before = data.split(b'\r\n')
+    after = _lines(path)
+    assert before[0] == b'hq' and b'hq' not in after and len(after) == len(before) - 1
+    # hq の行を除けば、変わったのは x=5000 で反転した線・円弧と、y=0 で反転した lg0 の線だけ
+    changed = [k for k, (a, b) in enumerate(zip(before[1:], after)) if a != b]
+    assert [before[1 + k] for k in changed] == [b'1000 0 1000 1000', b'5000 5000 6000 5000',
+                                                b'ci 5000 5000 800 0 90 1 0']
+    assert after[changed[0]] == b'1000.0 0.0 1000.0 -1000.0'
+
+
+def test_close_removes_base(jwc):
+    path, _, store = jwc
+    journal = jwai_core.TransformJournal(store)
+    journal.apply({"type": "mirror_x", "axis_x": 0.0})
+    journal.write(path)
+    base = path + jwai_core._JOURNAL_BASE_SUFFIX
+    assert os.path.exists(base)
+    journal.close()
+    assert not os.path.exists(base)
+    journal.close()                     # 2度目は何もしない
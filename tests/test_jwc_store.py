@@ -0,0 +1,169 @@
+"""
+列で持つ JwcElementStore（parse_jwc_store）と差分書き戻し _write_jwc_delta の確認。
+要素が parse_jwc_temp・旧実装（jwai_bench.legacy_parse_jwc_temp）と同じになること（NumPy の有無も）、
+差分書き戻しで変わらない行が改行まで元のバイト列のまま残ること、一時ファイルから os.replace で置き換えること、
+読み込み後にファイルが変わっていたら全体の書き直しにすること。
+"""
+import os
+
+import pytest
+
+import jwai_bench
+import jwai_core
+
+# 先頭の語・空白・読めない座標など、判定の分かれ目になる行
+EDGE_ROWS = [
+    b'hq', b'hk', b'', b'   ', b'\x81\x40', b'lg1', b'ly2', b'lcA',
+    b'0 0 1 1', b'1e3 -2 +3 .5', b'1\t2\t3\t4', b'  1 2 3 4  ', b'inf 1 2 3', b'1_0 2 3 4',
+    b'a b c d', b'0x1 2 3 4', b'1 2 3', b'1 2 3 4 5',
+    b'ci 1 2 3', b'ci 1 2 3 0 90 1 0', b'ci a b c', b'ci',
+    b'ch 0 0 1 0 "\x8b\x8f\x8a\xd4', b'cv 0 0', b'pt 1 2', b'hd', b'hp',
+]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def numpy_mode(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(jwai_core, "_import_numpy", lambda: None)
+    return request.param
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def _assert_same_as_legacy(path):
+    store, err = jwai_core.parse_jwc_store(path)
+    assert err is None, err
+    elements, raw_lines, err = jwai_core.parse_jwc_temp(path)
+    assert err is None, err
+    old, old_raw, _ = jwai_bench.legacy_parse_jwc_temp(path)
+    assert store.raw_lines == raw_lines == old_raw
+    assert store.to_elements() == elements
+    assert [e.to_dict() for e in elements] == old
+    # 列の値は要素と同じ並び
+    lines = [e for e in elements if e.type == 'line']
+    circles = [e for e in elements if e.type == 'circle']
+    assert [store.line(i) for i in range(len(lines))] == [(e.x1, e.y1, e.x2, e.y2) for e in lines]
+    assert [elements[s] for s in store.line_slots] == lines
+    assert [elements[s] for s in store.circle_slots] == circles
+    assert [store.raw_lines[r] for r in store.rows] == [e.raw for e in elements]
+    return store
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_synthetic_matches_legacy(tmp_path, numpy_mode, seed):
+    path = str(tmp_path / "JWC_TEMP.TXT")
+    jwai_bench.make_synthetic_jwc(path, 3000, seed=seed)
+    store = _assert_same_as_legacy(path)
+    assert store.count(jwai_core.JWC_LINE) > 1000
+
+
+@pytest.mark.parametrize("eol", [b'\r\n', b'\n', b'\r'])
+@pytest.mark.parametrize("last_eol", [True, False])
+def test_edge_rows_match_legacy(tmp_path, numpy_mode, eol, last_eol):
+    data = eol.join(EDGE_ROWS) + (eol if last_eol else b'')
+    path = _write(str(tmp_path / "JWC_TEMP.TXT"), data)
+    store = _assert_same_as_legacy(path)
+    # 単独の \r で改行したファイルは行の位置を決めない（差分書き戻しはしない）
+    assert (store.offsets is None) is (eol == b'\r')
+
+
+def test_missing_file(tmp_path):
+    store, err = jwai_core.parse_jwc_store(str(tmp_path / "none.txt"))
+    assert err and len(store) == 0 and store.offsets is None    # 空の索引とエラーを返す
+    elements, raw_lines, err = jwai_core.parse_jwc_temp(str(tmp_path / "none.txt"))
+    assert (elements, raw_lines) == ([], []) and err
+
+
+ROWS = [b'hq', b'lg0', b'0 0 1000 0', b'1000 0 1000 1000', b'ci 0 0 500 0 90 1 0',
+        b'ch 0 0 1 0 "\x8b\x8f\x8a\xd4', b'5000 5000 6000 5000', b'']
+
+
+@pytest.fixture
+def mixed(tmp_path):
+    # 行ごとに改行が違う（CRLF と LF が混ざり、最後の行には改行が無い）
+    data = (b'hq\r\nlg0\n0 0 1000 0\r\n1000 0 1000 1000\r\nci 0 0 500 0 90 1 0\n'
+            b'ch 0 0 1 0 "\x8b\x8f\x8a\xd4\r\n5000 5000 6000 5000')
+    path = _write(str(tmp_path / "JWC_TEMP.TXT"), data)
+    store, err = jwai_core.parse_jwc_store(path)
+    assert err is None, err
+    return path, data, store
+
+
+def test_delta_keeps_unchanged_bytes(mixed):
+    path, data, store = mixed
+    lines = {0: {'x1': 0.0, 'y1': 0.0, 'x2': 1000.0, 'y2': 0.0},       # 値が同じなら書き換えない
+             1: {'x2': 2000.0},
+             2: {'y1': -1.5}}
+    written = jwai_core._write_jwc_delta(store, path, lines, {0: 'ci 0.0 0.0 500.0 90.0 180.0 1 0'})
+    out = open(path, 'rb').read()
+    assert written == len(out)
+    assert out == (b'lg0\n0 0 1000 0\r\n1000.0 0.0 2000.0 1000.0\r\nci 0.0 0.0 500.0 90.0 180.0 1 0\n'
+                   b'ch 0 0 1 0 "\x8b\x8f\x8a\xd4\r\n5000.0 -1.5 6000.0 5000.0')
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_delta_only_removes_hq(mixed):
+    path, data, store = mixed
+    assert jwai_core._write_jwc_delta(store, path, {}, {})
+    assert open(path, 'rb').read() == data[len(b'hq\r\n'):]
+
+
+def test_delta_replaces_atomically(mixed, monkeypatch):
+    path, data, store = mixed
+    calls = []
+    real_replace = os.replace
+
+    def replace(src, dst):
+        calls.append((src, dst, open(path, 'rb').read()))
+        real_replace(src, dst)
+    monkeypatch.setattr(os, "replace", replace)
+    stats = {}
+    ok, err = jwai_core.write_result_to_jwc(store.to_elements(), {1: {'x2': 2000.0}}, path,
+                                            stats=stats, store=store)
+    assert ok, err
+    assert stats["mode"] == "delta"
+    # 一時ファイルに書き終えてから1度だけ置き換える（置き換える直前まで元のファイルはそのまま）
+    assert [(src, dst) for src, dst, _ in calls] == [(path + ".tmp", path)]
+    assert calls[0][2] == data
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_delta_failure_keeps_original(mixed, monkeypatch):
+    path, data, store = mixed
+
+    def replace(src, dst):
+        raise OSError("置き換えに失敗")
+    monkeypatch.setattr(os, "replace", replace)
+    ok, err = jwai_core.write_result_to_jwc(store.to_elements(), {1: {'x2': 2000.0}}, path, store=store)
+    assert not ok and "置き換えに失敗" in err
+    assert open(path, 'rb').read() == data
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_changed_file_falls_back_to_full(mixed):
+    path, data, store = mixed
+    _write(path, data + b'\r\n')                  # 読み込んだ後に書き換わった
+    assert jwai_core._write_jwc_delta(store, path, {1: {'x2': 2000.0}}, {}) is None
+    stats = {}
+    ok, err = jwai_core.write_result_to_jwc(store.to_elements(), {1: {'x2': 2000.0}}, path,
+                                            stats=stats, store=store)
+    assert ok, err
+    assert stats["mode"] == "full"
+    assert open(path, 'rb').read().decode('cp932').splitlines()[2] == '1000.0 0.0 2000.0 1000.0'
+
+
+def test_lone_cr_falls_back_to_full(tmp_path):
+    path = _write(str(tmp_path / "JWC_TEMP.TXT"), b'\r'.join(ROWS))
+    store, _ = jwai_core.parse_jwc_store(path)
+    assert jwai_core._write_jwc_delta(store, path, {}, {}) is None
+    stats = {}
+    ok, err = jwai_core.write_result_to_jwc(store.to_elements(), {}, path, stats=stats, store=store)
+    assert ok, err
+    assert stats["mode"] == "full"
+    assert open(path, 'rb').read().splitlines() == ROWS[1:-1]
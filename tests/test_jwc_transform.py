@@ -0,0 +1,219 @@
+"""
+座標変換 apply_transform と、AIの返した変換を整える normalize_ai_transform の確認。
+手順のリストと MAX_TRANSFORM_STEPS、属性・範囲の絞り込み、door_indices、rotate で円弧も動くこと、
+90°の倍数の回転で座標に誤差が出ないこと、変わらない行は元の文字列のまま書き戻すこと。
+索引（store）の有無・NumPy の有無で同じ結果になることも確かめる。
+"""
+import pytest
+
+import jwai_core
+
+ROWS = [
+    'hq',
+    'lg0', 'ly0', 'lc1', 'lt1', 'lw1',
+    '0 0 1000 0',                       # 線0
+    '1000 0 1000 1000',                 # 線1
+    'ci 500 500 300',                   # 円弧0（角度の無い円）
+    'lg1', 'ly2', 'lc3',
+    '2000 0 3000 0',                    # 線2
+    'ci 0 0 800 0 90 1 0',              # 円弧1（ドアの扇形、吊元 (0, 0)）
+    '0 0 0 800',                        # 線3（戸の線）
+    '0 0 -120 0',                       # 線4（枠の線）
+    'lt2', 'lw5',
+    '5000 5000 6000 6000',              # 線5
+    'ci 5000 5000 400 30 60 1 0',       # 円弧2
+    'ch 0 0 1 0 "居間',
+]
+
+
+@pytest.fixture
+def jwc(tmp_path):
+    path = str(tmp_path / "JWC_TEMP.TXT")
+    with open(path, 'wb') as f:
+        f.write(('\r\n'.join(ROWS) + '\r\n').encode('cp932'))
+    store, err = jwai_core.parse_jwc_store(path)
+    assert err is None, err
+    return path, store
+
+
+@pytest.fixture(params=[(True, True), (True, False), (False, True), (False, False)],
+                ids=["store-numpy", "store-python", "elements-numpy", "elements-python"])
+def run(request, jwc, monkeypatch):
+    """apply_transform を (線の変更 {番号: (x1, y1, x2, y2)}, 円弧の変更 {番号: ci 行}) にして返す関数"""
+    use_store, use_numpy = request.param
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(jwai_core, "_import_numpy", lambda: None)
+    _, store = jwc
+
+    def apply(transform):
+        lines, circles = jwai_core.apply_transform(store.to_elements(), transform,
+                                                   store if use_store else None)
+        return ({i: (v['x1'], v['y1'], v['x2'], v['y2']) for i, v in lines.items()}, dict(circles))
+    return apply
+
+
+# ----- normalize_ai_transform -----
+
+def test_normalize_steps():
+    steps, err = jwai_core.normalize_ai_transform([
+        {"type": "mirror_x", "axis_x": "100"},
+        {"type": "rotate", "angle": "90", "target": "bogus", "filter": {"lg": [2, 1, 1], "ly": 3}},
+    ])
+    assert err is None, err
+    assert steps == [
+        {"type": "mirror_x", "target": "all", "axis_x": 100.0},
+        {"type": "rotate", "target": "all", "filter": {"lg": [1, 2], "ly": 3}, "angle": 90.0},
+    ]
+    assert jwai_core.normalize_ai_transform([])[1]
+    _, err = jwai_core.normalize_ai_transform([{"type": "mirror_x"}, "rotate"])
+    assert err.startswith("手順2:")
+    _, err = jwai_core.normalize_ai_transform([{"type": "mirror_x"}, {"type": "scale"}])
+    assert err.startswith("手順2:")
+
+
+def test_normalize_step_limit():
+    step = {"type": "arc_flip_x"}
+    steps, err = jwai_core.normalize_ai_transform([step] * jwai_core.MAX_TRANSFORM_STEPS)
+    assert err is None and len(steps) == jwai_core.MAX_TRANSFORM_STEPS
+    steps, err = jwai_core.normalize_ai_transform([step] * (jwai_core.MAX_TRANSFORM_STEPS + 1))
+    assert steps is None and err
+
+
+@pytest.mark.parametrize("transform", [
+    {"type": "mirror_x", "filter": {"layer": 1}},
+    {"type": "mirror_x", "filter": [0]},
+    {"type": "mirror_x", "filter": {"lg": -1}},
+    {"type": "mirror_x", "filter": {"lc": []}},
+    {"type": "mirror_x", "filter": {"lt": "a"}},
+    {"type": "mirror_x", "filter": {"bbox": [0, 0, 1]}},
+    {"type": "mirror_x", "filter": {"bbox": [0, 0, 1, "nan"]}},
+    {"type": "mirror_x", "filter": {"near": [0, 0, -1]}},
+    {"type": "mirror_x", "axis_x": "left"},
+    {"type": "rotate", "cx": [0]},
+    {"type": "arc_flip_x", "circle_indices": 3},
+    {"type": "arc_flip_x", "door_indices": [-1]},
+    {"type": "arc_flip_x", "door_indices": ["a"]},
+    {"type": "scale"},
+    "mirror_x",
+])
+def test_normalize_rejects(transform):
+    normalized, err = jwai_core.normalize_ai_transform(transform)
+    assert normalized is None and err
+
+
+def test_normalize_filters_and_indices():
+    normalized, err = jwai_core.normalize_ai_transform({
+        "type": "arc_flip_y", "target": "lines_only",
+        "filter": {"lw": [5], "bbox": ["0", 0, 10, 10], "near": [1, 2, 0]},
+        "circle_indices": [3, 1, 3], "door_indices": [0],
+    })
+    assert err is None, err
+    assert normalized == {"type": "arc_flip_y", "target": "lines_only",
+                          "filter": {"bbox": [0.0, 0.0, 10.0, 10.0], "near": [1.0, 2.0, 0.0], "lw": 5},
+                          "circle_indices": [1, 3], "door_indices": [0]}
+
+
+# ----- apply_transform -----
+
+@pytest.mark.parametrize("flt, lines, circles", [
+    ({"lg": 1}, {2, 4, 5}, {1, 2}),           # 線3 は x=0 上にあるので変わらない
+    ({"ly": 0}, {0, 1}, {0}),
+    ({"lc": [1, 3]}, {0, 1, 2, 4, 5}, {0, 1, 2}),
+    ({"lt": 2}, {5}, {2}),
+    ({"lw": 5, "lg": 1}, {5}, {2}),
+    ({"bbox": [1900, -10, 3100, 10]}, {2}, set()),
+    ({"near": [5500, 5500, 10]}, {5}, set()),
+    ({"near": [5346.41, 5200, 5]}, set(), {2}),
+    ({"ly": 2, "bbox": [-200, -200, 200, 200]}, {4}, {1}),
+])
+def test_filters(run, flt, lines, circles):
+    got_lines, got_circles = run({"type": "mirror_x", "axis_x": 0.0, "filter": flt})
+    assert set(got_lines) == lines
+    assert set(got_circles) == circles
+
+
+def test_target(run):
+    lines, circles = run({"type": "mirror_y", "axis_y": 0.0, "target": "lines_only"})
+    assert set(lines) == {1, 3, 5} and not circles
+    lines, circles = run({"type": "mirror_y", "axis_y": 0.0, "target": "circles_only"})
+    assert not lines and set(circles) == {0, 1, 2}
+    lines, circles = run({"type": "arc_flip_x", "target": "all"})
+    assert not lines and set(circles) == {1, 2}     # 角度の無い円は変わらない
+
+
+def test_door_indices(run):
+    # ドア0（円弧1）を吊元まわりに回すと、扇形と戸の線だけが動き、枠の線は動かない
+    lines, circles = run({"type": "rotate", "angle": 90.0, "cx": 0.0, "cy": 0.0, "door_indices": [0]})
+    assert lines == {3: (0.0, 0.0, -800.0, 0.0)}
+    assert circles == {1: "ci 0.0 0.0 800.0 90.0 180.0 1 0"}
+    lines, circles = run({"type": "arc_flip_y", "door_indices": [0]})
+    assert not lines and circles == {1: "ci 0.0 0.0 800.0 270.0 0.0 1 0"}
+    lines, circles = run({"type": "arc_flip_y", "door_indices": [5]})       # 無いドアは対象にしない
+    assert not lines and not circles
+
+
+def test_rotate_moves_arcs(run):
+    lines, circles = run({"type": "rotate", "angle": 90.0, "cx": 0.0, "cy": 0.0})
+    assert circles == {
+        0: "ci -500.0 500.0 300.0",
+        1: "ci 0.0 0.0 800.0 90.0 180.0 1 0",
+        2: "ci -5000.0 5000.0 400.0 120.0 150.0 1 0",
+    }
+    lines, circles = run({"type": "mirror_x", "axis_x": 0.0, "filter": {"lt": 2}})
+    assert circles == {2: "ci -5000.0 5000.0 400.0 120.0 150.0 1 0"}
+
+
+@pytest.mark.parametrize("angle, expected", [
+    (90.0, (0.0, 1000.0, -1000.0, 1000.0)),
+    (180.0, (-1000.0, 0.0, -1000.0, -1000.0)),
+    (-90.0, (0.0, -1000.0, 1000.0, -1000.0)),
+    (450.0, (0.0, 1000.0, -1000.0, 1000.0)),
+])
+def test_exact_quarter_turns(run, angle, expected):
+    lines, _ = run({"type": "rotate", "angle": angle, "cx": 0.0, "cy": 0.0})
+    assert lines[1] == expected            # 誤差（6e-14 など）の無いちょうどの値
+
+
+def test_steps(run):
+    # 同じ鏡映を2回・回転と逆回転は元に戻るので、変わる線・円弧は無い
+    assert run([{"type": "mirror_x", "axis_x": 0.0}] * 2) == ({}, {})
+    assert run([{"type": "rotate", "angle": 30.0, "cx": 0.0, "cy": 0.0},
+                {"type": "rotate", "angle": -30.0, "cx": 0.0, "cy": 0.0}]) == ({}, {})
+    # 2つ目の手順の軸の既定値は、1つ目を当てた後の範囲（x 1000〜2000）の中心
+    lines, circles = run([{"type": "mirror_x", "axis_x": 1000.0, "filter": {"ly": 0}},
+                          {"type": "mirror_x", "filter": {"ly": 0}}])
+    assert lines == {0: (1000.0, 0.0, 2000.0, 0.0), 1: (2000.0, 0.0, 2000.0, 1000.0)}
+    assert circles == {0: "ci 1500.0 500.0 300.0"}
+    # 手順ごとの対象は変換前の図面で決める
+    lines, circles = run([{"type": "mirror_y", "axis_y": 0.0, "filter": {"ly": 0}},
+                          {"type": "mirror_x", "axis_x": 0.0, "filter": {"lt": 2}}])
+    assert set(lines) == {1, 5} and set(circles) == {0, 2}
+
+
+def test_step_limit_in_one_pass(run):
+    steps = [{"type": "rotate", "angle": 90.0, "cx": 0.0, "cy": 0.0}] * jwai_core.MAX_TRANSFORM_STEPS
+    assert run(steps) == ({}, {})             # 90°×16 = 4周
+
+
+@pytest.mark.parametrize("delta", [True, False])
+def test_unchanged_rows_keep_text(jwc, delta):
+    path, store = jwc
+    elements = store.to_elements()
+    lines, circles = jwai_core.apply_transform(elements, {"type": "mirror_x", "axis_x": 0.0, "filter": {"ly": 2}},
+                                               store)
+    stats = {}
+    ok, err = jwai_core.write_result_to_jwc(elements, lines, path, circles, stats=stats,
+                                            store=store if delta else None)
+    assert ok, err
+    assert stats["mode"] == ("delta" if delta else "full")
+    with open(path, 'rb') as f:
+        out = f.read().decode('cp932').splitlines()     # 全体の書き直しは OS の改行で書く
+    expected = list(ROWS[1:])
+    expected[ROWS.index('2000 0 3000 0') - 1] = '-2000.0 0.0 -3000.0 0.0'
+    expected[ROWS.index('ci 0 0 800 0 90 1 0') - 1] = 'ci 0.0 0.0 800.0 90.0 180.0 1 0'
+    expected[ROWS.index('0 0 -120 0') - 1] = '0.0 0.0 120.0 0.0'
+    expected[ROWS.index('5000 5000 6000 6000') - 1] = '-5000.0 5000.0 -6000.0 6000.0'
+    expected[ROWS.index('ci 5000 5000 400 30 60 1 0') - 1] = 'ci -5000.0 5000.0 400.0 120.0 150.0 1 0'
+    assert out == expected
@@ -0,0 +1,101 @@
+"""
+オブジェクトストリームとして読める図面の差分解析（parse_jww_incremental）と並列解析が、
+直列のフル解析（parse_jww_full）と同じ結果になることの確認。
+"""
+import pytest
+
+import jwai_bench
+import jwai_core
+
+
+def _same(a, b):
+    """layout・header を除いた解析結果が一致するか（列指向の配列は要素ごとに比べる）"""
+    keys = set(a) | set(b)
+    for k in keys - {"layout", "header", "line_array", "arc_array"}:
+        if a.get(k) != b.get(k):
+            return False
+    if "line_array" in a:
+        return (a["line_array"] == b["line_array"]).all() and (a["arc_array"] == b["arc_array"]).all()
+    return True
+
+
+@pytest.fixture(scope="module")
+def drawing(tmp_path_factory):
+    path = tmp_path_factory.mktemp("archive") / "archive.jww"
+    jwai_bench.make_synthetic_jww_archive(str(path), 512 * 1024, seed=1)
+    return str(path), path.read_bytes()
+
+
+@pytest.mark.parametrize("columnar", [True, False])
+def test_incremental_matches_full(drawing, columnar):
+    path, data = drawing
+    base, err = jwai_core.parse_jww_full(path, columnar, layout=True)
+    assert err is None, err
+    assert isinstance(base["layout"], jwai_core.JwwArchiveLayout)
+    try:
+        for title, content in jwai_bench._jww_archive_edits(data):
+            with open(path, 'wb') as f:
+                f.write(content)
+            full, _ = jwai_core.parse_jww_full(path, columnar, layout=True)
+            inc, err = jwai_core.parse_jww_incremental(path, base, columnar)
+            assert err is None, (title, err)
+            assert _same(inc, full), title
+            for name in ("tags", "ordinals", "layer_keys", "line_src", "arc_src", "text_src",
+                         "classes", "end", "count", "block_hashes"):
+                assert getattr(inc["layout"], name) == getattr(full["layout"], name), (title, name)
+            start, end = inc["layout"].decoded
+            assert end - start < len(data) // 4, title
+    finally:
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+def test_incremental_from_cache(drawing, tmp_path):
+    path, data = drawing
+    cache = jwai_core.JwwParseCache(str(tmp_path / "cache"), 1 << 30)
+    base, _ = jwai_core.parse_jww_full(path, True, layout=True)
+    _, err = cache.store(jwai_core.jww_fingerprint(path), base)
+    assert err is None, err
+    title, content = jwai_bench._jww_archive_edits(data)[1]
+    try:
+        with open(path, 'wb') as f:
+            f.write(content)
+        restored = cache.load_base(jwai_core.jww_fingerprint(path), columnar=True)
+        assert restored is not None
+        inc, err = jwai_core.parse_jww_incremental(path, restored[0], True)
+        assert err is None, err
+        full, _ = jwai_core.parse_jww_full(path, True)
+        assert _same(inc, full), title
+    finally:
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+def test_incremental_rejects_header_change(drawing):
+    path, data = drawing
+    base, _ = jwai_core.parse_jww_full(path, True, layout=True)
+    memo = '合成オブジェクトストリーム図面'.encode('cp932')
+    try:
+        with open(path, 'wb') as f:
+            f.write(data.replace(memo, b'X' * len(memo), 1))
+        info, err = jwai_core.parse_jww_incremental(path, base, True)
+        assert info is None and err
+    finally:
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+@pytest.mark.parametrize("layers", [None, [(0, 0), (3, 4)]])
+def test_parallel_matches_serial(drawing, monkeypatch, layers):
+    path, _ = drawing
+    serial, err = jwai_core.parse_jww_full(path, True, layout=True, layers=layers)
+    assert err is None, err
+    monkeypatch.setattr(jwai_core, "_JWW_PARALLEL_MIN_BYTES", 0)
+    parallel, err = jwai_core.parse_jww_full(path, True, workers=2, layout=True, layers=layers)
+    assert err is None, err
+    assert _same(parallel, serial)
+    if layers is None:
+        for name in ("tags", "ordinals", "layer_keys", "line_src", "arc_src", "text_src", "classes", "end"):
+            assert getattr(parallel["layout"], name) == getattr(serial["layout"], name), name
+    else:
+        assert "layout" not in parallel and "layout" not in serial
@@ -0,0 +1,163 @@
+"""
+解析キャッシュ JwwParseCache の確認。
+保存・読み込みで解析結果（差分解析用の配置も含む）が戻ること、図面が変わったら指紋が一致しないこと、
+途中で打ち切った結果は保存しないこと、切れた・壊れた .jwac は無いものとして扱うこと。
+"""
+import os
+import zlib
+
+import pytest
+
+import jwai_bench
+import jwai_core
+
+LAYOUT_ARRAYS = ("geom_heads", "text_heads", "line_src", "arc_src", "text_src")
+
+
+@pytest.fixture
+def drawing(tmp_path):
+    path = str(tmp_path / "plan.jww")
+    jwai_bench.make_synthetic_jww(path, 96 * 1024, seed=6)
+    return path
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return jwai_core.JwwParseCache(str(tmp_path / "cache"), 1 << 30)
+
+
+def _entry(cache, fp):
+    return cache._entry_path(fp)
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_round_trip(drawing, cache, columnar):
+    if columnar:
+        pytest.importorskip("numpy")
+    info, _ = jwai_core.parse_jww_full(drawing, columnar, layout=True)
+    fp = jwai_core.jww_fingerprint(drawing)
+    size, err = cache.store(fp, info, extra={"summary": "説明"})
+    assert err is None, err
+    assert size == os.path.getsize(_entry(cache, fp))
+
+    hit = cache.load(fp, columnar)
+    assert hit is not None
+    restored, extra = hit
+    assert extra == {"summary": "説明"}
+    assert set(restored) == set(info)
+    for key in info.keys() - {"lines", "arcs", "line_array", "arc_array", "layout"}:
+        assert restored[key] == info[key], key
+    if columnar:
+        assert (restored["line_array"] == info["line_array"]).all()
+        assert (restored["arc_array"] == info["arc_array"]).all()
+    else:
+        assert restored["lines"] == info["lines"] and restored["arcs"] == info["arcs"]
+    old, new = info["layout"], restored["layout"]
+    for name in LAYOUT_ARRAYS + ("size", "block_hashes", "text_stream", "text_kept", "decoded", "fallback"):
+        assert getattr(new, name) == getattr(old, name), name
+    # 内容が変わっていなければ差分解析の土台としては返さない
+    assert cache.load_base(fp) is None
+
+
+def test_fingerprint_miss_after_change(drawing, cache):
+    info, _ = jwai_core.parse_jww_full(drawing, layout=True)
+    fp = jwai_core.jww_fingerprint(drawing)
+    cache.store(fp, info)
+    data = bytearray(open(drawing, 'rb').read())
+    data[len(data) // 2] ^= 0xFF                # 同じサイズのまま1バイトだけ書き換える
+    with open(drawing, 'wb') as f:
+        f.write(data)
+    os.utime(drawing, ns=(fp["mtime_ns"], fp["mtime_ns"]))     # 更新日時も同じにする
+    changed = jwai_core.jww_fingerprint(drawing)
+    assert changed["hash"] != fp["hash"]
+    assert cache.load(changed) is None
+    base = cache.load_base(changed)
+    assert base is not None and base[0]["stats"] == info["stats"]
+
+
+def test_entry_without_layout_is_no_base(drawing, cache):
+    info, _ = jwai_core.parse_jww_full(drawing)
+    fp = jwai_core.jww_fingerprint(drawing)
+    cache.store(fp, info)
+    assert cache.load(fp) is not None
+    assert cache.load_base(dict(fp, hash="0" * 32)) is None
+
+
+def test_partial_not_stored(drawing, cache):
+    budget = jwai_core.JwwParseBudget(max_bytes=16 * 1024)
+    info, err = jwai_core.parse_jww_full(drawing, layout=True, budget=budget)
+    assert err is None, err
+    assert info["partial"]["reason"] == "bytes"
+    fp = jwai_core.jww_fingerprint(drawing)
+    assert cache.store(fp, info) == (0, None)
+    assert not os.path.exists(_entry(cache, fp))
+    assert cache.load(fp) is None
+
+
+def _damaged(data):
+    head = jwai_core._JWW_CACHE_HEAD
+    magic, version, meta_len, geom_len = head.unpack_from(data, 0)
+    yield "空", b''
+    yield "ヘッダの途中まで", data[:head.size - 3]
+    yield "末尾が欠けた", data[:-10]
+    yield "座標部の途中まで", data[:head.size + meta_len + geom_len // 2]
+    yield "マジックが違う", b'XXXX' + data[4:]
+    yield "版が違う", head.pack(magic, version + 1, meta_len, geom_len) + data[head.size:]
+    broken = bytearray(data)
+    broken[head.size + 2:head.size + 10] = b'\0' * 8
+    yield "メタ情報が壊れた", bytes(broken)
+    broken = bytearray(data)
+    broken[head.size + meta_len + 2:head.size + meta_len + 10] = b'\xff' * 8
+    yield "座標部が壊れた", bytes(broken)
+    yield "メタ情報がJSONでない", (head.pack(magic, version, len(zlib.compress(b'{')), geom_len)
+                                  + zlib.compress(b'{') + data[head.size + meta_len:])
+
+
+def test_damaged_entry_is_miss(drawing, cache):
+    info, _ = jwai_core.parse_jww_full(drawing, layout=True)
+    fp = jwai_core.jww_fingerprint(drawing)
+    cache.store(fp, info)
+    path = _entry(cache, fp)
+    data = open(path, 'rb').read()
+    stale = dict(fp, hash="0" * 32)
+    for title, content in _damaged(data):
+        with open(path, 'wb') as f:
+            f.write(content)
+        assert cache.load(fp) is None, title
+        assert cache.load_base(stale) is None, title
+    # 保存し直せばまた使える
+    cache.store(fp, info)
+    assert cache.load(fp) is not None
+
+
+def test_damaged_layout(drawing, cache):
+    # 配置の長さが合わないエントリは、結果としては使えても差分解析の土台にはしない
+    info, _ = jwai_core.parse_jww_full(drawing, layout=True)
+    info["layout"].text_kept.append(1)
+    fp = jwai_core.jww_fingerprint(drawing)
+    cache.store(fp, info)
+    hit = cache.load(fp)
+    assert hit is not None and "layout" not in hit[0]
+    assert cache.load_base(dict(fp, hash="0" * 32)) is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    paths = []
+    for k in range(3):
+        path = str(tmp_path / f"plan{k}.jww")
+        jwai_bench.make_synthetic_jww(path, 32 * 1024, seed=k)
+        paths.append(path)
+    cache = jwai_core.JwwParseCache(str(tmp_path / "cache"), 1 << 30)
+    sizes = []
+    for k, path in enumerate(paths):
+        info, _ = jwai_core.parse_jww_full(path)
+        fp = jwai_core.jww_fingerprint(path)
+        sizes.append(cache.store(fp, info)[0])
+        os.utime(_entry(cache, fp), (1000 + k, 1000 + k))
+    cache.load(jwai_core.jww_fingerprint(paths[0]))          # 最初のエントリを使い直す
+    cache.max_bytes = sizes[0] + sizes[2] + 1
+    cache.evict()
+    hits = [cache.load(jwai_core.jww_fingerprint(p)) is not None for p in paths]
+    assert hits == [True, False, True]
+    cache.clear()
+    assert os.listdir(str(tmp_path / "cache")) == []
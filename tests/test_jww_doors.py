@@ -0,0 +1,99 @@
+"""
+扇形と線からドアを組み立てる detect_doors の確認。
+戸の線・枠の線の結び付け、開く向き、閉じた位置、端点を同じ点とみなす距離（DOOR_JOIN_TOL）の境目。
+NumPy の有無で同じ結果になることも確かめる。
+"""
+import math
+
+import pytest
+
+import jwai_core
+
+# 吊元 (0, 0)、半径 800、0°→90° の扇形。始角側の端は (800, 0)、終角側の端は (0, 800)
+ARC = [0.0, 0.0, 800.0, 0.0, 90.0]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def detect(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(jwai_core, "_import_numpy", lambda: None)
+    return jwai_core.detect_doors
+
+
+def test_leaf_opens_ccw(detect):
+    lines = [0, 0, 0, 800,          # 戸の線（終角側の端へ）
+             0, 0, 0, -120,         # 吊元の枠
+             800, 0, 800, -120,     # 閉じた位置の枠
+             0, 800, -100, 800,     # 開いた位置の端にだけ接する線は枠ではない
+             3000, 0, 4000, 0]      # 離れた線
+    (door,) = detect(lines, ARC)
+    assert door["arc"] == 0 and door["width"] == 800.0 and door["hinge"] == [0.0, 0.0]
+    assert door["leaf"] == 0 and door["jambs"] == [1, 2]
+    assert door["swing"] == "ccw" and door["open_to"] == [0.0, 1.0]
+    assert door["closed"] == [800.0, 0.0]
+    assert door["ends"][0] == [800.0, 0.0] and door["ends"][1] == pytest.approx([0.0, 800.0])
+
+
+def test_leaf_opens_cw(detect):
+    lines = [800, 0, 0, 0,          # 戸の線（始角側の端へ、向きは逆）
+             0, 800, 0, 920]        # 閉じた位置の枠
+    (door,) = detect(lines, ARC)
+    assert door["leaf"] == 0 and door["jambs"] == [1]
+    assert door["swing"] == "cw" and door["open_to"] == [1.0, 0.0]
+    assert door["closed"] == pytest.approx([0.0, 800.0])
+
+
+def test_without_leaf(detect):
+    # 戸の線が無ければ向きは不明。枠は吊元か円弧の両端のどれかに接する線
+    lines = [0, 0, -120, 0, 800, 0, 800, -120, 0, 800, -100, 800, 400, 400, 500, 500]
+    (door,) = detect(lines, ARC)
+    assert door["leaf"] is None and door["swing"] is None and door["open_to"] is None
+    assert door["closed"] is None
+    assert door["jambs"] == [0, 1, 2]
+
+
+def test_arc_filter(detect):
+    arcs = [0, 0, 800, 0, 45,             # 開き角が小さい
+            0, 0, 1.5, 0, 90,             # 半径が DOOR_JOIN_TOL 以下
+            5000, 0, 800, 270, 0,         # 360° をまたぐ 90°
+            float('nan'), 0, 800, 0, 90]  # 中心が読めない
+    doors = detect([5000, 0, 5000, -800], arcs)
+    assert [d["arc"] for d in doors] == [2]
+    assert doors[0]["leaf"] == 0 and doors[0]["swing"] == "cw"
+
+
+@pytest.mark.parametrize("gap, linked", [(0.0, True), (jwai_core.DOOR_JOIN_TOL, True),
+                                         (jwai_core.DOOR_JOIN_TOL * 1.01, False)])
+def test_join_tolerance(detect, gap, linked):
+    # 戸の線の吊元側の端を gap だけ離す（斜め45°方向）
+    d = gap / math.sqrt(2)
+    lines = [-d, -d, 0, 800]
+    (door,) = detect(lines, ARC)
+    assert (door["leaf"] == 0) is linked
+    assert door["swing"] == ("ccw" if linked else None)
+
+
+def test_custom_tolerance(detect):
+    lines = [-5, 0, 0, 800]
+    assert detect(lines, ARC)[0]["leaf"] is None
+    assert detect(lines, ARC, tol=5.0)[0]["leaf"] == 0
+
+
+def test_numpy_matches_python(monkeypatch):
+    pytest.importorskip("numpy")
+    import random
+    rnd = random.Random(7)
+    lines, arcs = [], []
+    for k in range(300):
+        x, y = rnd.randrange(0, 40) * 1000, rnd.randrange(0, 40) * 1000
+        sa = rnd.choice((0.0, 90.0, 180.0, 270.0))
+        arcs += [x, y, 800.0, sa, sa + rnd.choice((45.0, 90.0))]
+        a = math.radians(sa + rnd.choice((0.0, 90.0)))
+        lines += [x, y, x + 800 * math.cos(a), y + 800 * math.sin(a)]
+        lines += [x + rnd.uniform(-3, 3), y + rnd.uniform(-3, 3), x - 120, y]
+    with_np = jwai_core.detect_doors(lines, arcs)
+    monkeypatch.setattr(jwai_core, "_import_numpy", lambda: None)
+    assert jwai_core.detect_doors(lines, arcs) == with_np
+    assert sum(d["leaf"] is not None for d in with_np) > 100
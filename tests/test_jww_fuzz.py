@@ -0,0 +1,43 @@
+"""
+壊れた・変わった JWW 入力で parse_jww_full が例外を出さず、1MBあたりの処理時間が上限に収まることの確認。
+入力と上限は jwai_bench の fuzz と同じもの（_fuzz_inputs / FUZZ_SECONDS_PER_MB）。
+"""
+import time
+
+import pytest
+
+import jwai_bench
+import jwai_core
+
+CASES = jwai_bench._fuzz_inputs(0.5, 2, seed=0)
+SLACK = 0.05        # 小さな入力での計時の揺れ（秒）
+
+
+def _best_time(path):
+    best = None
+    for _ in range(2):
+        started = time.perf_counter()
+        info, err = jwai_core.parse_jww_full(path, True)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, info, err
+
+
+@pytest.mark.parametrize("title, data, limit", CASES, ids=[c[0] for c in CASES])
+def test_parse_jww_full_bounded_per_byte(tmp_path, title, data, limit):
+    path = tmp_path / "fuzz.jww"
+    path.write_bytes(data)
+    elapsed, info, err = _best_time(str(path))
+    assert info is not None or err
+    mb = len(data) / 1e6
+    assert elapsed <= limit * mb + SLACK, f"{title}: {elapsed / mb:.3f}s/MB（上限 {limit}s/MB）"
+
+
+@pytest.mark.parametrize("title, data, limit", CASES, ids=[c[0] for c in CASES])
+def test_parse_jww_full_budget_stops(tmp_path, title, data, limit):
+    path = tmp_path / "fuzz.jww"
+    path.write_bytes(data)
+    budget = jwai_core.JwwParseBudget(max_bytes=len(data) // 2)
+    info, _ = jwai_core.parse_jww_full(str(path), True, budget=budget)
+    if info is not None and info.get("partial"):
+        assert info["partial"]["scanned"] <= len(data) // 2 + jwai_core._JWW_SCAN_CHUNK
@@ -0,0 +1,72 @@
+"""
+レコード推定の解析（parse_jww_full）が旧3パス実装（jwai_bench.legacy_parse_jww_full）と同じ結果になることと、
+フォールバックを絞る指定（narrow_fallback=True）の確認。
+"""
+import pytest
+
+import jwai_bench
+import jwai_core
+
+KEYS = ("lines", "arcs", "texts", "dims", "rooms")
+
+
+def _record_texts(info):
+    return [t for t in info["texts"] if t["source"] != "fallback"]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_matches_legacy(tmp_path, seed):
+    # フォールバックの追いつき（64KB）が1度で済む大きさなら、文字の並びまで旧実装と同じ
+    path = str(tmp_path / "small.jww")
+    jwai_bench.make_synthetic_jww(path, 48 * 1024, seed=seed)
+    old, err = jwai_bench.legacy_parse_jww_full(path, max_texts=None)
+    assert err is None, err
+    new, err = jwai_core.parse_jww_full(path)
+    assert err is None, err
+    assert new["decoder"] == "heuristic"
+    assert any(t["source"] == "fallback" for t in new["texts"])
+    for key in KEYS:
+        assert new[key] == old[key], key
+
+
+def test_matches_legacy_records(tmp_path):
+    # 大きい図面ではフォールバックの文字の並びが変わるが、線・円弧・レコード由来の文字は同じ
+    path = str(tmp_path / "large.jww")
+    jwai_bench.make_synthetic_jww(path, 256 * 1024, seed=3)
+    old, _ = jwai_bench.legacy_parse_jww_full(path, max_texts=None)
+    new, _ = jwai_core.parse_jww_full(path)
+    assert new["lines"] == old["lines"] and new["arcs"] == old["arcs"]
+    assert _record_texts(new) == _record_texts(old)
+
+
+def test_narrow_fallback(tmp_path):
+    path = str(tmp_path / "narrow.jww")
+    jwai_bench.make_synthetic_jww(path, 128 * 1024, seed=4)
+    full, _ = jwai_core.parse_jww_full(path)
+    narrow, err = jwai_core.parse_jww_full(path, narrow_fallback=True)
+    assert err is None, err
+    # 文字レコードのある図面ではフォールバックを行わない
+    assert narrow["texts"] == _record_texts(full)
+    old, _ = jwai_bench.legacy_parse_jww_full(path, max_texts=None, fallback=False)
+    assert narrow["texts"] == old["texts"]
+    assert narrow["lines"] == full["lines"] and narrow["arcs"] == full["arcs"]
+
+
+@pytest.mark.parametrize("narrow", [False, True])
+def test_incremental_keeps_fallback_mode(tmp_path, narrow):
+    path = str(tmp_path / "incr.jww")
+    jwai_bench.make_synthetic_jww(path, 128 * 1024, seed=5)
+    data = open(path, 'rb').read()
+    base, _ = jwai_core.parse_jww_full(path, layout=True, narrow_fallback=narrow)
+    assert base["layout"].fallback is (False if narrow else True)
+    title, content = jwai_bench._jww_edits(data)[0]
+    with open(path, 'wb') as f:
+        f.write(content)
+    inc, err = jwai_core.parse_jww_incremental(path, base)
+    assert err is None, err
+    assert inc["layout"].fallback == base["layout"].fallback
+    full, _ = jwai_core.parse_jww_full(path, narrow_fallback=narrow)
+    assert inc["lines"] == full["lines"] and inc["arcs"] == full["arcs"]
+    assert _record_texts(inc) == _record_texts(full)
+    if narrow:
+        assert inc["texts"] == full["texts"]
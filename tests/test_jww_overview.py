@@ -0,0 +1,57 @@
+"""
+render_jww_overview が合成JWWファイルから常に同じ PNG を描き、画素数の上限を守ることの確認。
+レコード推定（make_synthetic_jww）とオブジェクトストリーム（make_synthetic_jww_archive）の両方で、
+解析し直した結果・列指向の結果からも同じ画像になるかを見る。
+"""
+import base64
+
+import pytest
+
+import jwai_bench
+import jwai_core
+
+pytest.importorskip("PIL")
+
+MAKERS = {
+    "records": jwai_bench.make_synthetic_jww,
+    "archive": jwai_bench.make_synthetic_jww_archive,
+}
+
+
+def _png(info, **kw):
+    img, err = jwai_core.render_jww_overview(info, **kw)
+    assert err is None, err
+    return img, base64.b64decode(jwai_core.image_to_base64_png(img))
+
+
+@pytest.fixture(params=sorted(MAKERS))
+def drawing(request, tmp_path):
+    path = tmp_path / f"{request.param}.jww"
+    MAKERS[request.param](str(path), 512 * 1024, seed=1)
+    return str(path)
+
+
+def test_overview_is_deterministic(drawing):
+    info, err = jwai_core.parse_jww_full(drawing, True)
+    assert err is None, err
+    _, first = _png(info)
+    _, second = _png(info)
+    assert first == second
+
+    again, err = jwai_core.parse_jww_full(drawing)
+    assert err is None, err
+    _, third = _png(again)
+    assert third == first
+
+
+@pytest.mark.parametrize("max_pixels, max_side", [
+    (jwai_core.JWW_OVERVIEW_PIXELS, jwai_core.JWW_OVERVIEW_MAX_SIDE),
+    (320 * 240, 400),
+    (100 * 100, 1000),
+])
+def test_overview_pixel_budget(drawing, max_pixels, max_side):
+    info, _ = jwai_core.parse_jww_full(drawing, True)
+    img, png = _png(info, max_pixels=max_pixels, max_side=max_side)
+    assert img.width * img.height <= max_pixels
+    assert max(img.width, img.height) <= max_side
+    assert png.startswith(b"\x89PNG")
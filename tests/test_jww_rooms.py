@@ -0,0 +1,105 @@
+"""
+壁の線から部屋を取り出す extract_rooms の確認。
+共有する壁・T字の取り合い・斜めの壁、部屋名を一番小さい閉じた範囲に付けること、上限を超えたときの skipped、
+斜めの線の交点の求め方（空間索引 / NumPy）で結果が変わらないこと。
+"""
+import pytest
+
+import jwai_bench
+import jwai_core
+
+
+def _rect(x0, y0, x1, y1):
+    return [x0, y0, x1, y0, x1, y0, x1, y1, x1, y1, x0, y1, x0, y1, x0, y0]
+
+
+def _by_name(res):
+    return {r["name"]: r for r in res["rooms"]}
+
+
+def test_shared_wall():
+    # 隣り合う2室がそれぞれ自分の矩形を描き、x=4000 の壁が重なっている
+    lines = _rect(0, 0, 4000, 4000) + _rect(4000, 0, 8000, 4000)
+    res = jwai_core.extract_rooms(lines, [("居間", 2000, 2000), ("寝室", 6000, 2000)])
+    assert res["skipped"] is None
+    assert res["faces"] == 2 and res["unlabeled"] == 0
+    rooms = _by_name(res)
+    assert rooms["居間"]["area_m2"] == 16.0 and rooms["寝室"]["area_m2"] == 16.0
+    assert rooms["居間"]["bbox"] == [0, 0, 4000, 4000]
+    assert rooms["寝室"]["bbox"] == [4000, 0, 8000, 4000]
+    assert sorted(map(tuple, rooms["寝室"]["polygon"])) == [(4000, 0), (4000, 4000), (8000, 0), (8000, 4000)]
+
+
+def test_t_junction():
+    # 外周は1本ずつの長い線、間仕切りの端は外周の線の途中に付く
+    lines = [0, 0, 6000, 0, 6000, 0, 6000, 3000, 6000, 3000, 0, 3000, 0, 3000, 0, 0,
+             2000, 0, 2000, 3000]
+    res = jwai_core.extract_rooms(lines, [("玄関", 1000, 1500), ("洋室", 4000, 1500)])
+    rooms = _by_name(res)
+    assert rooms["玄関"]["area_m2"] == 6.0
+    assert rooms["洋室"]["area_m2"] == 12.0
+    assert rooms["洋室"]["centroid"] == [4000.0, 1500.0]
+    assert res["unlabeled"] == 0
+
+
+def test_diagonal_wall():
+    # 隅を切る斜めの壁。両端は外周の線を越えて飛び出している
+    lines = _rect(0, 0, 4000, 4000) + [-500, 2500, 2500, -500]
+    res = jwai_core.extract_rooms(lines, [("収納", 500, 500), ("和室", 3000, 3000)])
+    rooms = _by_name(res)
+    assert rooms["収納"]["area_m2"] == 2.0
+    assert rooms["和室"]["area_m2"] == 14.0
+    assert sorted(map(tuple, rooms["収納"]["polygon"])) == [(0, 0), (0, 2000), (2000, 0)]
+
+
+def test_label_goes_to_smallest_face():
+    # 大きな部屋の中に離れて置かれた小部屋。小部屋の文字は両方の範囲に入るが、小さい方に付く
+    lines = _rect(0, 0, 10000, 10000) + _rect(2000, 2000, 4000, 4000)
+    labels = [("LDK", 8000, 8000), ("WIC", 3000, 3000), ("物入", 3500, 3500)]
+    res = jwai_core.extract_rooms(lines, labels)
+    rooms = _by_name(res)
+    assert set(rooms) == {"LDK", "WIC・物入"}
+    assert rooms["WIC・物入"]["area_m2"] == 4.0
+    assert [r["name"] for r in res["rooms"]] == ["LDK", "WIC・物入"]     # 面積の大きい順
+
+
+def test_caps_skip():
+    lines = _rect(0, 0, 4000, 4000) + _rect(4000, 0, 8000, 4000)
+    res = jwai_core.extract_rooms(lines, [("居間", 2000, 2000)], max_lines=7)
+    assert res == {"rooms": [], "faces": 0, "unlabeled": 0, "edges": 0, "skipped": "lines"}
+    res = jwai_core.extract_rooms(lines, [("居間", 2000, 2000)], max_crossings=3)
+    assert res["skipped"] == "crossings" and res["rooms"] == []
+    res = jwai_core.extract_rooms(lines + [-500, 2500, 2500, -500], [], max_crossings=8)
+    assert res["skipped"] == "crossings"
+
+
+def _segments(coords):
+    hs, vs, diag = jwai_core._wall_runs(coords, jwai_core.ROOM_SNAP)
+    segs = [(x1, y, x2, y) for y, spans in hs.items() for x1, x2 in spans]
+    segs += [(x, y1, x, y2) for x, spans in vs.items() for y1, y2 in spans]
+    return segs, diag
+
+
+@pytest.mark.parametrize("hatch", [0, 300, 3000])
+def test_crossings_grid_matches_numpy(hatch):
+    np = pytest.importorskip("numpy")
+    coords, _, _ = jwai_bench._planted_rooms(2000, hatch=hatch, seed=hatch)
+    # 同じ直線上で重なる斜めの線・端点で接する線も入れる
+    coords += [0, 0, 500, 500, 250, 250, 750, 750, 750, 750, 750, 0]
+    segs, diag = _segments(coords)
+    grid = jwai_core._diagonal_crossings_grid(segs, diag)
+    vec = jwai_core._diagonal_crossings_numpy(np, segs, diag)
+
+    def norm(out):
+        return sorted((k, j, round(t, 9), round(x, 6), round(y, 6)) for k, j, t, x, y in out)
+    assert norm(grid) == norm(vec)
+
+
+def test_rooms_without_numpy(monkeypatch):
+    pytest.importorskip("numpy")
+    coords, fields, labels = jwai_bench._planted_rooms(500, hatch=200)
+    doors = jwai_core.detect_doors(coords, fields)
+    with_np = jwai_core.extract_rooms(coords, labels, doors)
+    monkeypatch.setattr(jwai_core, "_import_numpy", lambda: None)
+    assert jwai_core.extract_rooms(coords, labels, doors) == with_np
+    assert len(with_np["rooms"]) == len(labels)